@@ -0,0 +1,80 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Measure the CPU time vBMC instances spend answering IPMI requests.
+
+Each request is answered by a vBMC instance of a domain of the libvirt
+test driver, both through the pyghmi handlers and the way vbmcd does.
+The IPMI session only encodes the responses, nothing is sent.
+
+Usage: python tools/bench_ipmi.py [--requests N]
+"""
+
+import argparse
+import time
+
+import pyghmi.ipmi.bmc as bmc
+
+from virtualbmc import config as vbmc_config
+from virtualbmc import vbmc
+
+CONF = vbmc_config.get_config()
+
+REQUESTS = (
+    ('Get Device ID', {'netfn': 0x06, 'command': 0x01, 'data': []}),
+    ('Get Chassis Status', {'netfn': 0x00, 'command': 0x01, 'data': []}),
+)
+
+
+class Session(object):
+    """Encodes responses the way pyghmi server sessions do."""
+
+    def send_ipmi_response(self, data=(), code=0):
+        self.payload = bytearray((code,)) + bytearray(data)
+
+
+def cpu_time(handler, request, count):
+    session = Session()
+    start = time.process_time()
+    for _ in range(count):
+        handler(request, session)
+    return (time.process_time() - start) / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=100000,
+                        help='Requests sent per command and path')
+    args = parser.parse_args()
+
+    CONF['sol']['enabled'] = False
+    CONF['sensors']['enabled'] = False
+    instance = vbmc.VirtualBMC(
+        username='admin', password='password', port=0,
+        address='127.0.0.1', domain_name='test',
+        libvirt_uri='test:///default')
+
+    def pyghmi_handler(request, session):
+        bmc.Bmc.handle_raw_request(instance, request, session)
+
+    print('%-20s %12s %12s' % ('Command', 'pyghmi (us)', 'vbmc (us)'))
+    for name, request in REQUESTS:
+        # Warm the domain handles and cached states up
+        instance.handle_raw_request(request, Session())
+        reference = cpu_time(pyghmi_handler, request, args.requests)
+        served = cpu_time(instance.handle_raw_request, request,
+                          args.requests)
+        print('%-20s %12.2f %12.2f' % (name, reference * 1e6, served * 1e6))
+
+
+if __name__ == '__main__':
+    main()
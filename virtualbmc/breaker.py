@@ -0,0 +1,243 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Circuit breakers guarding libvirt URIs.
+
+IPMI clients retry commands answered with "node busy" right away. When
+libvirtd goes away, every vBMC instance of the host keeps failing and
+retrying at the pace of its clients, which only makes things worse
+while libvirtd comes back. Once most recent calls to a URI failed for
+reasons pointing at libvirtd itself, the breaker of the URI opens and
+calls fail right away for a while. A single call is then let through
+to probe libvirtd, closing the breaker on success or keeping it open
+for longer on failure.
+
+Breakers live in the memory of the process making the calls. With the
+``single`` and ``sharded`` execution modes, the instances sharing a
+process share the breakers of their URIs. With the ``process`` and
+``forkserver`` modes, every instance only backs off on its own failures.
+"""
+
+import collections
+import random
+import threading
+import time
+
+import libvirt
+
+from virtualbmc import config as vbmc_config
+from virtualbmc import exception
+from virtualbmc import log
+
+__all__ = ['causes', 'get_breaker', 'is_transient', 'libvirt_error_code']
+
+LOG = log.get_logger()
+
+CONF = vbmc_config.get_config()
+
+BREAKERS = {}
+_BREAKERS_LOCK = threading.Lock()
+
+# Breaker states
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+# Seconds of call outcomes the error rate is computed over
+WINDOW = 30
+
+# Most call outcomes remembered
+MAX_OUTCOMES = 256
+
+# Longest time (in seconds) a breaker stays open
+MAX_RESET_TIMEOUT = 60
+
+# libvirt errors reporting trouble with the connection to libvirtd rather
+# than with the domain or the request. Errors of a given domain, even
+# retried, must not fail the calls made for the other ones
+TRANSIENT_ERRORS = frozenset((
+    libvirt.VIR_ERR_NO_CONNECT,
+    libvirt.VIR_ERR_SYSTEM_ERROR,
+    libvirt.VIR_ERR_RPC,
+))
+
+
+def causes(error):
+    """Iterate over an exception and the exceptions it was raised from."""
+    while error is not None:
+        yield error
+        error = error.__cause__ or error.__context__
+
+
+def libvirt_error_code(error):
+    """Return the code of the libvirt error behind an exception.
+
+    :returns: The libvirt error code or None if the exception was not
+        caused by a libvirt error
+    """
+    for cause in causes(error):
+        if isinstance(cause, libvirt.libvirtError):
+            return cause.get_error_code()
+
+
+def is_transient(error):
+    """Tell whether an exception points at libvirtd being in trouble."""
+    if any(isinstance(cause, (exception.LibvirtUnavailable,
+                              exception.LibvirtConnectionOpenError,
+                              exception.LibvirtCallTimeout,
+                              exception.LibvirtBusy))
+           for cause in causes(error)):
+        return True
+
+    return libvirt_error_code(error) in TRANSIENT_ERRORS
+
+
+class CircuitBreaker(object):
+    """Tracks the health of a libvirt URI.
+
+    :param uri: The libvirt URI
+    :param error_rate: Share of failed calls over the last :data:`WINDOW`
+        seconds opening the breaker
+    :param min_calls: Calls needed over the window before the error rate
+        is considered
+    :param reset_timeout: Seconds the breaker first stays open, doubled
+        whenever probing fails
+    """
+
+    def __init__(self, uri, error_rate, min_calls, reset_timeout):
+        self.uri = uri
+        self.error_rate = error_rate
+        self.min_calls = min_calls
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self._lock = threading.Lock()
+        self._outcomes = collections.deque(maxlen=MAX_OUTCOMES)
+        self._opened_at = None
+        self._open_for = None
+        self._probed_at = None
+        self._trips = 0
+
+    def _open(self, now):
+        self._trips += 1
+        timeout = min(self.reset_timeout * 2 ** (self._trips - 1),
+                      MAX_RESET_TIMEOUT)
+        # Spread the probes of the instances of a host hitting the same
+        # libvirtd
+        self._open_for = timeout * random.uniform(0.75, 1.25)
+        self._opened_at = now
+        self._outcomes.clear()
+        self.state = OPEN
+
+    def admit(self):
+        """Let a call through, unless the breaker is open.
+
+        :returns: True if the call probes libvirtd, its outcome deciding
+            whether the breaker closes
+        :raises: LibvirtUnavailable if the call must not be made
+        """
+        now = time.monotonic()
+
+        with self._lock:
+            if self.state == CLOSED:
+                return False
+
+            if ((self.state == OPEN
+                 and now - self._opened_at >= self._open_for)
+                    or (self.state == HALF_OPEN
+                        and now - self._probed_at >= self._open_for)):
+                # This call probes libvirtd, others keep failing meanwhile.
+                # A probe still hanging after as long is taken over
+                self.state = HALF_OPEN
+                self._probed_at = now
+                LOG.info('Probing libvirt URI %(uri)s',
+                         {'uri': self.uri})
+                return True
+
+        raise exception.LibvirtUnavailable(uri=self.uri)
+
+    def record(self, error=None, probe=False):
+        """Account for the outcome of an admitted call.
+
+        :param error: The exception the call failed with, if any
+        :param probe: Whether the call was admitted as a probe
+        """
+        failed = error is not None and is_transient(error)
+        now = time.monotonic()
+
+        with self._lock:
+            if self.state == HALF_OPEN:
+                if not probe:
+                    # Admitted before the breaker opened
+                    return
+
+                if failed:
+                    self._open(now)
+                    LOG.warning('libvirt URI %(uri)s is still failing, '
+                                'failing calls for %(timeout).1f seconds',
+                                {'uri': self.uri, 'timeout': self._open_for})
+                else:
+                    self.state = CLOSED
+                    self._trips = 0
+                    LOG.info('libvirt URI %(uri)s has recovered',
+                             {'uri': self.uri})
+                return
+
+            if self.state == OPEN:
+                # Admitted before the breaker opened
+                return
+
+            self._outcomes.append((now, failed))
+            while self._outcomes and now - self._outcomes[0][0] > WINDOW:
+                self._outcomes.popleft()
+
+            calls = len(self._outcomes)
+            failures = sum(1 for _, f in self._outcomes if f)
+            if (failed and calls >= self.min_calls
+                    and failures >= self.error_rate * calls):
+                self._open(now)
+                LOG.warning('%(failures)d of the last %(calls)d calls to '
+                            'libvirt URI %(uri)s failed, failing calls for '
+                            '%(timeout).1f seconds',
+                            {'failures': failures, 'calls': calls,
+                             'uri': self.uri, 'timeout': self._open_for})
+
+
+class _NoBreaker(object):
+    """Stand-in for a breaker when they are disabled."""
+
+    state = CLOSED
+
+    def admit(self):
+        return False
+
+    def record(self, error=None, probe=False):
+        pass
+
+
+_NO_BREAKER = _NoBreaker()
+
+
+def get_breaker(uri):
+    """Return the process-wide circuit breaker of a libvirt URI."""
+    libvirt_conf = CONF['libvirt']
+    if not libvirt_conf['breaker_error_rate']:
+        return _NO_BREAKER
+
+    with _BREAKERS_LOCK:
+        breaker = BREAKERS.get(uri)
+        if breaker is None:
+            breaker = BREAKERS[uri] = CircuitBreaker(
+                uri, error_rate=libvirt_conf['breaker_error_rate'],
+                min_calls=libvirt_conf['breaker_min_calls'],
+                reset_timeout=libvirt_conf['breaker_reset_timeout'])
+
+    return breaker
@@ -24,6 +24,7 @@ import virtualbmc
 from virtualbmc import config as vbmc_config
 from virtualbmc.exception import VirtualBMCError
 from virtualbmc import log
+from virtualbmc import manifest
 
 CONF = vbmc_config.get_config()
 
@@ -179,6 +180,43 @@ class AddCommand(Command):
         )
 
 
+class ImportCommand(Command):
+    """Create virtual BMCs for the virtual machines listed in a manifest"""
+
+    def get_parser(self, prog_name):
+        parser = super(ImportCommand, self).get_parser(prog_name)
+
+        parser.add_argument('manifest',
+                            help=('A JSON, YAML or CSV file listing the '
+                                  'virtual BMCs by the options of "vbmc '
+                                  'add", such as domain_name and port'))
+        parser.add_argument('--format',
+                            dest='format',
+                            choices=manifest.FORMATS,
+                            default=None,
+                            help=('The format of the manifest; guessed from '
+                                  'its extension by default'))
+        parser.add_argument('--first-port',
+                            dest='first_port',
+                            type=int,
+                            default=None,
+                            help=('The port to allocate the ports left '
+                                  'unset from; defaults to 6230'))
+        parser.add_argument('--start',
+                            dest='start',
+                            action='store_true',
+                            default=False,
+                            help='Start the virtual BMCs once created')
+        return parser
+
+    def take_action(self, args):
+        args.bmcs = manifest.load(args.manifest, args.format)
+
+        self.app.zmq.communicate(
+            'bulk_add', args, no_daemon=self.app.options.no_daemon
+        )
+
+
 class DeleteCommand(Command):
     """Delete a virtual BMC for a virtual machine instance"""
 
@@ -256,6 +294,25 @@ class ShowCommand(Lister):
         return rsp['header'], sorted(rsp['rows'])
 
 
+class StatsCommand(Lister):
+    """Show latency statistics of virtual BMC instances"""
+
+    def get_parser(self, prog_name):
+        parser = super(StatsCommand, self).get_parser(prog_name)
+
+        parser.add_argument('domain_name', nargs='?',
+                            help='The name of the virtual machine, all '
+                                 'of them if not given')
+
+        return parser
+
+    def take_action(self, args):
+        rsp = self.app.zmq.communicate(
+            'stats', args, no_daemon=self.app.options.no_daemon
+        )
+        return rsp['header'], rsp['rows']
+
+
 class VirtualBMCApp(App):
 
     def __init__(self):
@@ -0,0 +1,128 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Coalescing of duplicate domain queries.
+
+Clients tend to ask a BMC the same thing several times in a row, like
+the power state right before and after setting the boot device. Rather
+than hitting libvirt every time, identical queries made while one is in
+flight wait for its outcome, which then keeps answering identical
+queries for a short while after it came in.
+"""
+
+import concurrent.futures
+import threading
+import time
+
+from virtualbmc import config as vbmc_config
+
+__all__ = ['get_coalescer']
+
+CONF = vbmc_config.get_config()
+
+COALESCER = None
+
+
+class Coalescer(object):
+    """In-flight and short-lived results of domain queries.
+
+    :param window: Seconds the outcome of a query keeps answering
+        identical queries once in, 0 not to keep it at all
+    """
+
+    def __init__(self, window):
+        self.window = window
+        self._lock = threading.Lock()
+        # key -> (result, time it came in)
+        self._results = {}
+        # key -> future of the query in flight
+        self._flights = {}
+
+    def _keep(self, key, value):
+        now = time.monotonic()
+
+        # Keys are not necessarily asked for again, forget about the
+        # expired results rather than waiting for them to be
+        for expired in [k for k, (_, t) in self._results.items()
+                        if now - t >= self.window]:
+            del self._results[expired]
+
+        self._results[key] = value, now
+
+    def fetch(self, key, fetcher):
+        """Run a query, unless an identical one can answer it.
+
+        Queries made while an identical one is in flight wait for it and
+        share its outcome, failures included. Failed queries are not kept
+        around afterwards.
+
+        :param key: Hashable identifying the query
+        :param fetcher: Callable making the query
+        :returns: The query result
+        """
+        with self._lock:
+            result = self._results.get(key)
+            if (result is not None
+                    and time.monotonic() - result[1] < self.window):
+                return result[0]
+
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = self._flights[key] = concurrent.futures.Future()
+                leader = True
+            else:
+                leader = False
+
+        if not leader:
+            return flight.result()
+
+        try:
+            value = fetcher()
+
+        except BaseException as e:
+            with self._lock:
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+            flight.set_exception(e)
+            raise
+
+        with self._lock:
+            # Unless invalidated while in flight
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+                if self.window:
+                    self._keep(key, value)
+
+        flight.set_result(value)
+        return value
+
+    def invalidate(self, key):
+        """Make the next query not share the outcome of earlier ones."""
+        with self._lock:
+            self._results.pop(key, None)
+            self._flights.pop(key, None)
+
+
+def get_coalescer():
+    """Return the process-wide coalescer.
+
+    :returns: A Coalescer object or None if coalescing is disabled
+    """
+    global COALESCER
+
+    if not CONF['libvirt']['coalesce_queries']:
+        return None
+
+    if COALESCER is None:
+        COALESCER = Coalescer(window=CONF['libvirt']['coalesce_window'])
+
+    return COALESCER
@@ -11,6 +11,7 @@
 #    under the License.
 
 import configparser
+import copy
 import os
 
 from virtualbmc import utils
@@ -26,6 +27,13 @@ CONFIG_FILE = next((x for x in _CONFIG_FILE_PATHS if os.path.exists(x)), '')
 
 CONFIG = None
 
+EXECUTION_MODES = ('process', 'forkserver', 'single', 'sharded')
+
+CONFIG_STORES = ('directory', 'sqlite')
+
+# Most heavy libvirt operations let through to a libvirt URI at once
+MAX_CONCURRENT = 32
+
 
 class VirtualBMCConfig(object):
 
@@ -35,12 +43,33 @@ class VirtualBMCConfig(object):
             'config_dir': os.path.join(
                 os.path.expanduser('~'), '.vbmc'
             ),
+            # Where the configurations of the vBMC instances are kept:
+            # "directory" writes a configuration file per instance in
+            # config_dir, "sqlite" keeps them all in a database in
+            # config_dir, importing existing configuration files once and
+            # renaming them, there is no going back
+            'config_store': 'directory',
             'pid_file': os.path.join(
                 os.path.expanduser('~'), '.vbmc', 'master.pid'
             ),
             'server_port': 50891,
             'server_response_timeout': 5000,  # milliseconds
             'server_spawn_wait': 3000,  # milliseconds
+            # How vBMC instances are run: "process" runs each instance
+            # in its own process, "forkserver" too but forks them from a
+            # preloaded spawner process, "single" serves them all from
+            # one worker process and "sharded" spreads them over a pool
+            # of worker processes
+            'execution_mode': 'process',
+            # Number of worker processes in "sharded" execution mode,
+            # 0 stands for the number of CPUs
+            'worker_count': 0,
+            # Number of idle processes the spawner keeps forked in
+            # advance in "forkserver" execution mode
+            'warm_processes': 0,
+            # Maximum number of vBMC instances sharing their sensor
+            # readings and metrics with vbmcd through shared memory
+            'shared_memory_slots': 4096,
         },
         'log': {
             'logfile': None,
@@ -48,7 +77,101 @@ class VirtualBMCConfig(object):
         },
         'ipmi': {
             # Maximum time (in seconds) to wait for the data to come across
-            'session_timeout': 1
+            'session_timeout': 1,
+            # Time (in seconds) a boot device change is held back so it
+            # can be coalesced with the next power action, 0 disables.
+            # Held back changes are acknowledged before being applied,
+            # their failures being reported to the next power on or reset
+            'boot_device_flush_delay': 0,
+            # Port of the IPMI endpoint shared by the vBMC instances
+            # configured with that port, sessions are routed by user
+            # name. 0 disables the shared endpoint
+            'shared_port': 0,
+            # Address the shared IPMI endpoint listens on
+            'shared_address': '::',
+            # Acknowledge power commands right away and carry them out in
+            # the background, repeated commands are ignored meanwhile.
+            # Failures are then only logged, the power state reported
+            # going back to the actual one of the domain
+            'async_power': 'false',
+            # Seconds a domain is given to shut down on a soft power off
+            # command before it is forced off, 0 leaves it running
+            'soft_off_timeout': 0
+        },
+        'libvirt': {
+            # Seconds between keepalive probes on pooled connections
+            'keepalive_interval': 5,
+            # Unanswered probes before a connection is considered dead
+            'keepalive_count': 5,
+            # Answer domain queries from a cache fed by libvirt events
+            'domain_events': 'true',
+            # Maximum age (in seconds) of a cached domain property
+            'domain_cache_ttl': 60,
+            # Answer domain queries with the outcome of an identical one
+            # in flight or recent
+            'coalesce_queries': 'true',
+            # Seconds the outcome of a domain query keeps answering
+            # identical queries once in, 0 not to keep it
+            'coalesce_window': 0.05,
+            # Share of failed calls to a libvirt URI over the last 30
+            # seconds after which calls fail right away for a while, 0
+            # never to fail them. Counted per process, so per instance
+            # with the process and forkserver execution modes
+            'breaker_error_rate': 0.5,
+            # Calls to a libvirt URI over the last 30 seconds needed for
+            # their error rate to be considered
+            'breaker_min_calls': 5,
+            # Seconds calls first fail right away, doubled (up to a
+            # minute) every time libvirt keeps failing
+            'breaker_reset_timeout': 5,
+            # Threads making libvirt calls on behalf of IPMI commands, per
+            # process
+            'call_workers': 8
+        },
+        'deadlines': {
+            # Seconds IPMI commands wait for libvirt calls before being
+            # answered with "node busy", meanwhile no other command of
+            # the process is handled. Set by call (see "vbmc stats"),
+            # the default applies to the calls not listed. 0 makes the
+            # call right away and waits for as long as it takes. The
+            # get_all_domain_stats call of the sensor readings is bound
+            # the same way, its pass being skipped past the deadline
+            'default': 3,
+            'get_power_state': 2,
+            'get_boot_device': 2
+        },
+        'scheduler': {
+            # Most domain starts, resets and boot device changes made at
+            # once on a libvirt URI by the vBMC instances of the host,
+            # others are queued. 0 does not limit them. A [scheduler:URI]
+            # section sets the options of a given libvirt URI
+            'max_concurrent': 4,
+            # Seconds between the start of two operations on a libvirt URI
+            'stagger': 0.2
+        },
+        'sensors': {
+            # Emulate IPMI sensors out of libvirt domain statistics
+            'enabled': 'true',
+            # Seconds between two collections of domain statistics
+            'interval': 10
+        },
+        'metrics': {
+            # Record latency histograms of IPMI commands and libvirt calls
+            'enabled': 'true',
+            # Port vbmcd serves metrics on in the Prometheus format, 0 not
+            # to serve them
+            'listen_port': 0,
+            # Address vbmcd serves metrics on
+            'listen_address': '127.0.0.1'
+        },
+        'sol': {
+            # Serve Serial-over-LAN out of the domain console
+            'enabled': 'true',
+            # Console output (in bytes) held for a SOL client that does
+            # not keep up before reading the console is paused
+            'buffer_size': 65536,
+            # Seconds before an unacknowledged SOL packet is sent again
+            'retransmit_timeout': 1
         },
     }
 
@@ -59,7 +182,7 @@ class VirtualBMCConfig(object):
         self._validate()
 
     def _as_dict(self, config):
-        conf_dict = self.DEFAULTS
+        conf_dict = copy.deepcopy(self.DEFAULTS)
         for section in config.sections():
             if section not in conf_dict:
                 conf_dict[section] = {}
@@ -84,9 +207,130 @@ class VirtualBMCConfig(object):
         self._conf_dict['default']['server_response_timeout'] = int(
             self._conf_dict['default']['server_response_timeout'])
 
+        execution_mode = self._conf_dict['default']['execution_mode']
+        if execution_mode not in EXECUTION_MODES:
+            raise ValueError(
+                'Unknown execution mode "%(mode)s", expected one of '
+                '%(modes)s' % {'mode': execution_mode,
+                               'modes': ', '.join(EXECUTION_MODES)})
+
+        config_store = self._conf_dict['default']['config_store']
+        if config_store not in CONFIG_STORES:
+            raise ValueError(
+                'Unknown configuration store "%(store)s", expected one of '
+                '%(stores)s' % {'store': config_store,
+                                'stores': ', '.join(CONFIG_STORES)})
+
+        self._conf_dict['default']['worker_count'] = int(
+            self._conf_dict['default']['worker_count'])
+
+        self._conf_dict['default']['warm_processes'] = int(
+            self._conf_dict['default']['warm_processes'])
+        if self._conf_dict['default']['warm_processes'] < 0:
+            raise ValueError('The number of warm processes cannot be '
+                             'negative')
+
+        self._conf_dict['default']['shared_memory_slots'] = int(
+            self._conf_dict['default']['shared_memory_slots'])
+
         self._conf_dict['ipmi']['session_timeout'] = int(
             self._conf_dict['ipmi']['session_timeout'])
 
+        self._conf_dict['ipmi']['boot_device_flush_delay'] = float(
+            self._conf_dict['ipmi']['boot_device_flush_delay'])
+
+        self._conf_dict['ipmi']['shared_port'] = int(
+            self._conf_dict['ipmi']['shared_port'])
+
+        if (self._conf_dict['ipmi']['shared_port']
+                and execution_mode in ('process', 'forkserver')):
+            raise ValueError(
+                'The shared IPMI endpoint requires the "single" or '
+                '"sharded" execution mode')
+
+        self._conf_dict['ipmi']['async_power'] = utils.str2bool(
+            self._conf_dict['ipmi']['async_power'])
+
+        self._conf_dict['ipmi']['soft_off_timeout'] = float(
+            self._conf_dict['ipmi']['soft_off_timeout'])
+
+        self._conf_dict['libvirt']['keepalive_interval'] = int(
+            self._conf_dict['libvirt']['keepalive_interval'])
+
+        self._conf_dict['libvirt']['keepalive_count'] = int(
+            self._conf_dict['libvirt']['keepalive_count'])
+
+        self._conf_dict['libvirt']['domain_events'] = utils.str2bool(
+            self._conf_dict['libvirt']['domain_events'])
+
+        self._conf_dict['libvirt']['domain_cache_ttl'] = int(
+            self._conf_dict['libvirt']['domain_cache_ttl'])
+
+        self._conf_dict['libvirt']['coalesce_queries'] = utils.str2bool(
+            self._conf_dict['libvirt']['coalesce_queries'])
+
+        self._conf_dict['libvirt']['coalesce_window'] = float(
+            self._conf_dict['libvirt']['coalesce_window'])
+
+        self._conf_dict['libvirt']['breaker_error_rate'] = float(
+            self._conf_dict['libvirt']['breaker_error_rate'])
+        if not 0 <= self._conf_dict['libvirt']['breaker_error_rate'] <= 1:
+            raise ValueError('The libvirt breaker error rate must be '
+                             'between 0 and 1')
+
+        self._conf_dict['libvirt']['breaker_min_calls'] = int(
+            self._conf_dict['libvirt']['breaker_min_calls'])
+
+        self._conf_dict['libvirt']['breaker_reset_timeout'] = float(
+            self._conf_dict['libvirt']['breaker_reset_timeout'])
+
+        self._conf_dict['libvirt']['call_workers'] = int(
+            self._conf_dict['libvirt']['call_workers'])
+        if self._conf_dict['libvirt']['call_workers'] < 1:
+            raise ValueError('At least one libvirt call worker is needed')
+
+        for call, deadline in self._conf_dict['deadlines'].items():
+            self._conf_dict['deadlines'][call] = float(deadline)
+
+        scheduler = self._conf_dict['scheduler']
+        for section, options in self._conf_dict.items():
+            if section != 'scheduler' and not section.startswith(
+                    'scheduler:'):
+                continue
+
+            # Sections of libvirt URIs default to the [scheduler] options
+            options = dict(scheduler, **options)
+            options['max_concurrent'] = int(options['max_concurrent'])
+            if not 0 <= options['max_concurrent'] <= MAX_CONCURRENT:
+                raise ValueError(
+                    'The max_concurrent option of section [%(section)s] '
+                    'must be between 0 and %(max)d'
+                    % {'section': section, 'max': MAX_CONCURRENT})
+
+            options['stagger'] = float(options['stagger'])
+            self._conf_dict[section] = options
+
+        self._conf_dict['sensors']['enabled'] = utils.str2bool(
+            self._conf_dict['sensors']['enabled'])
+
+        self._conf_dict['sensors']['interval'] = int(
+            self._conf_dict['sensors']['interval'])
+
+        self._conf_dict['metrics']['enabled'] = utils.str2bool(
+            self._conf_dict['metrics']['enabled'])
+
+        self._conf_dict['metrics']['listen_port'] = int(
+            self._conf_dict['metrics']['listen_port'])
+
+        self._conf_dict['sol']['enabled'] = utils.str2bool(
+            self._conf_dict['sol']['enabled'])
+
+        self._conf_dict['sol']['buffer_size'] = int(
+            self._conf_dict['sol']['buffer_size'])
+
+        self._conf_dict['sol']['retransmit_timeout'] = float(
+            self._conf_dict['sol']['retransmit_timeout'])
+
     def __getitem__(self, key):
         return self._conf_dict[key]
 
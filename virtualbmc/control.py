@@ -14,13 +14,16 @@
 #    under the License.
 
 import json
+import math
 import signal
 import sys
+import time
 
 import zmq
 
 from virtualbmc import config as vbmc_config
 from virtualbmc import exception
+from virtualbmc import exporter
 from virtualbmc import log
 from virtualbmc.manager import VirtualBMCManager
 
@@ -31,6 +34,24 @@ LOG = log.get_logger()
 TIMER_PERIOD = 3000  # milliseconds
 
 
+def _watch_sentinels(poller, watched, sentinels):
+    """Poll the sentinels of the vBMC instances along with the sockets.
+
+    :param watched: The sentinels polled so far
+    :param sentinels: The sentinels to poll from now on
+    :returns: The sentinels polled
+    """
+    sentinels = set(sentinels)
+
+    for fd in watched - sentinels:
+        poller.unregister(fd)
+
+    for fd in sentinels - watched:
+        poller.register(fd, zmq.POLLIN)
+
+    return sentinels
+
+
 def main_loop(vbmc_manager, handle_command):
     """Server part of the CLI control interface
 
@@ -45,10 +66,16 @@ def main_loop(vbmc_manager, handle_command):
     contains at least the `rc` and `msg` attributes, used to indicate the
     outcome of the command, and optionally 2-D table conveyed through the
     `header` and `rows` attributes pointing to lists of cell values.
+
+    Metrics scrapes, if enabled, are served from the same loop. vBMC
+    instances that die are noticed through their process sentinels and
+    restarted from the loop right away, unless they keep dying. The vBMC
+    instances are checked at least every :data:`TIMER_PERIOD`, however
+    busy the sockets are.
     """
     server_port = CONF['default']['server_port']
 
-    context = socket = None
+    context = socket = metrics_server = None
 
     try:
         context = zmq.Context()
@@ -59,14 +86,48 @@ def main_loop(vbmc_manager, handle_command):
         poller = zmq.Poller()
         poller.register(socket, zmq.POLLIN)
 
+        metrics_server = exporter.start_server(vbmc_manager)
+        if metrics_server:
+            poller.register(metrics_server.fileno(), zmq.POLLIN)
+
         LOG.info('Started vBMC server on port %s', server_port)
 
+        sentinels = set()
+        next_check = time.monotonic() + TIMER_PERIOD / 1000
+
         while True:
-            socks = dict(poller.poll(timeout=TIMER_PERIOD))
+            sentinels = _watch_sentinels(poller, sentinels,
+                                         vbmc_manager.sentinels())
+
+            check_at = next_check
+            restart_delay = vbmc_manager.restart_delay()
+            if restart_delay is not None:
+                check_at = min(check_at, time.monotonic() + restart_delay)
+
+            timeout = max(math.ceil((check_at - time.monotonic()) * 1000), 0)
+
+            socks = dict(poller.poll(timeout=timeout))
+            if metrics_server and metrics_server.fileno() in socks:
+                metrics_server.handle_request()
+
+            # Due whatever else is ready, commands and scrapes coming in
+            # faster than the period must not hold restarts back
+            if (not socks or time.monotonic() >= check_at
+                    or not sentinels.isdisjoint(socks)):
+                next_check = time.monotonic() + TIMER_PERIOD / 1000
+                # Also restarts the vBMC instances that died
+                try:
+                    vbmc_manager.periodic()
+
+                except Exception as ex:
+                    # Carry on serving commands, the next pass may do
+                    # better
+                    LOG.exception('Failed to check the vBMC instances: '
+                                  '%(error)s', {'error': ex})
+
             if socket in socks and socks[socket] == zmq.POLLIN:
                 message = socket.recv()
             else:
-                vbmc_manager.periodic()
                 continue
 
             try:
@@ -109,6 +170,8 @@ def main_loop(vbmc_manager, handle_command):
             socket.send(message.encode('utf-8'))
 
     finally:
+        if metrics_server:
+            metrics_server.server_close()
         if socket:
             socket.close()
         if context:
@@ -143,6 +206,15 @@ def command_dispatcher(vbmc_manager, data_in):
             'msg': [msg] if msg else []
         }
 
+    elif command == 'bulk_add':
+        rc, msg = vbmc_manager.bulk_add(data_in['bmcs'],
+                                        start=data_in.get('start', False),
+                                        first_port=data_in.get('first_port'))
+        return {
+            'rc': rc,
+            'msg': msg,
+        }
+
     elif command == 'delete':
         data_out = [vbmc_manager.delete(domain_name)
                     for domain_name in set(data_in['domain_names'])]
@@ -152,19 +224,17 @@ def command_dispatcher(vbmc_manager, data_in):
         }
 
     elif command == 'start':
-        data_out = [vbmc_manager.start(domain_name)
-                    for domain_name in set(data_in['domain_names'])]
+        rc, msg = vbmc_manager.bulk_start(set(data_in['domain_names']))
         return {
-            'rc': max(rc for rc, msg in data_out),
-            'msg': [msg for rc, msg in data_out if msg],
+            'rc': rc,
+            'msg': msg,
         }
 
     elif command == 'stop':
-        data_out = [vbmc_manager.stop(domain_name)
-                    for domain_name in set(data_in['domain_names'])]
+        rc, msg = vbmc_manager.bulk_stop(set(data_in['domain_names']))
         return {
-            'rc': max(rc for rc, msg in data_out),
-            'msg': [msg for rc, msg in data_out if msg],
+            'rc': rc,
+            'msg': msg,
         }
 
     elif command == 'list':
@@ -189,6 +259,27 @@ def command_dispatcher(vbmc_manager, data_in):
             'rows': table,
         }
 
+    elif command == 'stats':
+        rc, histograms = vbmc_manager.stats(data_in.get('domain_name'))
+
+        def milliseconds(histogram, percent):
+            latency = histogram.percentile(percent)
+            return None if latency is None else round(latency * 1000, 2)
+
+        return {
+            'rc': rc,
+            'msg': [] if rc == 0 else ['Metrics are disabled'],
+            'header': ('Domain name', 'Layer', 'Command', 'Count',
+                       'p50 (ms)', 'p95 (ms)', 'p99 (ms)', 'Errors', 'Busy'),
+            'rows': [
+                [domain_name, layer, command, histogram.count,
+                 milliseconds(histogram, 50), milliseconds(histogram, 95),
+                 milliseconds(histogram, 99), histogram.errors,
+                 histogram.busy]
+                for domain_name, layer, command, histogram in histograms
+            ]
+        }
+
     else:
         return {
             'rc': 1,
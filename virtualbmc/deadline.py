@@ -0,0 +1,117 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Deadline-bounded libvirt calls.
+
+IPMI commands are handled one at a time by the I/O loop of pyghmi. A
+libvirt call hanging on a wedged libvirtd would keep the loop, and
+therefore every session of the instances it serves, waiting for as long
+as it takes. Calls are instead made by a bounded pool of worker threads,
+the loop only waiting for them until their deadline. A call past its
+deadline keeps its worker busy until libvirt gives up on it, its
+outcome is thrown away.
+"""
+
+import concurrent.futures
+import os
+import threading
+
+from virtualbmc import config as vbmc_config
+from virtualbmc import exception
+
+__all__ = ['get_executor']
+
+CONF = vbmc_config.get_config()
+
+EXECUTOR = None
+_EXECUTOR_LOCK = threading.Lock()
+
+# Calls queued or in progress per worker thread, past which calls are
+# refused rather than queued
+PENDING_PER_WORKER = 2
+
+
+class CallExecutor(object):
+    """Makes libvirt calls on worker threads.
+
+    :param workers: Number of worker threads
+    """
+
+    def __init__(self, workers):
+        self.workers = workers
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix='libvirt-call')
+        self._pending = threading.BoundedSemaphore(
+            workers * PENDING_PER_WORKER)
+
+    def _done(self, future):
+        self._pending.release()
+
+    def submit(self, call, func):
+        """Call func on a worker thread without waiting for it.
+
+        :param call: Name of the call, for reporting
+        :param func: Callable making the libvirt calls
+        :returns: A :class:`concurrent.futures.Future` of what func returns
+        :raises: LibvirtBusy if too many calls are pending already
+        """
+        if not self._pending.acquire(blocking=False):
+            raise exception.LibvirtBusy(call=call)
+
+        try:
+            future = self._executor.submit(func)
+
+        except Exception:
+            self._pending.release()
+            raise
+
+        future.add_done_callback(self._done)
+        return future
+
+    def run(self, call, func, timeout):
+        """Call func on a worker thread, waiting for it until the deadline.
+
+        :param call: Name of the call, for reporting
+        :param func: Callable making the libvirt calls
+        :param timeout: Seconds to wait for func to return
+        :returns: What func returns
+        :raises: LibvirtCallTimeout if func did not return in time,
+            LibvirtBusy if too many calls are pending already, whatever
+            func raises otherwise
+        """
+        future = self.submit(call, func)
+
+        try:
+            return future.result(timeout)
+
+        except concurrent.futures.TimeoutError:
+            if future.done():
+                # Raised by func itself
+                raise
+
+            raise exception.LibvirtCallTimeout(call=call, timeout=timeout)
+
+
+def get_executor():
+    """Return the process-wide libvirt call executor.
+
+    Worker threads do not survive fork(), a forked child gets its own
+    executor on the first call.
+    """
+    global EXECUTOR
+
+    with _EXECUTOR_LOCK:
+        if EXECUTOR is None or EXECUTOR[0] != os.getpid():
+            EXECUTOR = os.getpid(), CallExecutor(
+                CONF['libvirt']['call_workers'])
+
+        return EXECUTOR[1]
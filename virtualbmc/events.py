@@ -0,0 +1,305 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import functools
+import os
+import threading
+import time
+
+import libvirt
+
+from virtualbmc import config as vbmc_config
+from virtualbmc import deadline
+from virtualbmc import log
+from virtualbmc import pool
+
+__all__ = ['get_domain_cache', 'start_event_loop']
+
+LOG = log.get_logger()
+
+CONF = vbmc_config.get_config()
+
+DOMAIN_CACHE = None
+
+# PID of the process running the libvirt event loop thread
+_EVENT_LOOP_PID = None
+_EVENT_LOOP_LOCK = threading.Lock()
+
+
+def _run_event_loop():
+    while True:
+        try:
+            libvirt.virEventRunDefaultImpl()
+        except libvirt.libvirtError as e:
+            LOG.error('libvirt event loop iteration failed: %(error)s',
+                      {'error': e})
+            time.sleep(1)
+
+
+def start_event_loop():
+    """Run the libvirt default event loop implementation in a thread.
+
+    The event loop implementation has to be registered before the
+    connections that subscribe to domain events (or use keepalive) are
+    opened. Threads do not survive fork(), hence a forked child gets its
+    own event loop thread on the first call.
+    """
+    global _EVENT_LOOP_PID
+
+    with _EVENT_LOOP_LOCK:
+        if _EVENT_LOOP_PID == os.getpid():
+            return
+
+        if _EVENT_LOOP_PID is None:
+            libvirt.virEventRegisterDefaultImpl()
+
+        thread = threading.Thread(target=_run_event_loop,
+                                  name='libvirt-event-loop')
+        thread.daemon = True
+        thread.start()
+
+        _EVENT_LOOP_PID = os.getpid()
+
+
+class DomainCache(object):
+    """In-memory view of libvirt domains fed by lifecycle events.
+
+    Entries are keyed by libvirt URI and domain name. They are only served
+    while the lifecycle event subscription for their URI is up and while
+    they are younger than the configured TTL, otherwise the caller falls
+    back to querying libvirt directly.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._sequence = {}
+        self._undefined = {}
+        self._subscriptions = {}
+        self._watched = {}
+        # URIs being subscribed to in the background
+        self._subscribing = set()
+        self._listeners = {}
+
+    def watch(self, uri, sasl_username=None, sasl_password=None):
+        """Make sure lifecycle events of the URI are being received.
+
+        Called while handling IPMI commands, it never waits on libvirt.
+        Unless the event stream is up, subscribing is left to a libvirt
+        call worker and the caller queries libvirt directly meanwhile.
+
+        :returns: True if the event stream is up, False otherwise
+        """
+        conn = pool.get_pool().connection(uri, sasl_username=sasl_username,
+                                          readonly=True)
+
+        with self._lock:
+            if conn is not None and self._watched.get(uri) is conn:
+                return True
+
+            if uri in self._subscribing:
+                return False
+
+            # Events missed while the stream was down may have made any
+            # cached entry of this URI stale
+            self._unwatch(uri)
+            self._subscribing.add(uri)
+
+        try:
+            future = deadline.get_executor().submit(
+                'watch', functools.partial(self._subscribe, uri,
+                                           sasl_username, sasl_password))
+
+        except Exception as e:
+            LOG.debug('Not subscribing to domain events of libvirt URI '
+                      '%(uri)s for now: %(error)s', {'uri': uri, 'error': e})
+            with self._lock:
+                self._subscribing.discard(uri)
+            return False
+
+        return future.done() and future.result()
+
+    def _subscribe(self, uri, sasl_username, sasl_password):
+        try:
+            with pool.pooled_connection(uri, sasl_username=sasl_username,
+                                        sasl_password=sasl_password,
+                                        readonly=True) as conn:
+                conn.domainEventRegisterAny(
+                    None, libvirt.VIR_DOMAIN_EVENT_ID_LIFECYCLE,
+                    self._lifecycle_event, uri)
+
+        except Exception as e:
+            LOG.warning('Failed to subscribe to domain events of libvirt '
+                        'URI %(uri)s: %(error)s', {'uri': uri, 'error': e})
+            with self._lock:
+                self._subscribing.discard(uri)
+            return False
+
+        with self._lock:
+            self._subscribing.discard(uri)
+            self._watched[uri] = conn
+            # Undefinitions may have been missed in the meantime
+            self._subscriptions[uri] = self._subscriptions.get(uri, 0) + 1
+
+        LOG.debug('Subscribed to domain lifecycle events of libvirt URI '
+                  '%(uri)s', {'uri': uri})
+
+        return True
+
+    def _unwatch(self, uri):
+        # Called with the lock held
+        self._watched.pop(uri, None)
+        for key in [k for k in self._entries if k[0] == uri]:
+            del self._entries[key]
+
+    def _lifecycle_event(self, conn, domain, event, detail, uri):
+        domain_name = domain.name()
+
+        LOG.debug('Lifecycle event %(event)s (detail %(detail)s) for '
+                  'domain %(domain)s', {'event': event, 'detail': detail,
+                                        'domain': domain_name})
+
+        key = uri, domain_name
+
+        with self._lock:
+            if self._watched.get(uri) is not conn:
+                return
+
+            self._sequence[key] = self._sequence.get(key, 0) + 1
+            listeners = list(self._listeners.get(key, ()))
+
+            if event == libvirt.VIR_DOMAIN_EVENT_UNDEFINED:
+                # Also received for the former name of a renamed domain
+                self._undefined[key] = self._undefined.get(key, 0) + 1
+                self._entries.pop(key, None)
+
+            else:
+                entry = self._entries.setdefault(key, {})
+
+                if event == libvirt.VIR_DOMAIN_EVENT_STARTED:
+                    entry['active'] = True, time.monotonic()
+                elif event == libvirt.VIR_DOMAIN_EVENT_STOPPED:
+                    entry['active'] = False, time.monotonic()
+                elif event == libvirt.VIR_DOMAIN_EVENT_DEFINED:
+                    # The domain has been (re)defined, its boot
+                    # configuration may have changed
+                    entry.pop('boot', None)
+                else:
+                    entry.pop('active', None)
+
+        for listener in listeners:
+            try:
+                listener(event, detail)
+
+            except Exception as e:
+                LOG.error('Failed handling lifecycle event %(event)s of '
+                          'domain %(domain)s: %(error)s',
+                          {'event': event, 'domain': domain_name,
+                           'error': e})
+
+    def listen(self, uri, domain_name, listener):
+        """Have the lifecycle events of a domain passed to a callable.
+
+        Events are only received while the URI is watched, see
+        :meth:`watch`.
+
+        :param listener: Callable taking the event and its detail
+        """
+        with self._lock:
+            self._listeners.setdefault((uri, domain_name), []).append(
+                listener)
+
+    def unlisten(self, uri, domain_name, listener):
+        """Stop passing the lifecycle events of a domain to a callable."""
+        key = uri, domain_name
+
+        with self._lock:
+            listeners = self._listeners.get(key, [])
+            if listener in listeners:
+                listeners.remove(listener)
+            if not listeners:
+                self._listeners.pop(key, None)
+
+    def fetch(self, uri, domain_name, field, fetcher):
+        """Return a cached domain property or fetch it from libvirt.
+
+        :param uri: The libvirt URI of the domain
+        :param domain_name: The name of the domain
+        :param field: The name of the cached property
+        :param fetcher: Callable querying libvirt for the property value
+        :returns: The property value
+        """
+        key = uri, domain_name
+
+        with self._lock:
+            cached = self._entries.get(key, {}).get(field)
+            if uri in self._watched and cached is not None:
+                value, timestamp = cached
+                if time.monotonic() - timestamp < self.ttl:
+                    return value
+
+            sequence = self._sequence.get(key, 0)
+
+        value = fetcher()
+
+        with self._lock:
+            # Do not let an event received in the meantime be overwritten
+            # by a possibly outdated value
+            if (uri in self._watched
+                    and self._sequence.get(key, 0) == sequence):
+                self._entries.setdefault(key, {})[field] = (
+                    value, time.monotonic())
+
+        return value
+
+    def definition(self, uri, domain_name):
+        """Identify the current definition of a domain.
+
+        :returns: A value changing whenever the domain is undefined or
+            renamed, None while the events of the URI are not received
+        """
+        with self._lock:
+            if uri not in self._watched:
+                return None
+
+            return (self._subscriptions[uri],
+                    self._undefined.get((uri, domain_name), 0))
+
+    def invalidate(self, uri, domain_name, field=None):
+        """Drop cached domain properties."""
+        key = uri, domain_name
+
+        with self._lock:
+            self._sequence[key] = self._sequence.get(key, 0) + 1
+            if field is None:
+                self._entries.pop(key, None)
+            else:
+                self._entries.get(key, {}).pop(field, None)
+
+
+def get_domain_cache():
+    """Return the process-wide domain cache.
+
+    :returns: A DomainCache object or None if domain events are disabled
+    """
+    global DOMAIN_CACHE
+
+    if not CONF['libvirt']['domain_events']:
+        return None
+
+    start_event_loop()
+
+    if DOMAIN_CACHE is None:
+        DOMAIN_CACHE = DomainCache(ttl=CONF['libvirt']['domain_cache_ttl'])
+
+    return DOMAIN_CACHE
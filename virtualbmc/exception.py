@@ -31,11 +31,39 @@ class DomainNotFound(VirtualBMCError):
     message = 'No domain with matching name %(domain)s was found'
 
 
+class ManifestError(VirtualBMCError):
+    message = 'Invalid manifest %(path)s: %(error)s'
+
+
 class LibvirtConnectionOpenError(VirtualBMCError):
     message = ('Fail to establish a connection with libvirt URI "%(uri)s". '
                'Error: %(error)s')
 
 
+class LibvirtUnavailable(VirtualBMCError):
+    message = ('libvirt URI "%(uri)s" is failing, not calling it for a '
+               'while')
+
+
+class LibvirtCallTimeout(VirtualBMCError):
+    message = ('libvirt call %(call)s did not complete within %(timeout)s '
+               'seconds')
+
+
+class LibvirtCallQueued(VirtualBMCError):
+    message = ('libvirt call %(call)s was still queued after %(timeout)s '
+               'seconds, not making it')
+
+
+class LibvirtBusy(VirtualBMCError):
+    message = 'Too many libvirt calls pending, not making call %(call)s'
+
+
+class PowerOperationPending(VirtualBMCError):
+    message = ('Power operation %(call)s is still in progress on domain '
+               '%(domain)s')
+
+
 class DetachProcessError(VirtualBMCError):
     message = ('Error when forking (detaching) the VirtualBMC process '
                'from its parent and session. Error: %(error)s')
@@ -0,0 +1,227 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Prometheus metrics endpoint of vbmcd.
+
+The HTTP socket is served by the vbmcd control loop, along with the
+control interface socket, so that scrapes never run concurrently with
+commands. Everything reported comes out of the memory of vbmcd, either
+its own state or the metrics table it shares with the vBMC instances.
+A scraper slower than half a second is dropped rather than keeping the
+control interface waiting.
+"""
+
+import collections
+import http.server
+import os
+import socket
+
+from virtualbmc import config as vbmc_config
+from virtualbmc import log
+from virtualbmc import metrics
+
+__all__ = ['render', 'start_server']
+
+LOG = log.get_logger()
+
+CONF = vbmc_config.get_config()
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Seconds a scraper is given to send its request and to take each part of
+# the answer, the control loop waits on it meanwhile
+REQUEST_TIMEOUT = 0.5
+
+
+def _labels(**labels):
+    return ','.join(
+        '%s="%s"' % (name, str(value).replace('\\', r'\\').replace(
+            '"', r'\"').replace('\n', r'\n'))
+        for name, value in sorted(labels.items()))
+
+
+def _value(value):
+    if value == float('inf'):
+        return '+Inf'
+
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Family(object):
+    """Lines of a metric family in the text exposition format."""
+
+    def __init__(self, name, kind, description):
+        self.lines = ['# HELP %s %s' % (name, description),
+                      '# TYPE %s %s' % (name, kind)]
+        self.name = name
+
+    def add(self, value, suffix='', **labels):
+        self.lines.append('%s%s{%s} %s' % (self.name, suffix,
+                                           _labels(**labels), _value(value)))
+
+    def add_histogram(self, histogram, **labels):
+        cumulative = 0
+        for bound, count in zip(metrics.BUCKETS, histogram.buckets):
+            cumulative += count
+            self.add(cumulative, suffix='_bucket', le=_value(bound), **labels)
+
+        self.add(histogram.total, suffix='_sum', **labels)
+        self.add(cumulative, suffix='_count', **labels)
+
+
+def render(vbmc_manager):
+    """Render the metrics of vbmcd in the Prometheus text format.
+
+    :param vbmc_manager: The :class:`virtualbmc.manager.VirtualBMCManager`
+    :returns: The metrics document
+    """
+    families = []
+
+    family = _Family('vbmc_instances', 'gauge',
+                     'Number of vBMC instances by status.')
+    for status, count in sorted(vbmc_manager.census().items()):
+        family.add(count, status=status)
+    families.append(family)
+
+    family = _Family('vbmc_instance_restarts_total', 'counter',
+                     'Number of times a vBMC instance was restarted.')
+    for domain_name, count in sorted(vbmc_manager.restarts.items()):
+        family.add(count, domain=domain_name)
+    families.append(family)
+
+    histograms, counters, processes = vbmc_manager.metrics()
+
+    requests = _Family('vbmc_ipmi_requests_total', 'counter',
+                       'Number of IPMI requests handled.')
+    errors = _Family('vbmc_ipmi_request_errors_total', 'counter',
+                     'Number of IPMI requests answered with an error.')
+    busy = _Family('vbmc_ipmi_request_busy_total', 'counter',
+                   'Number of IPMI requests answered with "node busy".')
+
+    # Per-domain latencies would make for too many series with many
+    # instances, add them up per call
+    libvirt_calls = collections.defaultdict(
+        lambda: metrics.Histogram([0] * len(metrics.BUCKETS), 0, 0, 0.0))
+
+    for domain_name, series in sorted(histograms.items()):
+        ipmi = [histogram for (layer, _), histogram in series.items()
+                if layer == metrics.IPMI]
+        requests.add(sum(h.count for h in ipmi), domain=domain_name)
+        errors.add(sum(h.errors for h in ipmi), domain=domain_name)
+        busy.add(sum(h.busy for h in ipmi), domain=domain_name)
+
+        for (layer, call), histogram in series.items():
+            if layer != metrics.LIBVIRT:
+                continue
+
+            total = libvirt_calls[call]
+            libvirt_calls[call] = metrics.Histogram(
+                [a + b for a, b in zip(total.buckets, histogram.buckets)],
+                total.errors + histogram.errors, total.busy + histogram.busy,
+                total.total + histogram.total)
+
+    families.extend((requests, errors, busy))
+
+    latency = _Family('vbmc_libvirt_call_duration_seconds', 'histogram',
+                      'Duration of the libvirt calls of vBMC instances.')
+    call_errors = _Family('vbmc_libvirt_call_errors_total', 'counter',
+                          'Number of failed libvirt calls.')
+    for call, histogram in sorted(libvirt_calls.items()):
+        latency.add_histogram(histogram, call=call)
+        call_errors.add(histogram.errors, call=call)
+    families.extend((latency, call_errors))
+
+    for counter, description in (
+            (metrics.DOMAIN_CACHE_HITS,
+             'Number of domain queries answered out of the domain event '
+             'cache.'),
+            (metrics.DOMAIN_CACHE_MISSES,
+             'Number of domain queries the domain event cache passed on '
+             'to libvirt.')):
+        family = _Family('vbmc_%s_total' % counter, 'counter', description)
+        for domain_name, values in sorted(counters.items()):
+            family.add(values[counter], domain=domain_name)
+        families.append(family)
+
+    family = _Family('vbmc_process_resident_memory_bytes', 'gauge',
+                     'Resident memory size of vbmcd and of the processes '
+                     'hosting vBMC instances.')
+    processes = dict(processes)
+    processes[os.getpid()] = metrics.resident_memory()
+    for pid, rss in sorted(processes.items()):
+        family.add(rss, pid=pid)
+    families.append(family)
+
+    return '\n'.join(line for family in families
+                     for line in family.lines) + '\n'
+
+
+class _MetricsHandler(http.server.BaseHTTPRequestHandler):
+
+    timeout = REQUEST_TIMEOUT
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+
+        try:
+            body = render(self.server.vbmc_manager).encode('utf-8')
+
+        except Exception as ex:
+            LOG.exception('Failed to render metrics: %(error)s',
+                          {'error': ex})
+            self.send_error(500)
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        LOG.debug('Metrics endpoint: ' + format, *args)
+
+
+class MetricsServer(http.server.HTTPServer):
+    """HTTP server handing out metrics, one request at a time.
+
+    Meant to be driven by the caller's own poll loop through
+    :meth:`handle_request` whenever its socket is readable.
+    """
+
+    def __init__(self, vbmc_manager, address, port):
+        self.vbmc_manager = vbmc_manager
+        if ':' in address:
+            self.address_family = socket.AF_INET6
+        super(MetricsServer, self).__init__((address, port), _MetricsHandler)
+        # The socket is known to be readable when a request is handled
+        self.timeout = 0
+
+
+def start_server(vbmc_manager):
+    """Start listening for metrics scrapes, if configured.
+
+    :returns: A :class:`MetricsServer` or None if disabled
+    """
+    port = CONF['metrics']['listen_port']
+    if not port:
+        return None
+
+    address = CONF['metrics']['listen_address']
+    server = MetricsServer(vbmc_manager, address, port)
+
+    LOG.info('Serving metrics on %(address)s port %(port)s',
+             {'address': address, 'port': port})
+
+    return server
@@ -0,0 +1,311 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""In-memory index of the vBMC instance configurations.
+
+vbmcd looks at the configuration of every vBMC instance every few
+seconds. Rather than parsing every configuration file each time, the
+parsed configurations are kept and only the files that changed since
+are parsed again. Changes are learnt of through inotify on Linux. Where
+inotify is unavailable, or when it runs out of watches, the
+configuration directory is scanned for files whose modification time
+changed instead.
+"""
+
+import ctypes
+import errno
+import os
+import struct
+
+from virtualbmc import exception
+from virtualbmc import log
+
+__all__ = ['ConfigIndex']
+
+LOG = log.get_logger()
+
+CONFIG_FILE = 'config'
+
+# From <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+# Changes to the entries of a directory
+DIRECTORY_EVENTS = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE
+                    | IN_DELETE | IN_ONLYDIR)
+
+# Changes to the configuration directory itself
+ROOT_EVENTS = DIRECTORY_EVENTS | IN_DELETE_SELF | IN_MOVE_SELF
+
+_EVENT = struct.Struct('iIII')
+
+_READ_SIZE = 65536
+
+
+class _Inotify(object):
+    """Watches the configuration directory and its domain directories.
+
+    :param config_dir: The configuration directory
+    :raises: OSError if inotify is unavailable or the directory cannot be
+        watched
+    """
+
+    def __init__(self, config_dir):
+        try:
+            self._libc = ctypes.CDLL(None, use_errno=True)
+            init = self._libc.inotify_init1
+        except (OSError, AttributeError):
+            raise OSError(errno.ENOSYS, 'inotify is unavailable')
+
+        self.fd = init(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+
+        self.config_dir = config_dir
+        # Watch descriptor -> domain name, None for the configuration
+        # directory
+        self._watches = {}
+
+        try:
+            self._watch(config_dir, None, ROOT_EVENTS)
+        except OSError:
+            self.close()
+            raise
+
+    def _watch(self, path, domain_name, mask):
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error), path)
+
+        self._watches[wd] = domain_name
+
+    def watch(self, domain_name):
+        """Watch the directory of a domain.
+
+        :raises: OSError if the directory cannot be watched, ENOSPC if
+            the inotify watches of the user ran out
+        """
+        try:
+            self._watch(os.path.join(self.config_dir, domain_name),
+                        domain_name, DIRECTORY_EVENTS)
+
+        except OSError as e:
+            # Removed meanwhile
+            if e.errno not in (errno.ENOENT, errno.ENOTDIR):
+                raise
+
+    def changes(self):
+        """Return the domains whose configuration may have changed.
+
+        :returns: A set of domain names, or None if changes were lost and
+            all the configurations have to be looked at again
+        """
+        changed = set()
+
+        while True:
+            try:
+                data = os.read(self.fd, _READ_SIZE)
+            except BlockingIOError:
+                return changed
+
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = _EVENT.unpack_from(data, offset)
+                name = data[offset + _EVENT.size:
+                            offset + _EVENT.size + length].rstrip(b'\0')
+                offset += _EVENT.size + length
+
+                if mask & IN_Q_OVERFLOW:
+                    changed = None
+                    continue
+
+                if wd not in self._watches:
+                    continue
+
+                domain_name = self._watches[wd]
+
+                if mask & IN_IGNORED:
+                    del self._watches[wd]
+                    if domain_name is None:
+                        raise OSError(errno.ENOENT, 'Configuration directory '
+                                      'is gone', self.config_dir)
+                    continue
+
+                if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                    if domain_name is None:
+                        raise OSError(errno.ENOENT, 'Configuration directory '
+                                      'is gone', self.config_dir)
+                    continue
+
+                if domain_name is None:
+                    domain_name = os.fsdecode(name)
+                    if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                        self.watch(domain_name)
+
+                if changed is not None:
+                    changed.add(domain_name)
+
+    def close(self):
+        os.close(self.fd)
+
+
+class ConfigIndex(object):
+    """Parsed vBMC instance configurations, refreshed as files change.
+
+    :param config_dir: The configuration directory, holding a directory
+        per domain
+    :param parse: Callable parsing the configuration of a domain,
+        raising DomainNotFound if it has none
+    """
+
+    def __init__(self, config_dir, parse):
+        self.config_dir = config_dir
+        self._parse = parse
+        # domain name -> parsed configuration
+        self._configs = {}
+        # domain name -> (mtime, size, inode) of the parsed file
+        self._stamps = {}
+        # Domains to parse again whatever their file says
+        self._stale = set()
+        self._inotify = None
+        self._scanned = False
+
+    def invalidate(self, domain_name):
+        """Have the configuration of a domain parsed on the next refresh."""
+        self._stale.add(domain_name)
+
+    def configs(self):
+        """Return copies of the configurations by domain name."""
+        return {domain_name: dict(config)
+                for domain_name, config in self._configs.items()}
+
+    def refresh(self):
+        """Bring the index up to date with the configuration files."""
+        if not self._scanned:
+            self._start_watching()
+            self._scan()
+            self._scanned = True
+            return
+
+        if self._inotify is None:
+            self._scan()
+            return
+
+        try:
+            changed = self._inotify.changes()
+
+        except OSError as e:
+            self._stop_watching(e)
+            self._scan()
+            return
+
+        if changed is None:
+            LOG.warning('Lost track of configuration changes in %(dir)s, '
+                        'parsing all of them again',
+                        {'dir': self.config_dir})
+            self._stale.update(self._configs)
+            self._scan()
+            return
+
+        self._stale.update(changed)
+        for domain_name in list(self._stale):
+            self._load(domain_name)
+
+    def close(self):
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
+
+    def _start_watching(self):
+        if self._inotify is not None:
+            return
+
+        try:
+            self._inotify = _Inotify(self.config_dir)
+
+        except OSError as e:
+            LOG.info('Not watching configuration directory %(dir)s, '
+                     'scanning it instead: %(error)s',
+                     {'dir': self.config_dir, 'error': e})
+
+    def _stop_watching(self, error):
+        LOG.warning('Stopped watching configuration directory %(dir)s, '
+                    'scanning it instead: %(error)s',
+                    {'dir': self.config_dir, 'error': error})
+        self.close()
+
+    def _scan(self):
+        stamps = {}
+
+        with os.scandir(self.config_dir) as entries:
+            for entry in entries:
+                if not entry.is_dir():
+                    continue
+
+                if self._inotify is not None and not self._scanned:
+                    try:
+                        self._inotify.watch(entry.name)
+                    except OSError as e:
+                        self._stop_watching(e)
+
+                stamps[entry.name] = self._stamp(entry.name)
+
+        for domain_name in set(self._configs) - set(stamps):
+            self._drop(domain_name)
+
+        for domain_name, stamp in stamps.items():
+            if (domain_name in self._stale
+                    or self._stamps.get(domain_name) != stamp):
+                self._load(domain_name)
+
+    def _stamp(self, domain_name):
+        try:
+            stat = os.stat(os.path.join(self.config_dir, domain_name,
+                                        CONFIG_FILE))
+        except OSError:
+            return
+
+        return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+    def _load(self, domain_name):
+        # Changes made after the file is looked at get it parsed again
+        stamp = self._stamp(domain_name)
+        self._stale.discard(domain_name)
+
+        try:
+            config = self._parse(domain_name)
+
+        except exception.DomainNotFound:
+            self._drop(domain_name)
+            return
+
+        except Exception:
+            self._stale.add(domain_name)
+            raise
+
+        self._configs[domain_name] = config
+        self._stamps[domain_name] = stamp
+
+    def _drop(self, domain_name):
+        self._configs.pop(domain_name, None)
+        self._stamps.pop(domain_name, None)
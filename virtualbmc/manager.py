@@ -10,18 +10,33 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import collections
 import configparser
+import contextlib
 import errno
 import multiprocessing
 import os
 import shutil
 import signal
+import sys
+import time
+
+import libvirt
 
 from virtualbmc import config as vbmc_config
 from virtualbmc import exception
+from virtualbmc import index
 from virtualbmc import log
+from virtualbmc import metrics
+from virtualbmc import pool
+from virtualbmc import router
+from virtualbmc import scheduler
+from virtualbmc import sensors
+from virtualbmc import spawner
+from virtualbmc import store
 from virtualbmc import utils
 from virtualbmc.vbmc import VirtualBMC
+from virtualbmc import worker
 
 LOG = log.get_logger()
 
@@ -32,13 +47,36 @@ ERROR = 'error'
 
 DEFAULT_SECTION = 'VirtualBMC'
 
+# Name configuration files are renamed to once imported into the
+# configuration database, for them not to come back as they were if the
+# configuration files were used again
+MIGRATED_CONFIG_FILE = 'config.migrated'
+
+# Seconds a vBMC instance that keeps dying waits before being restarted,
+# doubled on every consecutive death up to MAX_RESTART_BACKOFF. The first
+# restart is immediate
+RESTART_BACKOFF = 1
+MAX_RESTART_BACKOFF = 60
+
+# Seconds a vBMC instance has to run for its deaths to no longer be
+# considered consecutive
+STABLE_PERIOD = 60
+
+# Port the ports of the vBMC instances added in bulk are allocated from
+FIRST_PORT = 6230
+
 CONF = vbmc_config.get_config()
 
 
+def _exit_on_sigterm(signum, frame):
+    sys.exit(0)
+
+
 def vbmc_runner(bmc_config):
     # The manager process installs a signal handler for SIGTERM to
-    # propagate it to children. Return to the default handler.
-    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    # propagate it to children. Exit cleanly instead, so that pending
+    # work such as a deferred boot device change is not lost.
+    signal.signal(signal.SIGTERM, _exit_on_sigterm)
 
     show_passwords = CONF['default']['show_passwords']
 
@@ -68,6 +106,9 @@ def vbmc_runner(bmc_config):
         )
         return
 
+    finally:
+        vbmc.flush_boot_device()
+
 
 class VirtualBMCManager(object):
 
@@ -75,12 +116,114 @@ class VirtualBMCManager(object):
                     'domain_name', 'libvirt_uri', 'libvirt_sasl_username',
                     'libvirt_sasl_password', 'active']
 
+    # Options of the vBMC instances added in bulk, when left unset
+    BULK_ADD_DEFAULTS = {'username': 'admin',
+                         'password': 'password',
+                         'address': '::',
+                         'port': None,
+                         'libvirt_uri': 'qemu:///system',
+                         'libvirt_sasl_username': None,
+                         'libvirt_sasl_password': None}
+
     def __init__(self):
         super(VirtualBMCManager, self).__init__()
         self.config_dir = CONF['default']['config_dir']
+        # Parsed configurations, set up on first use
+        self._index = None
+        # Database holding the configurations in place of configuration
+        # files, if configured
+        self._store = None
         self._running_domains = {}
+        self._worker_pool = None
+        self._spawner = None
+        # domain name -> number of times its vBMC instance was restarted
+        self.restarts = collections.Counter()
+        # domain name -> number of times its vBMC instance died
+        self.crashes = collections.Counter()
+        # domain name -> exit code of its last dead vBMC instance
+        self.exit_codes = {}
+        # domain name -> dead vBMC instance already accounted for
+        self._dead = {}
+        # domain name -> consecutive deaths of its vBMC instance
+        self._streaks = collections.Counter()
+        # domain name -> time its vBMC instance is started again at
+        self._restart_at = {}
+        # domain name -> time its vBMC instance was started at
+        self._started_at = {}
+        # domain name -> sentinel of the process of its vBMC instance
+        self._sentinels = {}
+        # domain name -> (shared memory slot, libvirt connection arguments)
+        self._slots = {}
+        self._stats_collector = None
+        self._metrics_table = None
+        self._scheduler_table = scheduler.get_scheduler_table()
+
+        # NOTE: the tables have to be allocated before any vBMC instance
+        # is forked, for them to share them
+        if CONF['sensors']['enabled']:
+            self._stats_collector = sensors.StatsCollector(
+                sensors.get_sensor_table(), CONF['sensors']['interval'])
+
+        if CONF['metrics']['enabled']:
+            self._metrics_table = metrics.get_metrics_table()
+
+        if CONF['default']['config_store'] == 'sqlite':
+            os.makedirs(self.config_dir, mode=0o700, exist_ok=True)
+            self._store = store.SQLiteStore(
+                os.path.join(self.config_dir, store.DATABASE_FILE))
+            self._migrate_config_files()
+
+        # NOTE: the spawner is forked before vbmcd sets its control server
+        # up and after the tables are allocated, for the instances to
+        # share them
+        if CONF['default']['execution_mode'] == 'forkserver':
+            self._spawner = spawner.Spawner(
+                CONF['default']['warm_processes'])
+
+    def _migrate_config_files(self):
+        """Import the configuration files into the database, once.
+
+        The imported configuration files are renamed to
+        :data:`MIGRATED_CONFIG_FILE`, the database being the only source
+        of configurations from then on.
+        """
+        migrated = []
+
+        def configs():
+            with os.scandir(self.config_dir) as entries:
+                for entry in entries:
+                    if not entry.is_dir():
+                        continue
+
+                    try:
+                        yield self._read_config_file(entry.name)
+
+                    except exception.DomainNotFound:
+                        continue
+
+                    migrated.append(entry.name)
+
+        count = self._store.migrate(configs())
+
+        for domain_name in migrated:
+            domain_path = os.path.join(self.config_dir, domain_name)
+            os.replace(os.path.join(domain_path, 'config'),
+                       os.path.join(domain_path, MIGRATED_CONFIG_FILE))
+
+        if count:
+            LOG.info('Imported the configuration of %(count)d domains from '
+                     '%(dir)s into %(path)s, the configuration files are no '
+                     'longer used and were renamed to %(name)s',
+                     {'count': count, 'dir': self.config_dir,
+                      'path': self._store.path, 'name': MIGRATED_CONFIG_FILE})
 
     def _parse_config(self, domain_name):
+        if self._store is not None:
+            return self._store.get(domain_name)
+
+        return self._read_config_file(domain_name)
+
+    def _read_config_file(self, domain_name):
         config_path = os.path.join(self.config_dir, domain_name, 'config')
         if not os.path.exists(config_path):
             raise exception.DomainNotFound(domain=domain_name)
@@ -107,6 +250,10 @@ class VirtualBMCManager(object):
             raise exception.DomainNotFound(domain=domain_name)
 
     def _store_config(self, **options):
+        if self._store is not None:
+            self._store.put(options)
+            return
+
         config = configparser.ConfigParser()
         config.add_section(DEFAULT_SECTION)
 
@@ -121,6 +268,32 @@ class VirtualBMCManager(object):
         with open(config_path, 'w') as f:
             config.write(f)
 
+        if self._index is not None:
+            self._index.invalidate(options['domain_name'])
+
+    def _configs(self, **filters):
+        """Return the configurations of the vBMC instances by domain name.
+
+        Only the configuration files that changed since the last call are
+        parsed again.
+
+        :param filters: Values of the port or libvirt_uri options the
+            configurations must have
+        """
+        if self._store is not None:
+            return self._store.all(**filters)
+
+        if self._index is None:
+            self._index = index.ConfigIndex(self.config_dir,
+                                            self._parse_config)
+
+        self._index.refresh()
+
+        return {domain_name: config
+                for domain_name, config in self._index.configs().items()
+                if all(config.get(option) == value
+                       for option, value in filters.items())}
+
     def _vbmc_enabled(self, domain_name, lets_enable=None, config=None):
         if not config:
             config = self._parse_config(domain_name)
@@ -146,19 +319,12 @@ class VirtualBMCManager(object):
         enabled but dead instances, kills non-configured
         but alive ones.
         """
+        if self._worker_pool and not shutdown:
+            self._worker_pool.maintain()
 
-        for domain_name in os.listdir(self.config_dir):
-            if not os.path.isdir(
-                    os.path.join(self.config_dir, domain_name)
-            ):
-                continue
-
-            try:
-                bmc_config = self._parse_config(domain_name)
-
-            except exception.DomainNotFound:
-                continue
+        configs = self._configs()
 
+        for domain_name, bmc_config in configs.items():
             if shutdown:
                 lets_enable = False
             else:
@@ -169,32 +335,50 @@ class VirtualBMCManager(object):
             instance = self._running_domains.get(domain_name)
 
             if lets_enable:
+                alive = instance is not None and instance.is_alive()
 
-                if not instance or not instance.is_alive():
+                if (instance and not alive
+                        and self._dead.get(domain_name) is not instance):
+                    self._instance_died(domain_name, instance)
 
-                    instance = multiprocessing.Process(
-                        name='vbmcd-managing-domain-%s' % domain_name,
-                        target=vbmc_runner,
-                        args=(bmc_config,)
-                    )
+                if not alive:
+                    if time.monotonic() < self._restart_at.get(domain_name,
+                                                               0):
+                        continue
+
+                    if instance:
+                        self.restarts[domain_name] += 1
 
-                    instance.daemon = True
-                    instance.start()
+                    bmc_config = self._with_slot(domain_name, bmc_config)
+
+                    try:
+                        instance = self._spawn(domain_name, bmc_config)
+
+                    except exception.VirtualBMCError as ex:
+                        delay = self._backoff(domain_name)
+                        LOG.error(
+                            'Failed to start vBMC instance for domain '
+                            '%(domain)s, retrying in %(delay).1f seconds: '
+                            '%(error)s', {'domain': domain_name,
+                                          'error': ex, 'delay': delay}
+                        )
+                        continue
 
                     self._running_domains[domain_name] = instance
+                    self._dead.pop(domain_name, None)
+                    self._restart_at.pop(domain_name, None)
+                    self._started_at[domain_name] = time.monotonic()
+
+                    # Only per-instance processes have one
+                    sentinel = getattr(instance, 'sentinel', None)
+                    if sentinel is not None:
+                        self._sentinels[domain_name] = sentinel
 
                     LOG.info(
                         'Started vBMC instance for domain '
                         '%(domain)s', {'domain': domain_name}
                     )
 
-                if not instance.is_alive():
-                    LOG.debug(
-                        'Found dead vBMC instance for domain %(domain)s '
-                        '(rc %(rc)s)', {'domain': domain_name,
-                                        'rc': instance.exitcode}
-                    )
-
             else:
                 if instance:
                     if instance.is_alive():
@@ -206,8 +390,172 @@ class VirtualBMCManager(object):
 
                     self._running_domains.pop(domain_name, None)
 
-    def _show(self, domain_name):
-        bmc_config = self._parse_config(domain_name)
+                self._slots.pop(domain_name, None)
+                self.restarts.pop(domain_name, None)
+                self._forget_crashes(domain_name)
+
+        # Domains whose configuration is gone
+        for domain_name in set(self._restart_at).difference(configs):
+            self._forget_crashes(domain_name)
+
+        if shutdown and self._worker_pool:
+            self._worker_pool.terminate()
+            self._worker_pool = None
+
+        if shutdown and self._spawner:
+            self._spawner.terminate()
+            self._spawner = None
+
+    def _instance_died(self, domain_name, instance):
+        self._dead[domain_name] = instance
+        self._sentinels.pop(domain_name, None)
+        self.crashes[domain_name] += 1
+        self.exit_codes[domain_name] = instance.exitcode
+        delay = self._backoff(domain_name)
+
+        LOG.warning('vBMC instance for domain %(domain)s died (rc %(rc)s), '
+                    'restarting it in %(delay).1f seconds',
+                    {'domain': domain_name, 'rc': instance.exitcode,
+                     'delay': delay})
+
+    def _backoff(self, domain_name):
+        """Hold the restart of a vBMC instance back.
+
+        :returns: The number of seconds the restart is held back for
+        """
+        now = time.monotonic()
+
+        started_at = self._started_at.get(domain_name)
+        if started_at is not None and now - started_at >= STABLE_PERIOD:
+            self._streaks.pop(domain_name, None)
+
+        streak = self._streaks[domain_name]
+        self._streaks[domain_name] += 1
+
+        delay = 0
+        if streak:
+            delay = min(RESTART_BACKOFF * 2 ** (streak - 1),
+                        MAX_RESTART_BACKOFF)
+
+        self._restart_at[domain_name] = now + delay
+
+        return delay
+
+    def _forget_crashes(self, domain_name):
+        for tracked in (self.crashes, self.exit_codes, self._dead,
+                        self._streaks, self._restart_at, self._started_at,
+                        self._sentinels):
+            tracked.pop(domain_name, None)
+
+    def sentinels(self):
+        """Return file descriptors ready as vBMC instances die.
+
+        Waiting on them lets dead instances be restarted right away
+        rather than on the next periodic call.
+        """
+        sentinels = set(self._sentinels.values())
+
+        if self._worker_pool:
+            sentinels.update(self._worker_pool.sentinels())
+
+        if self._spawner:
+            sentinels.update(self._spawner.sentinels())
+
+        return sentinels
+
+    def restart_delay(self):
+        """Return the seconds left before a dead vBMC instance restarts.
+
+        :returns: The number of seconds until the next restart held back,
+            None if there is none
+        """
+        if not self._restart_at:
+            return None
+
+        return max(min(self._restart_at.values()) - time.monotonic(), 0)
+
+    def _with_slot(self, domain_name, bmc_config):
+        """Assign a shared memory slot to a vBMC instance about to start.
+
+        The slot locates the sensor readings, the metrics and the queued
+        libvirt operations of the instance in the tables it shares with
+        vbmcd.
+        """
+        if (self._stats_collector is None and self._metrics_table is None
+                and self._scheduler_table is None):
+            return bmc_config
+
+        if domain_name in self._slots:
+            slot = self._slots[domain_name][0]
+
+        else:
+            used = {slot for slot, _ in self._slots.values()}
+            slot = next((index for index in range(
+                CONF['default']['shared_memory_slots'])
+                if index not in used), None)
+
+            if slot is None:
+                LOG.warning('No shared memory slot left for domain '
+                            '%(domain)s, its sensors and metrics are '
+                            'unavailable', {'domain': domain_name})
+                return bmc_config
+
+            if self._stats_collector is not None:
+                self._stats_collector.table.clear(slot)
+
+            if self._metrics_table is not None:
+                self._metrics_table.clear(slot)
+
+            if self._scheduler_table is not None:
+                self._scheduler_table.clear(slot)
+
+        self._slots[domain_name] = slot, {
+            'uri': bmc_config['libvirt_uri'],
+            'sasl_username': bmc_config['libvirt_sasl_username'],
+            'sasl_password': bmc_config['libvirt_sasl_password']}
+
+        return dict(bmc_config, slot=slot)
+
+    def _spawn(self, domain_name, bmc_config):
+        """Start a vBMC instance according to the execution mode.
+
+        :returns: An object following the :class:`multiprocessing.Process`
+            interface for the instance
+        """
+        execution_mode = CONF['default']['execution_mode']
+
+        if execution_mode in ('single', 'sharded'):
+            if not self._worker_pool:
+                if execution_mode == 'single':
+                    size = 1
+                else:
+                    size = (CONF['default']['worker_count']
+                            or os.cpu_count() or 1)
+
+                self._worker_pool = worker.WorkerPool(size)
+
+            return self._worker_pool.start_bmc(domain_name, bmc_config)
+
+        name = 'vbmcd-managing-domain-%s' % domain_name
+
+        if execution_mode == 'forkserver':
+            self._maintain_spawner()
+            return self._spawner.start(name, vbmc_runner, (bmc_config,))
+
+        instance = multiprocessing.Process(
+            name=name,
+            target=vbmc_runner,
+            args=(bmc_config,)
+        )
+
+        instance.daemon = True
+        instance.start()
+
+        return instance
+
+    def _show(self, domain_name, bmc_config=None):
+        if bmc_config is None:
+            bmc_config = self._parse_config(domain_name)
 
         show_passwords = CONF['default']['show_passwords']
 
@@ -227,18 +575,71 @@ class VirtualBMCManager(object):
 
         return show_options
 
+    def _maintain_spawner(self):
+        """Start the spawner process again if it died."""
+        if self._spawner and not self._spawner.is_alive():
+            LOG.warning('The spawner process died (rc %(rc)s), starting it '
+                        'again', {'rc': self._spawner.process.exitcode})
+            self._spawner.terminate()
+            self._spawner = None
+
+        if not self._spawner:
+            self._spawner = spawner.Spawner(CONF['default']['warm_processes'])
+
     def periodic(self, shutdown=False):
+        if (CONF['default']['execution_mode'] == 'forkserver'
+                and not shutdown):
+            self._maintain_spawner()
+            # Exit reports of instances no longer looked after would
+            # otherwise keep the spawner ready for reading
+            self._spawner.poll()
+
         self._sync_vbmc_states(shutdown)
 
+        if self._stats_collector is not None and not shutdown:
+            self._stats_collector.collect(self._slots)
+
     def add(self, username, password, port, address, domain_name,
             libvirt_uri, libvirt_sasl_username, libvirt_sasl_password,
             **kwargs):
 
         # check libvirt's connection and if domain exist prior to adding it
-        utils.check_libvirt_connection_and_domain(
-            libvirt_uri, domain_name,
-            sasl_username=libvirt_sasl_username,
-            sasl_password=libvirt_sasl_password)
+        with pool.pooled_connection(
+                libvirt_uri, readonly=True,
+                sasl_username=libvirt_sasl_username,
+                sasl_password=libvirt_sasl_password) as conn:
+            utils.get_libvirt_domain(conn, domain_name)
+
+        if router.is_shared({'port': port}):
+            # Sessions of the shared IPMI endpoint are routed by user name
+            for other_domain, other_config in self._configs(
+                    port=int(port)).items():
+                if (router.is_shared(other_config)
+                        and other_config['username'] == username):
+                    msg = ('IPMI user name %(user)s is already used by '
+                           'domain %(domain)s on the shared port %(port)s'
+                           % {'user': username, 'domain': other_domain,
+                              'port': port})
+                    LOG.error(msg)
+                    return 1, msg
+
+        options = dict(domain_name=domain_name,
+                       username=username,
+                       password=password,
+                       port=str(port),
+                       address=address,
+                       libvirt_uri=libvirt_uri,
+                       libvirt_sasl_username=libvirt_sasl_username,
+                       libvirt_sasl_password=libvirt_sasl_password,
+                       active=False)
+
+        if self._store is not None:
+            try:
+                self._store.add(options)
+            except exception.DomainAlreadyExists as ex:
+                return 1, str(ex)
+
+            return 0, ''
 
         domain_path = os.path.join(self.config_dir, domain_name)
 
@@ -254,15 +655,7 @@ class VirtualBMCManager(object):
             return 1, msg
 
         try:
-            self._store_config(domain_name=domain_name,
-                               username=username,
-                               password=password,
-                               port=str(port),
-                               address=address,
-                               libvirt_uri=libvirt_uri,
-                               libvirt_sasl_username=libvirt_sasl_username,
-                               libvirt_sasl_password=libvirt_sasl_password,
-                               active=False)
+            self._store_config(**options)
 
         except Exception as ex:
             self.delete(domain_name)
@@ -270,9 +663,210 @@ class VirtualBMCManager(object):
 
         return 0, ''
 
+    def bulk_add(self, bmcs, start=False, first_port=None):
+        """Add many vBMC instances at once, all or none of them.
+
+        The domains are looked up with a single libvirt call per libvirt
+        URI, and the configurations are only written once all of them
+        are found valid.
+
+        :param bmcs: List of dicts of the options of :meth:`add`, only
+            the domain name is required
+        :param start: Whether to start the instances once added
+        :param first_port: Port the ports left unset are allocated from,
+            :data:`FIRST_PORT` by default
+        :returns: The highest return code and the error messages
+        """
+        configs = self._configs()
+        bulk = []
+        errors = []
+
+        for bmc in bmcs:
+            options = dict(self.BULK_ADD_DEFAULTS)
+            options.update((option, value) for option, value in bmc.items()
+                           if value is not None)
+            options['active'] = False
+            domain_name = options['domain_name']
+
+            if domain_name in configs or any(
+                    domain_name == other['domain_name'] for other in bulk):
+                errors.append(str(exception.DomainAlreadyExists(
+                    domain=domain_name)))
+
+            if (bool(options['libvirt_sasl_username'])
+                    != bool(options['libvirt_sasl_password'])):
+                errors.append('A password and username are required to use '
+                              'Libvirt\'s SASL authentication for domain '
+                              '%s' % domain_name)
+
+            bulk.append(options)
+
+        errors.extend(self._allocate_ports(bulk, configs,
+                                           first_port or FIRST_PORT))
+
+        if not errors:
+            errors.extend(self._find_domains(bulk))
+
+        if errors:
+            for msg in errors:
+                LOG.error(msg)
+            return 1, errors
+
+        rc, msgs = self._add_configs(bulk)
+
+        if rc or not start:
+            return rc, msgs
+
+        return self.bulk_start([options['domain_name'] for options in bulk])
+
+    @staticmethod
+    def _allocate_ports(bulk, configs, first_port):
+        """Check the ports of vBMC instances, allocating the unset ones.
+
+        :returns: The error messages
+        """
+        errors = []
+        # (address, port) -> domain name, of the ports used on their own
+        used = {}
+        # user name -> domain name, of the instances on the shared port
+        shared_users = {}
+
+        def take(domain_name, config):
+            if router.is_shared(config):
+                other = shared_users.setdefault(config['username'],
+                                                domain_name)
+                if other != domain_name:
+                    return ('IPMI user name %(user)s is already used by '
+                            'domain %(domain)s on the shared port %(port)s'
+                            % {'user': config['username'], 'domain': other,
+                               'port': config['port']})
+                return
+
+            other = used.setdefault((config['address'], int(config['port'])),
+                                    domain_name)
+            if other != domain_name:
+                return ('Port %(port)s of address %(address)s is already '
+                        'used by domain %(domain)s'
+                        % {'port': config['port'],
+                           'address': config['address'], 'domain': other})
+
+        for domain_name, config in configs.items():
+            take(domain_name, config)
+
+        for options in bulk:
+            if options['port'] is None:
+                continue
+
+            try:
+                port = int(options['port'])
+                if not 0 < port < 65536:
+                    raise ValueError(port)
+
+            except ValueError:
+                errors.append('Invalid port %(port)s for domain %(domain)s'
+                              % {'port': options['port'],
+                                 'domain': options['domain_name']})
+                continue
+
+            options['port'] = str(port)
+            error = take(options['domain_name'], options)
+            if error:
+                errors.append(error)
+
+        # Allocated ports are not used on any address
+        ports = {port for _, port in used}
+        port = first_port
+
+        for options in bulk:
+            if options['port'] is not None:
+                continue
+
+            while port in ports or router.is_shared({'port': port}):
+                port += 1
+
+            if port > 65535:
+                errors.append('No port left for domain %s'
+                              % options['domain_name'])
+                continue
+
+            ports.add(port)
+            options['port'] = str(port)
+
+        return errors
+
+    @staticmethod
+    def _find_domains(bulk):
+        """Look the domains of vBMC instances up in libvirt.
+
+        :returns: The error messages
+        """
+        errors = []
+        domain_names = collections.defaultdict(list)
+
+        for options in bulk:
+            domain_names[options['libvirt_uri'],
+                         options['libvirt_sasl_username'],
+                         options['libvirt_sasl_password']].append(
+                options['domain_name'])
+
+        for (uri, sasl_username, sasl_password), names in (
+                domain_names.items()):
+            try:
+                with pool.pooled_connection(
+                        uri, readonly=True, sasl_username=sasl_username,
+                        sasl_password=sasl_password) as conn:
+                    known = {domain.name()
+                             for domain in conn.listAllDomains()}
+
+            except (libvirt.libvirtError, exception.VirtualBMCError) as ex:
+                errors.append(str(ex))
+                continue
+
+            errors.extend(str(exception.DomainNotFound(domain=domain_name))
+                          for domain_name in names
+                          if domain_name not in known)
+
+        return errors
+
+    def _add_configs(self, bulk):
+        """Write the configurations of new vBMC instances, all or none."""
+        if self._store is not None:
+            try:
+                self._store.add(*bulk)
+            except exception.DomainAlreadyExists as ex:
+                return 1, [str(ex)]
+
+            return 0, []
+
+        added = []
+
+        try:
+            for options in bulk:
+                os.makedirs(os.path.join(self.config_dir,
+                                         options['domain_name']))
+                added.append(options['domain_name'])
+                self._store_config(**options)
+
+        except OSError as ex:
+            for domain_name in added:
+                shutil.rmtree(os.path.join(self.config_dir, domain_name),
+                              ignore_errors=True)
+                if self._index is not None:
+                    self._index.invalidate(domain_name)
+
+            msg = ('Failed to add domain %(domain)s. Error: %(error)s'
+                   % {'domain': options['domain_name'], 'error': ex})
+            LOG.error(msg)
+            return 1, [msg]
+
+        return 0, []
+
     def delete(self, domain_name):
         domain_path = os.path.join(self.config_dir, domain_name)
-        if not os.path.exists(domain_path):
+        if self._store is not None:
+            # Fail on unknown domains
+            self._store.get(domain_name)
+        elif not os.path.exists(domain_path):
             raise exception.DomainNotFound(domain=domain_name)
 
         try:
@@ -280,60 +874,114 @@ class VirtualBMCManager(object):
         except exception.VirtualBMCError:
             pass
 
+        if self._store is not None:
+            self._store.delete(domain_name)
+            return 0, ''
+
         shutil.rmtree(domain_path)
 
+        if self._index is not None:
+            self._index.invalidate(domain_name)
+
         return 0, ''
 
+    def _batch(self):
+        """Make configuration changes in a single transaction, if possible."""
+        if self._store is not None:
+            return self._store.transaction()
+
+        return contextlib.nullcontext()
+
     def start(self, domain_name):
-        try:
-            bmc_config = self._parse_config(domain_name)
+        rc, msgs = self.bulk_start([domain_name])
+        return rc, ''.join(msgs)
 
-        except Exception as ex:
-            return 1, str(ex)
+    def stop(self, domain_name):
+        rc, msgs = self.bulk_stop([domain_name])
+        return rc, ''.join(msgs)
+
+    def bulk_start(self, domain_names):
+        """Enable the vBMC instances of many domains at once.
 
-        if domain_name in self._running_domains:
+        The configurations are all updated first, then the instances are
+        all started by a single synchronisation.
+
+        :returns: The highest return code and the error messages
+        """
+        rc = 0
+        msgs = []
+        configs = {}
+
+        for domain_name in domain_names:
+            try:
+                configs[domain_name] = self._parse_config(domain_name)
+
+            except Exception as ex:
+                rc = 1
+                msgs.append(str(ex))
+
+        if any(domain_name in self._running_domains
+               for domain_name in configs):
 
             self._sync_vbmc_states()
 
-            if domain_name in self._running_domains:
-                LOG.warning(
-                    'BMC instance %(domain)s already running, ignoring '
-                    '"start" command' % {'domain': domain_name})
-                return 0, ''
+            for domain_name in list(configs):
+                if domain_name in self._running_domains:
+                    LOG.warning(
+                        'BMC instance %(domain)s already running, ignoring '
+                        '"start" command' % {'domain': domain_name})
+                    del configs[domain_name]
 
-        try:
-            self._vbmc_enabled(domain_name,
-                               config=bmc_config,
-                               lets_enable=True)
+        if not configs:
+            return rc, msgs
 
-        except Exception as e:
-            LOG.exception('Failed to start domain %s', domain_name)
-            return 1, ('Failed to start domain %(domain)s. Error: '
-                       '%(error)s' % {'domain': domain_name, 'error': e})
+        with self._batch():
+            for domain_name, bmc_config in configs.items():
+                try:
+                    self._vbmc_enabled(domain_name,
+                                       config=bmc_config,
+                                       lets_enable=True)
+
+                except Exception as e:
+                    LOG.exception('Failed to start domain %s', domain_name)
+                    rc = 1
+                    msgs.append('Failed to start domain %(domain)s. Error: '
+                                '%(error)s' % {'domain': domain_name,
+                                               'error': e})
 
         self._sync_vbmc_states()
 
-        return 0, ''
+        return rc, msgs
 
-    def stop(self, domain_name):
-        try:
-            self._vbmc_enabled(domain_name, lets_enable=False)
+    def bulk_stop(self, domain_names):
+        """Disable the vBMC instances of many domains at once.
 
-        except Exception as ex:
-            LOG.exception('Failed to stop domain %s', domain_name)
-            return 1, str(ex)
+        :returns: The highest return code and the error messages
+        """
+        rc = 0
+        msgs = []
 
-        self._sync_vbmc_states()
+        with self._batch():
+            for domain_name in domain_names:
+                try:
+                    self._vbmc_enabled(domain_name, lets_enable=False)
 
-        return 0, ''
+                except Exception as ex:
+                    LOG.exception('Failed to stop domain %s', domain_name)
+                    rc = 1
+                    msgs.append(str(ex))
+
+        if len(msgs) < len(domain_names):
+            self._sync_vbmc_states()
+
+        return rc, msgs
 
     def list(self):
         rc = 0
         tables = []
         try:
-            for domain in os.listdir(self.config_dir):
-                if os.path.isdir(os.path.join(self.config_dir, domain)):
-                    tables.append(self._show(domain))
+            for domain_name, bmc_config in self._configs().items():
+                tables.append(self._show(domain_name, bmc_config=bmc_config))
 
         except OSError as e:
             if e.errno == errno.EEXIST:
@@ -342,4 +990,99 @@ class VirtualBMCManager(object):
         return rc, tables
 
     def show(self, domain_name):
-        return 0, list(self._show(domain_name).items())
+        show_options = self._show(domain_name)
+
+        if self._scheduler_table is not None:
+            # Domain starts, resets and boot device changes of all the
+            # instances waiting on the libvirt URI of this one
+            show_options['queued_operations'] = self._scheduler_table.queued(
+                show_options['libvirt_uri'],
+                [slot for slot, _ in self._slots.values()])
+
+            # Progress of a graceful shutdown of the domain
+            remaining = None
+            if domain_name in self._slots:
+                remaining = self._scheduler_table.soft_off(
+                    self._slots[domain_name][0])
+            show_options['soft_off'] = (
+                None if remaining is None
+                else 'forced off in %ds' % remaining)
+
+        show_options['crashes'] = self.crashes[domain_name]
+        show_options['last_exit_code'] = self.exit_codes.get(domain_name)
+
+        if self._metrics_table is not None and domain_name in self._slots:
+            show_options.update(self._metrics_table.counters(
+                self._slots[domain_name][0]))
+
+        return 0, list(show_options.items())
+
+    def stats(self, domain_name=None):
+        """Return the latency histograms of the vBMC instances.
+
+        :param domain_name: The domain to report on, all of them if None
+        :returns: rc and a list of (domain name, layer, command,
+            :class:`virtualbmc.metrics.Histogram`) tuples
+        """
+        if self._metrics_table is None:
+            return 1, []
+
+        if domain_name is None:
+            domain_names = sorted(self._slots)
+        else:
+            # Fail on unknown domains
+            self._parse_config(domain_name)
+            domain_names = [domain_name] if domain_name in self._slots else []
+
+        histograms = []
+
+        for name in domain_names:
+            slot = self._slots[name][0]
+            for (layer, command), histogram in sorted(
+                    self._metrics_table.read(slot).items()):
+                histograms.append((name, layer, command, histogram))
+
+        return 0, histograms
+
+    def census(self):
+        """Count the vBMC instances by status.
+
+        Unlike :meth:`list`, does not read the configuration of every
+        instance, only the ones that changed.
+
+        :returns: A dict of instance counts by status
+        """
+        census = {RUNNING: 0, DOWN: 0, ERROR: 0}
+
+        for domain_name in self._configs():
+            instance = self._running_domains.get(domain_name)
+            if instance and instance.is_alive():
+                census[RUNNING] += 1
+            elif instance:
+                census[ERROR] += 1
+            else:
+                census[DOWN] += 1
+
+        return census
+
+    def metrics(self):
+        """Return what the metrics table holds on the vBMC instances.
+
+        :returns: A dict of histograms (as returned by
+            :meth:`virtualbmc.metrics.MetricsTable.read`) by domain name,
+            a dict of counters (as returned by
+            :meth:`virtualbmc.metrics.MetricsTable.counters`) by domain
+            name and a dict of resident set sizes by PID of the processes
+            hosting the instances, all empty when metrics are disabled
+        """
+        if self._metrics_table is None:
+            return {}, {}, {}
+
+        histograms = {domain_name: self._metrics_table.read(slot)
+                      for domain_name, (slot, _) in self._slots.items()}
+        counters = {domain_name: self._metrics_table.counters(slot)
+                    for domain_name, (slot, _) in self._slots.items()}
+        processes = self._metrics_table.processes(
+            slot for slot, _ in self._slots.values())
+
+        return histograms, counters, processes
@@ -0,0 +1,113 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Manifests describing many vBMC instances to add at once.
+
+A manifest lists vBMC instances by the options of ``vbmc add``, written
+with underscores, such as ``domain_name`` or ``libvirt_uri``. Only the
+domain name is required. JSON and YAML manifests hold a list of
+mappings, possibly under a ``bmcs`` key. CSV manifests have a header row
+naming the options, empty cells leave options unset.
+"""
+
+import csv
+import json
+import os
+
+from virtualbmc import exception
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+__all__ = ['FORMATS', 'load']
+
+FORMATS = ('json', 'yaml', 'csv')
+
+# Options a manifest may set
+OPTIONS = ('domain_name', 'username', 'password', 'port', 'address',
+           'libvirt_uri', 'libvirt_sasl_username', 'libvirt_sasl_password')
+
+# Errors reading or parsing a manifest
+_ERRORS = (OSError, ValueError, csv.Error)
+if yaml is not None:
+    _ERRORS += (yaml.YAMLError,)
+
+_EXTENSIONS = {'.json': 'json', '.yaml': 'yaml', '.yml': 'yaml',
+               '.csv': 'csv'}
+
+
+def _load_csv(f):
+    return [{option: value or None for option, value in row.items()}
+            for row in csv.DictReader(f)]
+
+
+def _load_json(f):
+    return json.load(f)
+
+
+def _load_yaml(f):
+    if yaml is None:
+        raise ValueError('PyYAML is required to read YAML manifests')
+
+    return yaml.safe_load(f)
+
+
+def load(path, fmt=None):
+    """Read the vBMC instances described by a manifest.
+
+    :param path: Path of the manifest
+    :param fmt: One of :data:`FORMATS`, guessed from the file name
+        extension if not given
+    :returns: A list of dicts of options
+    :raises: ManifestError if the manifest cannot be read or is invalid
+    """
+    if fmt is None:
+        fmt = _EXTENSIONS.get(os.path.splitext(path)[1].lower())
+        if fmt is None:
+            raise exception.ManifestError(
+                path=path, error='unknown format, expected one of %s'
+                % ', '.join(FORMATS))
+
+    loader = {'json': _load_json, 'yaml': _load_yaml, 'csv': _load_csv}[fmt]
+
+    try:
+        with open(path, newline='') as f:
+            bmcs = loader(f)
+
+    except _ERRORS as ex:
+        raise exception.ManifestError(path=path, error=ex)
+
+    if isinstance(bmcs, dict):
+        bmcs = bmcs.get('bmcs')
+
+    if not isinstance(bmcs, list):
+        raise exception.ManifestError(
+            path=path, error='expected a list of vBMC instances')
+
+    for number, bmc in enumerate(bmcs, 1):
+        if not isinstance(bmc, dict):
+            raise exception.ManifestError(
+                path=path, error='entry %d is not a mapping' % number)
+
+        unknown = set(bmc).difference(OPTIONS)
+        if unknown:
+            raise exception.ManifestError(
+                path=path, error='unknown options %s in entry %d'
+                % (', '.join(sorted(map(str, unknown))), number))
+
+        if not bmc.get('domain_name'):
+            raise exception.ManifestError(
+                path=path, error='no domain_name in entry %d' % number)
+
+    return bmcs
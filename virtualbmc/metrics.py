@@ -0,0 +1,360 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Latency histograms of IPMI commands and libvirt calls.
+
+Every vBMC instance records how long it takes to handle IPMI commands,
+and to make the libvirt calls they involve, into its slot of a table
+living in shared memory, along with a few counters and the memory usage
+of its process.
+vbmcd allocates the table before it forks any instance and reads it to
+report on all the instances at once, without talking to them.
+"""
+
+import bisect
+import collections
+import contextlib
+import multiprocessing
+import os
+import resource
+import threading
+import time
+
+from virtualbmc import config as vbmc_config
+
+__all__ = ['get_metrics_table', 'BMCMetrics']
+
+CONF = vbmc_config.get_config()
+
+METRICS_TABLE = None
+
+# Layers a command is measured at
+IPMI = 'ipmi'
+LIBVIRT = 'libvirt'
+
+# IPMI commands by network function and command number
+IPMI_COMMANDS = {
+    (0x06, 0x01): 'get_device_id',
+    (0x06, 0x48): 'activate_payload',
+    (0x06, 0x49): 'deactivate_payload',
+    (0x00, 0x01): 'get_chassis_status',
+    (0x00, 0x02): 'chassis_control',
+    (0x00, 0x08): 'set_boot_options',
+    (0x00, 0x09): 'get_boot_options',
+    # Sensor/Event and Storage network functions
+    (0x04, None): 'sensors',
+    (0x0a, None): 'sensors',
+}
+
+OTHER = 'other'
+
+LIBVIRT_CALLS = ('get_power_state', 'get_boot_device', 'set_boot_device',
+                 'power_on', 'power_off', 'power_reset', 'power_shutdown',
+                 'pulse_diag', 'open_console')
+
+SERIES = tuple(
+    [(IPMI, name) for name in sorted(set(IPMI_COMMANDS.values()))]
+    + [(IPMI, OTHER)]
+    + [(LIBVIRT, name) for name in LIBVIRT_CALLS])
+
+_SERIES_INDEX = {series: index for index, series in enumerate(SERIES)}
+
+# Counters of the domain queries answered out of the domain event cache,
+# and of the ones it had to pass on to libvirt
+DOMAIN_CACHE_HITS = 'domain_cache_hits'
+DOMAIN_CACHE_MISSES = 'domain_cache_misses'
+
+COUNTERS = (DOMAIN_CACHE_HITS, DOMAIN_CACHE_MISSES)
+
+# Upper bounds (in seconds) of the histogram buckets
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+           2.5, 5.0, 10.0, float('inf'))
+
+# Seconds between two updates of the memory usage of a process
+RSS_INTERVAL = 15
+
+# From the IPMI - Intelligent Platform Management Interface Specification
+# Second Generation v2.0 Document Revision 1.1 October 1, 2013
+#
+# Command failed and can be retried
+IPMI_COMMAND_NODE_BUSY = 0xC0
+
+
+def resident_memory():
+    """Return the resident set size of the current process, in bytes."""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize()
+
+    except (OSError, IndexError, ValueError):
+        # Peak rather than current usage, better than nothing
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def ipmi_command(request):
+    """Name an IPMI request after its command."""
+    netfn = request['netfn']
+    return IPMI_COMMANDS.get(
+        (netfn, request['command']),
+        IPMI_COMMANDS.get((netfn, None), OTHER))
+
+
+class Histogram(collections.namedtuple(
+        'Histogram', ['buckets', 'errors', 'busy', 'total'])):
+    """Latencies of a command.
+
+    :param buckets: Number of calls per bucket of :data:`BUCKETS`
+    :param errors: Number of failed calls
+    :param busy: Number of calls answered with a "node busy" completion
+        code
+    :param total: Sum of the latencies, in seconds
+    """
+
+    @property
+    def count(self):
+        return sum(self.buckets)
+
+    def percentile(self, percent):
+        """Estimate a latency percentile, in seconds.
+
+        Interpolates linearly within the bucket the percentile falls in,
+        latencies past the last finite bucket bound are reported as that
+        bound.
+
+        :returns: The estimate or None if nothing was recorded
+        """
+        count = self.count
+        if not count:
+            return None
+
+        rank = percent / 100.0 * count
+        seen = 0
+
+        for index, bucket in enumerate(self.buckets):
+            if not bucket or seen + bucket < rank:
+                seen += bucket
+                continue
+
+            lower = BUCKETS[index - 1] if index else 0.0
+            upper = BUCKETS[index]
+            if upper == float('inf'):
+                return lower
+
+            return lower + (upper - lower) * (rank - seen) / bucket
+
+
+class MetricsTable(object):
+    """Latency histograms of the vBMC instances.
+
+    The table lives in anonymous shared memory allocated by vbmcd before
+    it forks any vBMC instance, each instance is given a slot of its own.
+    A slot is only written to by the process hosting its instance, a
+    reader may see the counters of a call being recorded only partially.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._width = len(BUCKETS) + 2
+        self._counters = multiprocessing.RawArray(
+            'Q', capacity * len(SERIES) * self._width)
+        self._totals = multiprocessing.RawArray('d', capacity * len(SERIES))
+        self._events = multiprocessing.RawArray('Q',
+                                                capacity * len(COUNTERS))
+        # PID and resident set size of the process hosting each slot
+        self._processes = multiprocessing.RawArray('Q', capacity * 2)
+        # Instances of a worker process share the table with the threads
+        # recording into their slots
+        self._lock = threading.Lock()
+
+    def record(self, slot, series, latency, error=False, busy=False):
+        """Account for a call.
+
+        :param slot: The slot index
+        :param series: The (layer, command) tuple of :data:`SERIES`
+        :param latency: Duration of the call, in seconds
+        """
+        index = slot * len(SERIES) + _SERIES_INDEX[series]
+        start = index * self._width
+
+        with self._lock:
+            self._counters[start + bisect.bisect_left(BUCKETS, latency)] += 1
+            if error:
+                self._counters[start + len(BUCKETS)] += 1
+            if busy:
+                self._counters[start + len(BUCKETS) + 1] += 1
+            self._totals[index] += latency
+
+    def count(self, slot, counter):
+        """Increment one of the :data:`COUNTERS` of a slot."""
+        with self._lock:
+            self._events[slot * len(COUNTERS) + COUNTERS.index(counter)] += 1
+
+    def counters(self, slot):
+        """Return the :data:`COUNTERS` of a slot, by name."""
+        start = slot * len(COUNTERS)
+        return dict(zip(COUNTERS, self._events[start:start + len(COUNTERS)]))
+
+    def clear(self, slot):
+        start = slot * len(SERIES)
+        end = start + len(SERIES)
+
+        with self._lock:
+            self._counters[start * self._width:end * self._width] = [0] * (
+                len(SERIES) * self._width)
+            self._totals[start:end] = [0.0] * len(SERIES)
+            self._events[slot * len(COUNTERS):(slot + 1) * len(COUNTERS)] = (
+                [0] * len(COUNTERS))
+            self._processes[slot * 2:slot * 2 + 2] = [0, 0]
+
+    def publish_process(self, slot):
+        """Publish the memory usage of the process hosting a slot."""
+        self._processes[slot * 2:slot * 2 + 2] = [os.getpid(),
+                                                  resident_memory()]
+
+    def processes(self, slots):
+        """Return the memory usage of the processes hosting slots.
+
+        :returns: A dict of resident set sizes (in bytes) by PID
+        """
+        processes = {}
+
+        for slot in slots:
+            pid, rss = self._processes[slot * 2:slot * 2 + 2]
+            if pid:
+                processes[pid] = rss
+
+        return processes
+
+    def read(self, slot):
+        """Return the histograms of a slot.
+
+        :returns: A dict of :class:`Histogram` by (layer, command) tuple
+            of :data:`SERIES`, for the commands called at least once
+        """
+        start = slot * len(SERIES)
+        counters = self._counters[start * self._width:
+                                  (start + len(SERIES)) * self._width]
+        totals = self._totals[start:start + len(SERIES)]
+
+        histograms = {}
+
+        for index, series in enumerate(SERIES):
+            row = counters[index * self._width:(index + 1) * self._width]
+            if any(row):
+                histograms[series] = Histogram(
+                    buckets=row[:len(BUCKETS)], errors=row[-2], busy=row[-1],
+                    total=totals[index])
+
+        return histograms
+
+
+class BMCMetrics(object):
+    """Records the metrics of a vBMC instance.
+
+    :param table: The :class:`MetricsTable` to record into, None not to
+        record anything
+    :param slot: The slot of the instance in the table
+    """
+
+    def __init__(self, table=None, slot=None):
+        self.table = table
+        self.slot = slot
+        self._published = None
+
+        self._publish_process()
+
+    def _publish_process(self):
+        if self.table is not None:
+            self.table.publish_process(self.slot)
+            self._published = time.monotonic()
+
+    @property
+    def enabled(self):
+        return self.table is not None
+
+    def record(self, layer, command, latency, error=False, busy=False):
+        if self.table is not None:
+            self.table.record(self.slot, (layer, command), latency,
+                              error=error, busy=busy)
+
+    def count(self, counter):
+        if self.table is not None:
+            self.table.count(self.slot, counter)
+
+    def record_ipmi(self, request, latency, code):
+        """Account for an IPMI request answered with a completion code."""
+        self.record(IPMI, ipmi_command(request), latency,
+                    error=code not in (0, IPMI_COMMAND_NODE_BUSY),
+                    busy=code == IPMI_COMMAND_NODE_BUSY)
+
+        if (self._published is not None
+                and time.monotonic() - self._published > RSS_INTERVAL):
+            self._publish_process()
+
+    @contextlib.contextmanager
+    def libvirt_call(self, name):
+        """Measure the libvirt calls made within the context.
+
+        Exceptions raised within the context are accounted as errors.
+        """
+        start = time.monotonic()
+
+        try:
+            yield
+
+        except Exception:
+            self.record(LIBVIRT, name, time.monotonic() - start, error=True)
+            raise
+
+        self.record(LIBVIRT, name, time.monotonic() - start)
+
+
+class ResponseRecorder(object):
+    """IPMI session stand-in remembering the completion code sent.
+
+    Everything else, including attribute assignments, goes through to
+    the session.
+    """
+
+    def __init__(self, session):
+        object.__setattr__(self, 'session', session)
+        object.__setattr__(self, 'code', 0)
+
+    def __getattr__(self, name):
+        return getattr(self.session, name)
+
+    def __setattr__(self, name, value):
+        setattr(self.session, name, value)
+
+    def send_ipmi_response(self, *args, **kwargs):
+        object.__setattr__(self, 'code',
+                           kwargs.get('code', args[1] if len(args) > 1 else 0))
+        return self.session.send_ipmi_response(*args, **kwargs)
+
+    def _send_ipmi_net_payload(self, *args, **kwargs):
+        # pyghmi answers this way when a command handler blows up
+        object.__setattr__(self, 'code', kwargs.get('code', 0))
+        return self.session._send_ipmi_net_payload(*args, **kwargs)
+
+
+def get_metrics_table():
+    """Return the process-wide metrics table.
+
+    It has to be first called by vbmcd before it forks any vBMC instance,
+    for the instances to share the table with it.
+    """
+    global METRICS_TABLE
+
+    if METRICS_TABLE is None:
+        METRICS_TABLE = MetricsTable(CONF['default']['shared_memory_slots'])
+
+    return METRICS_TABLE
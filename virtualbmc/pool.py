@@ -0,0 +1,225 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import os
+import threading
+
+import libvirt
+
+from virtualbmc import breaker
+from virtualbmc import config as vbmc_config
+from virtualbmc import log
+from virtualbmc import utils
+
+__all__ = ['get_pool', 'pooled_connection']
+
+LOG = log.get_logger()
+
+CONF = vbmc_config.get_config()
+
+POOL = None
+
+
+class LibvirtConnectionPool(object):
+    """Long-lived libvirt connections shared by all vBMC handlers.
+
+    Opening a libvirt connection costs a full handshake with libvirtd
+    (plus SASL or SSH negotiation for remote URIs), which used to be paid
+    on every IPMI command. The pool keeps one connection per
+    ``(uri, sasl_username, readonly)`` key open for the life of the
+    process, health-checks it on every use and transparently opens a new
+    one once libvirt reports it dead.
+    """
+
+    def __init__(self, keepalive_interval=5, keepalive_count=5):
+        self.keepalive_interval = keepalive_interval
+        self.keepalive_count = keepalive_count
+        self._lock = threading.Lock()
+        self._connections = {}
+        # Serialize connection attempts per key, without holding the
+        # pool-wide lock while libvirtd may take its time answering
+        self._opening = {}
+        self._pid = os.getpid()
+        # Connections inherited across fork() share their socket with the
+        # parent process. Closing (or garbage collecting) them here would
+        # tear down the parent's session, so they are parked instead.
+        self._inherited = []
+
+    @staticmethod
+    def _key(uri, sasl_username=None, readonly=False):
+        return uri, sasl_username, bool(readonly)
+
+    @staticmethod
+    def is_alive(conn):
+        try:
+            return bool(conn.isAlive())
+        except libvirt.libvirtError:
+            return False
+
+    def _check_fork(self):
+        if self._pid != os.getpid():
+            self._inherited.extend(self._connections.values())
+            self._connections = {}
+            self._opening = {}
+            self._pid = os.getpid()
+
+    def _set_keepalive(self, conn, uri):
+        try:
+            conn.setKeepAlive(self.keepalive_interval, self.keepalive_count)
+        except libvirt.libvirtError as e:
+            # Keepalive needs a registered libvirt event loop implementation
+            # and is not supported by every driver, e.g. the local ones.
+            LOG.debug('Keepalive is not available for libvirt URI '
+                      '%(uri)s: %(error)s', {'uri': uri, 'error': e})
+
+    def acquire(self, uri, sasl_username=None, sasl_password=None,
+                readonly=False):
+        """Return a healthy pooled connection, opening it if needed.
+
+        :param uri: The libvirt URI
+        :param sasl_username: The libvirt SASL username
+        :param sasl_password: The libvirt SASL password
+        :param readonly: Whether the connection should be read-only
+        :returns: A libvirt connection object
+        :raises: LibvirtConnectionOpenError if a new connection failed
+        """
+        key = self._key(uri, sasl_username, readonly)
+
+        with self._lock:
+            conn = self._get(key)
+            if conn is not None:
+                return conn
+
+            opening = self._opening.setdefault(key, threading.Lock())
+
+        with opening:
+            with self._lock:
+                # Possibly opened by another thread in the meantime
+                conn = self._get(key)
+                if conn is not None:
+                    return conn
+
+            conn = utils.open_libvirt_connection(
+                uri, sasl_username=sasl_username,
+                sasl_password=sasl_password, readonly=readonly)
+            self._set_keepalive(conn, uri)
+
+            with self._lock:
+                self._check_fork()
+                self._connections[key] = conn
+
+        LOG.debug('Opened pooled connection to libvirt URI %(uri)s '
+                  '(read-only: %(ro)s)', {'uri': uri, 'ro': readonly})
+
+        return conn
+
+    def connection(self, uri, sasl_username=None, readonly=False):
+        """Return the pooled connection if healthy, never opening one.
+
+        :returns: A libvirt connection object or None
+        """
+        with self._lock:
+            return self._get(self._key(uri, sasl_username, readonly))
+
+    def _get(self, key):
+        self._check_fork()
+
+        conn = self._connections.get(key)
+        if conn is None or self.is_alive(conn):
+            return conn
+
+        LOG.info('Pooled connection to libvirt URI %(uri)s is dead, '
+                 'dropping it', {'uri': key[0]})
+        self._drop(key)
+
+    def _drop(self, key):
+        conn = self._connections.pop(key, None)
+        if conn is None:
+            return
+
+        try:
+            conn.close()
+        except libvirt.libvirtError:
+            pass
+
+    def check(self, uri, sasl_username=None, readonly=False):
+        """Evict the pooled connection if libvirt reports it dead."""
+        key = self._key(uri, sasl_username, readonly)
+
+        with self._lock:
+            self._check_fork()
+
+            conn = self._connections.get(key)
+            if conn is not None and not self.is_alive(conn):
+                LOG.info('Evicting dead pooled connection to libvirt '
+                         'URI %(uri)s', {'uri': uri})
+                self._drop(key)
+
+    def close(self):
+        """Close all pooled connections."""
+        with self._lock:
+            self._check_fork()
+
+            for key in list(self._connections):
+                self._drop(key)
+
+
+class pooled_connection(object):
+    """Borrow a connection from the process-wide connection pool.
+
+    Unlike :class:`virtualbmc.utils.libvirt_open` the connection is not
+    closed on exit. If the body fails, the connection is health-checked
+    and evicted from the pool when broken, so the next caller reconnects.
+
+    Calls are guarded by the circuit breaker of the URI, entering raises
+    LibvirtUnavailable while it is open.
+    """
+
+    def __init__(self, uri, sasl_username=None, sasl_password=None,
+                 readonly=False):
+        self.uri = uri
+        self.sasl_username = sasl_username
+        self.sasl_password = sasl_password
+        self.readonly = readonly
+
+    def __enter__(self):
+        self.breaker = breaker.get_breaker(self.uri)
+        self.probe = self.breaker.admit()
+
+        try:
+            self.conn = get_pool().acquire(
+                self.uri, sasl_username=self.sasl_username,
+                sasl_password=self.sasl_password, readonly=self.readonly)
+
+        except Exception as e:
+            self.breaker.record(e, probe=self.probe)
+            raise
+
+        return self.conn
+
+    def __exit__(self, type, value, traceback):
+        self.breaker.record(value, probe=self.probe)
+
+        if value is not None:
+            get_pool().check(self.uri, sasl_username=self.sasl_username,
+                             readonly=self.readonly)
+
+
+def get_pool():
+    global POOL
+    if POOL is None:
+        libvirt_conf = CONF['libvirt']
+        POOL = LibvirtConnectionPool(
+            keepalive_interval=libvirt_conf['keepalive_interval'],
+            keepalive_count=libvirt_conf['keepalive_count'])
+
+    return POOL
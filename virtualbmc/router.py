@@ -0,0 +1,110 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""IPMI endpoint shared by many vBMC instances.
+
+RMCP+ sessions are opened against the shared endpoint, which learns the
+IPMI user name during the RAKP exchange, authenticates the client with
+the password of the vBMC instance owning that user name and hands the
+session over to that instance.
+"""
+
+import collections
+
+import pyghmi.ipmi.private.serversession as serversession
+
+from virtualbmc import config as vbmc_config
+from virtualbmc import exception
+from virtualbmc import log
+
+LOG = log.get_logger()
+
+CONF = vbmc_config.get_config()
+
+# From the IPMI - Intelligent Platform Management Interface Specification
+# Second Generation v2.0 Document Revision 1.1 October 1, 2013
+#
+# Insufficient privilege level or other security-based restriction
+IPMI_INSUFFICIENT_PRIVILEGE = 0xD4
+
+# IpmiServer attributes a vBMC instance inherits from the endpoint
+_SHARED_ATTRIBUTES = ('revision', 'deviceid', 'firmwaremajor',
+                      'firmwareminor', 'ipmiversion', 'additionaldevices',
+                      'mfgid', 'prodid', 'uuid', 'authcap', 'kg', 'timeout',
+                      'port', 'serversocket')
+
+
+def is_shared(bmc_config):
+    """Tell whether a vBMC instance is served by the shared endpoint."""
+    shared_port = CONF['ipmi']['shared_port']
+    return bool(shared_port) and int(bmc_config['port']) == shared_port
+
+
+class _Credentials(object):
+    """Password lookup across the vBMC instances of an endpoint."""
+
+    def __init__(self, bmcs):
+        self._bmcs = bmcs
+
+    def get(self, username, default=None):
+        entry = self._bmcs.get(username)
+        return default if entry is None else entry[1]
+
+
+class SharedEndpoint(serversession.IpmiServer):
+    """A single IPMI socket routing sessions to vBMC instances."""
+
+    def __init__(self, port, address='::'):
+        # user name -> (vBMC instance, password)
+        self.bmcs = {}
+        super(SharedEndpoint, self).__init__(_Credentials(self.bmcs),
+                                             port=port, address=address)
+
+    def adopt(self, vbmc, username, password):
+        """Serve a vBMC instance through this endpoint.
+
+        Sets up the instance in place of the socket-bound part of the
+        :class:`pyghmi.ipmi.private.serversession.IpmiServer`
+        initialization.
+
+        :raises: VirtualBMCError if the user name is already taken
+        """
+        if username in self.bmcs:
+            raise exception.VirtualBMCError(
+                'IPMI user name %(user)s is already in use on the shared '
+                'endpoint at port %(port)s' % {'user': username,
+                                               'port': self.port})
+
+        for attribute in _SHARED_ATTRIBUTES:
+            setattr(vbmc, attribute, getattr(self, attribute))
+
+        vbmc.authdata = {username: password}
+        vbmc.pktqueue = collections.deque([])
+
+        self.bmcs[username] = vbmc, password
+
+    def release(self, vbmc):
+        """Stop serving a vBMC instance."""
+        for username, (adopted, _) in list(self.bmcs.items()):
+            if adopted is vbmc:
+                del self.bmcs[username]
+
+    def handle_raw_request(self, request, session):
+        # Authentication succeeded, the session belongs to the instance
+        # of the user name the client authenticated with from now on
+        entry = self.bmcs.get(session.username.decode('utf-8'))
+        if entry is None:
+            session.send_ipmi_response(code=IPMI_INSUFFICIENT_PRIVILEGE)
+            return
+
+        session.bmc = entry[0]
+        session.bmc.handle_raw_request(request, session)
@@ -0,0 +1,363 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Admission of heavy libvirt operations, by libvirt URI.
+
+Starting, resetting or redefining many domains at once makes libvirtd
+and the host thrash. These operations are queued instead, and only a
+few of them are let through to a libvirt URI at once, each one starting
+a little while after the previous one. The limits hold across all the
+vBMC instances of the host: vbmcd allocates the table tracking the
+operations in shared memory before it forks any instance.
+
+Queued operations wait on threads of their own rather than on the
+workers making libvirt calls, which keep serving cheap queries such as
+power state reads meanwhile.
+"""
+
+import collections
+import concurrent.futures
+import multiprocessing
+import os
+import threading
+import time
+import zlib
+
+from virtualbmc import config as vbmc_config
+from virtualbmc import exception
+from virtualbmc import log
+
+__all__ = ['get_scheduler', 'get_scheduler_table', 'limits']
+
+LOG = log.get_logger()
+
+CONF = vbmc_config.get_config()
+
+SCHEDULER_TABLE = None
+SCHEDULER = None
+_SCHEDULER_LOCK = threading.Lock()
+
+# Tells whether the current thread makes an admitted operation
+_LOCAL = threading.local()
+
+# Calls admitted by the scheduler
+HEAVY_CALLS = frozenset(('power_on', 'power_reset', 'set_boot_device'))
+
+MAX_CONCURRENT = vbmc_config.MAX_CONCURRENT
+
+# Most libvirt URIs operations are tracked for
+MAX_URIS = 64
+
+# Seconds an admitted operation is accounted for at most, in case the
+# process making it died meanwhile
+LEASE = 300
+
+# Seconds between two attempts at admitting queued operations
+POLL_INTERVAL = 0.05
+
+# States of the operation of a vBMC instance
+IDLE = 0
+QUEUED = 1
+RUNNING = 2
+
+
+def _uri_key(uri):
+    # Never 0, which marks free rows
+    return zlib.crc32(uri.encode()) + 1
+
+
+def admitted():
+    """Tell whether the current thread makes an admitted operation."""
+    return getattr(_LOCAL, 'admitted', False)
+
+
+def limits(uri):
+    """Return the admission limits of a libvirt URI.
+
+    :returns: The most operations let through at once, 0 if they are not
+        limited, and the seconds between the start of two of them
+    """
+    options = CONF['scheduler']
+    section = 'scheduler:%s' % uri
+    try:
+        options = CONF[section]
+    except KeyError:
+        pass
+
+    return options['max_concurrent'], options['stagger']
+
+
+class SchedulerTable(object):
+    """Heavy libvirt operations of the vBMC instances.
+
+    Admitted operations hold a lease in the row of their libvirt URI.
+    The operation of each vBMC instance is also tracked in its slot, for
+    vbmcd to report on queued operations, along with the time its
+    domain is forced off at if it is being shut down gracefully.
+
+    :param capacity: Number of vBMC instance slots
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._width = 2 + MAX_CONCURRENT
+        # URI key, start time of the last operation and lease expiry times
+        self._uris = multiprocessing.RawArray('d', MAX_URIS * self._width)
+        # URI key, operation state and forced off time by slot
+        self._slots = multiprocessing.RawArray('d', capacity * 3)
+        self._lock = multiprocessing.Lock()
+
+    def _uri_row(self, key):
+        free = None
+
+        for row in range(MAX_URIS):
+            row_key = self._uris[row * self._width]
+            if row_key == key:
+                return row
+            if not row_key and free is None:
+                free = row
+
+        if free is not None:
+            self._uris[free * self._width] = key
+
+        return free
+
+    def admit(self, uri, max_concurrent, stagger):
+        """Let an operation on a libvirt URI start, if its turn came.
+
+        :returns: The lease of the operation to release once done, -1 if
+            operations on the URI cannot be tracked, or None if it has to
+            wait
+        """
+        key = _uri_key(uri)
+        now = time.monotonic()
+
+        with self._lock:
+            row = self._uri_row(key)
+            if row is None:
+                LOG.warning('Too many libvirt URIs, not limiting operations '
+                            'on %(uri)s', {'uri': uri})
+                return -1
+
+            start = row * self._width
+            if now - self._uris[start + 1] < stagger:
+                return
+
+            leases = self._uris[start + 2:start + 2 + max_concurrent]
+            for index, expiry in enumerate(leases):
+                if expiry < now:
+                    self._uris[start + 1] = now
+                    self._uris[start + 2 + index] = now + LEASE
+                    return row * MAX_CONCURRENT + index
+
+    def release(self, lease):
+        """Release the lease of a completed operation."""
+        if lease < 0:
+            return
+
+        row, index = divmod(lease, MAX_CONCURRENT)
+        with self._lock:
+            self._uris[row * self._width + 2 + index] = 0
+
+    def track(self, slot, uri, state):
+        """Record the state of the operation of a vBMC instance."""
+        if slot is not None:
+            self._slots[slot * 3:slot * 3 + 2] = [_uri_key(uri), state]
+
+    def track_soft_off(self, slot, until=0):
+        """Record when the domain of a vBMC instance is forced off.
+
+        :param until: Monotonic time the domain is forced off at if still
+            running, 0 once no longer shutting down
+        """
+        if slot is not None:
+            self._slots[slot * 3 + 2] = until
+
+    def soft_off(self, slot):
+        """Return the seconds left before the domain is forced off.
+
+        :returns: The number of seconds or None if the domain of the vBMC
+            instance is not being shut down gracefully
+        """
+        until = self._slots[slot * 3 + 2]
+        if until:
+            return max(until - time.monotonic(), 0)
+
+    def clear(self, slot):
+        self._slots[slot * 3:slot * 3 + 3] = [0, IDLE, 0]
+
+    def queued(self, uri, slots):
+        """Count the operations queued on a libvirt URI.
+
+        :param slots: The slots of the vBMC instances to look at
+        """
+        key = _uri_key(uri)
+        operations = self._slots[:]
+
+        return sum(1 for slot in slots
+                   if operations[slot * 3:slot * 3 + 2] == [key, QUEUED])
+
+
+_Operation = collections.namedtuple(
+    '_Operation', ['call', 'func', 'uri', 'slot', 'future'])
+
+
+class Scheduler(object):
+    """Queues the heavy libvirt operations of a process.
+
+    :param table: The :class:`SchedulerTable` admitting operations
+    """
+
+    def __init__(self, table):
+        self.table = table
+        self._queue = collections.deque()
+        self._changed = threading.Condition()
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=MAX_CONCURRENT, thread_name_prefix='libvirt-heavy')
+        self._dispatcher = threading.Thread(
+            target=self._dispatch, name='libvirt-scheduler', daemon=True)
+        self._dispatcher.start()
+
+    def submit(self, call, func, uri, slot=None):
+        """Queue an operation.
+
+        :param call: Name of the call, for reporting
+        :param func: Callable making the libvirt calls
+        :param uri: The libvirt URI the operation is made on
+        :param slot: The slot of the vBMC instance making it, if any
+        :returns: A :class:`concurrent.futures.Future` of what func
+            returns, cancelling it takes the operation off the queue
+        """
+        future = concurrent.futures.Future()
+
+        with self._changed:
+            self.table.track(slot, uri, QUEUED)
+            self._queue.append(_Operation(call, func, uri, slot, future))
+            self._changed.notify()
+
+        return future
+
+    def run(self, call, func, uri, slot=None, timeout=None):
+        """Queue an operation and wait for it.
+
+        :param timeout: Seconds to wait for the operation to complete,
+            None to wait for as long as it takes
+        :returns: What func returns
+        :raises: LibvirtCallQueued if the operation did not start in time,
+            LibvirtCallTimeout if it started but did not complete in time,
+            whatever func raises otherwise
+        """
+        future = self.submit(call, func, uri, slot=slot)
+
+        try:
+            return future.result(timeout)
+
+        except concurrent.futures.TimeoutError:
+            if future.done():
+                # Raised by func itself
+                raise
+
+            # Taken off the queue unless it started already
+            if future.cancel():
+                self.table.track(slot, uri, IDLE)
+                # libvirt was never called, it is not to blame
+                raise exception.LibvirtCallQueued(call=call, timeout=timeout)
+
+            raise exception.LibvirtCallTimeout(call=call, timeout=timeout)
+
+    def _start(self, operation, lease):
+        self.table.track(operation.slot, operation.uri, RUNNING)
+
+        def run():
+            _LOCAL.admitted = True
+            try:
+                operation.future.set_result(operation.func())
+
+            except Exception as e:
+                operation.future.set_exception(e)
+
+            finally:
+                _LOCAL.admitted = False
+                self.table.release(lease)
+                self.table.track(operation.slot, operation.uri, IDLE)
+                with self._changed:
+                    self._changed.notify()
+
+        self._executor.submit(run)
+
+    def _dispatch(self):
+        while True:
+            with self._changed:
+                while not self._queue:
+                    self._changed.wait()
+
+                waiting = collections.deque()
+
+                while self._queue:
+                    operation = self._queue.popleft()
+
+                    if operation.future.cancelled():
+                        self.table.track(operation.slot, operation.uri, IDLE)
+                        continue
+
+                    max_concurrent, stagger = limits(operation.uri)
+                    lease = -1
+                    if max_concurrent:
+                        lease = self.table.admit(
+                            operation.uri, max_concurrent, stagger)
+
+                    if lease is None:
+                        waiting.append(operation)
+
+                    elif operation.future.set_running_or_notify_cancel():
+                        self._start(operation, lease)
+
+                    else:
+                        self.table.release(lease)
+                        self.table.track(operation.slot, operation.uri, IDLE)
+
+                self._queue = waiting
+
+                if self._queue:
+                    # Queued operations may be admitted once others
+                    # complete or as time goes by
+                    self._changed.wait(POLL_INTERVAL)
+
+
+def get_scheduler_table():
+    """Return the process-wide scheduler table.
+
+    It has to be first called by vbmcd before it forks any vBMC instance,
+    for the instances to share the table with it.
+    """
+    global SCHEDULER_TABLE
+
+    if SCHEDULER_TABLE is None:
+        SCHEDULER_TABLE = SchedulerTable(
+            CONF['default']['shared_memory_slots'])
+
+    return SCHEDULER_TABLE
+
+
+def get_scheduler():
+    """Return the process-wide scheduler.
+
+    Threads do not survive fork(), a forked child gets its own scheduler
+    on the first call, sharing the table with its parent.
+    """
+    global SCHEDULER
+
+    with _SCHEDULER_LOCK:
+        if SCHEDULER is None or SCHEDULER[0] != os.getpid():
+            SCHEDULER = os.getpid(), Scheduler(get_scheduler_table())
+
+        return SCHEDULER[1]
@@ -0,0 +1,502 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""IPMI sensors backed by libvirt domain statistics.
+
+vbmcd periodically queries libvirt for the statistics of all the domains
+of a URI at once and publishes the resulting sensor readings in a table
+living in shared memory. The vBMC instances answer the IPMI SDR and
+sensor commands out of that table, without ever talking to libvirt.
+"""
+
+import collections
+import math
+import multiprocessing
+import struct
+import time
+
+import libvirt
+
+from virtualbmc import breaker
+from virtualbmc import config as vbmc_config
+from virtualbmc import deadline
+from virtualbmc import exception
+from virtualbmc import log
+from virtualbmc import pool
+
+__all__ = ['get_sensor_table', 'SensorDevice', 'StatsCollector']
+
+LOG = log.get_logger()
+
+CONF = vbmc_config.get_config()
+
+SENSOR_TABLE = None
+
+# From the IPMI - Intelligent Platform Management Interface Specification
+# Second Generation v2.0 Document Revision 1.1 October 1, 2013
+#
+# Network functions and commands
+NETFN_SENSOR = 0x04
+NETFN_STORAGE = 0x0a
+CMD_GET_SENSOR_THRESHOLDS = 0x27
+CMD_GET_SENSOR_READING = 0x2d
+CMD_GET_SDR_REPOSITORY_INFO = 0x20
+CMD_RESERVE_SDR_REPOSITORY = 0x22
+CMD_GET_SDR = 0x23
+
+# Requested sensor, data, or record not present
+IPMI_NOT_PRESENT = 0xcb
+# Request data length invalid
+IPMI_INVALID_LENGTH = 0xc7
+
+# Device ID "additional device support" bit for SDR repository devices
+SDR_REPOSITORY_DEVICE = 0x02
+
+SDR_VERSION = 0x51
+SDR_TYPE_FULL_SENSOR = 0x01
+SDR_LAST_RECORD = 0xffff
+BMC_SLAVE_ADDRESS = 0x20
+EVENT_READING_TYPE_THRESHOLD = 0x01
+
+# Entity IDs
+ENTITY_PROCESSOR = 0x03
+ENTITY_DISK = 0x04
+ENTITY_SYSTEM_BOARD = 0x07
+ENTITY_MEMORY_DEVICE = 0x20
+
+# Sensor types
+SENSOR_TYPE_PROCESSOR = 0x07
+SENSOR_TYPE_OTHER_UNITS = 0x0b
+SENSOR_TYPE_MEMORY = 0x0c
+SENSOR_TYPE_DRIVE_SLOT = 0x0d
+
+# Sensor units 1: percentage, rate per second
+UNITS_PERCENTAGE = 0x01
+UNITS_PER_SECOND = 0x03 << 3
+# Sensor units 2: base units
+UNIT_UNSPECIFIED = 0
+UNIT_MEGABYTE = 72
+
+# Get Sensor Reading flags: sensor scanning enabled, reading unavailable
+READING_SCANNING = 0x40
+READING_UNAVAILABLE = 0x20
+
+Sensor = collections.namedtuple(
+    'Sensor', ['number', 'name', 'entity', 'type', 'units', 'base_unit'])
+
+SENSORS = (
+    Sensor(1, 'CPU Utilization', ENTITY_PROCESSOR, SENSOR_TYPE_PROCESSOR,
+           UNITS_PERCENTAGE, UNIT_UNSPECIFIED),
+    Sensor(2, 'Memory Usage', ENTITY_MEMORY_DEVICE, SENSOR_TYPE_MEMORY,
+           UNITS_PERCENTAGE, UNIT_UNSPECIFIED),
+    Sensor(3, 'Disk Throughput', ENTITY_DISK, SENSOR_TYPE_DRIVE_SLOT,
+           UNITS_PER_SECOND, UNIT_MEGABYTE),
+    Sensor(4, 'NIC Throughput', ENTITY_SYSTEM_BOARD, SENSOR_TYPE_OTHER_UNITS,
+           UNITS_PER_SECOND, UNIT_MEGABYTE),
+)
+
+# Readings are reported as raw 8-bit values, with M = 1, B = 0 and no
+# exponents, i.e. in percents or megabytes per second
+_RAW_MAX = 0xff
+
+_STATS_FLAGS = (libvirt.VIR_DOMAIN_STATS_STATE
+                | libvirt.VIR_DOMAIN_STATS_CPU_TOTAL
+                | libvirt.VIR_DOMAIN_STATS_BALLOON
+                | libvirt.VIR_DOMAIN_STATS_VCPU
+                | libvirt.VIR_DOMAIN_STATS_INTERFACE
+                | libvirt.VIR_DOMAIN_STATS_BLOCK)
+
+# Deadline of the statistics query, see the [deadlines] section
+_STATS_CALL = 'get_all_domain_stats'
+
+
+def _full_sensor_record(record_id, sensor):
+    name = sensor.name.encode('ascii')[:16]
+
+    body = struct.pack(
+        '<9B3H28B',
+        BMC_SLAVE_ADDRESS,  # sensor owner ID
+        0,  # sensor owner LUN
+        sensor.number,
+        sensor.entity,
+        1,  # entity instance
+        0,  # sensor initialization
+        0x40,  # capabilities: auto re-arm, no thresholds nor hysteresis
+        sensor.type,
+        EVENT_READING_TYPE_THRESHOLD,
+        0, 0, 0,  # assertion, deassertion and reading masks
+        sensor.units,
+        sensor.base_unit,
+        0,  # modifier unit
+        0,  # linear
+        1, 0,  # M, tolerance
+        0, 0, 0,  # B, accuracy
+        0,  # R and B exponents
+        0,  # analog characteristic flags
+        0, 0, 0,  # nominal, normal maximum and minimum readings
+        _RAW_MAX, 0,  # sensor maximum and minimum readings
+        0, 0, 0, 0, 0, 0,  # thresholds
+        0, 0,  # hysteresis
+        0, 0,  # reserved
+        0,  # OEM
+        0xc0 | len(name),  # 8-bit ASCII ID string
+    ) + name
+
+    header = struct.pack('<HBBB', record_id, SDR_VERSION,
+                         SDR_TYPE_FULL_SENSOR, len(body))
+    return header + body
+
+
+# The SDR repository content never changes, it is built once
+SDR_RECORDS = tuple(_full_sensor_record(record_id, sensor)
+                    for record_id, sensor in enumerate(SENSORS, 1))
+
+SDR_REPOSITORY_INFO = struct.pack(
+    '<BHHIIB', SDR_VERSION, len(SDR_RECORDS), 0, 0, 0,
+    0x02)  # reserve SDR repository command supported
+
+
+class SensorTable(object):
+    """Sensor readings shared by vbmcd with the vBMC instances.
+
+    The table lives in anonymous shared memory allocated by vbmcd before
+    it forks any vBMC instance, each instance is given a slot of its own.
+    Only vbmcd writes to the table. Every slot carries a sequence number,
+    odd while the slot is being written to, so that readers can detect
+    and retry torn reads without taking any lock.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._readings = multiprocessing.RawArray(
+            'd', [math.nan] * (capacity * len(SENSORS)))
+        self._timestamps = multiprocessing.RawArray('d', capacity)
+        self._sequence = multiprocessing.RawArray('L', capacity)
+
+    def write(self, slot, readings):
+        """Publish the readings of a slot.
+
+        :param slot: The slot index
+        :param readings: One value per sensor of :data:`SENSORS`, None
+            for unavailable readings
+        """
+        start = slot * len(SENSORS)
+        sequence = self._sequence[slot]
+
+        self._sequence[slot] = sequence + 1
+        self._readings[start:start + len(SENSORS)] = [
+            math.nan if value is None else value for value in readings]
+        self._timestamps[slot] = time.time()
+        self._sequence[slot] = sequence + 2
+
+    def clear(self, slot):
+        self.write(slot, [None] * len(SENSORS))
+
+    def read(self, slot, max_age, retries=8):
+        """Return the readings of a slot.
+
+        :returns: One value per sensor of :data:`SENSORS`, None for
+            unavailable or outdated readings
+        """
+        start = slot * len(SENSORS)
+
+        for _ in range(retries):
+            sequence = self._sequence[slot]
+            if sequence % 2:
+                continue
+
+            readings = self._readings[start:start + len(SENSORS)]
+            timestamp = self._timestamps[slot]
+
+            if self._sequence[slot] == sequence:
+                break
+
+        else:
+            return [None] * len(SENSORS)
+
+        if time.time() - timestamp > max_age:
+            return [None] * len(SENSORS)
+
+        return [None if math.isnan(value) else value for value in readings]
+
+
+def get_sensor_table():
+    """Return the process-wide sensor table.
+
+    It has to be first called by vbmcd before it forks any vBMC instance,
+    for the instances to share the table with it.
+    """
+    global SENSOR_TABLE
+
+    if SENSOR_TABLE is None:
+        SENSOR_TABLE = SensorTable(CONF['default']['shared_memory_slots'])
+
+    return SENSOR_TABLE
+
+
+def _sum_stats(stats, prefix, count_key, suffixes):
+    total = 0
+    for index in range(stats.get(count_key, 0)):
+        for suffix in suffixes:
+            total += stats.get('%s.%d.%s' % (prefix, index, suffix), 0)
+
+    return total
+
+
+class StatsCollector(object):
+    """Feed the sensor table with libvirt domain statistics.
+
+    Statistics are gathered with a single ``getAllDomainStats()`` call per
+    libvirt URI and collection interval, whatever the number of vBMC
+    instances polling the sensors.
+    """
+
+    def __init__(self, table, interval):
+        self.table = table
+        self.interval = interval
+        self._last_run = None
+        # (uri, domain name) -> (timestamp, cumulative counters)
+        self._counters = {}
+
+    @staticmethod
+    def _counters_of(stats):
+        return {
+            'cpu': stats.get('cpu.time'),
+            'disk': _sum_stats(stats, 'block', 'block.count',
+                               ('rd.bytes', 'wr.bytes')),
+            'net': _sum_stats(stats, 'net', 'net.count',
+                              ('rx.bytes', 'tx.bytes')),
+        }
+
+    @staticmethod
+    def _memory_usage(stats):
+        available = stats.get('balloon.available')
+        unused = stats.get('balloon.unused')
+        if available and unused is not None:
+            return 100.0 * (available - unused) / available
+
+        current = stats.get('balloon.current')
+        rss = stats.get('balloon.rss')
+        if current and rss is not None:
+            return min(100.0, 100.0 * rss / current)
+
+    def _readings(self, key, stats, now):
+        counters = self._counters_of(stats)
+        previous = self._counters.get(key)
+        self._counters[key] = now, counters
+
+        readings = [None, self._memory_usage(stats), None, None]
+
+        if stats.get('state.state') != libvirt.VIR_DOMAIN_RUNNING:
+            readings[0] = 0.0
+            return readings
+
+        if previous is None:
+            return readings
+
+        elapsed = now - previous[0]
+        deltas = {name: value - previous[1][name]
+                  for name, value in counters.items()
+                  if value is not None and previous[1][name] is not None}
+        if elapsed <= 0:
+            return readings
+
+        vcpus = stats.get('vcpu.current') or 1
+        if deltas.get('cpu', -1) >= 0:
+            readings[0] = min(
+                100.0, 100.0 * deltas['cpu'] / (elapsed * 1e9 * vcpus))
+
+        # Counters going backwards mean the domain has been restarted
+        for index, name in ((2, 'disk'), (3, 'net')):
+            if deltas.get(name, -1) >= 0:
+                readings[index] = deltas[name] / elapsed / 2 ** 20
+
+        return readings
+
+    def _domain_stats(self, conn_args):
+        """Query the statistics of all the domains of a libvirt URI.
+
+        The query is made within the deadline of the
+        ``get_all_domain_stats`` call, vbmcd not waiting on a wedged
+        libvirtd any longer than that.
+
+        :raises: LibvirtCallTimeout past the deadline
+        """
+        def run():
+            with pool.pooled_connection(readonly=True, **conn_args) as conn:
+                return conn.getAllDomainStats(_STATS_FLAGS)
+
+        deadlines = CONF['deadlines']
+        timeout = deadlines.get(_STATS_CALL, deadlines['default'])
+        if not timeout:
+            return run()
+
+        try:
+            return deadline.get_executor().run(_STATS_CALL, run,
+                                               timeout=timeout)
+
+        except exception.LibvirtCallTimeout as e:
+            # The call may be hanging on libvirtd
+            breaker.get_breaker(conn_args['uri']).record(e)
+            raise
+
+    def collect(self, domains):
+        """Refresh the readings of the given domains if due.
+
+        :param domains: Dictionary mapping domain names to a tuple of
+            their sensor table slot and libvirt connection arguments
+            (``uri``, ``sasl_username`` and ``sasl_password``)
+        """
+        now = time.monotonic()
+        if self._last_run is not None and now - self._last_run < (
+                self.interval):
+            return
+
+        self._last_run = now
+
+        by_uri = collections.defaultdict(dict)
+        for domain_name, (slot, conn_args) in domains.items():
+            conn_key = tuple(sorted(conn_args.items()))
+            by_uri[conn_key][domain_name] = slot
+
+        for conn_key, slots in by_uri.items():
+            conn_args = dict(conn_key)
+
+            try:
+                records = self._domain_stats(conn_args)
+
+            except (libvirt.libvirtError, exception.VirtualBMCError) as e:
+                LOG.warning('Failed to collect domain statistics from '
+                            'libvirt URI %(uri)s: %(error)s',
+                            {'uri': conn_args['uri'], 'error': e})
+                for slot in slots.values():
+                    self.table.clear(slot)
+                continue
+
+            sampled = time.monotonic()
+            stats_by_name = {domain.name(): stats
+                             for domain, stats in records}
+
+            for domain_name, slot in slots.items():
+                stats = stats_by_name.get(domain_name)
+                if stats is None:
+                    self.table.clear(slot)
+                    continue
+
+                self.table.write(slot, self._readings(
+                    (conn_args['uri'], domain_name), stats, sampled))
+
+        # Forget about domains which are gone
+        managed = {(dict(conn_key)['uri'], domain_name)
+                   for conn_key, slots in by_uri.items()
+                   for domain_name in slots}
+        for key in set(self._counters) - managed:
+            del self._counters[key]
+
+
+class SensorDevice(object):
+    """IPMI SDR repository and sensor commands of a vBMC instance."""
+
+    def __init__(self, table, slot, max_age):
+        self.table = table
+        self.slot = slot
+        self.max_age = max_age
+        self._reservation = 0
+        self._handlers = {
+            (NETFN_SENSOR, CMD_GET_SENSOR_READING): self._get_sensor_reading,
+            (NETFN_SENSOR, CMD_GET_SENSOR_THRESHOLDS):
+                self._get_sensor_thresholds,
+            (NETFN_STORAGE, CMD_GET_SDR_REPOSITORY_INFO):
+                self._get_sdr_repository_info,
+            (NETFN_STORAGE, CMD_RESERVE_SDR_REPOSITORY):
+                self._reserve_sdr_repository,
+            (NETFN_STORAGE, CMD_GET_SDR): self._get_sdr,
+        }
+
+    def handle(self, request, session):
+        """Answer a sensor or SDR request.
+
+        :returns: True if the request has been handled, False if it is not
+            a sensor or SDR request
+        """
+        handler = self._handlers.get((request['netfn'], request['command']))
+        if handler is None:
+            return False
+
+        handler(request['data'], session)
+        return True
+
+    @staticmethod
+    def _find_sensor(data):
+        if len(data) < 1:
+            return None
+
+        for index, sensor in enumerate(SENSORS):
+            if sensor.number == data[0]:
+                return index
+
+    def _get_sensor_reading(self, data, session):
+        index = self._find_sensor(data)
+        if index is None:
+            session.send_ipmi_response(code=IPMI_NOT_PRESENT)
+            return
+
+        value = self.table.read(self.slot, self.max_age)[index]
+        if value is None:
+            session.send_ipmi_response(
+                data=[0, READING_SCANNING | READING_UNAVAILABLE, 0])
+            return
+
+        raw = max(0, min(_RAW_MAX, int(round(value))))
+        session.send_ipmi_response(data=[raw, READING_SCANNING, 0])
+
+    def _get_sensor_thresholds(self, data, session):
+        if self._find_sensor(data) is None:
+            session.send_ipmi_response(code=IPMI_NOT_PRESENT)
+            return
+
+        # No readable threshold
+        session.send_ipmi_response(data=[0] * 7)
+
+    def _get_sdr_repository_info(self, data, session):
+        session.send_ipmi_response(data=SDR_REPOSITORY_INFO)
+
+    def _reserve_sdr_repository(self, data, session):
+        self._reservation = self._reservation % 0xffff + 1
+        session.send_ipmi_response(
+            data=struct.pack('<H', self._reservation))
+
+    def _get_sdr(self, data, session):
+        if len(data) < 6:
+            session.send_ipmi_response(code=IPMI_INVALID_LENGTH)
+            return
+
+        # The repository never changes, reservations can be ignored
+        record_id, offset, count = struct.unpack('<2xHBB', bytes(data[:6]))
+
+        # Record ID 0 stands for the first record
+        index = max(record_id, 1) - 1
+        if index >= len(SDR_RECORDS):
+            session.send_ipmi_response(code=IPMI_NOT_PRESENT)
+            return
+
+        if index + 1 < len(SDR_RECORDS):
+            next_record_id = index + 2
+        else:
+            next_record_id = SDR_LAST_RECORD
+
+        record = SDR_RECORDS[index]
+        chunk = record[offset:] if count == 0xff else (
+            record[offset:offset + count])
+
+        session.send_ipmi_response(
+            data=struct.pack('<H', next_record_id) + chunk)
@@ -0,0 +1,412 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Serial-over-LAN backed by libvirt console streams.
+
+The console of a domain is read from a non-blocking libvirt stream by
+the libvirt event loop thread into a fixed-size ring buffer, and sent to
+the IPMI client straight out of that buffer, one SOL packet in flight at
+a time. Neither side ever waits for the other: the IPMI I/O loop only
+sends the next packet when the client acknowledges the previous one,
+and lost packets are retransmitted as a timer of the event loop asks. A
+busy console therefore cannot hold up the power commands served by the
+same process. Should the client not keep up, the ring buffer fills up
+and reading from the stream pauses, pushing back on the domain console.
+
+Only the IPMI I/O loop ever sends on the IPMI session: the event loop
+thread hands new output and retransmissions over to it rather than
+sending packets itself.
+"""
+
+import threading
+import time
+
+import libvirt
+import pyghmi.ipmi.console as ipmiconsole
+import pyghmi.ipmi.private.session as ipmisession
+
+from virtualbmc import log
+from virtualbmc import pool
+from virtualbmc import utils
+
+LOG = log.get_logger()
+
+# Largest amount of console output read from a stream at once, so that
+# a chatty console does not monopolize the event loop thread
+READ_SIZE = 4096
+
+# The SOL "accepted character count" field is a single byte
+MAX_PACKET_DATA = 255
+
+# Times an unacknowledged packet is sent again before giving up
+MAX_RETRANSMITS = 5
+
+_STREAM_EVENTS = (libvirt.VIR_STREAM_EVENT_READABLE
+                  | libvirt.VIR_STREAM_EVENT_ERROR
+                  | libvirt.VIR_STREAM_EVENT_HANGUP)
+
+
+class ConsoleBuffer(object):
+    """Fixed-size ring buffer of console output.
+
+    Data is copied into a single pre-allocated bytearray and handed out
+    as memoryview slices of it, nothing is allocated per packet.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self._buffer = bytearray(size)
+        self._view = memoryview(self._buffer)
+        self._start = 0
+        self._length = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._length
+
+    def free(self):
+        return self.size - self._length
+
+    def write(self, data):
+        """Append as much data as fits.
+
+        :returns: The number of bytes copied into the buffer
+        """
+        data = memoryview(data)
+
+        with self._lock:
+            count = min(len(data), self.size - self._length)
+            end = (self._start + self._length) % self.size
+            head = min(count, self.size - end)
+            self._view[end:end + head] = data[:head]
+            self._view[:count - head] = data[head:count]
+            self._length += count
+
+        return count
+
+    def peek(self, limit):
+        """Return up to limit bytes from the head of the buffer.
+
+        The returned view is only valid until :meth:`consume` is called.
+        It does not wrap around, data past the end of the underlying
+        buffer comes with the next call.
+        """
+        with self._lock:
+            count = min(limit, self._length, self.size - self._start)
+            return self._view[self._start:self._start + count]
+
+    def consume(self, count):
+        with self._lock:
+            self._length -= count
+            self._start = (self._start + count) % self.size if (
+                self._length) else 0
+
+    def clear(self):
+        with self._lock:
+            self._start = self._length = 0
+
+
+class SOLConsole(ipmiconsole.ServerConsole):
+    """SOL payload channel sending out of a :class:`ConsoleBuffer`.
+
+    Unlike its parent, it never blocks waiting for the client to
+    acknowledge a packet, see :meth:`retransmit`.
+
+    :param session: The IPMI session SOL has been activated on
+    :param iohandler: Callable receiving the input of the client
+    :param output: The :class:`ConsoleBuffer` to send from
+    :param drained: Callable invoked once output has been sent
+    """
+
+    def __init__(self, session, iohandler, output, drained=None):
+        self.output = output
+        self._drained = drained
+        self._retransmits = 0
+        self._sent_at = 0
+        super(SOLConsole, self).__init__(session, iohandler)
+        self.maxoutcount = MAX_PACKET_DATA
+
+    def _sendpendingoutput(self):
+        with self.outputlock:
+            if self.awaitingack or self.broken:
+                return
+
+            if self.pendingoutput:
+                # Data the client rejected goes out first
+                super(SOLConsole, self)._sendpendingoutput()
+                return
+
+            chunk = self.output.peek(self.maxoutcount)
+            if not chunk:
+                return
+
+            # The packet is built out of the view, the buffer space can
+            # be reused right away
+            self._sendoutput(chunk)
+            self.output.consume(len(chunk))
+
+        if self._drained is not None:
+            self._drained()
+
+    def _sendoutput(self, output, sendbreak=False):
+        self.myseq = self.myseq % 0xf + 1
+
+        payload = bytearray((self.myseq, 0, 0, 0b10000 if sendbreak else 0))
+        payload += output
+
+        self.lasttextsize = len(output)
+        self.lastpayload = payload
+        self.awaitingack = True
+        self._retransmits = 0
+        self._sent_at = time.monotonic()
+        self.send_payload(payload, retry=False,
+                          needskeepalive=not self.lasttextsize)
+
+    def retransmit(self, timeout):
+        """Send again the packet not acknowledged within timeout seconds.
+
+        Gives up on the client after :data:`MAX_RETRANSMITS` attempts.
+        """
+        with self.outputlock:
+            if (not self.awaitingack or self.broken
+                    or time.monotonic() - self._sent_at < timeout):
+                return
+
+            if self._retransmits >= MAX_RETRANSMITS:
+                self._print_error('Connection lost')
+                return
+
+            self._retransmits += 1
+            self._sent_at = time.monotonic()
+            self.send_payload(self.lastpayload, retry=False)
+
+
+class ConsoleStream(object):
+    """The console of a libvirt domain, relayed over SOL.
+
+    :param domain_name: The name of the domain
+    :param conn_args: The libvirt connection arguments of the domain
+    :param buffer_size: Size of the console output buffer in bytes
+    :param retransmit_timeout: Seconds before an unacknowledged SOL
+        packet is sent again
+    :param on_close: Callable invoked when the console goes away
+    """
+
+    def __init__(self, domain_name, conn_args, buffer_size,
+                 retransmit_timeout, on_close=None):
+        self.domain_name = domain_name
+        self.output = ConsoleBuffer(buffer_size)
+        self._conn_args = conn_args
+        self._retransmit_timeout = retransmit_timeout
+        self._on_close = on_close
+        self._lock = threading.Lock()
+        self._stream = None
+        self._timer = None
+        self._paused = False
+        self._service_pending = False
+        self.console = None
+
+    def open(self):
+        """Connect to the console of the domain.
+
+        Takes the console over from whoever may be holding it.
+
+        :raises: libvirt.libvirtError on failure
+        """
+        self.close()
+
+        # The stream outlives the block, the pooled connection is not
+        # closed on exit
+        with pool.pooled_connection(**self._conn_args) as conn:
+            domain = utils.get_libvirt_domain(conn, self.domain_name)
+            stream = conn.newStream(libvirt.VIR_STREAM_NONBLOCK)
+
+            try:
+                domain.openConsole(None, stream,
+                                   libvirt.VIR_DOMAIN_CONSOLE_FORCE)
+                stream.eventAddCallback(_STREAM_EVENTS, self._stream_event,
+                                        None)
+
+            except libvirt.libvirtError:
+                self._abort(stream)
+                raise
+
+        timer = libvirt.virEventAddTimeout(
+            int(self._retransmit_timeout * 1000), self._check_acks, None)
+
+        with self._lock:
+            self._stream = stream
+            self._timer = timer
+
+        LOG.debug('Opened the console of domain %(domain)s',
+                  {'domain': self.domain_name})
+
+    def attach(self, session):
+        """Start relaying the console over SOL.
+
+        :param session: The IPMI session SOL has been activated on
+        :returns: The :class:`SOLConsole` of the session
+        """
+        console = SOLConsole(session, self.send, self.output,
+                             drained=self.resume)
+        self.console = console
+        # Flush what came in since the console was opened
+        console._sendpendingoutput()
+        return console
+
+    def send(self, data):
+        """Pass input of the SOL client on to the console."""
+        if isinstance(data, dict):
+            # pyghmi reports SOL errors this way
+            LOG.debug('SOL session of domain %(domain)s: %(error)s',
+                      {'domain': self.domain_name, 'error': data})
+            return
+
+        with self._lock:
+            stream = self._stream
+
+        if stream is None:
+            return
+
+        try:
+            sent = stream.send(data)
+
+        except libvirt.libvirtError as e:
+            LOG.warning('Failed writing to the console of domain '
+                        '%(domain)s: %(error)s', {'domain': self.domain_name,
+                                                  'error': e})
+            return
+
+        if sent != len(data):
+            # Only keystrokes are passed this way, losing some when the
+            # console is this busy is not worth buffering them
+            LOG.debug('Dropped console input of domain %(domain)s',
+                      {'domain': self.domain_name})
+
+    def resume(self):
+        """Resume reading from the console once output buffer drained."""
+        with self._lock:
+            if not self._paused or self._stream is None:
+                return
+
+            self._paused = False
+            self._stream.eventUpdateCallback(_STREAM_EVENTS)
+
+    def _stream_event(self, stream, events, opaque):
+        with self._lock:
+            if stream is not self._stream:
+                return
+
+            hangup = events & (libvirt.VIR_STREAM_EVENT_ERROR
+                               | libvirt.VIR_STREAM_EVENT_HANGUP)
+            if not hangup and not self.output.free():
+                # Raced with pausing the stream
+                return
+
+        if hangup:
+            self._closed()
+            return
+
+        with self._lock:
+            if stream is not self._stream:
+                return
+
+            try:
+                data = stream.recv(min(self.output.free(), READ_SIZE))
+
+            except libvirt.libvirtError as e:
+                LOG.warning('Failed reading the console of domain '
+                            '%(domain)s: %(error)s',
+                            {'domain': self.domain_name, 'error': e})
+                data = b''
+
+            if data == -2:
+                # Spurious wakeup, nothing to read
+                return
+
+            if data:
+                self.output.write(data)
+
+                if not self.output.free():
+                    # The SOL client is not keeping up
+                    self._paused = True
+                    stream.eventUpdateCallback(
+                        libvirt.VIR_STREAM_EVENT_ERROR
+                        | libvirt.VIR_STREAM_EVENT_HANGUP)
+
+        if not data:
+            self._closed()
+            return
+
+        self._request_service()
+
+    def _check_acks(self, timer, opaque):
+        console = self.console
+        if console is not None and console.awaitingack:
+            self._request_service()
+
+    def _request_service(self):
+        """Have the IPMI I/O loop send what is due on the SOL session."""
+        with self._lock:
+            if self._service_pending or self.console is None:
+                return
+
+            self._service_pending = True
+
+        # Run by the thread serving the IPMI sessions on its next pass
+        ipmisession.Session.iterwaiters.append(self._service)
+        # Break into the I/O loop, which may be waiting for packets
+        ipmisession._io_wait(0)
+
+    def _service(self, response=None):
+        with self._lock:
+            self._service_pending = False
+            console = self.console
+
+        if console is not None:
+            console.retransmit(self._retransmit_timeout)
+            console._sendpendingoutput()
+
+    def _closed(self):
+        LOG.info('The console of domain %(domain)s went away',
+                 {'domain': self.domain_name})
+        self.close()
+
+        if self._on_close is not None:
+            self._on_close()
+
+    @staticmethod
+    def _abort(stream):
+        try:
+            stream.abort()
+        except libvirt.libvirtError:
+            pass
+
+    def close(self):
+        """Stop relaying the console."""
+        with self._lock:
+            stream, self._stream = self._stream, None
+            timer, self._timer = self._timer, None
+            self._paused = False
+            self.console = None
+            self.output.clear()
+
+        if timer is not None:
+            libvirt.virEventRemoveTimeout(timer)
+
+        if stream is not None:
+            try:
+                stream.eventRemoveCallback()
+            except libvirt.libvirtError:
+                pass
+
+            self._abort(stream)
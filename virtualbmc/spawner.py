@@ -0,0 +1,458 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Spawner process forking the per-instance vBMC processes.
+
+Forking every vBMC instance straight out of vbmcd copies whatever vbmcd
+holds by then, and each instance then initialises the IPMI session
+cryptography on its own. The spawner is forked out of vbmcd once, before
+vbmcd sets its control server up. It loads and initialises everything
+the instances need, freezes the garbage collector so that the objects
+it holds stay shared with the instances rather than being copied as
+the collector goes through them, and forks the instances from there.
+
+The spawner may keep a few idle processes forked in advance, which are
+handed the next instances to start.
+"""
+
+import ctypes
+import gc
+import hashlib
+import hmac
+import importlib
+import itertools
+import multiprocessing
+import multiprocessing.connection
+import os
+import pickle
+import signal
+import weakref
+
+from virtualbmc import log
+
+__all__ = ['Spawner']
+
+LOG = log.get_logger()
+
+# Control messages
+START = 'start'
+STOP = 'stop'
+
+# Status messages
+EXITED = 'exited'
+
+# Modules the vBMC instances use, loaded once by the spawner
+PRELOAD = ('libvirt',
+           'pyghmi.ipmi.bmc',
+           'pyghmi.ipmi.console',
+           'pyghmi.ipmi.private.serversession',
+           'cryptography.hazmat.primitives.ciphers')
+
+# From <sys/prctl.h>
+PR_SET_PDEATHSIG = 1
+
+_READ_SIZE = 65536
+
+
+def _preload():
+    for name in PRELOAD:
+        try:
+            importlib.import_module(name)
+
+        except ImportError as ex:
+            LOG.debug('Not preloading %(module)s: %(error)s',
+                      {'module': name, 'error': ex})
+
+    # OpenSSL loads its algorithms on their first use, have it done once
+    # rather than in every instance
+    try:
+        from cryptography.hazmat.primitives.ciphers import algorithms
+        from cryptography.hazmat.primitives.ciphers import Cipher
+        from cryptography.hazmat.primitives.ciphers import modes
+
+        Cipher(algorithms.AES(bytes(16)), modes.CBC(bytes(16))).encryptor()
+
+    except ImportError:
+        pass
+
+    for digest in (hashlib.sha1, hashlib.sha256):
+        hmac.new(bytes(16), b'', digest).digest()
+
+
+def _libc():
+    try:
+        return ctypes.CDLL(None, use_errno=True)
+
+    except OSError:
+        return None
+
+
+def _die_with_parent(libc, parent):
+    """Have the current process terminated once its parent is gone.
+
+    :returns: False if the parent is gone already
+    """
+    if libc is not None:
+        libc.prctl(PR_SET_PDEATHSIG, signal.SIGTERM)
+
+    return os.getppid() == parent
+
+
+class _Children(object):
+    """The processes forked by the spawner.
+
+    :param conn: Connection to vbmcd
+    :param warm: Number of idle processes to keep forked in advance
+    :param libc: The C library, None if unavailable
+    """
+
+    def __init__(self, conn, warm, libc):
+        self.conn = conn
+        self.warm = warm
+        self.libc = libc
+        # pid -> identifier of the instance it runs
+        self.running = {}
+        # Idle processes, as (pid, write end of the pipe they wait on)
+        self.idle = []
+        self._wakeup = os.pipe()
+
+        for fd in self._wakeup:
+            os.set_blocking(fd, False)
+
+        # Learn about dead children as it happens
+        signal.set_wakeup_fd(self._wakeup[1])
+        signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+
+    def fill(self):
+        while len(self.idle) < self.warm:
+            try:
+                self.idle.append(self._fork())
+
+            except OSError as ex:
+                LOG.warning('Failed to fork an idle vBMC process: '
+                            '%(error)s', {'error': ex})
+                return
+
+    def start(self, ident, name, target, args):
+        data = pickle.dumps((name, target, args))
+
+        while True:
+            if self.idle:
+                pid, fd = self.idle.pop(0)
+            else:
+                pid, fd = self._fork()
+
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(data)
+
+            except BrokenPipeError:
+                # Died while idle
+                continue
+
+            self.running[pid] = ident
+            return
+
+    def stop(self, ident):
+        for pid, running in self.running.items():
+            if running == ident:
+                self._kill(pid)
+                return
+
+    def reap(self):
+        try:
+            while os.read(self._wakeup[0], _READ_SIZE):
+                pass
+
+        except BlockingIOError:
+            pass
+
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+
+            except ChildProcessError:
+                return
+
+            if not pid:
+                return
+
+            ident = self.running.pop(pid, None)
+            if ident is not None:
+                self.conn.send(
+                    (EXITED, ident, os.waitstatus_to_exitcode(status)))
+                continue
+
+            for index, (idle_pid, fd) in enumerate(self.idle):
+                if idle_pid == pid:
+                    del self.idle[index]
+                    os.close(fd)
+                    break
+
+    def wait(self):
+        """Wait for a message from vbmcd or for a child to die.
+
+        :returns: True if a message came
+        """
+        ready = multiprocessing.connection.wait(
+            [self.conn, self._wakeup[0]])
+        return self.conn in ready
+
+    def shutdown(self):
+        for pid, fd in self.idle:
+            os.close(fd)
+
+        for pid in self.running:
+            self._kill(pid)
+
+        # Give the instances the chance to exit cleanly, flushing any
+        # deferred boot device change
+        for pid in itertools.chain(self.running, (pid for pid, _
+                                                  in self.idle)):
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass
+
+        self.running.clear()
+        self.idle = []
+
+    @staticmethod
+    def _kill(pid):
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+
+    def _fork(self):
+        read_fd, write_fd = os.pipe()
+        inherited = [fd for _, fd in self.idle]
+        parent = os.getpid()
+
+        # Keep the objects the spawner holds out of the reach of the
+        # garbage collector of the child, for their pages to stay shared
+        gc.freeze()
+
+        # A SIGTERM caught by the handler of the spawner in the child
+        # would be lost, hold it until the child restores the default
+        signal.pthread_sigmask(signal.SIG_BLOCK, {signal.SIGTERM})
+        try:
+            pid = os.fork()
+
+        except OSError:
+            signal.pthread_sigmask(signal.SIG_UNBLOCK, {signal.SIGTERM})
+            os.close(read_fd)
+            os.close(write_fd)
+            raise
+
+        if pid:
+            signal.pthread_sigmask(signal.SIG_UNBLOCK, {signal.SIGTERM})
+            os.close(read_fd)
+            return pid, write_fd
+
+        code = 1
+        try:
+            signal.set_wakeup_fd(-1)
+            signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.pthread_sigmask(signal.SIG_UNBLOCK, {signal.SIGTERM})
+            self.conn.close()
+            for fd in [write_fd] + inherited + list(self._wakeup):
+                os.close(fd)
+
+            code = self._child(read_fd, parent)
+
+        except SystemExit as ex:
+            if isinstance(ex.code, int):
+                code = ex.code
+            else:
+                code = 0 if ex.code is None else 1
+
+        except BaseException:
+            LOG.exception('vBMC process failed')
+
+        finally:
+            os._exit(code)
+
+    def _child(self, read_fd, parent):
+        # Do not outlive the spawner, keeping the IPMI ports bound
+        if not _die_with_parent(self.libc, parent):
+            return 0
+
+        chunks = []
+        while True:
+            chunk = os.read(read_fd, _READ_SIZE)
+            if not chunk:
+                break
+            chunks.append(chunk)
+
+        os.close(read_fd)
+
+        if not chunks:
+            # Shut down while idle
+            return 0
+
+        name, target, args = pickle.loads(b''.join(chunks))
+        multiprocessing.current_process().name = name
+
+        target(*args)
+        return 0
+
+
+def spawner_runner(conn, warm):
+    # Raising SystemExit out of the handler could go unnoticed, in the
+    # middle of an import for instance. The handler wakes the loop up
+    # through the wakeup file descriptor instead.
+    stopping = []
+    signal.signal(signal.SIGTERM,
+                  lambda signum, frame: stopping.append(signum))
+
+    libc = _libc()
+    if not _die_with_parent(libc, multiprocessing.parent_process().pid):
+        return
+
+    _preload()
+
+    children = _Children(conn, warm, libc)
+
+    try:
+        while not stopping:
+            children.fill()
+
+            if children.wait():
+                while conn.poll():
+                    message = conn.recv()
+
+                    if message[0] == START:
+                        _, ident, name, target, args = message
+                        try:
+                            children.start(ident, name, target, args)
+
+                        except OSError as ex:
+                            LOG.error('Failed to fork %(name)s: %(error)s',
+                                      {'name': name, 'error': ex})
+                            conn.send((EXITED, ident, 1))
+
+                    elif message[0] == STOP:
+                        children.stop(message[1])
+
+            children.reap()
+
+    except (EOFError, BrokenPipeError):
+        LOG.info('Manager connection closed, shutting down spawner')
+
+    finally:
+        children.shutdown()
+
+
+class Spawner(object):
+    """Manager-side handle of the spawner process.
+
+    :param warm: Number of idle processes to keep forked in advance
+    """
+
+    def __init__(self, warm=0):
+        self._conn, child_conn = multiprocessing.Pipe()
+        self._ident = itertools.count()
+        # identifier -> process started, as long as the manager holds it
+        self._processes = weakref.WeakValueDictionary()
+
+        self.process = multiprocessing.Process(
+            name='vbmcd-spawner', target=spawner_runner,
+            args=(child_conn, warm)
+        )
+        self.process.daemon = True
+        self.process.start()
+
+        child_conn.close()
+
+    def is_alive(self):
+        return self.process.is_alive()
+
+    def sentinels(self):
+        """Return file descriptors ready as the spawner reports or dies.
+
+        Once the spawner is dead they would stay ready for good, none is
+        returned then.
+        """
+        if not self.process.is_alive():
+            return ()
+
+        return self.process.sentinel, self._conn.fileno()
+
+    def poll(self):
+        """Process the exit reports sent by the spawner."""
+        try:
+            while self._conn.poll():
+                status, ident, exitcode = self._conn.recv()
+
+                process = self._processes.get(ident)
+                if status == EXITED and process is not None:
+                    process.returncode = exitcode
+
+        except (EOFError, OSError):
+            pass
+
+    def start(self, name, target, args=()):
+        """Start a process running ``target(*args)``.
+
+        :returns: An object following the :class:`multiprocessing.Process`
+            interface for the process
+        """
+        process = SpawnedProcess(self, next(self._ident), name)
+        self._processes[process.ident] = process
+        self._conn.send((START, process.ident, name, target, args))
+        return process
+
+    def stop(self, ident):
+        try:
+            self._conn.send((STOP, ident))
+        except (BrokenPipeError, OSError):
+            pass
+
+    def terminate(self):
+        self._conn.close()
+        if self.process.is_alive():
+            self.process.terminate()
+        self.process.join()
+
+
+class SpawnedProcess(object):
+    """A vBMC instance process forked by the spawner.
+
+    Mimics the bits of :class:`multiprocessing.Process` the manager relies
+    on for per-instance processes.
+    """
+
+    def __init__(self, spawner, ident, name):
+        self.spawner = spawner
+        self.ident = ident
+        self.name = name
+        # Exit code reported by the spawner
+        self.returncode = None
+
+    def is_alive(self):
+        return self.exitcode is None
+
+    @property
+    def exitcode(self):
+        if self.returncode is None:
+            if not self.spawner.is_alive():
+                # Killed along with the spawner
+                return self.spawner.process.exitcode
+
+            self.spawner.poll()
+
+        return self.returncode
+
+    def terminate(self):
+        self.spawner.stop(self.ident)
@@ -0,0 +1,216 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Configurations of the vBMC instances in a single SQLite database.
+
+By default, the configuration of each vBMC instance lives in a file of
+its own, in a directory named after its domain. With many instances,
+listing them means opening as many files, and a configuration being
+rewritten can be read half-written. The database holds all the
+configurations in one file instead. Changes are made in transactions,
+possibly spanning several instances, and the write-ahead log lets the
+configurations be read while they are being changed.
+"""
+
+import contextlib
+import sqlite3
+
+from virtualbmc import exception
+
+__all__ = ['SQLiteStore']
+
+# Name of the database file in the configuration directory
+DATABASE_FILE = 'vbmc.sqlite'
+
+# Configuration options of a vBMC instance, the port is an integer and
+# the other options are stored as written in configuration files
+COLUMNS = ('domain_name', 'username', 'password', 'address', 'port',
+           'libvirt_uri', 'libvirt_sasl_username', 'libvirt_sasl_password',
+           'active')
+
+# Options instances can be looked up by
+INDEXED_COLUMNS = ('port', 'libvirt_uri')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS bmcs (
+    domain_name TEXT PRIMARY KEY,
+    username TEXT,
+    password TEXT,
+    address TEXT,
+    port INTEGER NOT NULL,
+    libvirt_uri TEXT,
+    libvirt_sasl_username TEXT,
+    libvirt_sasl_password TEXT,
+    active TEXT
+);
+CREATE INDEX IF NOT EXISTS bmcs_port ON bmcs (port);
+CREATE INDEX IF NOT EXISTS bmcs_libvirt_uri ON bmcs (libvirt_uri);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+_SELECT = 'SELECT %s FROM bmcs' % ', '.join(COLUMNS)
+
+_UPSERT = 'INSERT OR REPLACE INTO bmcs (%s) VALUES (%s)' % (
+    ', '.join(COLUMNS), ', '.join('?' * len(COLUMNS)))
+
+_INSERT = 'INSERT INTO bmcs (%s) VALUES (%s)' % (
+    ', '.join(COLUMNS), ', '.join('?' * len(COLUMNS)))
+
+_INSERT_OR_IGNORE = _INSERT.replace('INSERT', 'INSERT OR IGNORE', 1)
+
+
+def _row(config):
+    values = []
+
+    for column in COLUMNS:
+        value = config.get(column)
+        if value is not None and column != 'port':
+            value = str(value)
+        values.append(value)
+
+    return values
+
+
+class SQLiteStore(object):
+    """vBMC instance configurations held in an SQLite database.
+
+    Configurations are dicts of the :data:`COLUMNS` options, as parsed out
+    of configuration files.
+
+    :param path: Path of the database file, created if missing
+    """
+
+    def __init__(self, path):
+        self.path = path
+        # Transactions are begun explicitly
+        self._conn = sqlite3.connect(path, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        # Durable enough with the write-ahead log, without syncing the
+        # disk on every transaction
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(_SCHEMA)
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """Make changes atomically.
+
+        Changes made within the block are either all committed or, if it
+        raises, all rolled back.
+        """
+        if self._conn.in_transaction:
+            # Nested in an enclosing transaction
+            yield
+            return
+
+        self._conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield
+
+        except BaseException:
+            self._conn.execute('ROLLBACK')
+            raise
+
+        self._conn.execute('COMMIT')
+
+    def get(self, domain_name):
+        """Return the configuration of a domain.
+
+        :raises: DomainNotFound if the domain has no configuration
+        """
+        row = self._conn.execute(_SELECT + ' WHERE domain_name = ?',
+                                 (domain_name,)).fetchone()
+        if row is None:
+            raise exception.DomainNotFound(domain=domain_name)
+
+        return dict(row)
+
+    def all(self, **filters):
+        """Return the configurations by domain name.
+
+        :param filters: Values of the :data:`INDEXED_COLUMNS` options the
+            configurations must have
+        """
+        query = _SELECT
+        if filters:
+            for column in filters:
+                if column not in INDEXED_COLUMNS:
+                    raise ValueError('Cannot look vBMC instances up by '
+                                     '%s' % column)
+            query += ' WHERE ' + ' AND '.join(
+                '%s = ?' % column for column in filters)
+
+        return {row['domain_name']: dict(row)
+                for row in self._conn.execute(query, list(filters.values()))}
+
+    def add(self, *configs):
+        """Add the configurations of new domains, all or none of them.
+
+        :raises: DomainAlreadyExists if a domain already has a
+            configuration
+        """
+        with self.transaction():
+            for config in configs:
+                try:
+                    self._conn.execute(_INSERT, _row(config))
+
+                except sqlite3.IntegrityError:
+                    raise exception.DomainAlreadyExists(
+                        domain=config['domain_name'])
+
+    def put(self, *configs):
+        """Add or replace the configurations of domains."""
+        with self.transaction():
+            self._conn.executemany(_UPSERT, (_row(config)
+                                             for config in configs))
+
+    def delete(self, domain_name):
+        """Remove the configuration of a domain.
+
+        :raises: DomainNotFound if the domain has no configuration
+        """
+        with self.transaction():
+            cursor = self._conn.execute(
+                'DELETE FROM bmcs WHERE domain_name = ?', (domain_name,))
+
+        if not cursor.rowcount:
+            raise exception.DomainNotFound(domain=domain_name)
+
+    def migrate(self, configs):
+        """Import configurations once, the first time the store is used.
+
+        :param configs: Iterable of the configurations to import, only
+            gone through if they were never imported
+        :returns: The number of configurations imported
+        """
+        with self.transaction():
+            done = self._conn.execute(
+                "SELECT value FROM meta WHERE key = 'migrated'").fetchone()
+            if done is not None:
+                return 0
+
+            count = 0
+            for config in configs:
+                # Domains added meanwhile take precedence
+                count += self._conn.execute(_INSERT_OR_IGNORE,
+                                            _row(config)).rowcount
+
+            self._conn.execute(
+                "INSERT INTO meta (key, value) VALUES ('migrated', '1')")
+
+        return count
+
+    def close(self):
+        self._conn.close()
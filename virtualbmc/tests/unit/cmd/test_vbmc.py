@@ -21,6 +21,7 @@ from unittest import mock
 import zmq
 
 from virtualbmc.cmd import vbmc
+from virtualbmc import manifest
 from virtualbmc.tests.unit import base
 from virtualbmc.tests.unit import utils as test_utils
 
@@ -91,6 +92,49 @@ class VBMCTestCase(base.TestCase):
             self.assertEqual(expected_rc, rc)
             self.assertEqual(expected_output, output.getvalue())
 
+    @mock.patch.object(manifest, 'load', autospec=True)
+    @mock.patch.object(zmq, 'Context')
+    @mock.patch.object(zmq, 'Poller')
+    def test_main_import(self, mock_zmq_poller, mock_zmq_context,
+                         mock_load):
+        bmcs = [{'domain_name': 'foo'}, {'domain_name': 'bar'}]
+        mock_load.return_value = bmcs
+
+        srv_rsp = {
+            'rc': 0,
+            'msg': ['OK']
+        }
+
+        mock_zmq_context = mock_zmq_context.return_value
+        mock_zmq_socket = mock_zmq_context.socket.return_value
+        mock_zmq_socket.recv.return_value = json.dumps(srv_rsp).encode()
+        mock_zmq_poller = mock_zmq_poller.return_value
+        mock_zmq_poller.poll.return_value = {
+            mock_zmq_socket: zmq.POLLIN
+        }
+
+        with mock.patch.object(sys, 'stdout', io.StringIO()) as output:
+            rc = vbmc.main(['import', '--first-port', '7000', '--start',
+                            'bmcs.csv'])
+
+            query = json.loads(mock_zmq_socket.send.call_args[0][0].decode())
+
+            expected_query = {
+                'command': 'bulk_add',
+                'manifest': 'bmcs.csv',
+                'format': None,
+                'first_port': 7000,
+                'start': True,
+                'bmcs': bmcs,
+            }
+
+            self.assertEqual(expected_query, query)
+
+            self.assertEqual(0, rc)
+            self.assertEqual('', output.getvalue())
+
+        mock_load.assert_called_once_with('bmcs.csv', None)
+
     @mock.patch.object(zmq, 'Context')
     @mock.patch.object(zmq, 'Poller')
     def test_main_delete(self, mock_zmq_poller, mock_zmq_context):
@@ -289,3 +333,51 @@ class VBMCTestCase(base.TestCase):
 
             self.assertEqual(expected_rc, rc)
             self.assertEqual(expected_output, output.getvalue())
+
+    @mock.patch.object(zmq, 'Context')
+    @mock.patch.object(zmq, 'Poller')
+    def test_main_stats(self, mock_zmq_poller, mock_zmq_context):
+        expected_rc = 0
+
+        expected_output = """+-------+-------+
+| col1  | col2  |
++-------+-------+
+| cell3 | cell4 |
+| cell1 | cell2 |
++-------+-------+
+"""
+
+        srv_rsp = {
+            'rc': expected_rc,
+            'header': ['col1', 'col2'],
+            'rows': [['cell3', 'cell4'],
+                     ['cell1', 'cell2']]
+        }
+
+        mock_zmq_context = mock_zmq_context.return_value
+        mock_zmq_socket = mock_zmq_context.socket.return_value
+        mock_zmq_socket.recv.return_value = json.dumps(srv_rsp).encode()
+        mock_zmq_poller = mock_zmq_poller.return_value
+        mock_zmq_poller.poll.return_value = {
+            mock_zmq_socket: zmq.POLLIN
+        }
+
+        with mock.patch.object(sys, 'stdout', io.StringIO()) as output:
+
+            rc = vbmc.main(['stats'])
+
+            query = json.loads(mock_zmq_socket.send.call_args[0][0].decode())
+
+            expected_query = {
+                "domain_name": None,
+                "command": "stats",
+            }
+
+            # Cliff adds some extra args to the query
+            query = {key: query[key] for key in query
+                     if key in expected_query}
+
+            self.assertEqual(expected_query, query)
+
+            self.assertEqual(expected_rc, rc)
+            self.assertEqual(expected_output, output.getvalue())
@@ -0,0 +1,249 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import random
+import time
+from unittest import mock
+
+import libvirt
+
+from virtualbmc import breaker
+from virtualbmc import exception
+from virtualbmc.tests.unit import base
+
+_URI = 'fake:///bikini-bottom'
+
+
+def libvirt_error(code):
+    error = libvirt.libvirtError('boom')
+    error.get_error_code = mock.Mock(return_value=code)
+    return error
+
+
+class ClassificationTestCase(base.TestCase):
+
+    def test_libvirt_error_code(self):
+        self.assertEqual(libvirt.VIR_ERR_RPC, breaker.libvirt_error_code(
+            libvirt_error(libvirt.VIR_ERR_RPC)))
+        self.assertIsNone(breaker.libvirt_error_code(ValueError('boom')))
+
+    def test_libvirt_error_code_chained(self):
+        try:
+            try:
+                raise libvirt_error(libvirt.VIR_ERR_NO_DOMAIN)
+            except libvirt.libvirtError:
+                raise exception.DomainNotFound(domain='SpongeBob')
+        except exception.DomainNotFound as e:
+            error = e
+
+        self.assertEqual(libvirt.VIR_ERR_NO_DOMAIN,
+                         breaker.libvirt_error_code(error))
+
+    def test_is_transient(self):
+        self.assertTrue(breaker.is_transient(
+            libvirt_error(libvirt.VIR_ERR_SYSTEM_ERROR)))
+        self.assertTrue(breaker.is_transient(
+            exception.LibvirtConnectionOpenError(uri=_URI, error='boom')))
+        self.assertTrue(breaker.is_transient(
+            exception.LibvirtUnavailable(uri=_URI)))
+        self.assertTrue(breaker.is_transient(
+            exception.LibvirtCallTimeout(call='power_off', timeout=3)))
+        self.assertFalse(breaker.is_transient(
+            libvirt_error(libvirt.VIR_ERR_OPERATION_INVALID)))
+        self.assertFalse(breaker.is_transient(
+            libvirt_error(libvirt.VIR_ERR_INTERNAL_ERROR)))
+        self.assertFalse(breaker.is_transient(ValueError('boom')))
+
+    def test_is_transient_wrapped(self):
+        try:
+            try:
+                raise exception.LibvirtUnavailable(uri=_URI)
+            except exception.LibvirtUnavailable as e:
+                raise exception.VirtualBMCError(message='boom') from e
+        except exception.VirtualBMCError as e:
+            error = e
+
+        self.assertTrue(breaker.is_transient(error))
+        self.assertEqual([error, error.__cause__],
+                         list(breaker.causes(error)))
+
+
+class CircuitBreakerTestCase(base.TestCase):
+
+    def setUp(self):
+        super(CircuitBreakerTestCase, self).setUp()
+        mock.patch.object(random, 'uniform', autospec=True,
+                          return_value=1).start()
+        self.breaker = breaker.CircuitBreaker(
+            _URI, error_rate=0.5, min_calls=4, reset_timeout=5)
+        self.failure = libvirt_error(libvirt.VIR_ERR_RPC)
+
+    def _trip(self):
+        for _ in range(4):
+            self.breaker.admit()
+            self.breaker.record(self.failure)
+
+    def _later(self, seconds):
+        return mock.patch.object(time, 'monotonic',
+                                 return_value=time.monotonic() + seconds)
+
+    def test_closed(self):
+        for _ in range(10):
+            self.breaker.admit()
+            self.breaker.record()
+
+        self.assertEqual(breaker.CLOSED, self.breaker.state)
+
+    def test_not_enough_calls(self):
+        for _ in range(3):
+            self.breaker.admit()
+            self.breaker.record(self.failure)
+
+        self.assertEqual(breaker.CLOSED, self.breaker.state)
+
+    def test_permanent_errors_do_not_count(self):
+        for _ in range(10):
+            self.breaker.admit()
+            self.breaker.record(libvirt_error(libvirt.VIR_ERR_NO_DOMAIN))
+
+        self.assertEqual(breaker.CLOSED, self.breaker.state)
+
+    def test_error_rate(self):
+        for _ in range(3):
+            self.breaker.record()
+        self.breaker.record(self.failure)
+        self.breaker.record(self.failure)
+        self.assertEqual(breaker.CLOSED, self.breaker.state)
+
+        self.breaker.record(self.failure)
+        self.assertEqual(breaker.OPEN, self.breaker.state)
+
+    def test_old_outcomes_forgotten(self):
+        for _ in range(3):
+            self.breaker.record(self.failure)
+
+        with self._later(breaker.WINDOW + 1):
+            self.breaker.record(self.failure)
+
+        self.assertEqual(breaker.CLOSED, self.breaker.state)
+
+    def test_open_fails_fast(self):
+        self._trip()
+
+        self.assertEqual(breaker.OPEN, self.breaker.state)
+        self.assertRaises(exception.LibvirtUnavailable, self.breaker.admit)
+
+    def test_half_open_single_probe(self):
+        self._trip()
+
+        with self._later(6):
+            self.assertTrue(self.breaker.admit())
+            self.assertEqual(breaker.HALF_OPEN, self.breaker.state)
+            self.assertRaises(exception.LibvirtUnavailable,
+                              self.breaker.admit)
+
+    def test_probe_success_closes(self):
+        self._trip()
+
+        with self._later(6):
+            self.breaker.admit()
+            self.breaker.record(probe=True)
+
+        self.assertEqual(breaker.CLOSED, self.breaker.state)
+        self.assertFalse(self.breaker.admit())
+
+    def test_probe_failure_backs_off(self):
+        self._trip()
+
+        with self._later(6):
+            self.breaker.admit()
+            self.breaker.record(self.failure, probe=True)
+
+        self.assertEqual(breaker.OPEN, self.breaker.state)
+
+        # Open for twice as long
+        with self._later(6 + 9):
+            self.assertRaises(exception.LibvirtUnavailable,
+                              self.breaker.admit)
+
+        with self._later(6 + 11):
+            self.breaker.admit()
+
+    def test_late_outcome_while_probing_ignored(self):
+        self._trip()
+
+        with self._later(6):
+            self.breaker.admit()
+            # Admitted before the breaker opened
+            self.breaker.record()
+            self.breaker.record(self.failure)
+
+        self.assertEqual(breaker.HALF_OPEN, self.breaker.state)
+
+    def test_hanging_probe_taken_over(self):
+        self._trip()
+
+        with self._later(6):
+            self.breaker.admit()
+
+        with self._later(10):
+            self.assertRaises(exception.LibvirtUnavailable,
+                              self.breaker.admit)
+
+        with self._later(12):
+            self.assertTrue(self.breaker.admit())
+            self.breaker.record(probe=True)
+
+        self.assertEqual(breaker.CLOSED, self.breaker.state)
+
+    def test_backoff_capped(self):
+        self.breaker._trips = 10
+
+        self.breaker._open(time.monotonic())
+
+        self.assertEqual(breaker.MAX_RESET_TIMEOUT, self.breaker._open_for)
+
+    def test_late_outcome_ignored(self):
+        self.breaker.admit()
+        self._trip()
+
+        self.breaker.record()
+
+        self.assertEqual(breaker.OPEN, self.breaker.state)
+
+
+class GetBreakerTestCase(base.TestCase):
+
+    def setUp(self):
+        super(GetBreakerTestCase, self).setUp()
+        mock.patch.object(breaker, 'BREAKERS', {}).start()
+
+    def test_get_breaker(self):
+        with mock.patch.dict(breaker.CONF['libvirt'],
+                             {'breaker_error_rate': 0.25,
+                              'breaker_min_calls': 3,
+                              'breaker_reset_timeout': 1}):
+            circuit_breaker = breaker.get_breaker(_URI)
+
+        self.assertIs(circuit_breaker, breaker.get_breaker(_URI))
+        self.assertIsNot(circuit_breaker, breaker.get_breaker('test:///'))
+        self.assertEqual(0.25, circuit_breaker.error_rate)
+        self.assertEqual(3, circuit_breaker.min_calls)
+
+    def test_get_breaker_disabled(self):
+        with mock.patch.dict(breaker.CONF['libvirt'],
+                             {'breaker_error_rate': 0}):
+            circuit_breaker = breaker.get_breaker(_URI)
+
+        circuit_breaker.admit()
+        circuit_breaker.record(exception.LibvirtUnavailable(uri=_URI))
+        self.assertEqual({}, breaker.BREAKERS)
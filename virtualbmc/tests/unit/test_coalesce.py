@@ -0,0 +1,162 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import concurrent.futures
+import threading
+import time
+from unittest import mock
+
+from virtualbmc import coalesce
+from virtualbmc.tests.unit import base
+
+_KEY = ('fake:///bikini-bottom', 'SpongeBob', 'active')
+
+
+class CoalescerTestCase(base.TestCase):
+
+    def setUp(self):
+        super(CoalescerTestCase, self).setUp()
+        self.coalescer = coalesce.Coalescer(window=1)
+        self.fetcher = mock.Mock(return_value=True)
+
+    def test_fetch_within_window(self):
+        self.assertTrue(self.coalescer.fetch(_KEY, self.fetcher))
+        self.assertTrue(self.coalescer.fetch(_KEY, self.fetcher))
+
+        self.fetcher.assert_called_once_with()
+
+    def test_fetch_past_window(self):
+        self.coalescer.fetch(_KEY, self.fetcher)
+
+        with mock.patch.object(time, 'monotonic',
+                               return_value=time.monotonic() + 2):
+            self.coalescer.fetch(_KEY, self.fetcher)
+
+        self.assertEqual(2, self.fetcher.call_count)
+
+    def test_fetch_other_key(self):
+        self.coalescer.fetch(_KEY, self.fetcher)
+        self.coalescer.fetch(_KEY[:2] + ('boot',), self.fetcher)
+
+        self.assertEqual(2, self.fetcher.call_count)
+
+    def test_fetch_no_window(self):
+        self.coalescer.window = 0
+
+        self.coalescer.fetch(_KEY, self.fetcher)
+        self.coalescer.fetch(_KEY, self.fetcher)
+
+        self.assertEqual(2, self.fetcher.call_count)
+
+    def test_fetch_error_not_kept(self):
+        self.fetcher.side_effect = [ValueError('boom'), True]
+
+        self.assertRaises(ValueError, self.coalescer.fetch, _KEY,
+                          self.fetcher)
+        self.assertTrue(self.coalescer.fetch(_KEY, self.fetcher))
+        self.assertEqual(2, self.fetcher.call_count)
+
+    def _in_flight(self, fetcher):
+        # Runs a query on a thread of its own until released
+        started = threading.Event()
+        self.release = threading.Event()
+        self.addCleanup(self.release.set)
+
+        def _fetch():
+            started.set()
+            self.release.wait(5)
+            return fetcher()
+
+        leader = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.addCleanup(leader.shutdown)
+        future = leader.submit(self.coalescer.fetch, _KEY, _fetch)
+        started.wait(5)
+        return future
+
+    def _follow(self):
+        # The query in flight completes once waited for
+        flight = self.coalescer._flights[_KEY]
+        wait = flight.result
+
+        def _result(timeout=None):
+            self.release.set()
+            return wait(timeout)
+
+        flight.result = _result
+
+    def test_fetch_in_flight(self):
+        future = self._in_flight(self.fetcher)
+        self._follow()
+
+        self.assertTrue(self.coalescer.fetch(_KEY, self.fetcher))
+        self.assertTrue(future.result(5))
+        self.fetcher.assert_called_once_with()
+
+    def test_fetch_in_flight_error(self):
+        self.fetcher.side_effect = ValueError('boom')
+        future = self._in_flight(self.fetcher)
+        self._follow()
+
+        self.assertRaises(ValueError, self.coalescer.fetch, _KEY,
+                          self.fetcher)
+        self.assertRaises(ValueError, future.result, 5)
+        self.fetcher.assert_called_once_with()
+
+    def test_invalidate_in_flight(self):
+        future = self._in_flight(self.fetcher)
+
+        self.coalescer.invalidate(_KEY)
+        self.assertTrue(self.coalescer.fetch(_KEY, self.fetcher))
+
+        self.release.set()
+        future.result(5)
+        # The outcome of the invalidated query is not kept
+        self.coalescer.fetch(_KEY, self.fetcher)
+        self.assertEqual(2, self.fetcher.call_count)
+
+    def test_expired_results_pruned(self):
+        self.coalescer.fetch(_KEY, self.fetcher)
+
+        with mock.patch.object(time, 'monotonic',
+                               return_value=time.monotonic() + 2):
+            self.coalescer.fetch(_KEY[:2] + ('boot',), self.fetcher)
+
+        self.assertEqual([_KEY[:2] + ('boot',)],
+                         list(self.coalescer._results))
+
+    def test_invalidate(self):
+        self.coalescer.fetch(_KEY, self.fetcher)
+
+        self.coalescer.invalidate(_KEY)
+        self.coalescer.fetch(_KEY, self.fetcher)
+
+        self.assertEqual(2, self.fetcher.call_count)
+
+
+class GetCoalescerTestCase(base.TestCase):
+
+    def setUp(self):
+        super(GetCoalescerTestCase, self).setUp()
+        mock.patch.object(coalesce, 'COALESCER', None).start()
+
+    def test_get_coalescer(self):
+        with mock.patch.dict(coalesce.CONF['libvirt'],
+                             {'coalesce_queries': True,
+                              'coalesce_window': 0.5}):
+            coalescer = coalesce.get_coalescer()
+            self.assertIs(coalescer, coalesce.get_coalescer())
+            self.assertEqual(0.5, coalescer.window)
+
+    def test_get_coalescer_disabled(self):
+        with mock.patch.dict(coalesce.CONF['libvirt'],
+                             {'coalesce_queries': False}):
+            self.assertIsNone(coalesce.get_coalescer())
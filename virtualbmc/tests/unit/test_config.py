@@ -32,12 +32,48 @@ class VirtualBMCConfigTestCase(base.TestCase):
         self.vbmc_config = config.VirtualBMCConfig()
         self.config_dict = {'default': {'show_passwords': 'true',
                                         'config_dir': '/foo/bar/1',
+                                        'config_store': 'sqlite',
                                         'pid_file': '/foo/bar/2',
                                         'server_port': '12345',
                                         'server_spawn_wait': 3000,
-                                        'server_response_timeout': 5000},
+                                        'server_response_timeout': 5000,
+                                        'execution_mode': 'single',
+                                        'worker_count': '4',
+                                        'warm_processes': '2',
+                                        'shared_memory_slots': '128'},
                             'log': {'debug': 'true', 'logfile': '/foo/bar/4'},
-                            'ipmi': {'session_timeout': '30'}}
+                            'ipmi': {'session_timeout': '30',
+                                     'boot_device_flush_delay': '0.5',
+                                     'shared_port': '623',
+                                     'shared_address': '::',
+                                     'async_power': 'true',
+                                     'soft_off_timeout': '30'},
+                            'libvirt': {'keepalive_interval': '5',
+                                        'keepalive_count': '5',
+                                        'domain_events': 'true',
+                                        'domain_cache_ttl': '60',
+                                        'coalesce_queries': 'false',
+                                        'coalesce_window': '0.1',
+                                        'breaker_error_rate': '0.25',
+                                        'breaker_min_calls': '10',
+                                        'breaker_reset_timeout': '2.5',
+                                        'call_workers': '4'},
+                            'deadlines': {'default': '5',
+                                          'get_power_state': '1',
+                                          'get_boot_device': '1',
+                                          'power_on': '10'},
+                            'scheduler': {'max_concurrent': '2',
+                                          'stagger': '0.5'},
+                            'scheduler:qemu:///system': {
+                                'max_concurrent': '8'},
+                            'sensors': {'enabled': 'false',
+                                        'interval': '5'},
+                            'metrics': {'enabled': 'false',
+                                        'listen_port': '9623',
+                                        'listen_address': '::1'},
+                            'sol': {'enabled': 'false',
+                                    'buffer_size': '4096',
+                                    'retransmit_timeout': '0.5'}}
 
     @mock.patch.object(config.VirtualBMCConfig, '_validate')
     @mock.patch.object(config.VirtualBMCConfig, '_as_dict')
@@ -55,14 +91,52 @@ class VirtualBMCConfigTestCase(base.TestCase):
     def test__as_dict(self, mock_exists):
         mock_exists.side_effect = (False, True)
         config = mock.Mock()
-        config.sections.side_effect = ['default', 'log', 'ipmi'],
+        config.sections.side_effect = ['default', 'log', 'ipmi', 'libvirt',
+                                       'deadlines', 'scheduler',
+                                       'scheduler:qemu:///system', 'sensors',
+                                       'metrics', 'sol'],
         config.items.side_effect = [[('show_passwords', 'true'),
                                      ('config_dir', '/foo/bar/1'),
+                                     ('config_store', 'sqlite'),
                                      ('pid_file', '/foo/bar/2'),
-                                     ('server_port', '12345')],
+                                     ('server_port', '12345'),
+                                     ('execution_mode', 'single'),
+                                     ('worker_count', '4'),
+                                     ('warm_processes', '2'),
+                                     ('shared_memory_slots', '128')],
                                     [('logfile', '/foo/bar/4'),
                                      ('debug', 'true')],
-                                    [('session_timeout', '30')]]
+                                    [('session_timeout', '30'),
+                                     ('boot_device_flush_delay', '0.5'),
+                                     ('shared_port', '623'),
+                                     ('shared_address', '::'),
+                                     ('async_power', 'true'),
+                                     ('soft_off_timeout', '30')],
+                                    [('keepalive_interval', '5'),
+                                     ('keepalive_count', '5'),
+                                     ('domain_events', 'true'),
+                                     ('domain_cache_ttl', '60'),
+                                     ('coalesce_queries', 'false'),
+                                     ('coalesce_window', '0.1'),
+                                     ('breaker_error_rate', '0.25'),
+                                     ('breaker_min_calls', '10'),
+                                     ('breaker_reset_timeout', '2.5'),
+                                     ('call_workers', '4')],
+                                    [('default', '5'),
+                                     ('get_power_state', '1'),
+                                     ('get_boot_device', '1'),
+                                     ('power_on', '10')],
+                                    [('max_concurrent', '2'),
+                                     ('stagger', '0.5')],
+                                    [('max_concurrent', '8')],
+                                    [('enabled', 'false'),
+                                     ('interval', '5')],
+                                    [('enabled', 'false'),
+                                     ('listen_port', '9623'),
+                                     ('listen_address', '::1')],
+                                    [('enabled', 'false'),
+                                     ('buffer_size', '4096'),
+                                     ('retransmit_timeout', '0.5')]]
         ret = self.vbmc_config._as_dict(config)
         self.assertEqual(self.config_dict, ret)
 
@@ -75,6 +149,75 @@ class VirtualBMCConfigTestCase(base.TestCase):
         expected['default']['server_response_timeout'] = 5000
         expected['default']['server_spawn_wait'] = 3000
         expected['default']['server_port'] = 12345
+        expected['default']['worker_count'] = 4
+        expected['default']['warm_processes'] = 2
         expected['log']['debug'] = True
         expected['ipmi']['session_timeout'] = 30
+        expected['ipmi']['boot_device_flush_delay'] = 0.5
+        expected['ipmi']['shared_port'] = 623
+        expected['ipmi']['async_power'] = True
+        expected['ipmi']['soft_off_timeout'] = 30.0
+        expected['libvirt']['keepalive_interval'] = 5
+        expected['libvirt']['keepalive_count'] = 5
+        expected['libvirt']['domain_events'] = True
+        expected['libvirt']['domain_cache_ttl'] = 60
+        expected['libvirt']['coalesce_queries'] = False
+        expected['libvirt']['coalesce_window'] = 0.1
+        expected['libvirt']['breaker_error_rate'] = 0.25
+        expected['libvirt']['breaker_min_calls'] = 10
+        expected['libvirt']['breaker_reset_timeout'] = 2.5
+        expected['libvirt']['call_workers'] = 4
+        expected['deadlines'] = {'default': 5.0, 'get_power_state': 1.0,
+                                 'get_boot_device': 1.0, 'power_on': 10.0}
+        expected['scheduler'] = {'max_concurrent': 2, 'stagger': 0.5}
+        expected['scheduler:qemu:///system'] = {'max_concurrent': 8,
+                                                'stagger': 0.5}
+        expected['sensors']['enabled'] = False
+        expected['sensors']['interval'] = 5
+        expected['default']['shared_memory_slots'] = 128
+        expected['metrics']['enabled'] = False
+        expected['metrics']['listen_port'] = 9623
+        expected['sol']['enabled'] = False
+        expected['sol']['buffer_size'] = 4096
+        expected['sol']['retransmit_timeout'] = 0.5
         self.assertEqual(expected, self.vbmc_config._conf_dict)
+
+    def test_validate_unknown_execution_mode(self):
+        self.config_dict['default']['execution_mode'] = 'threaded'
+        self.vbmc_config._conf_dict = self.config_dict
+        self.assertRaises(ValueError, self.vbmc_config._validate)
+
+    def test_validate_unknown_config_store(self):
+        self.config_dict['default']['config_store'] = 'etcd'
+        self.vbmc_config._conf_dict = self.config_dict
+        self.assertRaises(ValueError, self.vbmc_config._validate)
+
+    def test_validate_warm_processes(self):
+        self.config_dict['default']['warm_processes'] = '-1'
+        self.vbmc_config._conf_dict = self.config_dict
+        self.assertRaises(ValueError, self.vbmc_config._validate)
+
+    def test_validate_breaker_error_rate(self):
+        self.config_dict['libvirt']['breaker_error_rate'] = '1.5'
+        self.vbmc_config._conf_dict = self.config_dict
+        self.assertRaises(ValueError, self.vbmc_config._validate)
+
+    def test_validate_call_workers(self):
+        self.config_dict['libvirt']['call_workers'] = '0'
+        self.vbmc_config._conf_dict = self.config_dict
+        self.assertRaises(ValueError, self.vbmc_config._validate)
+
+    def test_validate_scheduler_max_concurrent(self):
+        self.config_dict['scheduler:qemu:///system']['max_concurrent'] = '64'
+        self.vbmc_config._conf_dict = self.config_dict
+        self.assertRaises(ValueError, self.vbmc_config._validate)
+
+    def test_validate_shared_port_process_mode(self):
+        self.config_dict['default']['execution_mode'] = 'process'
+        self.vbmc_config._conf_dict = self.config_dict
+        self.assertRaises(ValueError, self.vbmc_config._validate)
+
+    def test_validate_shared_port_forkserver_mode(self):
+        self.config_dict['default']['execution_mode'] = 'forkserver'
+        self.vbmc_config._conf_dict = self.config_dict
+        self.assertRaises(ValueError, self.vbmc_config._validate)
@@ -15,11 +15,15 @@
 
 import json
 import os
+import time
 from unittest import mock
 
 import zmq
 
 from virtualbmc import control
+from virtualbmc import exception
+from virtualbmc import exporter
+from virtualbmc import metrics
 from virtualbmc.tests.unit import base
 
 
@@ -34,6 +38,7 @@ class VBMCControlServerTestCase(base.TestCase):
         mock_path.exists.return_value = False
 
         mock_vbmc_manager = mock.MagicMock()
+        mock_vbmc_manager.restart_delay.return_value = None
         mock_handle_command = mock.MagicMock()
 
         req = {
@@ -69,3 +74,165 @@ class VBMCControlServerTestCase(base.TestCase):
         response = json.loads(mock_zmq_socket.send.call_args[0][0].decode())
 
         self.assertEqual(rsp, response)
+
+    @mock.patch.object(exporter, 'start_server', autospec=True)
+    @mock.patch.object(zmq, 'Context')
+    @mock.patch.object(zmq, 'Poller')
+    def test_control_loop_metrics(self, mock_zmq_poller, mock_zmq_context,
+                                  mock_start_server):
+        mock_vbmc_manager = mock.MagicMock()
+        mock_vbmc_manager.restart_delay.return_value = None
+        mock_handle_command = mock.MagicMock()
+        metrics_server = mock_start_server.return_value
+        metrics_server.fileno.return_value = 42
+
+        class QuitNow(Exception):
+            pass
+
+        mock_zmq_poller = mock_zmq_poller.return_value
+        mock_zmq_poller.poll.side_effect = [{42: zmq.POLLIN}, QuitNow()]
+
+        self.assertRaises(QuitNow,
+                          control.main_loop,
+                          mock_vbmc_manager, mock_handle_command)
+
+        mock_start_server.assert_called_once_with(mock_vbmc_manager)
+        mock_zmq_poller.register.assert_called_with(42, zmq.POLLIN)
+        metrics_server.handle_request.assert_called_once_with()
+        metrics_server.server_close.assert_called_once_with()
+        mock_handle_command.assert_not_called()
+        mock_vbmc_manager.periodic.assert_not_called()
+
+    @mock.patch.object(zmq, 'Context')
+    @mock.patch.object(zmq, 'Poller')
+    def test_control_loop_sentinels(self, mock_zmq_poller, mock_zmq_context):
+        mock_vbmc_manager = mock.MagicMock()
+        mock_vbmc_manager.sentinels.side_effect = [{7, 8}, {8, 9}]
+        mock_vbmc_manager.restart_delay.return_value = 0.25
+
+        class QuitNow(Exception):
+            pass
+
+        mock_zmq_poller = mock_zmq_poller.return_value
+        mock_zmq_poller.poll.side_effect = [{7: zmq.POLLIN}, QuitNow()]
+
+        self.assertRaises(QuitNow, control.main_loop, mock_vbmc_manager,
+                          mock.MagicMock())
+
+        mock_zmq_poller.register.assert_has_calls(
+            [mock.call(7, zmq.POLLIN), mock.call(8, zmq.POLLIN),
+             mock.call(9, zmq.POLLIN)], any_order=True)
+        mock_zmq_poller.unregister.assert_called_once_with(7)
+        mock_zmq_poller.poll.assert_called_with(timeout=250)
+        mock_vbmc_manager.periodic.assert_called_once_with()
+
+    @mock.patch.object(zmq, 'Context')
+    @mock.patch.object(zmq, 'Poller')
+    def test_control_loop_periodic_error(self, mock_zmq_poller,
+                                         mock_zmq_context):
+        mock_vbmc_manager = mock.MagicMock()
+        mock_vbmc_manager.restart_delay.return_value = None
+        mock_vbmc_manager.periodic.side_effect = [
+            exception.LibvirtUnavailable(uri='qemu:///system'), None]
+
+        class QuitNow(Exception):
+            pass
+
+        mock_zmq_poller = mock_zmq_poller.return_value
+        mock_zmq_poller.poll.side_effect = [{}, {}, QuitNow()]
+
+        self.assertRaises(QuitNow, control.main_loop, mock_vbmc_manager,
+                          mock.MagicMock())
+
+        self.assertEqual(2, mock_vbmc_manager.periodic.call_count)
+
+    @mock.patch.object(time, 'monotonic', autospec=True)
+    @mock.patch.object(zmq, 'Context')
+    @mock.patch.object(zmq, 'Poller')
+    def test_control_loop_periodic_when_busy(self, mock_zmq_poller,
+                                             mock_zmq_context,
+                                             mock_monotonic):
+        mock_vbmc_manager = mock.MagicMock()
+        mock_vbmc_manager.restart_delay.return_value = None
+        mock_zmq_socket = mock_zmq_context.return_value.socket.return_value
+        mock_zmq_socket.recv.return_value = b'{"command": "list"}'
+        now = [100.0]
+        mock_monotonic.side_effect = lambda: now[0]
+
+        class QuitNow(Exception):
+            pass
+
+        def _poll(timeout):
+            # A command is always waiting, a second goes by
+            if now[0] >= 104:
+                raise QuitNow()
+            now[0] += 1
+            return {mock_zmq_socket: zmq.POLLIN}
+
+        mock_zmq_poller = mock_zmq_poller.return_value
+        mock_zmq_poller.poll.side_effect = _poll
+
+        self.assertRaises(QuitNow, control.main_loop, mock_vbmc_manager,
+                          mock.MagicMock(return_value={'rc': 0}))
+
+        # Due three seconds in, the period is counted from there on
+        mock_vbmc_manager.periodic.assert_called_once_with()
+        mock_zmq_poller.poll.assert_has_calls(
+            [mock.call(timeout=3000), mock.call(timeout=2000),
+             mock.call(timeout=1000), mock.call(timeout=3000)])
+
+    def test_command_dispatcher_bulk_add(self):
+        mock_vbmc_manager = mock.MagicMock()
+        mock_vbmc_manager.bulk_add.return_value = 0, []
+        bmcs = [{'domain_name': 'SpongeBob'}, {'domain_name': 'Patrick'}]
+
+        rsp = control.command_dispatcher(
+            mock_vbmc_manager, {'command': 'bulk_add', 'bmcs': bmcs,
+                                'start': True, 'first_port': 7000})
+
+        mock_vbmc_manager.bulk_add.assert_called_once_with(
+            bmcs, start=True, first_port=7000)
+        self.assertEqual({'rc': 0, 'msg': []}, rsp)
+
+    def test_command_dispatcher_start(self):
+        mock_vbmc_manager = mock.MagicMock()
+        mock_vbmc_manager.bulk_start.return_value = 1, ['boom']
+
+        rsp = control.command_dispatcher(
+            mock_vbmc_manager, {'command': 'start',
+                                'domain_names': ['SpongeBob', 'Patrick',
+                                                 'SpongeBob']})
+
+        mock_vbmc_manager.bulk_start.assert_called_once_with(
+            {'SpongeBob', 'Patrick'})
+        mock_vbmc_manager.start.assert_not_called()
+        self.assertEqual({'rc': 1, 'msg': ['boom']}, rsp)
+
+    def test_command_dispatcher_stop(self):
+        mock_vbmc_manager = mock.MagicMock()
+        mock_vbmc_manager.bulk_stop.return_value = 0, []
+
+        rsp = control.command_dispatcher(
+            mock_vbmc_manager, {'command': 'stop',
+                                'domain_names': ['SpongeBob', 'Patrick']})
+
+        mock_vbmc_manager.bulk_stop.assert_called_once_with(
+            {'SpongeBob', 'Patrick'})
+        self.assertEqual({'rc': 0, 'msg': []}, rsp)
+
+    def test_command_dispatcher_stats(self):
+        mock_vbmc_manager = mock.MagicMock()
+        histogram = metrics.Histogram(
+            [2, 2] + [0] * (len(metrics.BUCKETS) - 2), 1, 1, 0.004)
+        mock_vbmc_manager.stats.return_value = 0, [
+            ('SpongeBob', 'ipmi', 'chassis_control', histogram)]
+
+        rsp = control.command_dispatcher(
+            mock_vbmc_manager, {'command': 'stats', 'domain_name': None})
+
+        mock_vbmc_manager.stats.assert_called_once_with(None)
+        self.assertEqual(0, rsp['rc'])
+        self.assertEqual(9, len(rsp['header']))
+        self.assertEqual(
+            [['SpongeBob', 'ipmi', 'chassis_control', 4, 1.0, 2.35, 2.47, 1,
+              1]], rsp['rows'])
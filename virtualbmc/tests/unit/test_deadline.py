@@ -0,0 +1,104 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import concurrent.futures
+import os
+import threading
+from unittest import mock
+
+from virtualbmc import deadline
+from virtualbmc import exception
+from virtualbmc.tests.unit import base
+
+
+class CallExecutorTestCase(base.TestCase):
+
+    def setUp(self):
+        super(CallExecutorTestCase, self).setUp()
+        self.executor = deadline.CallExecutor(workers=1)
+        self.release = threading.Event()
+        self.addCleanup(self.release.set)
+
+    def _hang(self):
+        self.release.wait(5)
+
+    def test_run(self):
+        self.assertEqual('on', self.executor.run('get_power_state',
+                                                 lambda: 'on', 1))
+
+    def test_submit(self):
+        future = self.executor.submit('power_on', lambda: 'on')
+
+        self.assertEqual('on', future.result(1))
+
+    def test_submit_busy(self):
+        for _ in range(deadline.PENDING_PER_WORKER):
+            self.executor.submit('power_on', self._hang)
+
+        self.assertRaises(exception.LibvirtBusy, self.executor.submit,
+                          'power_on', self._hang)
+
+    def test_run_error(self):
+        func = mock.Mock(side_effect=ValueError('boom'))
+
+        self.assertRaises(ValueError, self.executor.run, 'power_on',
+                          func, 1)
+
+    def test_run_func_timeout_error(self):
+        func = mock.Mock(side_effect=concurrent.futures.TimeoutError)
+
+        self.assertRaises(concurrent.futures.TimeoutError,
+                          self.executor.run, 'power_on', func, 1)
+
+    def test_run_timeout(self):
+        self.assertRaises(exception.LibvirtCallTimeout, self.executor.run,
+                          'power_off', self._hang, 0.01)
+
+    def test_run_busy(self):
+        for _ in range(deadline.PENDING_PER_WORKER):
+            self.assertRaises(exception.LibvirtCallTimeout,
+                              self.executor.run, 'power_off', self._hang,
+                              0.01)
+
+        self.assertRaises(exception.LibvirtBusy, self.executor.run,
+                          'power_off', self._hang, 0.01)
+
+    def test_run_pending_released(self):
+        self.assertRaises(exception.LibvirtCallTimeout, self.executor.run,
+                          'power_off', self._hang, 0.01)
+        self.release.set()
+        self.executor._executor.shutdown(wait=True)
+
+        # The hung call gave its slot back
+        for _ in range(deadline.PENDING_PER_WORKER):
+            self.assertTrue(self.executor._pending.acquire(blocking=False))
+
+
+class GetExecutorTestCase(base.TestCase):
+
+    def setUp(self):
+        super(GetExecutorTestCase, self).setUp()
+        mock.patch.object(deadline, 'EXECUTOR', None).start()
+
+    def test_get_executor(self):
+        with mock.patch.dict(deadline.CONF['libvirt'], {'call_workers': 3}):
+            executor = deadline.get_executor()
+
+        self.assertIs(executor, deadline.get_executor())
+        self.assertEqual(3, executor.workers)
+
+    def test_get_executor_forked(self):
+        executor = deadline.get_executor()
+
+        with mock.patch.object(os, 'getpid', autospec=True,
+                               return_value=os.getpid() + 1):
+            self.assertIsNot(executor, deadline.get_executor())
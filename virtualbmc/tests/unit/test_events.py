@@ -0,0 +1,320 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import concurrent.futures
+from unittest import mock
+
+import libvirt
+
+from virtualbmc import breaker
+from virtualbmc import deadline
+from virtualbmc import events
+from virtualbmc import exception
+from virtualbmc import pool
+from virtualbmc.tests.unit import base
+
+_URI = 'fake:///bikini-bottom'
+
+
+class DomainCacheTestCase(base.TestCase):
+
+    def setUp(self):
+        super(DomainCacheTestCase, self).setUp()
+        self.conn = mock.Mock()
+        mock_pool = mock.patch.object(pool, 'get_pool', autospec=True).start()
+        self.mock_acquire = mock_pool.return_value.acquire
+        self.mock_acquire.return_value = self.conn
+        # The connection pooled last
+        mock_pool.return_value.connection.side_effect = (
+            lambda *args, **kwargs: self.mock_acquire.return_value)
+        # Subscriptions are made right away unless the test says otherwise
+        self.mock_executor = mock.patch.object(
+            deadline, 'get_executor', autospec=True).start()
+        self.mock_executor.return_value.submit.side_effect = self._submit
+        self.cache = events.DomainCache(ttl=60)
+        self.fetcher = mock.Mock(return_value=True)
+
+    @staticmethod
+    def _submit(call, func):
+        future = concurrent.futures.Future()
+        future.set_result(func())
+        return future
+
+    def _event(self, event, domain_name='SpongeBob', conn=None):
+        domain = mock.Mock()
+        domain.name.return_value = domain_name
+        self.cache._lifecycle_event(conn or self.conn, domain, event, 0,
+                                    _URI)
+
+    def test_watch(self):
+        self.assertTrue(self.cache.watch(_URI))
+        self.assertTrue(self.cache.watch(_URI))
+
+        self.mock_acquire.assert_called_with(
+            _URI, sasl_username=None, sasl_password=None, readonly=True)
+        self.conn.domainEventRegisterAny.assert_called_once_with(
+            None, libvirt.VIR_DOMAIN_EVENT_ID_LIFECYCLE,
+            self.cache._lifecycle_event, _URI)
+
+    def test_watch_reconnected(self):
+        self.cache.watch(_URI)
+        self.cache.fetch(_URI, 'SpongeBob', 'active', self.fetcher)
+
+        new_conn = mock.Mock()
+        self.mock_acquire.return_value = new_conn
+        self.assertTrue(self.cache.watch(_URI))
+
+        new_conn.domainEventRegisterAny.assert_called_once_with(
+            None, libvirt.VIR_DOMAIN_EVENT_ID_LIFECYCLE,
+            self.cache._lifecycle_event, _URI)
+        # entries cached before the reconnect are dropped
+        self.cache.fetch(_URI, 'SpongeBob', 'active', self.fetcher)
+        self.assertEqual(2, self.fetcher.call_count)
+
+    def test_watch_in_background(self):
+        future = concurrent.futures.Future()
+        self.mock_executor.return_value.submit.side_effect = None
+        self.mock_executor.return_value.submit.return_value = future
+
+        self.assertFalse(self.cache.watch(_URI))
+        # still subscribing
+        self.assertFalse(self.cache.watch(_URI))
+        self.assertFalse(self.cache.fetch(_URI, 'SpongeBob', 'active',
+                                          lambda: False))
+
+        call, func = self.mock_executor.return_value.submit.call_args[0]
+        self.assertEqual('watch', call)
+        future.set_result(func())
+
+        self.assertTrue(self.cache.watch(_URI))
+        self.mock_executor.return_value.submit.assert_called_once()
+        self.conn.domainEventRegisterAny.assert_called_once()
+
+    def test_watch_busy(self):
+        self.mock_executor.return_value.submit.side_effect = (
+            exception.LibvirtBusy(call='watch'))
+
+        self.assertFalse(self.cache.watch(_URI))
+        self.mock_acquire.assert_not_called()
+
+        self.mock_executor.return_value.submit.side_effect = self._submit
+        self.assertTrue(self.cache.watch(_URI))
+
+    def test_watch_breaker_open(self):
+        with mock.patch.object(breaker, 'get_breaker',
+                               autospec=True) as mock_get_breaker:
+            mock_get_breaker.return_value.admit.side_effect = (
+                exception.LibvirtUnavailable(uri=_URI))
+
+            self.assertFalse(self.cache.watch(_URI))
+
+        self.mock_acquire.assert_not_called()
+
+    def test_watch_register_error(self):
+        self.conn.domainEventRegisterAny.side_effect = (
+            libvirt.libvirtError('boom'))
+        self.assertFalse(self.cache.watch(_URI))
+
+    def test_watch_connection_error(self):
+        self.mock_acquire.side_effect = libvirt.libvirtError('boom')
+        self.assertFalse(self.cache.watch(_URI))
+
+    def test_fetch(self):
+        self.cache.watch(_URI)
+
+        self.assertTrue(
+            self.cache.fetch(_URI, 'SpongeBob', 'active', self.fetcher))
+        self.assertTrue(
+            self.cache.fetch(_URI, 'SpongeBob', 'active', self.fetcher))
+
+        self.fetcher.assert_called_once_with()
+
+    def test_fetch_not_watched(self):
+        self.cache.fetch(_URI, 'SpongeBob', 'active', self.fetcher)
+        self.cache.fetch(_URI, 'SpongeBob', 'active', self.fetcher)
+
+        self.assertEqual(2, self.fetcher.call_count)
+
+    def test_fetch_stale(self):
+        self.cache = events.DomainCache(ttl=0)
+        self.cache.watch(_URI)
+
+        self.cache.fetch(_URI, 'SpongeBob', 'active', self.fetcher)
+        self.cache.fetch(_URI, 'SpongeBob', 'active', self.fetcher)
+
+        self.assertEqual(2, self.fetcher.call_count)
+
+    def test_fetch_raced_by_event(self):
+        self.cache.watch(_URI)
+
+        def fetcher():
+            self._event(libvirt.VIR_DOMAIN_EVENT_STOPPED)
+            return True
+
+        # the value fetched concurrently with the event is not cached
+        self.assertTrue(
+            self.cache.fetch(_URI, 'SpongeBob', 'active', fetcher))
+        self.assertFalse(
+            self.cache.fetch(_URI, 'SpongeBob', 'active', self.fetcher))
+        self.fetcher.assert_not_called()
+
+    def test_lifecycle_events(self):
+        self.cache.watch(_URI)
+
+        self._event(libvirt.VIR_DOMAIN_EVENT_STARTED)
+        self.assertTrue(
+            self.cache.fetch(_URI, 'SpongeBob', 'active', self.fetcher))
+
+        self._event(libvirt.VIR_DOMAIN_EVENT_STOPPED)
+        self.assertFalse(
+            self.cache.fetch(_URI, 'SpongeBob', 'active', self.fetcher))
+
+        self.fetcher.assert_not_called()
+
+        self._event(libvirt.VIR_DOMAIN_EVENT_SUSPENDED)
+        self.assertTrue(
+            self.cache.fetch(_URI, 'SpongeBob', 'active', self.fetcher))
+        self.fetcher.assert_called_once_with()
+
+    def test_definition(self):
+        self.assertIsNone(self.cache.definition(_URI, 'SpongeBob'))
+
+        self.cache.watch(_URI)
+        definition = self.cache.definition(_URI, 'SpongeBob')
+        self._event(libvirt.VIR_DOMAIN_EVENT_STARTED)
+        self._event(libvirt.VIR_DOMAIN_EVENT_DEFINED)
+        self.assertEqual(definition, self.cache.definition(_URI, 'SpongeBob'))
+
+        self._event(libvirt.VIR_DOMAIN_EVENT_UNDEFINED)
+        self.assertNotEqual(definition,
+                            self.cache.definition(_URI, 'SpongeBob'))
+        self.assertEqual(definition, self.cache.definition(_URI, 'Patrick'))
+
+    def test_definition_resubscribed(self):
+        self.cache.watch(_URI)
+        definition = self.cache.definition(_URI, 'SpongeBob')
+
+        self.mock_acquire.return_value = mock.Mock()
+        self.cache.watch(_URI)
+
+        self.assertNotEqual(definition,
+                            self.cache.definition(_URI, 'SpongeBob'))
+
+    def test_lifecycle_event_defined(self):
+        self.cache.watch(_URI)
+        self._event(libvirt.VIR_DOMAIN_EVENT_STARTED)
+        self.cache.fetch(_URI, 'SpongeBob', 'boot', lambda: 'hd')
+        self._event(libvirt.VIR_DOMAIN_EVENT_DEFINED)
+
+        self.fetcher.return_value = 'network'
+        self.assertEqual(
+            'network', self.cache.fetch(_URI, 'SpongeBob', 'boot',
+                                        self.fetcher))
+        # power state is not affected by a redefinition
+        self.assertTrue(
+            self.cache.fetch(_URI, 'SpongeBob', 'active', mock.Mock()))
+        self.fetcher.assert_called_once_with()
+
+    def test_fetch_none_value(self):
+        self.cache.watch(_URI)
+        self.fetcher.return_value = None
+
+        self.assertIsNone(
+            self.cache.fetch(_URI, 'SpongeBob', 'boot', self.fetcher))
+        self.assertIsNone(
+            self.cache.fetch(_URI, 'SpongeBob', 'boot', self.fetcher))
+        self.fetcher.assert_called_once_with()
+
+    def test_lifecycle_event_undefined(self):
+        self.cache.watch(_URI)
+        self._event(libvirt.VIR_DOMAIN_EVENT_STARTED)
+        self._event(libvirt.VIR_DOMAIN_EVENT_UNDEFINED)
+
+        self.cache.fetch(_URI, 'SpongeBob', 'active', self.fetcher)
+        self.fetcher.assert_called_once_with()
+
+    def test_lifecycle_event_other_connection(self):
+        self.cache.watch(_URI)
+        self._event(libvirt.VIR_DOMAIN_EVENT_STARTED, conn=mock.Mock())
+
+        self.cache.fetch(_URI, 'SpongeBob', 'active', self.fetcher)
+        self.fetcher.assert_called_once_with()
+
+    def test_invalidate(self):
+        self.cache.watch(_URI)
+        self._event(libvirt.VIR_DOMAIN_EVENT_STARTED)
+        self.cache.invalidate(_URI, 'SpongeBob', 'active')
+
+        self.cache.fetch(_URI, 'SpongeBob', 'active', self.fetcher)
+        self.fetcher.assert_called_once_with()
+
+    def test_listen(self):
+        listener = mock.Mock()
+        self.cache.watch(_URI)
+        self.cache.listen(_URI, 'SpongeBob', listener)
+
+        self._event(libvirt.VIR_DOMAIN_EVENT_STOPPED)
+        self._event(libvirt.VIR_DOMAIN_EVENT_STARTED, domain_name='Patrick')
+        self._event(libvirt.VIR_DOMAIN_EVENT_UNDEFINED)
+
+        self.assertEqual(
+            [mock.call(libvirt.VIR_DOMAIN_EVENT_STOPPED, 0),
+             mock.call(libvirt.VIR_DOMAIN_EVENT_UNDEFINED, 0)],
+            listener.call_args_list)
+
+    def test_listen_error(self):
+        listener = mock.Mock(side_effect=ValueError('boom'))
+        self.cache.watch(_URI)
+        self.cache.listen(_URI, 'SpongeBob', listener)
+
+        self._event(libvirt.VIR_DOMAIN_EVENT_STOPPED)
+
+        # The event is still accounted for
+        self.assertFalse(self.cache.fetch(_URI, 'SpongeBob', 'active',
+                                          self.fetcher))
+
+    def test_unlisten(self):
+        listener = mock.Mock()
+        self.cache.watch(_URI)
+        self.cache.listen(_URI, 'SpongeBob', listener)
+
+        self.cache.unlisten(_URI, 'SpongeBob', listener)
+        self.cache.unlisten(_URI, 'SpongeBob', listener)
+        self._event(libvirt.VIR_DOMAIN_EVENT_STOPPED)
+
+        listener.assert_not_called()
+        self.assertEqual({}, self.cache._listeners)
+
+
+class GetDomainCacheTestCase(base.TestCase):
+
+    def setUp(self):
+        super(GetDomainCacheTestCase, self).setUp()
+        mock.patch.object(events, 'DOMAIN_CACHE', None).start()
+        self.mock_start = mock.patch.object(
+            events, 'start_event_loop', autospec=True).start()
+
+    def test_get_domain_cache(self):
+        conf = {'libvirt': {'domain_events': True, 'domain_cache_ttl': 7}}
+        with mock.patch('virtualbmc.events.CONF', conf):
+            cache = events.get_domain_cache()
+            self.assertIs(cache, events.get_domain_cache())
+
+        self.assertEqual(7, cache.ttl)
+        self.mock_start.assert_called_with()
+
+    def test_get_domain_cache_disabled(self):
+        conf = {'libvirt': {'domain_events': False, 'domain_cache_ttl': 7}}
+        with mock.patch('virtualbmc.events.CONF', conf):
+            self.assertIsNone(events.get_domain_cache())
+
+        self.mock_start.assert_not_called()
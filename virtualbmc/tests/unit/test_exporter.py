@@ -0,0 +1,182 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import http.client
+import os
+import threading
+import time
+from unittest import mock
+
+from virtualbmc import exporter
+from virtualbmc import metrics
+from virtualbmc.tests.unit import base
+
+
+def _histogram(buckets, errors=0, total=0.0):
+    return metrics.Histogram(
+        buckets + [0] * (len(metrics.BUCKETS) - len(buckets)), errors, 0,
+        total)
+
+
+class RenderTestCase(base.TestCase):
+
+    def setUp(self):
+        super(RenderTestCase, self).setUp()
+        mock.patch.object(metrics, 'resident_memory', autospec=True,
+                          return_value=2048).start()
+        self.manager = mock.Mock()
+        self.manager.census.return_value = {'running': 2, 'down': 1,
+                                            'error': 0}
+        self.manager.restarts = {'SpongeBob': 3}
+        self.manager.metrics.return_value = (
+            {'SpongeBob': {
+                ('ipmi', 'chassis_control'): _histogram([2], errors=1),
+                ('ipmi', 'get_device_id'): _histogram([3]),
+                ('libvirt', 'power_on'): _histogram([1, 1], total=0.003)},
+             'Patrick': {
+                 ('libvirt', 'power_on'): _histogram([0, 0, 1], errors=1,
+                                                     total=0.004)}},
+            {'SpongeBob': {'domain_cache_hits': 7, 'domain_cache_misses': 2},
+             'Patrick': {'domain_cache_hits': 0, 'domain_cache_misses': 1}},
+            {42: 1024})
+
+    def _lines(self):
+        return exporter.render(self.manager).splitlines()
+
+    def test_instances(self):
+        lines = self._lines()
+
+        self.assertIn('# TYPE vbmc_instances gauge', lines)
+        self.assertIn('vbmc_instances{status="running"} 2', lines)
+        self.assertIn('vbmc_instances{status="down"} 1', lines)
+        self.assertIn('vbmc_instances{status="error"} 0', lines)
+        self.assertIn('vbmc_instance_restarts_total{domain="SpongeBob"} 3',
+                      lines)
+
+    def test_ipmi_requests(self):
+        lines = self._lines()
+
+        self.assertIn('vbmc_ipmi_requests_total{domain="SpongeBob"} 5',
+                      lines)
+        self.assertIn('vbmc_ipmi_requests_total{domain="Patrick"} 0', lines)
+        self.assertIn(
+            'vbmc_ipmi_request_errors_total{domain="SpongeBob"} 1', lines)
+
+    def test_libvirt_calls(self):
+        lines = self._lines()
+
+        # Domains add up
+        self.assertIn('# TYPE vbmc_libvirt_call_duration_seconds histogram',
+                      lines)
+        self.assertIn('vbmc_libvirt_call_duration_seconds_bucket'
+                      '{call="power_on",le="0.001"} 1', lines)
+        self.assertIn('vbmc_libvirt_call_duration_seconds_bucket'
+                      '{call="power_on",le="0.0025"} 2', lines)
+        self.assertIn('vbmc_libvirt_call_duration_seconds_bucket'
+                      '{call="power_on",le="+Inf"} 3', lines)
+        self.assertIn('vbmc_libvirt_call_duration_seconds_count'
+                      '{call="power_on"} 3', lines)
+        self.assertIn('vbmc_libvirt_call_duration_seconds_sum'
+                      '{call="power_on"} 0.007', lines)
+        self.assertIn('vbmc_libvirt_call_errors_total{call="power_on"} 1',
+                      lines)
+
+    def test_domain_cache(self):
+        lines = self._lines()
+
+        self.assertIn('# TYPE vbmc_domain_cache_hits_total counter', lines)
+        self.assertIn('vbmc_domain_cache_hits_total{domain="SpongeBob"} 7',
+                      lines)
+        self.assertIn('vbmc_domain_cache_misses_total{domain="Patrick"} 1',
+                      lines)
+
+    def test_processes(self):
+        lines = self._lines()
+
+        self.assertIn('vbmc_process_resident_memory_bytes{pid="42"} 1024',
+                      lines)
+        self.assertIn('vbmc_process_resident_memory_bytes{pid="%d"} 2048'
+                      % os.getpid(), lines)
+
+    def test_label_escaping(self):
+        self.manager.restarts = {'Sponge"Bob\\': 1}
+
+        self.assertIn(
+            r'vbmc_instance_restarts_total{domain="Sponge\"Bob\\"} 1',
+            self._lines())
+
+
+class MetricsServerTestCase(base.TestCase):
+
+    def setUp(self):
+        super(MetricsServerTestCase, self).setUp()
+        mock.patch.object(exporter, 'render', autospec=True,
+                          return_value='vbmc_instances 1\n').start()
+        mock.patch.dict(exporter.CONF['metrics'],
+                        {'listen_port': 0,
+                         'listen_address': '127.0.0.1'}).start()
+        self.manager = mock.Mock()
+
+    def test_start_server_disabled(self):
+        self.assertIsNone(exporter.start_server(self.manager))
+
+    def _get(self, path):
+        server = exporter.MetricsServer(self.manager, '127.0.0.1', 0)
+        self.addCleanup(server.server_close)
+
+        handler = threading.Thread(target=server.handle_request)
+        conn = http.client.HTTPConnection(*server.server_address, timeout=5)
+        self.addCleanup(conn.close)
+        conn.connect()
+        handler.start()
+
+        conn.request('GET', path)
+        response = conn.getresponse()
+        body = response.read()
+        handler.join()
+        return response, body
+
+    def test_scrape(self):
+        response, body = self._get('/metrics')
+
+        self.assertEqual(200, response.status)
+        self.assertEqual(exporter.CONTENT_TYPE,
+                         response.getheader('Content-Type'))
+        self.assertEqual(b'vbmc_instances 1\n', body)
+        exporter.render.assert_called_once_with(self.manager)
+
+    def test_not_found(self):
+        response, _ = self._get('/')
+
+        self.assertEqual(404, response.status)
+        exporter.render.assert_not_called()
+
+    def test_render_error(self):
+        exporter.render.side_effect = ValueError('boom')
+
+        response, _ = self._get('/metrics')
+
+        self.assertEqual(500, response.status)
+
+    def test_slow_scraper(self):
+        server = exporter.MetricsServer(self.manager, '127.0.0.1', 0)
+        self.addCleanup(server.server_close)
+        conn = http.client.HTTPConnection(*server.server_address, timeout=5)
+        self.addCleanup(conn.close)
+        conn.connect()
+
+        # The request never comes, the control loop must not wait for it
+        started = time.monotonic()
+        server.handle_request()
+
+        self.assertLess(time.monotonic() - started, 1)
+        exporter.render.assert_not_called()
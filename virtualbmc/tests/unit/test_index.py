@@ -0,0 +1,166 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import errno
+import os
+import shutil
+from unittest import mock
+
+import fixtures
+
+from virtualbmc import exception
+from virtualbmc import index
+from virtualbmc.tests.unit import base
+
+
+class ConfigIndexTestCase(base.TestCase):
+
+    inotify = True
+
+    def setUp(self):
+        super(ConfigIndexTestCase, self).setUp()
+        self.config_dir = self.useFixture(fixtures.TempDir()).path
+        self.parse = mock.Mock(side_effect=self._parse)
+        if not self.inotify:
+            mock.patch.object(index, '_Inotify', autospec=True,
+                              side_effect=OSError(errno.ENOSYS,
+                                                  'unavailable')).start()
+        self.index = index.ConfigIndex(self.config_dir, self.parse)
+        self.addCleanup(self.index.close)
+
+    def _parse(self, domain_name):
+        try:
+            with open(os.path.join(self.config_dir, domain_name,
+                                   'config')) as f:
+                return {'domain_name': domain_name, 'port': f.read()}
+
+        except OSError:
+            raise exception.DomainNotFound(domain=domain_name)
+
+    def _write(self, domain_name, port):
+        path = os.path.join(self.config_dir, domain_name)
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, 'config'), 'w') as f:
+            f.write(port)
+
+    def _refresh(self):
+        self.parse.reset_mock()
+        self.index.refresh()
+        return self.index.configs()
+
+    def test_refresh(self):
+        self._write('SpongeBob', '623')
+        os.makedirs(os.path.join(self.config_dir, 'Patrick'))
+
+        self.assertEqual(
+            {'SpongeBob': {'domain_name': 'SpongeBob', 'port': '623'}},
+            self._refresh())
+
+    def test_refresh_unchanged(self):
+        self._write('SpongeBob', '623')
+        self._refresh()
+
+        self._refresh()
+
+        self.parse.assert_not_called()
+
+    def test_refresh_added(self):
+        self._write('SpongeBob', '623')
+        self._refresh()
+
+        self._write('Patrick', '624')
+
+        self.assertEqual({'SpongeBob', 'Patrick'}, set(self._refresh()))
+        self.parse.assert_called_once_with('Patrick')
+
+    def test_refresh_changed(self):
+        self._write('SpongeBob', '623')
+        self._write('Patrick', '624')
+        self._refresh()
+
+        self._write('SpongeBob', '1623')
+
+        self.assertEqual('1623', self._refresh()['SpongeBob']['port'])
+        self.parse.assert_called_once_with('SpongeBob')
+
+    def test_refresh_deleted(self):
+        self._write('SpongeBob', '623')
+        self._write('Patrick', '624')
+        self._refresh()
+
+        shutil.rmtree(os.path.join(self.config_dir, 'SpongeBob'))
+
+        self.assertEqual({'Patrick'}, set(self._refresh()))
+
+    def test_invalidate(self):
+        self._write('SpongeBob', '623')
+        self._refresh()
+
+        self.index.invalidate('SpongeBob')
+        self._refresh()
+
+        self.parse.assert_called_once_with('SpongeBob')
+
+    def test_refresh_parse_error(self):
+        self._write('SpongeBob', '623')
+        self._refresh()
+        self._write('SpongeBob', '1623')
+        self.parse.side_effect = ValueError('boom')
+
+        self.assertRaises(ValueError, self._refresh)
+
+        self.parse.side_effect = self._parse
+        self.assertEqual('1623', self._refresh()['SpongeBob']['port'])
+
+    def test_configs_copies(self):
+        self._write('SpongeBob', '623')
+
+        self._refresh()['SpongeBob']['port'] = '1623'
+
+        self.assertEqual('623', self.index.configs()['SpongeBob']['port'])
+
+
+class ScanningConfigIndexTestCase(ConfigIndexTestCase):
+
+    inotify = False
+
+
+class InotifyConfigIndexTestCase(base.TestCase):
+
+    def setUp(self):
+        super(InotifyConfigIndexTestCase, self).setUp()
+        self.config_dir = self.useFixture(fixtures.TempDir()).path
+        self.index = index.ConfigIndex(self.config_dir, mock.Mock())
+        self.addCleanup(self.index.close)
+        self.index.refresh()
+
+    def test_no_scan(self):
+        with mock.patch.object(os, 'scandir', autospec=True) as mock_scandir:
+            self.index.refresh()
+
+        mock_scandir.assert_not_called()
+
+    def test_overflow(self):
+        with mock.patch.object(self.index._inotify, 'changes',
+                               autospec=True, return_value=None):
+            with mock.patch.object(os, 'scandir',
+                                   wraps=os.scandir) as mock_scandir:
+                self.index.refresh()
+
+        mock_scandir.assert_called_once_with(self.config_dir)
+
+    def test_watches_exhausted(self):
+        with mock.patch.object(self.index._inotify, 'changes', autospec=True,
+                               side_effect=OSError(errno.ENOSPC, 'full')):
+            self.index.refresh()
+
+        self.assertIsNone(self.index._inotify)
@@ -20,11 +20,16 @@ import errno
 import multiprocessing
 import os
 import shutil
+import time
 from unittest import mock
 
+import fixtures
 
 from virtualbmc import exception
+from virtualbmc import index
 from virtualbmc import manager
+from virtualbmc import metrics
+from virtualbmc import pool
 from virtualbmc.tests.unit import base
 from virtualbmc.tests.unit import utils as test_utils
 from virtualbmc import utils
@@ -52,6 +57,15 @@ class VirtualBMCManagerTestCase(base.TestCase):
                            'libvirt_sasl_password': 'sasl_pass',
                            'active': 'False'}
 
+    def _assert_domain_checked(self, mock_pooled_conn, mock_get_domain):
+        mock_pooled_conn.assert_called_once_with(
+            self.add_params['libvirt_uri'], readonly=True,
+            sasl_username=self.add_params['libvirt_sasl_username'],
+            sasl_password=self.add_params['libvirt_sasl_password'])
+        mock_get_domain.assert_called_once_with(
+            mock_pooled_conn.return_value.__enter__.return_value,
+            self.add_params['domain_name'])
+
     def _get_config(self, section, item):
         return self.domain0.get(item)
 
@@ -115,9 +129,10 @@ class VirtualBMCManagerTestCase(base.TestCase):
     @mock.patch.object(builtins, 'open')
     @mock.patch.object(configparser, 'ConfigParser')
     @mock.patch.object(os, 'makedirs')
-    @mock.patch.object(utils, 'check_libvirt_connection_and_domain')
-    def test_add(self, mock_check_conn, mock_makedirs, mock_configparser,
-                 mock_open):
+    @mock.patch.object(utils, 'get_libvirt_domain')
+    @mock.patch.object(pool, 'pooled_connection')
+    def test_add(self, mock_pooled_conn, mock_get_domain, mock_makedirs,
+                 mock_configparser, mock_open):
         config = mock_configparser.return_value
         params = copy.copy(self.add_params)
         self.manager.add(**params)
@@ -128,10 +143,7 @@ class VirtualBMCManagerTestCase(base.TestCase):
                          sorted(config.set.call_args_list))
         config.add_section.assert_called_once_with('VirtualBMC')
         config.write.assert_called_once_with(mock.ANY)
-        mock_check_conn.assert_called_once_with(
-            self.add_params['libvirt_uri'], self.add_params['domain_name'],
-            sasl_username=self.add_params['libvirt_sasl_username'],
-            sasl_password=self.add_params['libvirt_sasl_password'])
+        self._assert_domain_checked(mock_pooled_conn, mock_get_domain)
         mock_makedirs.assert_called_once_with(
             os.path.join(_CONFIG_PATH, self.add_params['domain_name']))
         mock_configparser.assert_called_once_with()
@@ -139,8 +151,10 @@ class VirtualBMCManagerTestCase(base.TestCase):
     @mock.patch.object(builtins, 'open')
     @mock.patch.object(configparser, 'ConfigParser')
     @mock.patch.object(os, 'makedirs')
-    @mock.patch.object(utils, 'check_libvirt_connection_and_domain')
-    def test_add_with_port_as_int(self, mock_check_conn, mock_makedirs,
+    @mock.patch.object(utils, 'get_libvirt_domain')
+    @mock.patch.object(pool, 'pooled_connection')
+    def test_add_with_port_as_int(self, mock_pooled_conn,
+                                  mock_get_domain, mock_makedirs,
                                   mock_configparser, mock_open):
         config = mock_configparser.return_value
         params = copy.copy(self.add_params)
@@ -153,17 +167,62 @@ class VirtualBMCManagerTestCase(base.TestCase):
                          sorted(config.set.call_args_list))
         config.add_section.assert_called_once_with('VirtualBMC')
         config.write.assert_called_once_with(mock.ANY)
-        mock_check_conn.assert_called_once_with(
-            self.add_params['libvirt_uri'], self.add_params['domain_name'],
-            sasl_username=self.add_params['libvirt_sasl_username'],
-            sasl_password=self.add_params['libvirt_sasl_password'])
+        self._assert_domain_checked(mock_pooled_conn, mock_get_domain)
         mock_makedirs.assert_called_once_with(
             os.path.join(_CONFIG_PATH, self.add_params['domain_name']))
         mock_configparser.assert_called_once_with()
 
+    @mock.patch.object(manager.VirtualBMCManager, '_configs')
     @mock.patch.object(os, 'makedirs')
-    @mock.patch.object(utils, 'check_libvirt_connection_and_domain')
-    def test_add_domain_already_exist(self, mock_check_conn, mock_makedirs):
+    @mock.patch.object(utils, 'get_libvirt_domain')
+    @mock.patch.object(pool, 'pooled_connection')
+    def test_add_shared_port_username_taken(self, mock_pooled_conn,
+                                            mock_get_domain, mock_makedirs,
+                                            mock__configs):
+        mock__configs.return_value = {
+            self.domain_name0: test_utils.get_domain(port=623,
+                                                     username='squidward'),
+            self.domain_name1: test_utils.get_domain(
+                domain_name='Patrick', port=623, username='admin')}
+        params = copy.copy(self.add_params)
+        params['port'] = '623'
+
+        with mock.patch('virtualbmc.router.CONF',
+                        {'ipmi': {'shared_port': 623}}):
+            ret, msg = self.manager.add(**params)
+
+        self.assertEqual(1, ret)
+        self.assertIn('Patrick', msg)
+        mock_makedirs.assert_not_called()
+
+    @mock.patch.object(builtins, 'open')
+    @mock.patch.object(configparser, 'ConfigParser')
+    @mock.patch.object(manager.VirtualBMCManager, '_configs')
+    @mock.patch.object(os, 'makedirs')
+    @mock.patch.object(utils, 'get_libvirt_domain')
+    @mock.patch.object(pool, 'pooled_connection')
+    def test_add_shared_port(self, mock_pooled_conn, mock_get_domain,
+                             mock_makedirs, mock__configs,
+                             mock_configparser, mock_open):
+        mock__configs.return_value = {
+            self.domain_name0: test_utils.get_domain(port=623,
+                                                     username='squidward')}
+        params = copy.copy(self.add_params)
+        params['port'] = '623'
+
+        with mock.patch('virtualbmc.router.CONF',
+                        {'ipmi': {'shared_port': 623}}):
+            ret, msg = self.manager.add(**params)
+
+        self.assertEqual((0, ''), (ret, msg))
+        mock_makedirs.assert_called_once_with(
+            os.path.join(_CONFIG_PATH, self.add_params['domain_name']))
+
+    @mock.patch.object(os, 'makedirs')
+    @mock.patch.object(utils, 'get_libvirt_domain')
+    @mock.patch.object(pool, 'pooled_connection')
+    def test_add_domain_already_exist(self, mock_pooled_conn,
+                                      mock_get_domain, mock_makedirs):
         os_error = OSError()
         os_error.errno = errno.EEXIST
         mock_makedirs.side_effect = os_error
@@ -174,24 +233,20 @@ class VirtualBMCManagerTestCase(base.TestCase):
 
         self.assertEqual(ret, expected_ret)
 
-        mock_check_conn.assert_called_once_with(
-            self.add_params['libvirt_uri'], self.add_params['domain_name'],
-            sasl_username=self.add_params['libvirt_sasl_username'],
-            sasl_password=self.add_params['libvirt_sasl_password'])
+        self._assert_domain_checked(mock_pooled_conn, mock_get_domain)
 
     @mock.patch.object(os, 'makedirs')
-    @mock.patch.object(utils, 'check_libvirt_connection_and_domain')
-    def test_add_oserror(self, mock_check_conn, mock_makedirs):
+    @mock.patch.object(utils, 'get_libvirt_domain')
+    @mock.patch.object(pool, 'pooled_connection')
+    def test_add_oserror(self, mock_pooled_conn, mock_get_domain,
+                         mock_makedirs):
         mock_makedirs.side_effect = OSError
 
         ret, _ = self.manager.add(**self.add_params)
         expected_ret = 1
         self.assertEqual(ret, expected_ret)
 
-        mock_check_conn.assert_called_once_with(
-            self.add_params['libvirt_uri'], self.add_params['domain_name'],
-            sasl_username=self.add_params['libvirt_sasl_username'],
-            sasl_password=self.add_params['libvirt_sasl_password'])
+        self._assert_domain_checked(mock_pooled_conn, mock_get_domain)
 
     @mock.patch.object(shutil, 'rmtree')
     @mock.patch.object(os.path, 'exists')
@@ -214,20 +269,19 @@ class VirtualBMCManagerTestCase(base.TestCase):
     @mock.patch.object(builtins, 'open')
     @mock.patch.object(manager.VirtualBMCManager, '_parse_config')
     @mock.patch.object(os.path, 'exists')
-    @mock.patch.object(os.path, 'isdir')
-    @mock.patch.object(os, 'listdir')
+    @mock.patch.object(manager.VirtualBMCManager, '_configs')
     @mock.patch.object(multiprocessing, 'Process')
-    def test_start(self, mock_process, mock_listdir, mock_isdir, mock_exists,
+    def test_start(self, mock_process, mock__configs, mock_exists,
                    mock__parse, mock_open):
         conf = {'ipmi': {'session_timeout': 10},
-                'default': {'show_passwords': False}}
+                'default': {'show_passwords': False,
+                            'execution_mode': 'process'}}
         with mock.patch('virtualbmc.manager.CONF', conf):
-            mock_listdir.return_value = [self.domain_name0]
-            mock_isdir.return_value = True
             mock_exists.return_value = True
             domain0_conf = self.domain0.copy()
             domain0_conf.update(active='False')
             mock__parse.return_value = domain0_conf
+            mock__configs.return_value = {self.domain_name0: domain0_conf}
             file_handler = mock_open.return_value.__enter__.return_value
             self.manager.start(self.domain_name0)
             mock__parse.assert_called_with(self.domain_name0)
@@ -235,20 +289,19 @@ class VirtualBMCManagerTestCase(base.TestCase):
 
     @mock.patch.object(builtins, 'open')
     @mock.patch.object(manager.VirtualBMCManager, '_parse_config')
-    @mock.patch.object(os.path, 'isdir')
-    @mock.patch.object(os, 'listdir')
-    def test_stop(self, mock_listdir, mock_isdir, mock__parse, mock_open):
+    @mock.patch.object(manager.VirtualBMCManager, '_configs')
+    def test_stop(self, mock__configs, mock__parse, mock_open):
         conf = {'ipmi': {'session_timeout': 10},
-                'default': {'show_passwords': False}}
+                'default': {'show_passwords': False,
+                            'execution_mode': 'process'}}
         with mock.patch('virtualbmc.manager.CONF', conf):
-            mock_listdir.return_value = [self.domain_name0]
-            mock_isdir.return_value = True
             domain0_conf = self.domain0.copy()
             domain0_conf.update(active='True')
             mock__parse.return_value = domain0_conf
+            mock__configs.return_value = {self.domain_name0: domain0_conf}
             file_handler = mock_open.return_value.__enter__.return_value
             self.manager.stop(self.domain_name0)
-            mock_isdir.assert_called_once_with(self.domain_path0)
+            mock__configs.assert_called_once_with()
             mock__parse.assert_called_with(self.domain_name0)
             self.assertEqual(file_handler.write.call_count, 9)
 
@@ -262,31 +315,844 @@ class VirtualBMCManagerTestCase(base.TestCase):
             os.path.join(self.domain_path0, 'config')
         )
 
-    @mock.patch.object(os.path, 'isdir')
-    @mock.patch.object(os, 'listdir')
+    @mock.patch.object(manager.VirtualBMCManager, '_sync_vbmc_states')
+    @mock.patch.object(manager.VirtualBMCManager, '_vbmc_enabled')
+    @mock.patch.object(manager.VirtualBMCManager, '_parse_config')
+    def test_bulk_start(self, mock__parse, mock__vbmc_enabled, mock__sync):
+        configs = {self.domain_name0: self.domain0,
+                   self.domain_name1: self.domain1}
+
+        def parse(domain_name):
+            if domain_name not in configs:
+                raise exception.DomainNotFound(domain=domain_name)
+            return configs[domain_name]
+
+        mock__parse.side_effect = parse
+
+        rc, msgs = self.manager.bulk_start(
+            [self.domain_name0, 'Squidward', self.domain_name1])
+
+        self.assertEqual(1, rc)
+        self.assertEqual(['No domain with matching name Squidward was '
+                          'found'], msgs)
+        mock__vbmc_enabled.assert_has_calls(
+            [mock.call(self.domain_name0, config=self.domain0,
+                       lets_enable=True),
+             mock.call(self.domain_name1, config=self.domain1,
+                       lets_enable=True)])
+        mock__sync.assert_called_once_with()
+
+    @mock.patch.object(manager.VirtualBMCManager, '_sync_vbmc_states')
+    @mock.patch.object(manager.VirtualBMCManager, '_vbmc_enabled')
+    @mock.patch.object(manager.VirtualBMCManager, '_parse_config')
+    def test_bulk_start_already_running(self, mock__parse,
+                                        mock__vbmc_enabled, mock__sync):
+        mock__parse.side_effect = [self.domain0, self.domain1]
+        self.manager._running_domains = {self.domain_name0: mock.Mock()}
+
+        rc, msgs = self.manager.bulk_start([self.domain_name0,
+                                            self.domain_name1])
+
+        self.assertEqual((0, []), (rc, msgs))
+        mock__vbmc_enabled.assert_called_once_with(
+            self.domain_name1, config=self.domain1, lets_enable=True)
+        self.assertEqual(2, mock__sync.call_count)
+
+    @mock.patch.object(manager.VirtualBMCManager, '_sync_vbmc_states')
+    @mock.patch.object(manager.VirtualBMCManager, '_vbmc_enabled')
+    def test_bulk_stop(self, mock__vbmc_enabled, mock__sync):
+        mock__vbmc_enabled.side_effect = [
+            False, exception.DomainNotFound(domain='Squidward'), False]
+
+        rc, msgs = self.manager.bulk_stop(
+            [self.domain_name0, 'Squidward', self.domain_name1])
+
+        self.assertEqual(1, rc)
+        self.assertEqual(['No domain with matching name Squidward was '
+                          'found'], msgs)
+        mock__vbmc_enabled.assert_has_calls(
+            [mock.call(self.domain_name0, lets_enable=False),
+             mock.call('Squidward', lets_enable=False),
+             mock.call(self.domain_name1, lets_enable=False)])
+        mock__sync.assert_called_once_with()
+
+    @mock.patch.object(manager.VirtualBMCManager, '_sync_vbmc_states')
+    @mock.patch.object(manager.VirtualBMCManager, '_vbmc_enabled')
+    def test_bulk_stop_not_found(self, mock__vbmc_enabled, mock__sync):
+        mock__vbmc_enabled.side_effect = exception.DomainNotFound(
+            domain='Squidward')
+
+        self.assertEqual(1, self.manager.bulk_stop(['Squidward'])[0])
+        mock__sync.assert_not_called()
+
+    @mock.patch.object(manager.VirtualBMCManager, '_configs')
     @mock.patch.object(manager.VirtualBMCManager, '_show')
-    def test_list(self, mock__show, mock_listdir, mock_isdir):
-        mock_isdir.return_value = True
-        mock_listdir.return_value = (self.domain_name0, self.domain_name1)
+    def test_list(self, mock__show, mock__configs):
+        mock__configs.return_value = {self.domain_name0: self.domain0,
+                                      self.domain_name1: self.domain1}
 
         ret, _ = self.manager.list()
         expected_ret = 0
         self.assertEqual(ret, expected_ret)
-        mock_listdir.assert_called_once_with(_CONFIG_PATH)
-        expected_calls = [mock.call(self.domain_path0),
-                          mock.call(self.domain_path1)]
-        self.assertEqual(expected_calls, mock_isdir.call_args_list)
-        expected_calls = [mock.call(self.domain_name0),
-                          mock.call(self.domain_name1)]
+        mock__configs.assert_called_once_with()
+        expected_calls = [mock.call(self.domain_name0,
+                                    bmc_config=self.domain0),
+                          mock.call(self.domain_name1,
+                                    bmc_config=self.domain1)]
         self.assertEqual(expected_calls, mock__show.call_args_list)
 
     @mock.patch.object(manager.VirtualBMCManager, '_show')
     def test_show(self, mock__show):
-        self.manager.show(self.domain0)
-        mock__show.assert_called_once_with(self.domain0)
+        mock__show.return_value = {'libvirt_uri': 'foo://bar'}
+        self.manager._scheduler_table = mock.Mock()
+        self.manager._scheduler_table.queued.return_value = 3
+        self.manager._scheduler_table.soft_off.return_value = None
+        self.manager._slots = {self.domain_name0: (0, {}),
+                               self.domain_name1: (1, {})}
+
+        self.manager._metrics_table = mock.Mock()
+        self.manager._metrics_table.counters.return_value = {
+            'domain_cache_hits': 5, 'domain_cache_misses': 1}
+
+        ret = self.manager.show(self.domain_name0)
+
+        mock__show.assert_called_once_with(self.domain_name0)
+        self.manager._metrics_table.counters.assert_called_once_with(0)
+        self.manager._scheduler_table.queued.assert_called_once_with(
+            'foo://bar', [0, 1])
+        self.manager._scheduler_table.soft_off.assert_called_once_with(0)
+        self.assertEqual((0, [('libvirt_uri', 'foo://bar'),
+                              ('queued_operations', 3),
+                              ('soft_off', None),
+                              ('crashes', 0),
+                              ('last_exit_code', None),
+                              ('domain_cache_hits', 5),
+                              ('domain_cache_misses', 1)]), ret)
+
+    @mock.patch.object(manager.VirtualBMCManager, '_show')
+    def test_show_soft_off(self, mock__show):
+        mock__show.return_value = {'libvirt_uri': 'foo://bar'}
+        self.manager._scheduler_table = mock.Mock()
+        self.manager._scheduler_table.queued.return_value = 0
+        self.manager._scheduler_table.soft_off.return_value = 41.7
+        self.manager._slots = {self.domain_name0: (0, {})}
+
+        ret = self.manager.show(self.domain_name0)
+
+        self.assertIn(('soft_off', 'forced off in 41s'), ret[1])
+
+    @mock.patch.object(manager.worker, 'WorkerPool', autospec=True)
+    def test__spawn_single(self, mock_pool):
+        conf = {'default': {'execution_mode': 'single'}}
+        with mock.patch('virtualbmc.manager.CONF', conf):
+            instance0 = self.manager._spawn(self.domain_name0, self.domain0)
+            instance1 = self.manager._spawn(self.domain_name1, self.domain1)
+
+        mock_pool.assert_called_once_with(1)
+        worker_pool = mock_pool.return_value
+        self.assertEqual(worker_pool.start_bmc.return_value, instance0)
+        self.assertEqual(worker_pool.start_bmc.return_value, instance1)
+        worker_pool.start_bmc.assert_has_calls(
+            [mock.call(self.domain_name0, self.domain0),
+             mock.call(self.domain_name1, self.domain1)])
+
+    @mock.patch.object(os, 'cpu_count', lambda: 6)
+    @mock.patch.object(manager.worker, 'WorkerPool', autospec=True)
+    def test__spawn_sharded(self, mock_pool):
+        conf = {'default': {'execution_mode': 'sharded', 'worker_count': 0}}
+        with mock.patch('virtualbmc.manager.CONF', conf):
+            self.manager._spawn(self.domain_name0, self.domain0)
+
+        mock_pool.assert_called_once_with(6)
+
+    @mock.patch.object(manager.worker, 'WorkerPool', autospec=True)
+    def test__spawn_sharded_worker_count(self, mock_pool):
+        conf = {'default': {'execution_mode': 'sharded', 'worker_count': 3}}
+        with mock.patch('virtualbmc.manager.CONF', conf):
+            self.manager._spawn(self.domain_name0, self.domain0)
+
+        mock_pool.assert_called_once_with(3)
+
+    @mock.patch.object(multiprocessing, 'Process')
+    def test__spawn_process(self, mock_process):
+        conf = {'default': {'execution_mode': 'process'}}
+        with mock.patch('virtualbmc.manager.CONF', conf):
+            instance = self.manager._spawn(self.domain_name0, self.domain0)
+
+        self.assertEqual(mock_process.return_value, instance)
+        mock_process.assert_called_once_with(
+            name='vbmcd-managing-domain-%s' % self.domain_name0,
+            target=manager.vbmc_runner, args=(self.domain0,))
+        instance.start.assert_called_once_with()
+
+    @mock.patch.object(manager.spawner, 'Spawner', autospec=True)
+    def test__spawn_forkserver(self, mock_spawner):
+        conf = {'default': {'execution_mode': 'forkserver',
+                            'warm_processes': 2}}
+        with mock.patch('virtualbmc.manager.CONF', conf):
+            instance0 = self.manager._spawn(self.domain_name0, self.domain0)
+            instance1 = self.manager._spawn(self.domain_name1, self.domain1)
+
+        mock_spawner.assert_called_once_with(2)
+        spawner = mock_spawner.return_value
+        self.assertEqual(spawner.start.return_value, instance0)
+        self.assertEqual(spawner.start.return_value, instance1)
+        spawner.start.assert_has_calls(
+            [mock.call('vbmcd-managing-domain-%s' % self.domain_name0,
+                       manager.vbmc_runner, (self.domain0,)),
+             mock.call('vbmcd-managing-domain-%s' % self.domain_name1,
+                       manager.vbmc_runner, (self.domain1,))])
+
+    @mock.patch.object(manager.spawner, 'Spawner', autospec=True)
+    def test__spawn_forkserver_spawner_died(self, mock_spawner):
+        dead = mock.Mock()
+        dead.is_alive.return_value = False
+        self.manager._spawner = dead
+        conf = {'default': {'execution_mode': 'forkserver',
+                            'warm_processes': 0}}
+        with mock.patch('virtualbmc.manager.CONF', conf):
+            instance = self.manager._spawn(self.domain_name0, self.domain0)
+
+        dead.terminate.assert_called_once_with()
+        dead.start.assert_not_called()
+        self.assertIs(mock_spawner.return_value, self.manager._spawner)
+        self.assertEqual(mock_spawner.return_value.start.return_value,
+                         instance)
+
+    @mock.patch.object(manager.VirtualBMCManager, '_configs',
+                       return_value={})
+    def test_periodic_spawner(self, mock__configs):
+        mock.patch.dict(manager.CONF['default'],
+                        {'execution_mode': 'forkserver'}).start()
+        spawner = mock.Mock()
+        spawner.sentinels.return_value = (7, 8)
+        self.manager._spawner = spawner
+
+        self.manager.periodic()
+
+        spawner.poll.assert_called_once_with()
+        self.assertEqual({7, 8}, self.manager.sentinels())
+
+        self.manager.periodic(shutdown=True)
+
+        spawner.terminate.assert_called_once_with()
+        self.assertIsNone(self.manager._spawner)
+
+    @mock.patch.object(manager.spawner, 'Spawner', autospec=True)
+    @mock.patch.object(manager.VirtualBMCManager, '_configs',
+                       return_value={})
+    def test_periodic_spawner_died(self, mock__configs, mock_spawner):
+        mock.patch.dict(manager.CONF['default'],
+                        {'execution_mode': 'forkserver',
+                         'warm_processes': 2}).start()
+        dead = mock.Mock()
+        dead.is_alive.return_value = False
+        self.manager._spawner = dead
+
+        self.manager.periodic()
+
+        dead.terminate.assert_called_once_with()
+        dead.poll.assert_not_called()
+        mock_spawner.assert_called_once_with(2)
+        self.assertIs(mock_spawner.return_value, self.manager._spawner)
+        mock_spawner.return_value.poll.assert_called_once_with()
+
+    @mock.patch.object(manager.VirtualBMCManager, '_configs',
+                       return_value={})
+    def test_periodic_maintains_worker_pool(self, mock__configs):
+        worker_pool = mock.Mock()
+        self.manager._worker_pool = worker_pool
+
+        self.manager.periodic()
+
+        worker_pool.maintain.assert_called_once_with()
+        worker_pool.terminate.assert_not_called()
+
+    @mock.patch.object(manager.VirtualBMCManager, '_configs',
+                       return_value={})
+    def test_periodic_shutdown_terminates_worker_pool(self, mock__configs):
+        worker_pool = mock.Mock()
+        self.manager._worker_pool = worker_pool
+
+        self.manager.periodic(shutdown=True)
+
+        worker_pool.maintain.assert_not_called()
+        worker_pool.terminate.assert_called_once_with()
+        self.assertIsNone(self.manager._worker_pool)
+
+    def test__with_slot(self):
+        self.manager._stats_collector = mock.Mock()
+        self.manager._metrics_table = mock.Mock()
+        self.manager._scheduler_table = mock.Mock()
+        mock.patch.dict(manager.CONF['default'],
+                        {'shared_memory_slots': 2}).start()
+
+        config0 = self.manager._with_slot(self.domain_name0, self.domain0)
+        config1 = self.manager._with_slot(self.domain_name1, self.domain1)
+        # a restarted instance keeps its slot
+        config0 = self.manager._with_slot(self.domain_name0, self.domain0)
+
+        self.assertEqual(0, config0['slot'])
+        self.assertEqual(1, config1['slot'])
+        self.assertNotIn('slot', self.domain0)
+        self.assertEqual(
+            (0, {'uri': 'foo://bar', 'sasl_username': None,
+                 'sasl_password': None}),
+            self.manager._slots[self.domain_name0])
+        self.manager._stats_collector.table.clear.assert_has_calls(
+            [mock.call(0), mock.call(1)])
+        self.manager._metrics_table.clear.assert_has_calls(
+            [mock.call(0), mock.call(1)])
+        self.manager._scheduler_table.clear.assert_has_calls(
+            [mock.call(0), mock.call(1)])
+
+    def test__with_slot_metrics_only(self):
+        self.manager._stats_collector = None
+        self.manager._metrics_table = mock.Mock()
+        self.manager._scheduler_table = None
+
+        config0 = self.manager._with_slot(self.domain_name0, self.domain0)
+
+        self.assertEqual(0, config0['slot'])
+        self.manager._metrics_table.clear.assert_called_once_with(0)
+
+    def test__with_slot_table_full(self):
+        self.manager._stats_collector = mock.Mock()
+        mock.patch.dict(manager.CONF['default'],
+                        {'shared_memory_slots': 1}).start()
+        self.manager._with_slot(self.domain_name0, self.domain0)
+
+        config1 = self.manager._with_slot(self.domain_name1, self.domain1)
+
+        self.assertNotIn('slot', config1)
+        self.assertNotIn(self.domain_name1, self.manager._slots)
+
+    def test__with_slot_disabled(self):
+        self.manager._stats_collector = None
+        self.manager._metrics_table = None
+        self.manager._scheduler_table = None
+
+        self.assertIs(self.domain0, self.manager._with_slot(
+            self.domain_name0, self.domain0))
+
+    @mock.patch.object(manager.VirtualBMCManager, '_configs',
+                       return_value={})
+    def test_periodic_collects_sensors(self, mock__configs):
+        self.manager._stats_collector = mock.Mock()
+        self.manager._slots = {self.domain_name0: (0, {})}
+
+        self.manager.periodic()
+
+        self.manager._stats_collector.collect.assert_called_once_with(
+            {self.domain_name0: (0, {})})
+
+    def _histograms(self):
+        self.manager._metrics_table = mock.Mock()
+        self.manager._slots = {self.domain_name0: (0, {}),
+                               self.domain_name1: (1, {})}
+        histogram = metrics.Histogram([1] + [0] * (len(metrics.BUCKETS) - 1),
+                                      0, 0, 0.0005)
+        self.manager._metrics_table.read.side_effect = lambda slot: {
+            ('libvirt', 'power_on'): histogram,
+            ('ipmi', 'chassis_control'): histogram} if slot else {}
+        return histogram
+
+    def test_stats(self):
+        histogram = self._histograms()
+
+        rc, histograms = self.manager.stats()
+
+        self.assertEqual(0, rc)
+        self.assertEqual(
+            [(self.domain_name1, 'ipmi', 'chassis_control', histogram),
+             (self.domain_name1, 'libvirt', 'power_on', histogram)],
+            histograms)
+
+    @mock.patch.object(manager.VirtualBMCManager, '_parse_config')
+    def test_stats_domain(self, mock__parse_config):
+        self._histograms()
+
+        rc, histograms = self.manager.stats(self.domain_name0)
+
+        self.assertEqual((0, []), (rc, histograms))
+        mock__parse_config.assert_called_once_with(self.domain_name0)
+        self.manager._metrics_table.read.assert_called_once_with(0)
+
+    @mock.patch.object(manager.VirtualBMCManager, '_parse_config')
+    def test_stats_domain_not_found(self, mock__parse_config):
+        self._histograms()
+        mock__parse_config.side_effect = exception.DomainNotFound(
+            domain='Squidward')
+
+        self.assertRaises(exception.DomainNotFound, self.manager.stats,
+                          'Squidward')
+
+    def test_stats_disabled(self):
+        self.manager._metrics_table = None
+
+        self.assertEqual((1, []), self.manager.stats())
+
+    @mock.patch.object(time, 'monotonic', autospec=True)
+    @mock.patch.object(manager.VirtualBMCManager, '_spawn')
+    @mock.patch.object(manager.VirtualBMCManager, '_vbmc_enabled')
+    @mock.patch.object(manager.VirtualBMCManager, '_configs')
+    def test_periodic_counts_restarts(self, mock__configs, mock__vbmc_enabled,
+                                      mock__spawn, mock_monotonic):
+        mock_monotonic.return_value = 1000
+        mock__configs.return_value = {self.domain_name0: self.domain0}
+        mock__vbmc_enabled.return_value = True
+        mock__spawn.return_value.is_alive.return_value = False
+        mock__spawn.return_value.exitcode = 1
+        self.manager._stats_collector = self.manager._metrics_table = None
+
+        self.manager.periodic()
+        self.assertEqual({}, dict(self.manager.restarts))
+
+        self.manager.periodic()
+        self.manager.periodic()
+        self.assertEqual({self.domain_name0: 1}, self.manager.restarts)
+
+        mock_monotonic.return_value += manager.RESTART_BACKOFF
+        self.manager.periodic()
+        self.assertEqual({self.domain_name0: 2}, self.manager.restarts)
+        self.assertEqual({self.domain_name0: 2}, self.manager.crashes)
+        self.assertEqual({self.domain_name0: 1}, self.manager.exit_codes)
+
+        mock__vbmc_enabled.return_value = False
+        self.manager.periodic()
+        self.assertEqual({}, dict(self.manager.restarts))
+        self.assertEqual({}, dict(self.manager.crashes))
+
+    @mock.patch.object(time, 'monotonic', autospec=True)
+    @mock.patch.object(manager.VirtualBMCManager, '_spawn')
+    @mock.patch.object(manager.VirtualBMCManager, '_vbmc_enabled',
+                       return_value=True)
+    @mock.patch.object(manager.VirtualBMCManager, '_configs')
+    def test_periodic_restart_backoff(self, mock__configs, mock__vbmc_enabled,
+                                      mock__spawn, mock_monotonic):
+        mock_monotonic.return_value = 1000
+        mock__configs.return_value = {self.domain_name0: self.domain0}
+        mock__spawn.return_value.is_alive.return_value = False
+        self.manager._stats_collector = self.manager._metrics_table = None
+
+        # Started, then restarted right away
+        self.manager.periodic()
+        self.manager.periodic()
+        self.assertEqual(2, mock__spawn.call_count)
+        self.assertIsNone(self.manager.restart_delay())
+
+        # Held back for longer every time
+        for delay in (1, 2, 4):
+            self.manager.periodic()
+            mock_monotonic.return_value += delay - 0.5
+            self.manager.periodic()
+            mock_monotonic.return_value += 0.5
+            self.manager.periodic()
+
+        self.assertEqual(5, mock__spawn.call_count)
+        self.manager.periodic()
+        self.assertEqual(8, self.manager.restart_delay())
+
+    @mock.patch.object(time, 'monotonic', autospec=True)
+    @mock.patch.object(manager.VirtualBMCManager, '_spawn')
+    @mock.patch.object(manager.VirtualBMCManager, '_vbmc_enabled',
+                       return_value=True)
+    @mock.patch.object(manager.VirtualBMCManager, '_configs')
+    def test_periodic_restart_backoff_reset(self, mock__configs,
+                                            mock__vbmc_enabled, mock__spawn,
+                                            mock_monotonic):
+        mock_monotonic.return_value = 1000
+        mock__configs.return_value = {self.domain_name0: self.domain0}
+        instance = mock__spawn.return_value
+        self.manager._stats_collector = self.manager._metrics_table = None
+        self.manager.periodic()
+        instance.is_alive.return_value = False
+        self.manager.periodic()
+        self.manager._streaks[self.domain_name0] = 5
+
+        mock_monotonic.return_value += manager.STABLE_PERIOD
+        self.manager.periodic()
+
+        # Restarted right away after running for long enough
+        self.assertEqual(3, mock__spawn.call_count)
+
+    @mock.patch.object(manager.VirtualBMCManager, '_spawn')
+    @mock.patch.object(manager.VirtualBMCManager, '_vbmc_enabled')
+    @mock.patch.object(manager.VirtualBMCManager, '_configs')
+    def test_periodic_spawn_error_backoff(self, mock__configs,
+                                          mock__vbmc_enabled, mock__spawn):
+        mock__configs.return_value = {self.domain_name0: self.domain0}
+        mock__vbmc_enabled.return_value = True
+        mock__spawn.side_effect = exception.VirtualBMCError('boom')
+        self.manager._stats_collector = self.manager._metrics_table = None
+
+        self.manager.periodic()
+        self.manager.periodic()
+        self.manager.periodic()
+
+        self.assertEqual(2, mock__spawn.call_count)
+        self.assertGreater(self.manager.restart_delay(), 0)
+
+        mock__configs.return_value = {}
+        self.manager.periodic()
+        self.assertIsNone(self.manager.restart_delay())
+
+    @mock.patch.object(manager.VirtualBMCManager, '_spawn')
+    @mock.patch.object(manager.VirtualBMCManager, '_vbmc_enabled')
+    @mock.patch.object(manager.VirtualBMCManager, '_configs')
+    def test_sentinels(self, mock__configs, mock__vbmc_enabled, mock__spawn):
+        mock__configs.return_value = {self.domain_name0: self.domain0}
+        mock__vbmc_enabled.return_value = True
+        instance = mock__spawn.return_value
+        instance.sentinel = 42
+        self.manager._stats_collector = self.manager._metrics_table = None
+        self.manager._worker_pool = mock.Mock()
+        self.manager._worker_pool.sentinels.return_value = {7, 8}
+
+        self.manager.periodic()
+        self.assertEqual({7, 8, 42}, self.manager.sentinels())
+
+        instance.is_alive.return_value = False
+        mock__spawn.side_effect = exception.VirtualBMCError('boom')
+        self.manager.periodic()
+        self.assertEqual({7, 8}, self.manager.sentinels())
+
+    @mock.patch.object(index, 'ConfigIndex', autospec=True)
+    def test__configs(self, mock_index):
+        config_index = mock_index.return_value
+        config_index.configs.return_value = {self.domain_name0: self.domain0}
+
+        self.assertEqual({self.domain_name0: self.domain0},
+                         self.manager._configs())
+        self.manager._configs()
+
+        mock_index.assert_called_once_with(_CONFIG_PATH,
+                                           self.manager._parse_config)
+        self.assertEqual(2, config_index.refresh.call_count)
+
+    @mock.patch.object(builtins, 'open')
+    def test__store_config_invalidates(self, mock_open):
+        self.manager._index = mock.Mock(spec=index.ConfigIndex)
+
+        self.manager._store_config(**self.domain0)
+
+        self.manager._index.invalidate.assert_called_once_with(
+            self.domain_name0)
+
+    @mock.patch.object(manager.VirtualBMCManager, '_configs')
+    def test_census(self, mock__configs):
+        mock__configs.return_value = {self.domain_name0: self.domain0,
+                                      self.domain_name1: self.domain1,
+                                      'Squidward': {}}
+        self.manager._running_domains = {
+            self.domain_name0: mock.Mock(**{'is_alive.return_value': True}),
+            self.domain_name1: mock.Mock(**{'is_alive.return_value': False})}
+
+        self.assertEqual({'running': 1, 'error': 1, 'down': 1},
+                         self.manager.census())
+
+    def test_metrics(self):
+        histogram = self._histograms()
+        self.manager._metrics_table.processes.return_value = {42: 1024}
+
+        self.manager._metrics_table.counters.side_effect = lambda slot: {
+            'domain_cache_hits': slot}
+
+        histograms, counters, processes = self.manager.metrics()
+
+        self.assertEqual(
+            {self.domain_name0: {},
+             self.domain_name1: {('libvirt', 'power_on'): histogram,
+                                 ('ipmi', 'chassis_control'): histogram}},
+            histograms)
+        self.assertEqual({self.domain_name0: {'domain_cache_hits': 0},
+                          self.domain_name1: {'domain_cache_hits': 1}},
+                         counters)
+        self.assertEqual({42: 1024}, processes)
+        self.assertEqual(
+            [0, 1], sorted(
+                self.manager._metrics_table.processes.call_args[0][0]))
+
+    def test_metrics_disabled(self):
+        self.manager._metrics_table = None
+
+        self.assertEqual(({}, {}, {}), self.manager.metrics())
 
     def test_vbmc_runner_is_picklable(self):
         import pickle
         payload = pickle.dumps(manager.vbmc_runner)
         loaded = pickle.loads(payload)
         self.assertIs(manager.vbmc_runner, loaded)
+
+
+def _libvirt_domain(name):
+    domain = mock.Mock()
+    domain.name.return_value = name
+    return domain
+
+
+@mock.patch.object(pool, 'pooled_connection')
+class BulkAddTestCase(base.TestCase):
+
+    def setUp(self):
+        super(BulkAddTestCase, self).setUp()
+        self.config_dir = self.useFixture(fixtures.TempDir()).path
+        mock.patch.dict(manager.CONF['default'],
+                        {'config_dir': self.config_dir}).start()
+        self.manager = manager.VirtualBMCManager()
+        self.addCleanup(lambda: self.manager._index
+                        and self.manager._index.close())
+        self.bmcs = [{'domain_name': 'SpongeBob'},
+                     {'domain_name': 'Patrick', 'port': 6231,
+                      'username': 'patrick', 'libvirt_uri': 'foo://bar'},
+                     {'domain_name': 'Sandy', 'port': None}]
+
+    def _libvirt(self, mock_pooled_conn, *domain_names):
+        conn = mock_pooled_conn.return_value.__enter__.return_value
+        conn.listAllDomains.return_value = [
+            _libvirt_domain(domain_name) for domain_name in domain_names]
+        return conn
+
+    def test_bulk_add(self, mock_pooled_conn):
+        conn = self._libvirt(mock_pooled_conn, 'SpongeBob', 'Patrick',
+                             'Sandy', 'Gary')
+
+        self.assertEqual((0, []), self.manager.bulk_add(self.bmcs))
+
+        configs = self.manager._configs()
+        self.assertEqual({'SpongeBob': 6230, 'Patrick': 6231, 'Sandy': 6232},
+                         {domain_name: config['port']
+                          for domain_name, config in configs.items()})
+        self.assertEqual('patrick', configs['Patrick']['username'])
+        self.assertEqual('admin', configs['Sandy']['username'])
+        self.assertEqual('False', configs['Sandy']['active'])
+        # A single lookup per libvirt URI
+        mock_pooled_conn.assert_has_calls(
+            [mock.call('qemu:///system', readonly=True, sasl_username=None,
+                       sasl_password=None),
+             mock.call('foo://bar', readonly=True, sasl_username=None,
+                       sasl_password=None)], any_order=True)
+        self.assertEqual(2, conn.listAllDomains.call_count)
+
+    def test_bulk_add_first_port(self, mock_pooled_conn):
+        self._libvirt(mock_pooled_conn, 'SpongeBob', 'Patrick', 'Sandy')
+
+        self.assertEqual((0, []), self.manager.bulk_add(self.bmcs,
+                                                        first_port=6231))
+
+        self.assertEqual({'SpongeBob': 6232, 'Patrick': 6231, 'Sandy': 6233},
+                         {domain_name: config['port'] for domain_name, config
+                          in self.manager._configs().items()})
+
+    def test_bulk_add_domain_not_found(self, mock_pooled_conn):
+        self._libvirt(mock_pooled_conn, 'SpongeBob', 'Patrick')
+
+        rc, msgs = self.manager.bulk_add(self.bmcs)
+
+        self.assertEqual(1, rc)
+        self.assertEqual(['No domain with matching name Sandy was found'],
+                         msgs)
+        self.assertEqual({}, self.manager._configs())
+
+    def test_bulk_add_libvirt_error(self, mock_pooled_conn):
+        mock_pooled_conn.side_effect = exception.LibvirtConnectionOpenError(
+            uri='foo://bar', error='boom')
+
+        rc, msgs = self.manager.bulk_add(self.bmcs)
+
+        self.assertEqual(1, rc)
+        self.assertEqual(2, len(msgs))
+        self.assertEqual([], os.listdir(self.config_dir))
+
+    def test_bulk_add_invalid(self, mock_pooled_conn):
+        self._libvirt(mock_pooled_conn, 'SpongeBob')
+        self.assertEqual((0, []), self.manager.bulk_add(
+            [{'domain_name': 'SpongeBob', 'port': 6231}]))
+
+        rc, msgs = self.manager.bulk_add(
+            [{'domain_name': 'SpongeBob'},
+             {'domain_name': 'Patrick', 'port': 6231},
+             {'domain_name': 'Sandy', 'port': 'abc'},
+             {'domain_name': 'Sandy', 'libvirt_sasl_username': 'sandy'}])
+
+        self.assertEqual(1, rc)
+        self.assertEqual(
+            ['Domain SpongeBob already exists',
+             'Domain Sandy already exists',
+             "A password and username are required to use Libvirt's SASL "
+             "authentication for domain Sandy",
+             'Port 6231 of address :: is already used by domain SpongeBob',
+             'Invalid port abc for domain Sandy'], msgs)
+        self.assertEqual(['SpongeBob'], list(self.manager._configs()))
+        mock_pooled_conn.assert_called_once_with(
+            'qemu:///system', readonly=True, sasl_username=None,
+            sasl_password=None)
+
+    def test_bulk_add_shared_port(self, mock_pooled_conn):
+        self._libvirt(mock_pooled_conn, 'SpongeBob', 'Patrick', 'Sandy')
+        bmcs = [{'domain_name': 'SpongeBob', 'port': 623},
+                {'domain_name': 'Patrick', 'port': 623, 'username': 'patrick'},
+                {'domain_name': 'Sandy', 'port': 623}]
+
+        with mock.patch('virtualbmc.router.CONF',
+                        {'ipmi': {'shared_port': 623}}):
+            rc, msgs = self.manager.bulk_add(bmcs)
+            self.assertEqual(
+                (1, ['IPMI user name admin is already used by domain '
+                     'SpongeBob on the shared port 623']), (rc, msgs))
+
+            self.assertEqual((0, []), self.manager.bulk_add(bmcs[:2]))
+
+    @mock.patch.object(manager.VirtualBMCManager, 'bulk_start',
+                       autospec=True)
+    def test_bulk_add_start(self, mock_bulk_start, mock_pooled_conn):
+        self._libvirt(mock_pooled_conn, 'SpongeBob', 'Patrick', 'Sandy')
+        mock_bulk_start.return_value = 0, []
+
+        self.assertEqual((0, []), self.manager.bulk_add(self.bmcs,
+                                                        start=True))
+
+        mock_bulk_start.assert_called_once_with(
+            self.manager, ['SpongeBob', 'Patrick', 'Sandy'])
+
+    @mock.patch.object(manager.VirtualBMCManager, '_store_config',
+                       autospec=True)
+    def test_bulk_add_write_error(self, mock__store_config,
+                                  mock_pooled_conn):
+        self._libvirt(mock_pooled_conn, 'SpongeBob', 'Patrick', 'Sandy')
+        mock__store_config.side_effect = [None, OSError(errno.ENOSPC,
+                                                        'No space left')]
+
+        rc, msgs = self.manager.bulk_add(self.bmcs)
+
+        self.assertEqual(1, rc)
+        self.assertIn('Patrick', msgs[0])
+        self.assertEqual([], os.listdir(self.config_dir))
+
+
+@mock.patch.object(utils, 'get_libvirt_domain')
+@mock.patch.object(pool, 'pooled_connection')
+class SQLiteVirtualBMCManagerTestCase(base.TestCase):
+
+    def setUp(self):
+        super(SQLiteVirtualBMCManagerTestCase, self).setUp()
+        self.config_dir = self.useFixture(fixtures.TempDir()).path
+        mock.patch.dict(manager.CONF['default'],
+                        {'config_dir': self.config_dir,
+                         'config_store': 'sqlite'}).start()
+        self.mock_spawn = mock.patch.object(
+            manager.VirtualBMCManager, '_spawn', autospec=True).start()
+        self.domain0 = test_utils.get_domain()
+        self.add_params = dict(self.domain0)
+        del self.add_params['active']
+
+    def _manager(self):
+        vbmc_manager = manager.VirtualBMCManager()
+        self.addCleanup(vbmc_manager._store.close)
+        return vbmc_manager
+
+    def test_add_start_stop(self, mock_pooled_conn, mock_get_domain):
+        vbmc_manager = self._manager()
+
+        self.assertEqual((0, ''), vbmc_manager.add(**self.add_params))
+        self.assertEqual(1, vbmc_manager.add(**self.add_params)[0])
+        self.assertEqual((0, ''), vbmc_manager.start('SpongeBob'))
+
+        self.assertTrue(vbmc_manager._vbmc_enabled('SpongeBob'))
+        self.mock_spawn.assert_called_once_with(
+            vbmc_manager, 'SpongeBob', mock.ANY)
+        self.assertEqual(0, vbmc_manager.stop('SpongeBob')[0])
+        self.assertFalse(vbmc_manager._vbmc_enabled('SpongeBob'))
+        # No configuration file is written
+        self.assertEqual(['vbmc.sqlite'], [
+            name for name in os.listdir(self.config_dir)
+            if not name.startswith('vbmc.sqlite-')])
+
+    def test_bulk_start_stop(self, mock_pooled_conn, mock_get_domain):
+        vbmc_manager = self._manager()
+        domain_names = ['SpongeBob', 'Patrick', 'Sandy']
+        for port, domain_name in enumerate(domain_names, 623):
+            vbmc_manager.add(**dict(self.add_params, domain_name=domain_name,
+                                    port=port))
+
+        self.assertEqual((0, []), vbmc_manager.bulk_start(domain_names))
+
+        self.assertEqual(len(domain_names), self.mock_spawn.call_count)
+        self.assertEqual({'True'}, {config['active'] for config
+                                    in vbmc_manager._configs().values()})
+
+        self.assertEqual((0, []), vbmc_manager.bulk_stop(domain_names[:2]))
+        self.assertEqual(['Sandy'], [
+            domain_name for domain_name in domain_names
+            if vbmc_manager._vbmc_enabled(domain_name)])
+
+    def test_bulk_add(self, mock_pooled_conn, mock_get_domain):
+        vbmc_manager = self._manager()
+        vbmc_manager.add(**self.add_params)
+        conn = mock_pooled_conn.return_value.__enter__.return_value
+        conn.listAllDomains.return_value = [_libvirt_domain('Patrick'),
+                                            _libvirt_domain('Sandy')]
+        bmcs = [{'domain_name': 'Patrick', 'libvirt_uri': 'foo://bar'},
+                {'domain_name': 'Sandy', 'libvirt_uri': 'foo://bar'}]
+
+        self.assertEqual((0, []), vbmc_manager.bulk_add(bmcs, start=True))
+
+        self.assertEqual({'SpongeBob': 'False', 'Patrick': 'True',
+                          'Sandy': 'True'},
+                         {domain_name: config['active'] for domain_name, config
+                          in vbmc_manager._configs().items()})
+        self.assertEqual(2, self.mock_spawn.call_count)
+
+    def test_bulk_add_atomic(self, mock_pooled_conn, mock_get_domain):
+        vbmc_manager = self._manager()
+        conn = mock_pooled_conn.return_value.__enter__.return_value
+        conn.listAllDomains.return_value = [_libvirt_domain('Patrick'),
+                                            _libvirt_domain('SpongeBob')]
+
+        with mock.patch.object(vbmc_manager, '_configs', return_value={}):
+            vbmc_manager.add(**self.add_params)
+            rc, msgs = vbmc_manager.bulk_add([{'domain_name': 'Patrick'},
+                                              {'domain_name': 'SpongeBob'}])
+
+        self.assertEqual((1, ['Domain SpongeBob already exists']),
+                         (rc, msgs))
+        self.assertEqual(['SpongeBob'], list(vbmc_manager._configs()))
+
+    def test_list_delete(self, mock_pooled_conn, mock_get_domain):
+        vbmc_manager = self._manager()
+        vbmc_manager.add(**self.add_params)
+
+        rc, tables = vbmc_manager.list()
+
+        self.assertEqual(0, rc)
+        self.assertEqual(['SpongeBob'],
+                         [table['domain_name'] for table in tables])
+        self.assertEqual((0, ''), vbmc_manager.delete('SpongeBob'))
+        self.assertEqual((0, []), vbmc_manager.list())
+        self.assertRaises(exception.DomainNotFound, vbmc_manager.delete,
+                          'SpongeBob')
+
+    def test_migrate(self, mock_pooled_conn, mock_get_domain):
+        domain_path = os.path.join(self.config_dir, 'SpongeBob')
+        os.makedirs(domain_path)
+        config = configparser.ConfigParser()
+        config[manager.DEFAULT_SECTION] = {
+            'domain_name': 'SpongeBob', 'username': 'admin',
+            'password': 'pass', 'address': '::', 'port': '623',
+            'libvirt_uri': 'qemu:///system', 'active': 'True'}
+        with open(os.path.join(domain_path, 'config'), 'w') as f:
+            config.write(f)
+        os.makedirs(os.path.join(self.config_dir, 'Patrick'))
+
+        bmc_config = self._manager()._parse_config('SpongeBob')
+
+        self.assertEqual(623, bmc_config['port'])
+        self.assertEqual('True', bmc_config['active'])
+        # Not to be used again
+        self.assertEqual([manager.MIGRATED_CONFIG_FILE],
+                         os.listdir(domain_path))
+
+        # Only imported once
+        shutil.rmtree(domain_path)
+        os.makedirs(domain_path)
+        self.assertEqual(['SpongeBob'], list(self._manager()._configs()))
@@ -0,0 +1,122 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import os
+from unittest import mock
+
+import fixtures
+
+from virtualbmc import exception
+from virtualbmc import manifest
+from virtualbmc.tests.unit import base
+
+
+class LoadTestCase(base.TestCase):
+
+    def setUp(self):
+        super(LoadTestCase, self).setUp()
+        self.tmp_dir = self.useFixture(fixtures.TempDir()).path
+
+    def _write(self, name, text):
+        path = os.path.join(self.tmp_dir, name)
+        with open(path, 'w') as f:
+            f.write(text)
+        return path
+
+    def test_load_json(self):
+        path = self._write('bmcs.json', '[{"domain_name": "SpongeBob", '
+                                        '"port": 6230}, '
+                                        '{"domain_name": "Patrick"}]')
+
+        self.assertEqual([{'domain_name': 'SpongeBob', 'port': 6230},
+                          {'domain_name': 'Patrick'}], manifest.load(path))
+
+    def test_load_json_bmcs(self):
+        path = self._write('bmcs.json',
+                           '{"bmcs": [{"domain_name": "SpongeBob"}]}')
+
+        self.assertEqual([{'domain_name': 'SpongeBob'}], manifest.load(path))
+
+    def test_load_yaml(self):
+        path = self._write('bmcs.yml', 'bmcs:\n'
+                                       '- domain_name: SpongeBob\n'
+                                       '  port: 6230\n'
+                                       '  libvirt_uri: qemu:///session\n')
+
+        self.assertEqual([{'domain_name': 'SpongeBob', 'port': 6230,
+                           'libvirt_uri': 'qemu:///session'}],
+                         manifest.load(path))
+
+    def test_load_yaml_unavailable(self):
+        path = self._write('bmcs.yaml', '- domain_name: SpongeBob\n')
+
+        with mock.patch.object(manifest, 'yaml', None):
+            self.assertRaisesRegex(exception.ManifestError, 'PyYAML',
+                                   manifest.load, path)
+
+    def test_load_csv(self):
+        path = self._write('bmcs.csv', 'domain_name,port,username\n'
+                                       'SpongeBob,6230,\n'
+                                       'Patrick,,patrick\n')
+
+        self.assertEqual(
+            [{'domain_name': 'SpongeBob', 'port': '6230', 'username': None},
+             {'domain_name': 'Patrick', 'port': None, 'username': 'patrick'}],
+            manifest.load(path))
+
+    def test_load_format(self):
+        path = self._write('bmcs', 'domain_name\nSpongeBob\n')
+
+        self.assertEqual([{'domain_name': 'SpongeBob'}],
+                         manifest.load(path, 'csv'))
+
+    def test_load_unknown_format(self):
+        path = self._write('bmcs.txt', 'domain_name\nSpongeBob\n')
+
+        self.assertRaisesRegex(exception.ManifestError, 'unknown format',
+                               manifest.load, path)
+
+    def test_load_missing(self):
+        self.assertRaises(exception.ManifestError, manifest.load,
+                          os.path.join(self.tmp_dir, 'bmcs.json'))
+
+    def test_load_invalid_json(self):
+        path = self._write('bmcs.json', '[{"domain_name": ')
+
+        self.assertRaises(exception.ManifestError, manifest.load, path)
+
+    def test_load_not_a_list(self):
+        path = self._write('bmcs.json', '{"domain_name": "SpongeBob"}')
+
+        self.assertRaisesRegex(exception.ManifestError, 'expected a list',
+                               manifest.load, path)
+
+    def test_load_not_a_mapping(self):
+        path = self._write('bmcs.json', '[{"domain_name": "SpongeBob"}, 1]')
+
+        self.assertRaisesRegex(exception.ManifestError, 'entry 2',
+                               manifest.load, path)
+
+    def test_load_unknown_option(self):
+        path = self._write('bmcs.json', '[{"domain_name": "SpongeBob", '
+                                        '"active": true}]')
+
+        self.assertRaisesRegex(exception.ManifestError,
+                               'unknown options active in entry 1',
+                               manifest.load, path)
+
+    def test_load_no_domain_name(self):
+        path = self._write('bmcs.csv', 'domain_name,port\n,6230\n')
+
+        self.assertRaisesRegex(exception.ManifestError,
+                               'no domain_name in entry 1',
+                               manifest.load, path)
@@ -0,0 +1,205 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import os
+import time
+from unittest import mock
+
+from virtualbmc import metrics
+from virtualbmc.tests.unit import base
+
+
+class MetricsTableTestCase(base.TestCase):
+
+    def setUp(self):
+        super(MetricsTableTestCase, self).setUp()
+        self.table = metrics.MetricsTable(capacity=2)
+
+    def test_read_empty(self):
+        self.assertEqual({}, self.table.read(0))
+
+    def test_record_read(self):
+        self.table.record(1, ('ipmi', 'chassis_control'), 0.003)
+        self.table.record(1, ('ipmi', 'chassis_control'), 0.2, busy=True)
+        self.table.record(1, ('libvirt', 'power_on'), 42, error=True)
+
+        histograms = self.table.read(1)
+
+        self.assertEqual({}, self.table.read(0))
+        self.assertEqual(
+            {('ipmi', 'chassis_control'), ('libvirt', 'power_on')},
+            set(histograms))
+
+        histogram = histograms['ipmi', 'chassis_control']
+        self.assertEqual(2, histogram.count)
+        self.assertEqual((0, 1), (histogram.errors, histogram.busy))
+        self.assertAlmostEqual(0.203, histogram.total)
+        # 3ms falls in the (2.5ms, 5ms] bucket, 200ms in (100ms, 250ms]
+        self.assertEqual(1, histogram.buckets[2])
+        self.assertEqual(1, histogram.buckets[7])
+
+        histogram = histograms['libvirt', 'power_on']
+        self.assertEqual((1, 0), (histogram.errors, histogram.busy))
+        self.assertEqual(1, histogram.buckets[-1])
+
+    def test_clear(self):
+        self.table.record(0, ('ipmi', 'other'), 0.003)
+        self.table.record(1, ('ipmi', 'other'), 0.003)
+
+        self.table.clear(0)
+
+        self.assertEqual({}, self.table.read(0))
+        self.assertEqual(1, self.table.read(1)['ipmi', 'other'].count)
+
+    def test_count(self):
+        self.table.count(1, metrics.DOMAIN_CACHE_HITS)
+        self.table.count(1, metrics.DOMAIN_CACHE_HITS)
+        self.table.count(1, metrics.DOMAIN_CACHE_MISSES)
+
+        self.assertEqual({'domain_cache_hits': 0, 'domain_cache_misses': 0},
+                         self.table.counters(0))
+        self.assertEqual({'domain_cache_hits': 2, 'domain_cache_misses': 1},
+                         self.table.counters(1))
+
+        self.table.clear(1)
+        self.assertEqual({'domain_cache_hits': 0, 'domain_cache_misses': 0},
+                         self.table.counters(1))
+
+    @mock.patch.object(metrics, 'resident_memory', autospec=True)
+    def test_publish_process(self, mock_resident_memory):
+        mock_resident_memory.return_value = 4096
+
+        self.table.publish_process(1)
+
+        self.assertEqual({}, self.table.processes([0]))
+        self.assertEqual({os.getpid(): 4096}, self.table.processes([0, 1]))
+
+        self.table.clear(1)
+        self.assertEqual({}, self.table.processes([0, 1]))
+
+
+class HistogramTestCase(base.TestCase):
+
+    def _histogram(self, buckets):
+        return metrics.Histogram(
+            buckets + [0] * (len(metrics.BUCKETS) - len(buckets)), 0, 0, 0)
+
+    def test_percentile(self):
+        # 50 calls under 1ms, 50 calls between 1ms and 2.5ms
+        histogram = self._histogram([50, 50])
+
+        self.assertAlmostEqual(0.0005, histogram.percentile(25))
+        self.assertAlmostEqual(0.001, histogram.percentile(50))
+        self.assertAlmostEqual(0.0022, histogram.percentile(90))
+
+    def test_percentile_empty(self):
+        self.assertIsNone(self._histogram([]).percentile(50))
+
+    def test_percentile_overflow(self):
+        histogram = self._histogram([0] * (len(metrics.BUCKETS) - 1) + [1])
+
+        self.assertEqual(metrics.BUCKETS[-2], histogram.percentile(99))
+
+
+class BMCMetricsTestCase(base.TestCase):
+
+    def setUp(self):
+        super(BMCMetricsTestCase, self).setUp()
+        self.table = mock.Mock()
+        self.metrics = metrics.BMCMetrics(self.table, 5)
+
+    def test_disabled(self):
+        bmc_metrics = metrics.BMCMetrics()
+
+        self.assertFalse(bmc_metrics.enabled)
+        bmc_metrics.record('ipmi', 'other', 1)
+        bmc_metrics.count(metrics.DOMAIN_CACHE_HITS)
+
+    def test_count(self):
+        self.metrics.count(metrics.DOMAIN_CACHE_MISSES)
+
+        self.table.count.assert_called_once_with(5, 'domain_cache_misses')
+
+    def test_record_ipmi(self):
+        self.metrics.record_ipmi({'netfn': 0, 'command': 2}, 0.1, 0)
+        self.table.record.assert_called_with(
+            5, ('ipmi', 'chassis_control'), 0.1, error=False, busy=False)
+
+        self.metrics.record_ipmi({'netfn': 4, 'command': 0x2d}, 0.1, 0xC0)
+        self.table.record.assert_called_with(
+            5, ('ipmi', 'sensors'), 0.1, error=False, busy=True)
+
+        self.metrics.record_ipmi({'netfn': 0x2c, 'command': 0}, 0.1, 0xc1)
+        self.table.record.assert_called_with(
+            5, ('ipmi', 'other'), 0.1, error=True, busy=False)
+
+    def test_publish_process(self):
+        self.table.publish_process.assert_called_once_with(5)
+
+        self.metrics.record_ipmi({'netfn': 0, 'command': 1}, 0.1, 0)
+        self.table.publish_process.assert_called_once_with(5)
+
+        with mock.patch.object(time, 'monotonic',
+                               return_value=time.monotonic() + 60):
+            self.metrics.record_ipmi({'netfn': 0, 'command': 1}, 0.1, 0)
+
+        self.assertEqual(2, self.table.publish_process.call_count)
+
+    def test_resident_memory(self):
+        self.assertGreater(metrics.resident_memory(), 0)
+
+    def test_libvirt_call(self):
+        with self.metrics.libvirt_call('power_on'):
+            pass
+
+        self.table.record.assert_called_once_with(
+            5, ('libvirt', 'power_on'), mock.ANY, error=False, busy=False)
+
+    def test_libvirt_call_error(self):
+        def fail():
+            with self.metrics.libvirt_call('power_on'):
+                raise ValueError('boom')
+
+        self.assertRaises(ValueError, fail)
+        self.table.record.assert_called_once_with(
+            5, ('libvirt', 'power_on'), mock.ANY, error=True, busy=False)
+
+
+class ResponseRecorderTestCase(base.TestCase):
+
+    def setUp(self):
+        super(ResponseRecorderTestCase, self).setUp()
+        self.session = mock.Mock()
+        self.recorder = metrics.ResponseRecorder(self.session)
+
+    def test_send_ipmi_response(self):
+        self.recorder.send_ipmi_response(code=0xC0)
+
+        self.assertEqual(0xC0, self.recorder.code)
+        self.session.send_ipmi_response.assert_called_once_with(code=0xC0)
+
+    def test_send_ipmi_response_data(self):
+        self.recorder.send_ipmi_response(data=[1, 2])
+
+        self.assertEqual(0, self.recorder.code)
+        self.session.send_ipmi_response.assert_called_once_with(data=[1, 2])
+
+    def test_handler_failure(self):
+        self.recorder._send_ipmi_net_payload(code=0xff)
+
+        self.assertEqual(0xff, self.recorder.code)
+
+    def test_passthrough(self):
+        self.recorder.sol_handler = 'handler'
+
+        self.assertEqual('handler', self.session.sol_handler)
+        self.assertIs(self.session.bmc, self.recorder.bmc)
@@ -0,0 +1,211 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import os
+from unittest import mock
+
+import libvirt
+
+from virtualbmc import breaker
+from virtualbmc import exception
+from virtualbmc import pool
+from virtualbmc.tests.unit import base
+from virtualbmc import utils
+
+
+@mock.patch.object(utils, 'open_libvirt_connection')
+class LibvirtConnectionPoolTestCase(base.TestCase):
+
+    def setUp(self):
+        super(LibvirtConnectionPoolTestCase, self).setUp()
+        self.pool = pool.LibvirtConnectionPool(keepalive_interval=3,
+                                               keepalive_count=2)
+        self.uri = 'fake:///patrick'
+
+    def test_acquire(self, mock_open):
+        conn = self.pool.acquire(self.uri, readonly=True)
+
+        self.assertEqual(mock_open.return_value, conn)
+        mock_open.assert_called_once_with(
+            self.uri, sasl_username=None, sasl_password=None, readonly=True)
+        conn.setKeepAlive.assert_called_once_with(3, 2)
+
+    def test_acquire_reuses_connection(self, mock_open):
+        mock_open.return_value.isAlive.return_value = 1
+        conn0 = self.pool.acquire(self.uri, readonly=True)
+        conn1 = self.pool.acquire(self.uri, readonly=True)
+
+        self.assertIs(conn0, conn1)
+        mock_open.assert_called_once_with(
+            self.uri, sasl_username=None, sasl_password=None, readonly=True)
+
+    def test_acquire_keyed_by_readonly_and_username(self, mock_open):
+        mock_open.side_effect = lambda *args, **kwargs: mock.Mock()
+        conn0 = self.pool.acquire(self.uri, readonly=True)
+        conn1 = self.pool.acquire(self.uri)
+        conn2 = self.pool.acquire(self.uri, sasl_username='sandy',
+                                  sasl_password='squirrel')
+
+        self.assertEqual(3, mock_open.call_count)
+        self.assertEqual(3, len({id(c) for c in (conn0, conn1, conn2)}))
+
+    def test_acquire_reconnects_dead_connection(self, mock_open):
+        dead = mock.Mock()
+        dead.isAlive.return_value = 0
+        alive = mock.Mock()
+        mock_open.side_effect = (dead, alive)
+
+        self.assertIs(dead, self.pool.acquire(self.uri))
+        self.assertIs(alive, self.pool.acquire(self.uri))
+
+        dead.close.assert_called_once_with()
+        self.assertEqual(2, mock_open.call_count)
+
+    def test_acquire_keepalive_unsupported(self, mock_open):
+        conn = mock_open.return_value
+        conn.setKeepAlive.side_effect = libvirt.libvirtError('boom')
+
+        self.assertIs(conn, self.pool.acquire(self.uri))
+
+    def test_check_evicts_dead_connection(self, mock_open):
+        conn = self.pool.acquire(self.uri)
+        conn.isAlive.side_effect = libvirt.libvirtError('boom')
+
+        self.pool.check(self.uri)
+
+        conn.close.assert_called_once_with()
+        self.pool.acquire(self.uri)
+        self.assertEqual(2, mock_open.call_count)
+
+    def test_check_keeps_healthy_connection(self, mock_open):
+        conn = self.pool.acquire(self.uri)
+        conn.isAlive.return_value = 1
+
+        self.pool.check(self.uri)
+
+        conn.close.assert_not_called()
+
+    @mock.patch.object(os, 'getpid')
+    def test_acquire_after_fork(self, mock_getpid, mock_open):
+        mock_getpid.return_value = 1
+        self.pool = pool.LibvirtConnectionPool()
+        inherited = mock.Mock()
+        fresh = mock.Mock()
+        mock_open.side_effect = (inherited, fresh)
+        self.pool.acquire(self.uri)
+
+        mock_getpid.return_value = 2
+        self.assertIs(fresh, self.pool.acquire(self.uri))
+
+        # the parent's connection must not be closed by the child
+        inherited.close.assert_not_called()
+
+    def test_acquire_opens_outside_pool_lock(self, mock_open):
+        other = mock.Mock()
+        self.pool._connections[self.pool._key('fake:///sandy')] = other
+
+        def open_connection(*args, **kwargs):
+            # Other connections are still served while this one opens
+            self.assertIs(other, self.pool.connection('fake:///sandy'))
+            return mock.Mock()
+
+        mock_open.side_effect = open_connection
+
+        self.pool.acquire(self.uri)
+
+        mock_open.assert_called_once_with(
+            self.uri, sasl_username=None, sasl_password=None, readonly=False)
+
+    def test_connection(self, mock_open):
+        self.assertIsNone(self.pool.connection(self.uri, readonly=True))
+
+        conn = self.pool.acquire(self.uri, readonly=True)
+        self.assertIs(conn, self.pool.connection(self.uri, readonly=True))
+
+        conn.isAlive.return_value = 0
+        self.assertIsNone(self.pool.connection(self.uri, readonly=True))
+        conn.close.assert_called_once_with()
+        mock_open.assert_called_once()
+
+    def test_close(self, mock_open):
+        conn = self.pool.acquire(self.uri)
+        self.pool.close()
+
+        conn.close.assert_called_once_with()
+
+
+class PooledConnectionTestCase(base.TestCase):
+
+    def setUp(self):
+        super(PooledConnectionTestCase, self).setUp()
+        self.mock_pool = mock.Mock()
+        get_pool = mock.patch.object(pool, 'get_pool', autospec=True).start()
+        get_pool.return_value = self.mock_pool
+        self.breaker = mock.Mock()
+        self.breaker.admit.return_value = False
+        mock.patch.object(breaker, 'get_breaker', autospec=True,
+                          return_value=self.breaker).start()
+
+    def test_pooled_connection(self):
+        with pool.pooled_connection('fake:///sandy', readonly=True) as conn:
+            self.assertEqual(self.mock_pool.acquire.return_value, conn)
+
+        self.mock_pool.acquire.assert_called_once_with(
+            'fake:///sandy', sasl_username=None, sasl_password=None,
+            readonly=True)
+        self.mock_pool.check.assert_not_called()
+        conn.close.assert_not_called()
+        breaker.get_breaker.assert_called_once_with('fake:///sandy')
+        self.breaker.admit.assert_called_once_with()
+        self.breaker.record.assert_called_once_with(None, probe=False)
+
+    def test_pooled_connection_error(self):
+        def _fail():
+            with pool.pooled_connection('fake:///sandy'):
+                raise libvirt.libvirtError('boom')
+
+        self.assertRaises(libvirt.libvirtError, _fail)
+        self.mock_pool.check.assert_called_once_with(
+            'fake:///sandy', sasl_username=None, readonly=False)
+        self.breaker.record.assert_called_once_with(mock.ANY, probe=False)
+
+    def test_pooled_connection_open_error(self):
+        error = exception.LibvirtConnectionOpenError(uri='fake:///sandy',
+                                                     error='boom')
+        self.mock_pool.acquire.side_effect = error
+
+        def _fail():
+            with pool.pooled_connection('fake:///sandy'):
+                pass
+
+        self.assertRaises(exception.LibvirtConnectionOpenError, _fail)
+        self.breaker.record.assert_called_once_with(error, probe=False)
+
+    def test_pooled_connection_probe(self):
+        self.breaker.admit.return_value = True
+
+        with pool.pooled_connection('fake:///sandy'):
+            pass
+
+        self.breaker.record.assert_called_once_with(None, probe=True)
+
+    def test_pooled_connection_breaker_open(self):
+        self.breaker.admit.side_effect = exception.LibvirtUnavailable(
+            uri='fake:///sandy')
+
+        def _fail():
+            with pool.pooled_connection('fake:///sandy'):
+                pass
+
+        self.assertRaises(exception.LibvirtUnavailable, _fail)
+        self.mock_pool.acquire.assert_not_called()
+        self.breaker.record.assert_not_called()
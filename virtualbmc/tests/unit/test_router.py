@@ -0,0 +1,85 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from unittest import mock
+
+import pyghmi.ipmi.private.session as ipmisession
+
+from virtualbmc import exception
+from virtualbmc import router
+from virtualbmc.tests.unit import base
+
+
+class SharedEndpointTestCase(base.TestCase):
+
+    def setUp(self):
+        super(SharedEndpointTestCase, self).setUp()
+        mock.patch.object(ipmisession.Session, '_assignsocket').start()
+        mock.patch.object(ipmisession.Session, 'bmc_handlers', {}).start()
+        self.endpoint = router.SharedEndpoint(port=623)
+        self.vbmc = mock.Mock()
+
+    def test_adopt(self):
+        self.endpoint.adopt(self.vbmc, 'admin', 'pass')
+
+        self.assertEqual('pass', self.endpoint.authdata.get('admin'))
+        self.assertIsNone(self.endpoint.authdata.get('plankton'))
+        self.assertEqual({'admin': 'pass'}, self.vbmc.authdata)
+        self.assertEqual(623, self.vbmc.port)
+        self.assertIs(self.endpoint.serversocket, self.vbmc.serversocket)
+        self.assertIs(self.endpoint.uuid, self.vbmc.uuid)
+
+    def test_adopt_username_taken(self):
+        self.endpoint.adopt(self.vbmc, 'admin', 'pass')
+
+        self.assertRaises(exception.VirtualBMCError, self.endpoint.adopt,
+                          mock.Mock(), 'admin', 'secret')
+
+    def test_release(self):
+        self.endpoint.adopt(self.vbmc, 'admin', 'pass')
+        self.endpoint.release(self.vbmc)
+
+        self.assertEqual({}, self.endpoint.bmcs)
+        self.assertIsNone(self.endpoint.authdata.get('admin'))
+
+    def test_handle_raw_request(self):
+        self.endpoint.adopt(self.vbmc, 'admin', 'pass')
+        session = mock.Mock(username=b'admin', bmc=self.endpoint)
+        request = {'netfn': 0, 'command': 1, 'data': []}
+
+        self.endpoint.handle_raw_request(request, session)
+
+        self.assertIs(self.vbmc, session.bmc)
+        self.vbmc.handle_raw_request.assert_called_once_with(request,
+                                                             session)
+
+    def test_handle_raw_request_released(self):
+        session = mock.Mock(username=b'admin', bmc=self.endpoint)
+
+        self.endpoint.handle_raw_request({}, session)
+
+        session.send_ipmi_response.assert_called_once_with(
+            code=router.IPMI_INSUFFICIENT_PRIVILEGE)
+
+
+class IsSharedTestCase(base.TestCase):
+
+    def test_is_shared(self):
+        with mock.patch('virtualbmc.router.CONF',
+                        {'ipmi': {'shared_port': 623}}):
+            self.assertTrue(router.is_shared({'port': '623'}))
+            self.assertFalse(router.is_shared({'port': 624}))
+
+    def test_is_shared_disabled(self):
+        with mock.patch('virtualbmc.router.CONF',
+                        {'ipmi': {'shared_port': 0}}):
+            self.assertFalse(router.is_shared({'port': 0}))
@@ -0,0 +1,216 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import os
+import threading
+import time
+from unittest import mock
+
+from virtualbmc import exception
+from virtualbmc import scheduler
+from virtualbmc.tests.unit import base
+
+_URI = 'fake:///bikini-bottom'
+
+
+class SchedulerTableTestCase(base.TestCase):
+
+    def setUp(self):
+        super(SchedulerTableTestCase, self).setUp()
+        self.table = scheduler.SchedulerTable(capacity=4)
+
+    def _later(self, seconds):
+        return mock.patch.object(time, 'monotonic',
+                                 return_value=time.monotonic() + seconds)
+
+    def test_admit(self):
+        lease0 = self.table.admit(_URI, max_concurrent=2, stagger=0)
+        lease1 = self.table.admit(_URI, max_concurrent=2, stagger=0)
+
+        self.assertIsNotNone(lease0)
+        self.assertNotEqual(lease0, lease1)
+        self.assertIsNone(self.table.admit(_URI, max_concurrent=2, stagger=0))
+
+    def test_admit_other_uri(self):
+        self.table.admit(_URI, max_concurrent=1, stagger=0)
+
+        self.assertIsNotNone(self.table.admit('test:///', max_concurrent=1,
+                                              stagger=0))
+
+    def test_admit_stagger(self):
+        self.table.admit(_URI, max_concurrent=2, stagger=1)
+
+        self.assertIsNone(self.table.admit(_URI, max_concurrent=2, stagger=1))
+        with self._later(1.5):
+            self.assertIsNotNone(self.table.admit(_URI, max_concurrent=2,
+                                                  stagger=1))
+
+    def test_release(self):
+        lease = self.table.admit(_URI, max_concurrent=1, stagger=0)
+
+        self.table.release(lease)
+
+        self.assertEqual(lease, self.table.admit(_URI, max_concurrent=1,
+                                                 stagger=0))
+
+    def test_lease_expired(self):
+        self.table.admit(_URI, max_concurrent=1, stagger=0)
+
+        with self._later(scheduler.LEASE + 1):
+            self.assertIsNotNone(self.table.admit(_URI, max_concurrent=1,
+                                                  stagger=0))
+
+    def test_too_many_uris(self):
+        with mock.patch.object(scheduler, 'MAX_URIS', 1):
+            table = scheduler.SchedulerTable(capacity=4)
+            table.admit(_URI, max_concurrent=1, stagger=0)
+
+            self.assertEqual(-1, table.admit('test:///', max_concurrent=1,
+                                             stagger=0))
+            table.release(-1)
+
+    def test_queued(self):
+        self.table.track(0, _URI, scheduler.QUEUED)
+        self.table.track(1, _URI, scheduler.RUNNING)
+        self.table.track(2, 'test:///', scheduler.QUEUED)
+        self.table.track(3, _URI, scheduler.QUEUED)
+        self.table.clear(3)
+
+        self.assertEqual(1, self.table.queued(_URI, [0, 1, 2, 3]))
+        self.assertEqual(0, self.table.queued(_URI, [1, 2]))
+
+    def test_soft_off(self):
+        self.assertIsNone(self.table.soft_off(0))
+
+        self.table.track_soft_off(0, time.monotonic() + 30)
+        self.table.track(0, _URI, scheduler.RUNNING)
+
+        self.assertGreater(self.table.soft_off(0), 29)
+        self.assertEqual(0, self.table.queued(_URI, [0]))
+
+        self.table.track_soft_off(0)
+        self.assertIsNone(self.table.soft_off(0))
+
+    def test_soft_off_past(self):
+        self.table.track_soft_off(1, time.monotonic() - 1)
+
+        self.assertEqual(0, self.table.soft_off(1))
+        self.table.clear(1)
+        self.assertIsNone(self.table.soft_off(1))
+
+
+class SchedulerTestCase(base.TestCase):
+
+    def setUp(self):
+        super(SchedulerTestCase, self).setUp()
+        mock.patch.dict(scheduler.CONF['scheduler'],
+                        {'max_concurrent': 1, 'stagger': 0}).start()
+        self.table = scheduler.SchedulerTable(capacity=4)
+        self.scheduler = scheduler.Scheduler(self.table)
+        self.release = threading.Event()
+        self.addCleanup(self.release.set)
+
+    def _hang(self):
+        self.release.wait(5)
+
+    def test_run(self):
+        self.assertEqual('on', self.scheduler.run(
+            'power_on', lambda: 'on', _URI, slot=0, timeout=5))
+        self.assertEqual(0, self.table.queued(_URI, [0]))
+
+    def test_run_error(self):
+        func = mock.Mock(side_effect=ValueError('boom'))
+
+        self.assertRaises(ValueError, self.scheduler.run, 'power_on', func,
+                          _URI, timeout=5)
+
+    def test_run_admitted(self):
+        self.assertTrue(self.scheduler.run('power_on', scheduler.admitted,
+                                           _URI, timeout=5))
+        self.assertFalse(scheduler.admitted())
+
+    def test_queued(self):
+        self.scheduler.submit('power_on', self._hang, _URI, slot=0)
+        future = self.scheduler.submit('power_on', mock.Mock(), _URI,
+                                       slot=1)
+
+        self.assertRaises(exception.LibvirtCallQueued, self.scheduler.run,
+                          'power_reset', mock.Mock(), _URI, slot=2,
+                          timeout=0.1)
+        self.assertFalse(future.done())
+        self.assertEqual(1, self.table.queued(_URI, [0, 1, 2]))
+
+        self.release.set()
+        future.result(5)
+
+    def test_run_timeout_cancelled(self):
+        self.scheduler.submit('power_on', self._hang, _URI)
+        func = mock.Mock()
+
+        self.assertRaises(exception.LibvirtCallQueued, self.scheduler.run,
+                          'power_on', func, _URI, timeout=0.1)
+
+        self.release.set()
+        # Runs after the cancelled operation would have
+        self.scheduler.run('power_on', mock.Mock(), _URI, timeout=5)
+        func.assert_not_called()
+
+    def test_run_timeout_started(self):
+        self.assertRaises(exception.LibvirtCallTimeout, self.scheduler.run,
+                          'power_on', self._hang, _URI, timeout=0.1)
+
+    def test_unlimited(self):
+        self.scheduler.submit('power_on', self._hang, _URI)
+
+        with mock.patch.dict(scheduler.CONF['scheduler'],
+                             {'max_concurrent': 0}):
+            self.assertEqual('on', self.scheduler.run(
+                'power_on', lambda: 'on', _URI, timeout=5))
+
+
+class LimitsTestCase(base.TestCase):
+
+    def test_limits(self):
+        with mock.patch.dict(scheduler.CONF['scheduler'],
+                             {'max_concurrent': 4, 'stagger': 0.2}):
+            self.assertEqual((4, 0.2), scheduler.limits(_URI))
+
+    def test_limits_uri(self):
+        section = 'scheduler:%s' % _URI
+        with mock.patch.dict(scheduler.CONF._conf_dict,
+                             {section: {'max_concurrent': 8,
+                                        'stagger': 0}}):
+            self.assertEqual((8, 0), scheduler.limits(_URI))
+
+
+class GetSchedulerTestCase(base.TestCase):
+
+    def setUp(self):
+        super(GetSchedulerTestCase, self).setUp()
+        mock.patch.object(scheduler, 'SCHEDULER', None).start()
+        mock.patch.object(scheduler, 'SCHEDULER_TABLE', None).start()
+
+    def test_get_scheduler(self):
+        instance = scheduler.get_scheduler()
+
+        self.assertIs(instance, scheduler.get_scheduler())
+        self.assertIs(scheduler.get_scheduler_table(), instance.table)
+
+    def test_get_scheduler_forked(self):
+        instance = scheduler.get_scheduler()
+
+        with mock.patch.object(os, 'getpid', autospec=True,
+                               return_value=os.getpid() + 1):
+            forked = scheduler.get_scheduler()
+
+        self.assertIsNot(instance, forked)
+        self.assertIs(instance.table, forked.table)
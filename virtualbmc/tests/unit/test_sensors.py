@@ -0,0 +1,290 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import struct
+import time
+from unittest import mock
+
+import libvirt
+
+from virtualbmc import breaker
+from virtualbmc import deadline
+from virtualbmc import exception
+from virtualbmc import pool
+from virtualbmc import sensors
+from virtualbmc.tests.unit import base
+
+_CONN_ARGS = {'uri': 'fake:///krusty-krab', 'sasl_username': None,
+              'sasl_password': None}
+
+
+class SensorTableTestCase(base.TestCase):
+
+    def setUp(self):
+        super(SensorTableTestCase, self).setUp()
+        self.table = sensors.SensorTable(capacity=2)
+
+    def test_read_unset(self):
+        self.assertEqual([None] * 4, self.table.read(0, max_age=60))
+
+    def test_write_read(self):
+        self.table.write(1, [12.5, None, 3.0, 0.0])
+
+        self.assertEqual([12.5, None, 3.0, 0.0],
+                         self.table.read(1, max_age=60))
+        self.assertEqual([None] * 4, self.table.read(0, max_age=60))
+
+    def test_read_stale(self):
+        self.table.write(0, [12.5, 50.0, 3.0, 0.0])
+
+        with mock.patch.object(time, 'time', return_value=time.time() + 61):
+            self.assertEqual([None] * 4, self.table.read(0, max_age=60))
+
+    def test_read_while_writing(self):
+        self.table.write(0, [12.5, 50.0, 3.0, 0.0])
+        # a writer is in the middle of an update
+        self.table._sequence[0] += 1
+
+        self.assertEqual([None] * 4, self.table.read(0, max_age=60))
+
+    def test_clear(self):
+        self.table.write(0, [12.5, 50.0, 3.0, 0.0])
+        self.table.clear(0)
+
+        self.assertEqual([None] * 4, self.table.read(0, max_age=60))
+
+
+class SDRRecordsTestCase(base.TestCase):
+
+    def test_records(self):
+        for record_id, (record, sensor) in enumerate(
+                zip(sensors.SDR_RECORDS, sensors.SENSORS), 1):
+            header = struct.unpack('<HBBB', record[:5])
+            self.assertEqual((record_id, 0x51, 0x01, len(record) - 5),
+                             header)
+            # sensor number, then the ID string
+            self.assertEqual(sensor.number, record[7])
+            self.assertEqual(sensor.name.encode(), record[48:])
+            self.assertEqual(0xc0 | len(sensor.name), record[47])
+
+
+class SensorDeviceTestCase(base.TestCase):
+
+    def setUp(self):
+        super(SensorDeviceTestCase, self).setUp()
+        self.table = sensors.SensorTable(capacity=1)
+        self.device = sensors.SensorDevice(self.table, 0, max_age=30)
+        self.session = mock.Mock()
+
+    def _request(self, netfn, command, data=()):
+        return self.device.handle(
+            {'netfn': netfn, 'command': command, 'data': list(data)},
+            self.session)
+
+    def test_not_handled(self):
+        self.assertFalse(self._request(0, 1))
+        self.session.send_ipmi_response.assert_not_called()
+
+    def test_get_sensor_reading(self):
+        self.table.write(0, [42.4, 300.0, None, 0.0])
+
+        self.assertTrue(self._request(0x04, 0x2d, [1]))
+        self.session.send_ipmi_response.assert_called_with(
+            data=[42, 0x40, 0])
+
+        # readings are clamped to the 8-bit range
+        self._request(0x04, 0x2d, [2])
+        self.session.send_ipmi_response.assert_called_with(
+            data=[255, 0x40, 0])
+
+    def test_get_sensor_reading_unavailable(self):
+        self._request(0x04, 0x2d, [3])
+
+        self.session.send_ipmi_response.assert_called_once_with(
+            data=[0, 0x60, 0])
+
+    def test_get_sensor_reading_unknown_sensor(self):
+        self._request(0x04, 0x2d, [42])
+
+        self.session.send_ipmi_response.assert_called_once_with(code=0xcb)
+
+    def test_get_sensor_thresholds(self):
+        self._request(0x04, 0x27, [1])
+
+        self.session.send_ipmi_response.assert_called_once_with(
+            data=[0] * 7)
+
+    def test_get_sdr_repository_info(self):
+        self._request(0x0a, 0x20)
+
+        data = self.session.send_ipmi_response.call_args[1]['data']
+        self.assertEqual(0x51, data[0])
+        self.assertEqual(len(sensors.SENSORS),
+                         struct.unpack('<H', data[1:3])[0])
+
+    def test_reserve_sdr_repository(self):
+        self._request(0x0a, 0x22)
+        self._request(0x0a, 0x22)
+
+        self.session.send_ipmi_response.assert_called_with(
+            data=struct.pack('<H', 2))
+
+    def test_get_sdr(self):
+        # first record, header only
+        self._request(0x0a, 0x23, [1, 0, 0, 0, 0, 5])
+        self.session.send_ipmi_response.assert_called_with(
+            data=struct.pack('<H', 2) + sensors.SDR_RECORDS[0][:5])
+
+        # last record, rest of the record
+        last = len(sensors.SDR_RECORDS)
+        self._request(0x0a, 0x23, [1, 0, last, 0, 5, 0xff])
+        self.session.send_ipmi_response.assert_called_with(
+            data=struct.pack('<H', 0xffff) + sensors.SDR_RECORDS[-1][5:])
+
+    def test_get_sdr_not_present(self):
+        self._request(0x0a, 0x23, [1, 0, 42, 0, 0, 0xff])
+
+        self.session.send_ipmi_response.assert_called_once_with(code=0xcb)
+
+    def test_get_sdr_invalid_length(self):
+        self._request(0x0a, 0x23, [1, 0])
+
+        self.session.send_ipmi_response.assert_called_once_with(code=0xc7)
+
+
+class StatsCollectorTestCase(base.TestCase):
+
+    def setUp(self):
+        super(StatsCollectorTestCase, self).setUp()
+        self.conn = mock.Mock()
+        mock_pooled_conn = mock.patch.object(pool, 'pooled_connection',
+                                             autospec=True).start()
+        mock_pooled_conn.return_value.__enter__.return_value = self.conn
+        self.mock_pooled_conn = mock_pooled_conn
+        self.table = mock.Mock()
+        self.collector = sensors.StatsCollector(self.table, interval=10)
+        self.domain = mock.Mock()
+        self.domain.name.return_value = 'SpongeBob'
+
+    def _stats(self, cpu_time, disk_bytes, net_bytes, **kwargs):
+        stats = {'state.state': libvirt.VIR_DOMAIN_RUNNING,
+                 'cpu.time': cpu_time, 'vcpu.current': 2,
+                 'balloon.available': 1000, 'balloon.unused': 250,
+                 'block.count': 1, 'block.0.rd.bytes': disk_bytes,
+                 'block.0.wr.bytes': 0,
+                 'net.count': 2, 'net.0.rx.bytes': net_bytes,
+                 'net.0.tx.bytes': 0, 'net.1.rx.bytes': 0,
+                 'net.1.tx.bytes': 0}
+        stats.update(kwargs)
+        return stats
+
+    @mock.patch.object(time, 'monotonic', autospec=True)
+    def test_collect(self, mock_monotonic):
+        domains = {'SpongeBob': (3, _CONN_ARGS)}
+
+        mock_monotonic.return_value = 100
+        self.conn.getAllDomainStats.return_value = [
+            (self.domain, self._stats(0, 0, 0))]
+        self.collector.collect(domains)
+        self.table.write.assert_called_once_with(3, [None, 75.0, None, None])
+
+        # not due yet
+        mock_monotonic.return_value = 105
+        self.collector.collect(domains)
+        self.conn.getAllDomainStats.assert_called_once_with(
+            sensors._STATS_FLAGS)
+
+        mock_monotonic.return_value = 110
+        self.conn.getAllDomainStats.return_value = [
+            (self.domain, self._stats(5 * 10 ** 9, 20 * 2 ** 20,
+                                      10 * 2 ** 20))]
+        self.collector.collect(domains)
+        self.table.write.assert_called_with(3, [25.0, 75.0, 2.0, 1.0])
+        self.mock_pooled_conn.assert_called_with(readonly=True, **_CONN_ARGS)
+
+    @mock.patch.object(time, 'monotonic', autospec=True)
+    def test_collect_single_call_per_uri(self, mock_monotonic):
+        mock_monotonic.return_value = 100
+        patrick = mock.Mock()
+        patrick.name.return_value = 'Patrick'
+        self.conn.getAllDomainStats.return_value = [
+            (self.domain, self._stats(0, 0, 0)),
+            (patrick, self._stats(0, 0, 0))]
+
+        self.collector.collect({'SpongeBob': (0, _CONN_ARGS),
+                                'Patrick': (1, _CONN_ARGS),
+                                'Squidward': (2, _CONN_ARGS)})
+
+        self.conn.getAllDomainStats.assert_called_once_with(
+            sensors._STATS_FLAGS)
+        self.assertEqual(2, self.table.write.call_count)
+        # the domain is gone from libvirt
+        self.table.clear.assert_called_once_with(2)
+
+    @mock.patch.object(time, 'monotonic', autospec=True)
+    def test_collect_domain_shut_off(self, mock_monotonic):
+        mock_monotonic.return_value = 100
+        self.conn.getAllDomainStats.return_value = [
+            (self.domain, {'state.state': libvirt.VIR_DOMAIN_SHUTOFF})]
+
+        self.collector.collect({'SpongeBob': (0, _CONN_ARGS)})
+
+        self.table.write.assert_called_once_with(0, [0.0, None, None, None])
+
+    def test_collect_libvirt_error(self):
+        self.conn.getAllDomainStats.side_effect = libvirt.libvirtError('boom')
+
+        self.collector.collect({'SpongeBob': (0, _CONN_ARGS)})
+
+        self.table.clear.assert_called_once_with(0)
+        self.table.write.assert_not_called()
+
+    def test_collect_breaker_open(self):
+        self.mock_pooled_conn.side_effect = exception.LibvirtUnavailable(
+            uri=_CONN_ARGS['uri'])
+
+        self.collector.collect({'SpongeBob': (0, _CONN_ARGS)})
+
+        self.table.clear.assert_called_once_with(0)
+        self.table.write.assert_not_called()
+
+    @mock.patch.object(deadline, 'get_executor', autospec=True)
+    def test_collect_deadline(self, mock_get_executor):
+        mock_run = mock_get_executor.return_value.run
+        mock_run.return_value = [(self.domain, self._stats(0, 0, 0))]
+
+        with mock.patch.dict(sensors.CONF['deadlines'], {'default': 7}):
+            self.collector.collect({'SpongeBob': (0, _CONN_ARGS)})
+
+        mock_run.assert_called_once_with('get_all_domain_stats', mock.ANY,
+                                         timeout=7)
+        self.table.write.assert_called_once_with(0, mock.ANY)
+
+    @mock.patch.object(breaker, 'get_breaker', autospec=True)
+    @mock.patch.object(deadline, 'get_executor', autospec=True)
+    def test_collect_deadline_passed(self, mock_get_executor,
+                                     mock_get_breaker):
+        error = exception.LibvirtCallTimeout(call='get_all_domain_stats',
+                                             timeout=3)
+        mock_get_executor.return_value.run.side_effect = error
+
+        self.collector.collect({'SpongeBob': (0, _CONN_ARGS)})
+
+        mock_get_breaker.assert_called_once_with(_CONN_ARGS['uri'])
+        mock_get_breaker.return_value.record.assert_called_once_with(error)
+        self.table.clear.assert_called_once_with(0)
+        self.table.write.assert_not_called()
+
+    def test_memory_usage_rss_fallback(self):
+        self.assertEqual(50.0, self.collector._memory_usage(
+            {'balloon.current': 2048, 'balloon.rss': 1024}))
+        self.assertIsNone(self.collector._memory_usage({}))
@@ -0,0 +1,351 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import time
+from unittest import mock
+
+import libvirt
+import pyghmi.ipmi.private.session as ipmisession
+
+from virtualbmc import pool
+from virtualbmc import sol
+from virtualbmc.tests.unit import base
+from virtualbmc import utils
+
+_CONN_ARGS = {'uri': 'fake:///krusty-krab', 'sasl_username': None,
+              'sasl_password': None}
+
+
+class ConsoleBufferTestCase(base.TestCase):
+
+    def setUp(self):
+        super(ConsoleBufferTestCase, self).setUp()
+        self.buffer = sol.ConsoleBuffer(8)
+
+    def test_write_peek_consume(self):
+        self.assertEqual(5, self.buffer.write(b'hello'))
+        self.assertEqual(3, self.buffer.free())
+
+        chunk = self.buffer.peek(3)
+        self.assertIsInstance(chunk, memoryview)
+        self.assertEqual(b'hel', bytes(chunk))
+
+        self.buffer.consume(3)
+        self.assertEqual(b'lo', bytes(self.buffer.peek(10)))
+
+    def test_write_full(self):
+        self.assertEqual(8, self.buffer.write(b'0123456789'))
+        self.assertEqual(0, self.buffer.write(b'x'))
+        self.assertEqual(b'01234567', bytes(self.buffer.peek(10)))
+
+    def test_wrap_around(self):
+        self.buffer.write(b'012345')
+        self.buffer.consume(4)
+        self.assertEqual(6, self.buffer.write(b'abcdef'))
+
+        # The view stops at the end of the underlying buffer
+        self.assertEqual(b'45ab', bytes(self.buffer.peek(10)))
+        self.buffer.consume(4)
+        self.assertEqual(b'cdef', bytes(self.buffer.peek(10)))
+        self.buffer.consume(4)
+
+        self.assertEqual(0, len(self.buffer))
+        self.assertEqual(b'', bytes(self.buffer.peek(10)))
+
+    def test_clear(self):
+        self.buffer.write(b'hello')
+        self.buffer.clear()
+
+        self.assertEqual(8, self.buffer.free())
+
+
+class SOLConsoleTestCase(base.TestCase):
+
+    def setUp(self):
+        super(SOLConsoleTestCase, self).setUp()
+        mock.patch.object(ipmisession.Session, 'wait_for_rsp',
+                          autospec=True).start()
+        self.session = mock.Mock()
+        self.output = sol.ConsoleBuffer(1024)
+        self.drained = mock.Mock()
+        self.iohandler = mock.Mock()
+        self.console = sol.SOLConsole(self.session, self.iohandler,
+                                      self.output, drained=self.drained)
+
+    def _sent(self):
+        return [bytes(c[0][0]) for c in
+                self.session.send_payload.call_args_list]
+
+    def test_send_one_packet_at_a_time(self):
+        self.output.write(b'a' * 300)
+
+        self.console._sendpendingoutput()
+        self.console._sendpendingoutput()
+
+        self.assertEqual([b'\x01\x00\x00\x00' + b'a' * 255], self._sent())
+        self.assertEqual(45, len(self.output))
+        self.drained.assert_called_once_with()
+
+    def test_send_next_packet_on_ack(self):
+        self.output.write(b'a' * 300)
+        self.console._sendpendingoutput()
+        self.session.send_payload.reset_mock()
+
+        # The client acknowledges all of the first packet
+        self.console._got_sol_payload(bytearray((0, 1, 255, 0)))
+
+        self.assertEqual([b'\x02\x00\x00\x00' + b'a' * 45], self._sent())
+        self.assertEqual(0, len(self.output))
+
+    def test_nacked_data_sent_first(self):
+        self.output.write(b'hello world')
+        self.console._sendpendingoutput()
+        self.output.write(b'!')
+        self.session.send_payload.reset_mock()
+
+        # Only 6 characters accepted
+        self.console._got_sol_payload(bytearray((0, 1, 6, 0b1000000)))
+
+        self.assertEqual([b'\x02\x00\x00\x00world'], self._sent())
+
+    def test_client_input(self):
+        self.console._got_sol_payload(bytearray((1, 0, 0, 0)) + b'ls\r')
+
+        self.iohandler.assert_called_once_with(b'ls\r')
+
+    def test_retransmit(self):
+        self.output.write(b'hello')
+        self.console._sendpendingoutput()
+
+        # Not due yet
+        self.console.retransmit(timeout=1)
+        self.assertEqual(1, self.session.send_payload.call_count)
+
+        with mock.patch.object(time, 'monotonic',
+                               return_value=time.monotonic() + 2):
+            self.console.retransmit(timeout=1)
+
+        self.assertEqual([b'\x01\x00\x00\x00hello'] * 2, self._sent())
+
+    def test_retransmit_gives_up(self):
+        self.output.write(b'hello')
+        self.console._sendpendingoutput()
+
+        now = time.monotonic()
+        for attempt in range(sol.MAX_RETRANSMITS + 1):
+            with mock.patch.object(time, 'monotonic',
+                                   return_value=now + 2 * (attempt + 1)):
+                self.console.retransmit(timeout=1)
+
+        self.assertTrue(self.console.broken)
+        self.assertEqual(sol.MAX_RETRANSMITS + 1,
+                         self.session.send_payload.call_count)
+        self.iohandler.assert_called_once_with({'error': 'Connection lost'})
+
+
+@mock.patch.object(libvirt, 'virEventRemoveTimeout', create=True)
+@mock.patch.object(libvirt, 'virEventAddTimeout', create=True)
+class ConsoleStreamTestCase(base.TestCase):
+
+    def setUp(self):
+        super(ConsoleStreamTestCase, self).setUp()
+        self.conn = mock.Mock()
+        self.stream = self.conn.newStream.return_value
+        self.mock_pooled_conn = mock.patch.object(
+            pool, 'pooled_connection', autospec=True).start()
+        self.mock_pooled_conn.return_value.__enter__.return_value = self.conn
+        mock.patch.object(ipmisession.Session, 'iterwaiters', []).start()
+        self.mock_io_wait = mock.patch.object(
+            ipmisession, '_io_wait', autospec=True).start()
+        self.mock_get_domain = mock.patch.object(
+            utils, 'get_libvirt_domain', autospec=True).start()
+        self.on_close = mock.Mock()
+        self.console_stream = sol.ConsoleStream(
+            'SpongeBob', _CONN_ARGS, buffer_size=8, retransmit_timeout=0.5,
+            on_close=self.on_close)
+
+    def test_open(self, mock_add_timeout, mock_remove_timeout):
+        self.console_stream.open()
+
+        self.mock_pooled_conn.assert_called_once_with(**_CONN_ARGS)
+        self.conn.newStream.assert_called_once_with(
+            libvirt.VIR_STREAM_NONBLOCK)
+        self.mock_get_domain.return_value.openConsole.assert_called_once_with(
+            None, self.stream, libvirt.VIR_DOMAIN_CONSOLE_FORCE)
+        self.stream.eventAddCallback.assert_called_once_with(
+            sol._STREAM_EVENTS, self.console_stream._stream_event, None)
+        mock_add_timeout.assert_called_once_with(
+            500, self.console_stream._check_acks, None)
+
+    def test_open_error(self, mock_add_timeout, mock_remove_timeout):
+        self.mock_get_domain.return_value.openConsole.side_effect = (
+            libvirt.libvirtError('boom'))
+
+        self.assertRaises(libvirt.libvirtError, self.console_stream.open)
+
+        self.stream.abort.assert_called_once_with()
+        mock_add_timeout.assert_not_called()
+
+    def test_read(self, mock_add_timeout, mock_remove_timeout):
+        self.console_stream.open()
+        console = self.console_stream.console = mock.Mock()
+        self.stream.recv.return_value = b'hello'
+
+        self.console_stream._stream_event(
+            self.stream, libvirt.VIR_STREAM_EVENT_READABLE, None)
+
+        self.stream.recv.assert_called_once_with(8)
+        self.assertEqual(b'hello', bytes(self.console_stream.output.peek(8)))
+        # Sent by the IPMI I/O loop, not by the event loop thread
+        console._sendpendingoutput.assert_not_called()
+        self.assertEqual([self.console_stream._service],
+                         ipmisession.Session.iterwaiters)
+        self.mock_io_wait.assert_called_once_with(0)
+
+        # Handed over once until served
+        self.console_stream._stream_event(
+            self.stream, libvirt.VIR_STREAM_EVENT_READABLE, None)
+        self.assertEqual(1, len(ipmisession.Session.iterwaiters))
+
+        ipmisession.Session.iterwaiters.pop()({'success': True})
+        console.retransmit.assert_called_once_with(0.5)
+        console._sendpendingoutput.assert_called_once_with()
+
+    def test_read_nothing(self, mock_add_timeout, mock_remove_timeout):
+        self.console_stream.open()
+        self.stream.recv.return_value = -2
+
+        self.console_stream._stream_event(
+            self.stream, libvirt.VIR_STREAM_EVENT_READABLE, None)
+
+        self.assertEqual(0, len(self.console_stream.output))
+        self.on_close.assert_not_called()
+
+    def test_read_pauses_when_full(self, mock_add_timeout,
+                                   mock_remove_timeout):
+        self.console_stream.open()
+        self.stream.recv.return_value = b'12345678'
+
+        self.console_stream._stream_event(
+            self.stream, libvirt.VIR_STREAM_EVENT_READABLE, None)
+
+        self.stream.eventUpdateCallback.assert_called_once_with(
+            libvirt.VIR_STREAM_EVENT_ERROR | libvirt.VIR_STREAM_EVENT_HANGUP)
+
+        # A late readable event does not read the stream any further
+        self.console_stream._stream_event(
+            self.stream, libvirt.VIR_STREAM_EVENT_READABLE, None)
+        self.stream.recv.assert_called_once_with(8)
+
+        self.console_stream.output.consume(4)
+        self.console_stream.resume()
+        self.stream.eventUpdateCallback.assert_called_with(
+            sol._STREAM_EVENTS)
+
+        # Not paused anymore
+        self.console_stream.resume()
+        self.assertEqual(2, self.stream.eventUpdateCallback.call_count)
+
+    def test_hangup(self, mock_add_timeout, mock_remove_timeout):
+        self.console_stream.open()
+
+        self.console_stream._stream_event(
+            self.stream, libvirt.VIR_STREAM_EVENT_HANGUP, None)
+
+        self.on_close.assert_called_once_with()
+        self.stream.eventRemoveCallback.assert_called_once_with()
+        self.stream.abort.assert_called_once_with()
+        mock_remove_timeout.assert_called_once_with(
+            mock_add_timeout.return_value)
+
+    def test_eof(self, mock_add_timeout, mock_remove_timeout):
+        self.console_stream.open()
+        self.stream.recv.return_value = b''
+
+        self.console_stream._stream_event(
+            self.stream, libvirt.VIR_STREAM_EVENT_READABLE, None)
+
+        self.on_close.assert_called_once_with()
+
+    def test_stale_stream_event(self, mock_add_timeout, mock_remove_timeout):
+        self.console_stream.open()
+        self.console_stream.close()
+
+        self.console_stream._stream_event(
+            self.stream, libvirt.VIR_STREAM_EVENT_HANGUP, None)
+
+        self.on_close.assert_not_called()
+
+    def test_send(self, mock_add_timeout, mock_remove_timeout):
+        self.console_stream.open()
+        self.stream.send.return_value = 3
+
+        self.console_stream.send(b'ls\r')
+
+        self.stream.send.assert_called_once_with(b'ls\r')
+
+    def test_send_not_open(self, mock_add_timeout, mock_remove_timeout):
+        self.console_stream.send(b'ls\r')
+
+        self.stream.send.assert_not_called()
+
+    def test_send_error_report(self, mock_add_timeout, mock_remove_timeout):
+        self.console_stream.open()
+
+        self.console_stream.send({'error': 'Connection lost'})
+
+        self.stream.send.assert_not_called()
+
+    def test_check_acks(self, mock_add_timeout, mock_remove_timeout):
+        console = self.console_stream.console = mock.Mock()
+
+        self.console_stream._check_acks(mock_add_timeout.return_value, None)
+
+        console.retransmit.assert_not_called()
+        self.assertEqual([self.console_stream._service],
+                         ipmisession.Session.iterwaiters)
+
+        self.console_stream._service({'success': True})
+        console.retransmit.assert_called_once_with(0.5)
+
+    def test_check_acks_nothing_sent(self, mock_add_timeout,
+                                     mock_remove_timeout):
+        console = self.console_stream.console = mock.Mock()
+        console.awaitingack = False
+
+        self.console_stream._check_acks(mock_add_timeout.return_value, None)
+
+        self.assertEqual([], ipmisession.Session.iterwaiters)
+        self.mock_io_wait.assert_not_called()
+
+    def test_service_closed(self, mock_add_timeout, mock_remove_timeout):
+        console = self.console_stream.console = mock.Mock()
+        self.console_stream._check_acks(mock_add_timeout.return_value, None)
+
+        self.console_stream.close()
+        self.console_stream._service({'success': True})
+
+        console.retransmit.assert_not_called()
+        console._sendpendingoutput.assert_not_called()
+
+    @mock.patch.object(sol, 'SOLConsole', autospec=True)
+    def test_attach(self, mock_console, mock_add_timeout,
+                    mock_remove_timeout):
+        session = mock.Mock()
+
+        console = self.console_stream.attach(session)
+
+        mock_console.assert_called_once_with(
+            session, self.console_stream.send, self.console_stream.output,
+            drained=self.console_stream.resume)
+        self.assertIs(mock_console.return_value, console)
+        console._sendpendingoutput.assert_called_once_with()
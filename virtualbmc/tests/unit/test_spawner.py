@@ -0,0 +1,126 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import importlib
+import os
+import signal
+import sys
+import time
+from unittest import mock
+
+import fixtures
+
+from virtualbmc import spawner
+from virtualbmc.tests.unit import base
+
+
+def _write(path, text):
+    with open(path, 'w') as f:
+        f.write(text)
+
+
+def _exit(code):
+    sys.exit(code)
+
+
+def _sleep():
+    time.sleep(30)
+
+
+class SpawnerTestCase(base.TestCase):
+
+    warm = 0
+
+    def setUp(self):
+        super(SpawnerTestCase, self).setUp()
+        self.tmp_dir = self.useFixture(fixtures.TempDir()).path
+        self.spawner = spawner.Spawner(self.warm)
+        self.addCleanup(self.spawner.terminate)
+
+    def _wait(self, process, timeout=10):
+        deadline = time.monotonic() + timeout
+        while process.is_alive():
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.01)
+
+    def test_start(self):
+        path = os.path.join(self.tmp_dir, 'out')
+
+        process = self.spawner.start('vbmcd-managing-domain-SpongeBob',
+                                     _write, (path, 'SpongeBob'))
+        self._wait(process)
+
+        self.assertEqual(0, process.exitcode)
+        with open(path) as f:
+            self.assertEqual('SpongeBob', f.read())
+
+    def test_start_many(self):
+        processes = [self.spawner.start('vbmc-%d' % code, _exit, (code,))
+                     for code in range(4)]
+
+        for code, process in enumerate(processes):
+            self._wait(process)
+            self.assertEqual(code, process.exitcode)
+
+    def test_terminate(self):
+        process = self.spawner.start('vbmc', _sleep)
+        self.assertTrue(process.is_alive())
+
+        process.terminate()
+
+        self._wait(process)
+
+    def test_spawner_died(self):
+        process = self.spawner.start('vbmc', _sleep)
+
+        self.spawner.process.kill()
+        self.spawner.process.join()
+
+        self.assertFalse(process.is_alive())
+        self.assertEqual(-9, process.exitcode)
+
+    def test_sentinels(self):
+        self.assertEqual((self.spawner.process.sentinel,
+                          self.spawner._conn.fileno()),
+                         self.spawner.sentinels())
+
+    def test_sentinels_dead(self):
+        self.spawner.process.kill()
+        self.spawner.process.join()
+
+        self.assertEqual((), self.spawner.sentinels())
+
+
+class WarmSpawnerTestCase(SpawnerTestCase):
+
+    warm = 2
+
+
+class HelpersTestCase(base.TestCase):
+
+    @mock.patch.object(importlib, 'import_module', autospec=True,
+                       side_effect=ImportError('missing'))
+    def test_preload_missing(self, mock_import_module):
+        spawner._preload()
+
+        mock_import_module.assert_has_calls(
+            [mock.call(name) for name in spawner.PRELOAD])
+
+    def test_die_with_parent(self):
+        libc = mock.Mock()
+
+        self.assertTrue(spawner._die_with_parent(libc, os.getppid()))
+        libc.prctl.assert_called_once_with(spawner.PR_SET_PDEATHSIG,
+                                           signal.SIGTERM)
+
+    def test_die_with_parent_gone(self):
+        self.assertFalse(spawner._die_with_parent(None, os.getppid() + 1))
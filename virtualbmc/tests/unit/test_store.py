@@ -0,0 +1,116 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import os
+
+import fixtures
+
+from virtualbmc import exception
+from virtualbmc import store
+from virtualbmc.tests.unit import base
+from virtualbmc.tests.unit import utils as test_utils
+
+
+def _config(**kwargs):
+    config = test_utils.get_domain(**kwargs)
+    config['active'] = 'False'
+    return config
+
+
+class SQLiteStoreTestCase(base.TestCase):
+
+    def setUp(self):
+        super(SQLiteStoreTestCase, self).setUp()
+        self.path = os.path.join(self.useFixture(fixtures.TempDir()).path,
+                                 store.DATABASE_FILE)
+        self.store = store.SQLiteStore(self.path)
+        self.addCleanup(self.store.close)
+        self.config0 = _config()
+        self.config1 = _config(domain_name='Patrick', port=321,
+                               libvirt_uri='qemu:///session')
+
+    def test_wal(self):
+        self.assertEqual('wal', self.store._conn.execute(
+            'PRAGMA journal_mode').fetchone()[0])
+
+    def test_add_get(self):
+        self.store.add(self.config0)
+
+        self.assertEqual(self.config0, self.store.get('SpongeBob'))
+
+    def test_get_not_found(self):
+        self.assertRaises(exception.DomainNotFound, self.store.get,
+                          'SpongeBob')
+
+    def test_add_atomic(self):
+        self.store.add(self.config0)
+
+        self.assertRaises(exception.DomainAlreadyExists, self.store.add,
+                          self.config1, self.config0)
+        self.assertEqual(['SpongeBob'], list(self.store.all()))
+
+    def test_put(self):
+        self.store.add(self.config0)
+
+        self.store.put(dict(self.config0, active=True), self.config1)
+
+        self.assertEqual('True', self.store.get('SpongeBob')['active'])
+        self.assertEqual(self.config1, self.store.get('Patrick'))
+
+    def test_all(self):
+        self.store.add(self.config0, self.config1)
+
+        self.assertEqual({'SpongeBob': self.config0,
+                          'Patrick': self.config1}, self.store.all())
+        self.assertEqual({'Patrick': self.config1},
+                         self.store.all(port=321))
+        self.assertEqual({'SpongeBob': self.config0}, self.store.all(
+            libvirt_uri=self.config0['libvirt_uri'], port=123))
+
+    def test_all_unindexed(self):
+        self.assertRaises(ValueError, self.store.all, username='admin')
+
+    def test_delete(self):
+        self.store.add(self.config0)
+
+        self.store.delete('SpongeBob')
+
+        self.assertEqual({}, self.store.all())
+        self.assertRaises(exception.DomainNotFound, self.store.delete,
+                          'SpongeBob')
+
+    def test_transaction_rollback(self):
+        def fail():
+            with self.store.transaction():
+                self.store.put(self.config0)
+                self.store.delete('Patrick')
+
+        self.assertRaises(exception.DomainNotFound, fail)
+        self.assertEqual({}, self.store.all())
+
+    def test_migrate(self):
+        self.store.add(dict(self.config0, active='True'))
+
+        self.assertEqual(1, self.store.migrate([self.config0, self.config1]))
+        self.assertEqual(0, self.store.migrate([_config(domain_name='Sandy')]))
+
+        # Configurations added before the migration are kept
+        self.assertEqual('True', self.store.get('SpongeBob')['active'])
+        self.assertEqual({'SpongeBob', 'Patrick'}, set(self.store.all()))
+
+    def test_reopen(self):
+        self.store.add(self.config0)
+        self.store.close()
+
+        self.store = store.SQLiteStore(self.path)
+
+        self.assertEqual(self.config0, self.store.get('SpongeBob'))
@@ -52,6 +52,37 @@ class MiscUtilsTestCase(base.TestCase):
         self.assertEqual(expected, output_dict)
 
 
+class GetOsBootDeviceTestCase(base.TestCase):
+
+    DOMAIN_XML = """\
+<domain type='qemu'>
+  <name>Gary</name>
+  <os>
+    <type arch='x86_64' machine='pc-1.0'>hvm</type>
+    %s
+  </os>
+  <devices>
+    <disk type='block' device='disk'>
+      <boot order='1'/>
+    </disk>
+  </devices>
+</domain>
+"""
+
+    def test_get_os_boot_device(self):
+        domain_xml = self.DOMAIN_XML % "<boot dev='network'/><boot dev='hd'/>"
+        self.assertEqual('network', utils.get_os_boot_device(domain_xml))
+
+    def test_get_os_boot_device_small_chunks(self):
+        domain_xml = self.DOMAIN_XML % "<boot dev='cdrom'/>"
+        self.assertEqual('cdrom',
+                         utils.get_os_boot_device(domain_xml, chunk_size=3))
+
+    def test_get_os_boot_device_no_os_boot(self):
+        # per-device boot order is not an os/boot element
+        self.assertIsNone(utils.get_os_boot_device(self.DOMAIN_XML % ''))
+
+
 class LibvirtUtilsTestCase(base.TestCase):
 
     def setUp(self):
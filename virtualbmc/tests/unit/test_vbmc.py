@@ -13,11 +13,22 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import concurrent.futures
+import threading
 from unittest import mock
 
 import libvirt
 
+from virtualbmc import breaker
+from virtualbmc import coalesce
+from virtualbmc import deadline
+from virtualbmc import events
 from virtualbmc import exception
+from virtualbmc import metrics
+from virtualbmc import pool
+from virtualbmc import scheduler
+from virtualbmc import sensors
+from virtualbmc import sol
 from virtualbmc.tests.unit import base
 from virtualbmc.tests.unit import utils as test_utils
 from virtualbmc import utils
@@ -42,8 +53,33 @@ DOMAIN_XML_TEMPLATE = """\
 </domain>
 """
 
+NORMALIZED_DOMAIN_XML_TEMPLATE = """\
+<domain type='qemu'>
+  <os>
+    <type arch='x86_64' machine='pc-1.0'>hvm</type>
+    <boot dev='%s'/>
+  </os>
+  <devices>
+    <disk type='block' device='disk'/>
+  </devices>
+</domain>
+"""
 
-@mock.patch.object(utils, 'libvirt_open')
+
+def _bmc_init(bmc, *args, **kwargs):
+    # pyghmi's Bmc creates a socket in the constructor, only set the
+    # identity the BMC reports
+    bmc.deviceid = 0
+    bmc.revision = 0
+    bmc.firmwaremajor = 1
+    bmc.firmwareminor = 0
+    bmc.ipmiversion = 2
+    bmc.additionaldevices = 0
+    bmc.mfgid = 0
+    bmc.prodid = 0
+
+
+@mock.patch.object(pool, 'pooled_connection')
 @mock.patch.object(utils, 'get_libvirt_domain')
 class VirtualBMCTestCase(base.TestCase):
 
@@ -52,8 +88,18 @@ class VirtualBMCTestCase(base.TestCase):
         self.domain = test_utils.get_domain()
         # NOTE(lucasagomes): pyghmi's Bmc does create a socket in the
         # constructor so we need to mock it here
-        mock.patch('pyghmi.ipmi.bmc.Bmc.__init__',
-                   lambda *args, **kwargs: None).start()
+        mock.patch('pyghmi.ipmi.bmc.Bmc.__init__', _bmc_init).start()
+        self.mock_cache = mock.patch.object(
+            events, 'get_domain_cache', autospec=True).start()
+        self.mock_cache.return_value = None
+        mock.patch.object(coalesce, 'get_coalescer', autospec=True,
+                          return_value=None).start()
+        self.mock_event_loop = mock.patch.object(
+            events, 'start_event_loop', autospec=True).start()
+        mock.patch.dict(vbmc.CONF['ipmi'],
+                        {'boot_device_flush_delay': 0,
+                         'async_power': False}).start()
+        mock.patch.dict(vbmc.CONF['scheduler'], {'max_concurrent': 0}).start()
         self.vbmc = vbmc.VirtualBMC(**self.domain)
 
     def _assert_libvirt_calls(self, mock_libvirt_domain, mock_libvirt_open,
@@ -63,9 +109,8 @@ class VirtualBMCTestCase(base.TestCase):
             mock.ANY, self.domain['domain_name'])
         params = {'sasl_password': self.domain['libvirt_sasl_password'],
                   'sasl_username': self.domain['libvirt_sasl_username'],
-                  'uri': self.domain['libvirt_uri']}
-        if readonly:
-            params['readonly'] = True
+                  'uri': self.domain['libvirt_uri'],
+                  'readonly': readonly}
         mock_libvirt_open.assert_called_once_with(**params)
 
     def test_get_boot_device(self, mock_libvirt_domain, mock_libvirt_open):
@@ -81,6 +126,7 @@ class VirtualBMCTestCase(base.TestCase):
             # reset mocks for the next iteration
             mock_libvirt_domain.reset_mock()
             mock_libvirt_open.reset_mock()
+            self.vbmc._forget_domain()
 
     def test_set_boot_device(self, mock_libvirt_domain, mock_libvirt_open):
         for boot_device in vbmc.SET_BOOT_DEVICES_MAP:
@@ -98,6 +144,123 @@ class VirtualBMCTestCase(base.TestCase):
             # reset mocks for the next iteration
             mock_libvirt_domain.reset_mock()
             mock_libvirt_open.reset_mock()
+            self.vbmc._forget_domain()
+
+    def test_get_boot_device_cached(self, mock_libvirt_domain,
+                                    mock_libvirt_open):
+        cache = mock.Mock(spec=events.DomainCache)
+        cache.watch.return_value = True
+        cache.fetch.return_value = 'cdrom'
+        self.vbmc._cache = cache
+        mock_count = mock.patch.object(self.vbmc._metrics, 'count',
+                                       autospec=True).start()
+
+        ret = self.vbmc.get_boot_device()
+
+        self.assertEqual(vbmc.GET_BOOT_DEVICES_MAP['cdrom'], ret)
+        cache.fetch.assert_called_once_with(
+            self.domain['libvirt_uri'], self.domain['domain_name'],
+            'boot', mock.ANY)
+        mock_count.assert_called_once_with(
+            metrics.DOMAIN_CACHE_HITS)
+
+    def test_get_boot_device_cache_miss(self, mock_libvirt_domain,
+                                        mock_libvirt_open):
+        cache = mock.Mock(spec=events.DomainCache)
+        cache.watch.return_value = True
+        cache.fetch.side_effect = (
+            lambda uri, domain_name, field, fetcher: fetcher())
+        self.vbmc._cache = cache
+        mock_count = mock.patch.object(self.vbmc._metrics, 'count',
+                                       autospec=True).start()
+
+        with mock.patch.object(self.vbmc, '_get_os_boot_device',
+                               autospec=True, return_value='network'):
+            ret = self.vbmc.get_boot_device()
+
+        self.assertEqual(vbmc.GET_BOOT_DEVICES_MAP['network'], ret)
+        mock_count.assert_called_once_with(
+            metrics.DOMAIN_CACHE_MISSES)
+        self.assertFalse(mock_libvirt_domain.called)
+
+    def test_set_boot_device_unchanged(self, mock_libvirt_domain,
+                                       mock_libvirt_open):
+        domain_xml = NORMALIZED_DOMAIN_XML_TEMPLATE % 'network'
+        mock_libvirt_domain.return_value.XMLDesc.return_value = domain_xml
+        conn = mock_libvirt_open.return_value.__enter__.return_value
+
+        ret = self.vbmc.set_boot_device('network')
+
+        self.assertIsNone(ret)
+        conn.defineXML.assert_not_called()
+
+    def test_set_boot_device_other_device(self, mock_libvirt_domain,
+                                          mock_libvirt_open):
+        domain_xml = NORMALIZED_DOMAIN_XML_TEMPLATE % 'network'
+        mock_libvirt_domain.return_value.XMLDesc.return_value = domain_xml
+        conn = mock_libvirt_open.return_value.__enter__.return_value
+
+        self.vbmc.set_boot_device('hd')
+
+        self.assertIn('<boot dev="hd" />', str(conn.defineXML.call_args))
+
+    @mock.patch('threading.Timer', autospec=True)
+    def test_set_boot_device_deferred(self, mock_timer, mock_libvirt_domain,
+                                      mock_libvirt_open):
+        vbmc.CONF['ipmi']['boot_device_flush_delay'] = 2
+        domain = mock_libvirt_domain.return_value
+        domain.XMLDesc.return_value = DOMAIN_XML_TEMPLATE % 'hd'
+        domain.isActive.return_value = False
+        conn = mock_libvirt_open.return_value.__enter__.return_value
+
+        self.assertIsNone(self.vbmc.set_boot_device('hd'))
+        self.assertIsNone(self.vbmc.set_boot_device('network'))
+
+        # nothing is sent to libvirt until the change is flushed
+        self.assertFalse(mock_libvirt_open.called)
+        mock_timer.assert_called_once_with(2, self.vbmc.flush_boot_device)
+        mock_timer.return_value.start.assert_called_once_with()
+        self.assertEqual(vbmc.GET_BOOT_DEVICES_MAP['network'],
+                         self.vbmc.get_boot_device())
+
+        # the power on applies the latest boot device with one redefinition
+        self.vbmc.power_on()
+
+        conn.defineXML.assert_called_once_with(mock.ANY)
+        self.assertIn('<boot dev="network" />',
+                      str(conn.defineXML.call_args))
+        domain.create.assert_called_once_with()
+        mock_timer.return_value.cancel.assert_called_once_with()
+        self.assertIsNone(self.vbmc._pending_boot_device)
+
+    def test_flush_boot_device_error(self, mock_libvirt_domain,
+                                     mock_libvirt_open):
+        mock_libvirt_domain.side_effect = libvirt.libvirtError('boom')
+        self.vbmc._pending_boot_device = 'hd'
+
+        self.assertEqual(0xc0, self.vbmc.flush_boot_device())
+        # the change is kept to be retried
+        self.assertEqual('hd', self.vbmc._pending_boot_device)
+
+        self.assertEqual(0xc0, self.vbmc.power_on())
+        mock_libvirt_domain.return_value.create.assert_not_called()
+
+    def test_flush_boot_device_nothing_pending(self, mock_libvirt_domain,
+                                               mock_libvirt_open):
+        self.assertIsNone(self.vbmc.flush_boot_device())
+        self.assertFalse(mock_libvirt_open.called)
+
+    def test_set_boot_device_invalidates_cache(self, mock_libvirt_domain,
+                                               mock_libvirt_open):
+        cache = mock.Mock(spec=events.DomainCache)
+        self.vbmc._cache = cache
+        mock_libvirt_domain.return_value.XMLDesc.return_value = (
+            DOMAIN_XML_TEMPLATE % 'hd')
+
+        self.vbmc.set_boot_device('network')
+
+        cache.invalidate.assert_called_once_with(
+            self.domain['libvirt_uri'], self.domain['domain_name'], 'boot')
 
     def test_set_boot_device_error(self, mock_libvirt_domain,
                                    mock_libvirt_open):
@@ -138,6 +301,133 @@ class VirtualBMCTestCase(base.TestCase):
         self._assert_libvirt_calls(mock_libvirt_domain, mock_libvirt_open,
                                    readonly=True)
 
+    def test_get_power_state_cached(self, mock_libvirt_domain,
+                                    mock_libvirt_open):
+        cache = mock.Mock(spec=events.DomainCache)
+        cache.watch.return_value = True
+        cache.fetch.return_value = False
+        self.vbmc._cache = cache
+
+        ret = self.vbmc.get_power_state()
+
+        self.assertEqual(vbmc.POWEROFF, ret)
+        cache.watch.assert_called_once_with(
+            uri=self.domain['libvirt_uri'],
+            sasl_username=self.domain['libvirt_sasl_username'],
+            sasl_password=self.domain['libvirt_sasl_password'])
+        cache.fetch.assert_called_once_with(
+            self.domain['libvirt_uri'], self.domain['domain_name'],
+            'active', mock.ANY)
+        self.assertFalse(mock_libvirt_domain.called)
+
+    def test_get_power_state_events_down(self, mock_libvirt_domain,
+                                         mock_libvirt_open):
+        cache = mock.Mock(spec=events.DomainCache)
+        cache.watch.return_value = False
+        self.vbmc._cache = cache
+        mock_count = mock.patch.object(self.vbmc._metrics, 'count',
+                                       autospec=True).start()
+
+        self._test_get_power_state(mock_libvirt_domain, mock_libvirt_open,
+                                   power_on=True)
+        cache.fetch.assert_not_called()
+        mock_count.assert_called_once_with(
+            metrics.DOMAIN_CACHE_MISSES)
+
+    def test_domain_handle_reused(self, mock_libvirt_domain,
+                                  mock_libvirt_open):
+        domain = mock_libvirt_domain.return_value
+        domain.isActive.return_value = True
+
+        self.vbmc.get_power_state()
+        self.vbmc.get_power_state()
+
+        mock_libvirt_domain.assert_called_once_with(
+            mock.ANY, self.domain['domain_name'])
+        self.assertEqual(2, domain.isActive.call_count)
+
+    def test_domain_handle_new_connection(self, mock_libvirt_domain,
+                                          mock_libvirt_open):
+        domain = mock_libvirt_domain.return_value
+        domain.UUIDString.return_value = 'uuid'
+        self.vbmc.get_power_state()
+
+        conn = mock.Mock()
+        mock_libvirt_open.return_value.__enter__.return_value = conn
+        self.vbmc.get_power_state()
+
+        mock_libvirt_domain.assert_called_once_with(
+            mock.ANY, self.domain['domain_name'])
+        conn.lookupByUUIDString.assert_called_once_with('uuid')
+
+    def test_domain_handle_per_access(self, mock_libvirt_domain,
+                                      mock_libvirt_open):
+        mock_libvirt_domain.return_value.UUIDString.return_value = 'uuid'
+        conn = mock_libvirt_open.return_value.__enter__.return_value
+
+        self.vbmc.get_power_state()
+        self.vbmc.power_off()
+
+        # Read-only handles are no good for power actions
+        mock_libvirt_domain.assert_called_once_with(
+            mock.ANY, self.domain['domain_name'])
+        conn.lookupByUUIDString.assert_called_once_with('uuid')
+        conn.lookupByUUIDString.return_value.destroy.assert_called_once_with()
+
+    def test_domain_handle_stale(self, mock_libvirt_domain,
+                                 mock_libvirt_open):
+        error = libvirt.libvirtError('boom')
+        error.get_error_code = mock.Mock(
+            return_value=libvirt.VIR_ERR_NO_DOMAIN)
+        domain = mock_libvirt_domain.return_value
+        self.vbmc.get_power_state()
+
+        domain.isActive.side_effect = error
+        self.assertRaises(exception.VirtualBMCError,
+                          self.vbmc.get_power_state)
+
+        domain.isActive.side_effect = None
+        self.vbmc.get_power_state()
+
+        self.assertEqual(2, mock_libvirt_domain.call_count)
+
+    def test_domain_handle_undefined(self, mock_libvirt_domain,
+                                     mock_libvirt_open):
+        cache = self.vbmc._cache = mock.Mock(spec=events.DomainCache)
+        cache.watch.return_value = False
+        cache.definition.return_value = (1, 0)
+        self.vbmc.get_power_state()
+        self.vbmc.get_power_state()
+        self.assertEqual(1, mock_libvirt_domain.call_count)
+
+        cache.definition.return_value = (1, 1)
+        self.vbmc.get_power_state()
+
+        self.assertEqual(2, mock_libvirt_domain.call_count)
+
+    def test_get_power_state_coalesced(self, mock_libvirt_domain,
+                                       mock_libvirt_open):
+        self.vbmc._coalescer = coalesce.Coalescer(window=60)
+        mock_libvirt_domain.return_value.isActive.return_value = True
+
+        self.assertEqual(vbmc.POWERON, self.vbmc.get_power_state())
+        self.assertEqual(vbmc.POWERON, self.vbmc.get_power_state())
+
+        self._assert_libvirt_calls(mock_libvirt_domain, mock_libvirt_open,
+                                   readonly=True)
+
+    def test_power_off_invalidates_power_state(self, mock_libvirt_domain,
+                                               mock_libvirt_open):
+        self.vbmc._coalescer = coalesce.Coalescer(window=60)
+        domain = mock_libvirt_domain.return_value
+        domain.isActive.return_value = True
+        self.assertEqual(vbmc.POWERON, self.vbmc.get_power_state())
+
+        self.vbmc.power_off()
+        domain.isActive.return_value = False
+
+        self.assertEqual(vbmc.POWEROFF, self.vbmc.get_power_state())
+
     def test_pulse_diag_is_on(self, mock_libvirt_domain, mock_libvirt_open):
         domain = mock_libvirt_domain.return_value
         domain.isActive.return_value = True
@@ -229,6 +519,81 @@ class VirtualBMCTestCase(base.TestCase):
         domain.shutdown.assert_not_called()
         self._assert_libvirt_calls(mock_libvirt_domain, mock_libvirt_open)
 
+    @mock.patch.object(vbmc.threading, 'Timer', autospec=True)
+    def test_power_shutdown_no_soft_off_timeout(self, mock_timer,
+                                                mock_libvirt_domain,
+                                                mock_libvirt_open):
+        mock_libvirt_domain.return_value.isActive.return_value = True
+
+        self.vbmc.power_shutdown()
+
+        mock_timer.assert_not_called()
+
+    def _soft_off(self, mock_libvirt_domain):
+        self.vbmc._cache = mock.Mock()
+        self.vbmc._cache.watch.return_value = True
+        mock_libvirt_domain.return_value.isActive.return_value = True
+
+        with mock.patch.dict(vbmc.CONF['ipmi'], {'soft_off_timeout': 30}):
+            self.assertIsNone(self.vbmc.power_shutdown())
+            # Repeated commands keep the deadline
+            self.assertIsNone(self.vbmc.power_shutdown())
+
+    @mock.patch.object(vbmc.threading, 'Timer', autospec=True)
+    def test_power_shutdown_soft_off(self, mock_timer, mock_libvirt_domain,
+                                     mock_libvirt_open):
+        self._soft_off(mock_libvirt_domain)
+
+        mock_timer.assert_called_once_with(30, self.vbmc._escalate_soft_off)
+        mock_timer.return_value.start.assert_called_once_with()
+        self.vbmc._cache.listen.assert_called_once_with(
+            self.domain['libvirt_uri'], self.domain['domain_name'],
+            self.vbmc._lifecycle_event)
+        mock_libvirt_domain.return_value.destroy.assert_not_called()
+
+    @mock.patch.object(vbmc.threading, 'Timer', autospec=True)
+    def test_soft_off_escalated(self, mock_timer, mock_libvirt_domain,
+                                mock_libvirt_open):
+        self._soft_off(mock_libvirt_domain)
+
+        self.vbmc._escalate_soft_off()
+
+        mock_libvirt_domain.return_value.destroy.assert_called_once_with()
+        self.assertIsNone(self.vbmc._soft_off_timer)
+        self.vbmc._cache.unlisten.assert_called_once_with(
+            self.domain['libvirt_uri'], self.domain['domain_name'],
+            self.vbmc._lifecycle_event)
+
+    @mock.patch.object(vbmc.threading, 'Timer', autospec=True)
+    def test_soft_off_domain_stopped(self, mock_timer, mock_libvirt_domain,
+                                     mock_libvirt_open):
+        self._soft_off(mock_libvirt_domain)
+
+        self.vbmc._lifecycle_event(libvirt.VIR_DOMAIN_EVENT_STOPPED, 0)
+        self.vbmc._escalate_soft_off()
+
+        mock_timer.return_value.cancel.assert_called_once_with()
+        mock_libvirt_domain.return_value.destroy.assert_not_called()
+
+    @mock.patch.object(vbmc.threading, 'Timer', autospec=True)
+    def test_soft_off_other_event(self, mock_timer, mock_libvirt_domain,
+                                  mock_libvirt_open):
+        self._soft_off(mock_libvirt_domain)
+
+        self.vbmc._lifecycle_event(libvirt.VIR_DOMAIN_EVENT_SUSPENDED, 0)
+
+        mock_timer.return_value.cancel.assert_not_called()
+
+    @mock.patch.object(vbmc.threading, 'Timer', autospec=True)
+    def test_soft_off_overridden(self, mock_timer, mock_libvirt_domain,
+                                 mock_libvirt_open):
+        self._soft_off(mock_libvirt_domain)
+
+        self.vbmc.power_reset()
+
+        mock_timer.return_value.cancel.assert_called_once_with()
+        self.assertIsNone(self.vbmc._soft_off_timer)
+
     def test_power_shutdown_error(self, mock_libvirt_domain,
                                   mock_libvirt_open):
         mock_libvirt_domain.side_effect = libvirt.libvirtError('boom')
@@ -260,3 +625,564 @@ class VirtualBMCTestCase(base.TestCase):
         self.assertEqual(0xC0, ret)
         self.assertFalse(mock_libvirt_domain.return_value.create.called)
         self._assert_libvirt_calls(mock_libvirt_domain, mock_libvirt_open)
+
+    def test_power_on_invalid_state(self, mock_libvirt_domain,
+                                    mock_libvirt_open):
+        error = libvirt.libvirtError('boom')
+        error.get_error_code = mock.Mock(
+            return_value=libvirt.VIR_ERR_OPERATION_INVALID)
+        domain = mock_libvirt_domain.return_value
+        domain.isActive.return_value = False
+        domain.create.side_effect = error
+
+        self.assertEqual(0xD5, self.vbmc.power_on())
+
+    def test_power_off_libvirt_unavailable(self, mock_libvirt_domain,
+                                           mock_libvirt_open):
+        mock_libvirt_open.side_effect = exception.LibvirtUnavailable(
+            uri=self.domain['libvirt_uri'])
+
+        self.assertEqual(0xC0, self.vbmc.power_off())
+        mock_libvirt_domain.assert_not_called()
+
+    @mock.patch.object(breaker, 'get_breaker', autospec=True)
+    @mock.patch.object(deadline, 'get_executor', autospec=True)
+    def test_power_off_timeout(self, mock_executor, mock_breaker,
+                               mock_libvirt_domain, mock_libvirt_open):
+        error = exception.LibvirtCallTimeout(call='power_off', timeout=3)
+        mock_executor.return_value.run.side_effect = error
+
+        self.assertEqual(0xC0, self.vbmc.power_off())
+        mock_executor.return_value.run.assert_called_once_with(
+            'power_off', mock.ANY, timeout=3.0)
+        mock_breaker.assert_called_once_with(self.domain['libvirt_uri'])
+        mock_breaker.return_value.record.assert_called_once_with(error)
+
+    def test_queued_calls_do_not_trip_breaker(self, mock_libvirt_domain,
+                                              mock_libvirt_open):
+        mock.patch.dict(vbmc.CONF['scheduler'],
+                        {'max_concurrent': 1, 'stagger': 0}).start()
+        mock.patch.dict(vbmc.CONF['deadlines'], {'power_on': 0.1}).start()
+        mock.patch.dict(vbmc.CONF['libvirt'],
+                        {'breaker_error_rate': 0.5,
+                         'breaker_min_calls': 5}).start()
+        mock.patch.object(breaker, 'BREAKERS', {}).start()
+        admission = scheduler.Scheduler(scheduler.SchedulerTable(capacity=4))
+        mock.patch.object(scheduler, 'get_scheduler', autospec=True,
+                          return_value=admission).start()
+        release = threading.Event()
+        self.addCleanup(release.set)
+
+        # A slow domain start holds the only lease of the URI
+        admission.submit('power_on', lambda: release.wait(5),
+                         self.domain['libvirt_uri'])
+
+        for _ in range(5):
+            self.assertRaises(exception.LibvirtCallQueued, self.vbmc._bounded,
+                              'power_on', mock.Mock())
+
+        self.assertEqual(breaker.CLOSED, breaker.get_breaker(
+            self.domain['libvirt_uri']).state)
+        self.assertEqual(0xC0, vbmc.completion_code(
+            exception.LibvirtCallQueued(call='power_on', timeout=0.1)))
+
+    @mock.patch.object(deadline, 'get_executor', autospec=True)
+    def test_get_power_state_deadline(self, mock_executor,
+                                      mock_libvirt_domain, mock_libvirt_open):
+        mock_executor.return_value.run.side_effect = (
+            lambda call, func, timeout: func())
+        mock_libvirt_domain.return_value.isActive.return_value = True
+
+        self.assertEqual(vbmc.POWERON, self.vbmc.get_power_state())
+        mock_executor.return_value.run.assert_called_once_with(
+            'get_power_state', mock.ANY, timeout=2.0)
+
+    @mock.patch.object(scheduler, 'get_scheduler', autospec=True)
+    def test_set_boot_device_scheduled(self, mock_scheduler,
+                                       mock_libvirt_domain,
+                                       mock_libvirt_open):
+        mock_scheduler.return_value.run.side_effect = (
+            lambda call, func, uri, slot, timeout: func())
+        mock_libvirt_domain.return_value.XMLDesc.return_value = (
+            DOMAIN_XML_TEMPLATE % 'hd')
+
+        with mock.patch.dict(vbmc.CONF['scheduler'], {'max_concurrent': 2}):
+            self.assertIsNone(self.vbmc.set_boot_device('network'))
+
+        mock_scheduler.return_value.run.assert_called_once_with(
+            'set_boot_device', mock.ANY, uri=self.domain['libvirt_uri'],
+            slot=None, timeout=3.0)
+
+    @mock.patch.object(scheduler, 'admitted', autospec=True,
+                       return_value=True)
+    @mock.patch.object(deadline, 'get_executor', autospec=True)
+    def test_admitted_calls_made_right_away(self, mock_executor,
+                                            mock_admitted,
+                                            mock_libvirt_domain,
+                                            mock_libvirt_open):
+        mock_libvirt_domain.return_value.isActive.return_value = True
+
+        self.assertIsNone(self.vbmc.power_off())
+
+        mock_executor.assert_not_called()
+        mock_libvirt_domain.return_value.destroy.assert_called_once_with()
+
+    @mock.patch.object(deadline, 'get_executor', autospec=True)
+    def test_deadline_disabled(self, mock_executor, mock_libvirt_domain,
+                               mock_libvirt_open):
+        mock_libvirt_domain.return_value.isActive.return_value = False
+
+        with mock.patch.dict(vbmc.CONF['deadlines'], {'power_on': 0}):
+            self.assertIsNone(self.vbmc.power_on())
+
+        mock_executor.assert_not_called()
+        mock_libvirt_domain.return_value.create.assert_called_once_with()
+
+    def test_get_chassis_status(self, mock_libvirt_domain,
+                                mock_libvirt_open):
+        mock_libvirt_domain.return_value.isActive.return_value = True
+        session = mock.Mock()
+
+        self.vbmc.get_chassis_status(session)
+
+        session.send_ipmi_response.assert_called_once_with(
+            data=b'\x01\x00\x00')
+
+    def test_get_chassis_status_error(self, mock_libvirt_domain,
+                                      mock_libvirt_open):
+        mock_libvirt_open.side_effect = exception.LibvirtUnavailable(
+            uri=self.domain['libvirt_uri'])
+        session = mock.Mock()
+
+        self.vbmc.get_chassis_status(session)
+
+        session.send_ipmi_response.assert_called_once_with(code=0xC0)
+
+    def test_get_chassis_status_domain_not_found(self, mock_libvirt_domain,
+                                                 mock_libvirt_open):
+        mock_libvirt_domain.side_effect = exception.DomainNotFound(
+            domain=self.domain['domain_name'])
+        session = mock.Mock()
+
+        self.vbmc.get_chassis_status(session)
+
+        session.send_ipmi_response.assert_called_once_with(code=0xD5)
+
+    def test_get_system_boot_options_error(self, mock_libvirt_domain,
+                                           mock_libvirt_open):
+        mock_libvirt_domain.side_effect = exception.DomainNotFound(
+            domain=self.domain['domain_name'])
+        session = mock.Mock()
+
+        self.vbmc.get_system_boot_options({'data': [5]}, session)
+
+        session.send_ipmi_response.assert_called_once_with(code=0xD5)
+
+    def _sensor_vbmc(self, enabled=True):
+        mock.patch.dict(vbmc.CONF['sensors'],
+                        {'enabled': enabled, 'interval': 10}).start()
+        mock.patch.dict(vbmc.CONF['metrics'], {'enabled': False}).start()
+        mock_table = mock.patch.object(sensors, 'get_sensor_table',
+                                       autospec=True).start()
+        bmc = vbmc.VirtualBMC(slot=7, **self.domain)
+        return bmc, mock_table.return_value
+
+    def test_sensors(self, mock_libvirt_domain, mock_libvirt_open):
+        bmc, table = self._sensor_vbmc()
+        table.read.return_value = [12.0, None, None, None]
+        session = mock.Mock()
+
+        bmc.handle_raw_request(
+            {'netfn': 0x04, 'command': 0x2d, 'data': [1]}, session)
+
+        table.read.assert_called_once_with(7, 30)
+        session.send_ipmi_response.assert_called_once_with(
+            data=[12, 0x40, 0])
+        self.assertEqual(sensors.SDR_REPOSITORY_DEVICE,
+                         bmc.additionaldevices)
+
+    @mock.patch('pyghmi.ipmi.bmc.Bmc.handle_raw_request', autospec=True)
+    def test_sensors_other_request(self, mock_handle, mock_libvirt_domain,
+                                   mock_libvirt_open):
+        bmc, table = self._sensor_vbmc()
+        request = {'netfn': 0, 'command': 9, 'data': [5]}
+        session = mock.Mock()
+
+        bmc.handle_raw_request(request, session)
+
+        mock_handle.assert_called_once_with(bmc, request, session)
+        table.read.assert_not_called()
+
+    def test_sensors_disabled(self, mock_libvirt_domain, mock_libvirt_open):
+        bmc, table = self._sensor_vbmc(enabled=False)
+
+        self.assertIsNone(bmc._sensors)
+        self.assertEqual(0, bmc.additionaldevices)
+
+    def test_get_device_id(self, mock_libvirt_domain, mock_libvirt_open):
+        session = mock.Mock()
+
+        with mock.patch('pyghmi.ipmi.bmc.Bmc.handle_raw_request',
+                        autospec=True) as mock_handle:
+            self.vbmc.handle_raw_request(
+                {'netfn': 0x06, 'command': 0x01, 'data': []}, session)
+
+        mock_handle.assert_not_called()
+        session.send_ipmi_response.assert_called_once_with(
+            data=bytes([0, 0, 1, 0, 2, 0, 0, 0, 0, 0, 0, 0, 0, 0]))
+
+    def test_get_device_id_sensors(self, mock_libvirt_domain,
+                                   mock_libvirt_open):
+        bmc, table = self._sensor_vbmc()
+        session = mock.Mock()
+
+        bmc.handle_raw_request(
+            {'netfn': 0x06, 'command': 0x01, 'data': []}, session)
+
+        data = session.send_ipmi_response.call_args[1]['data']
+        self.assertEqual(sensors.SDR_REPOSITORY_DEVICE, data[5])
+
+    def test_get_device_id_same_as_pyghmi(self, mock_libvirt_domain,
+                                          mock_libvirt_open):
+        self.vbmc.mfgid = 0x1234
+        self.vbmc.prodid = 0x5678
+        static_responses = self.vbmc._encode_static_responses()
+        session = mock.Mock()
+
+        self.vbmc.send_device_id(session)
+
+        expected = session.send_ipmi_response.call_args[1]['data']
+        self.assertEqual(bytes(expected),
+                         static_responses[vbmc.GET_DEVICE_ID])
+
+    def test_get_chassis_status_off(self, mock_libvirt_domain,
+                                    mock_libvirt_open):
+        mock_libvirt_domain.return_value.isActive.return_value = False
+        session = mock.Mock()
+
+        self.vbmc.handle_raw_request(
+            {'netfn': 0x00, 'command': 0x01, 'data': []}, session)
+
+        session.send_ipmi_response.assert_called_once_with(
+            data=b'\x00\x00\x00')
+
+    def test_metrics_no_slot(self, mock_libvirt_domain, mock_libvirt_open):
+        self.assertFalse(self.vbmc._metrics.enabled)
+
+    @mock.patch.object(metrics, 'get_metrics_table', autospec=True)
+    def test_metrics(self, mock_table, mock_libvirt_domain,
+                     mock_libvirt_open):
+        table = mock_table.return_value
+        mock.patch.dict(vbmc.CONF['sensors'], {'enabled': False}).start()
+        bmc = vbmc.VirtualBMC(slot=3, **self.domain)
+        mock_libvirt_domain.return_value.isActive.return_value = False
+        mock_libvirt_domain.return_value.create.side_effect = (
+            libvirt.libvirtError('boom'))
+        session = mock.Mock()
+
+        # chassis control, power on
+        bmc.handle_raw_request(
+            {'netfn': 0x00, 'command': 0x02, 'data': [1]}, session)
+
+        session.send_ipmi_response.assert_called_once_with(code=0xC0)
+        table.record.assert_has_calls([
+            mock.call(3, ('libvirt', 'power_on'), mock.ANY, error=True,
+                      busy=False),
+            mock.call(3, ('ipmi', 'chassis_control'), mock.ANY, error=False,
+                      busy=True)])
+
+    def _sol_vbmc(self):
+        self.vbmc.port = 623
+        self.vbmc._console = mock.Mock(spec=sol.ConsoleStream)
+        return self.vbmc._console
+
+    def test_sol_enabled(self, mock_libvirt_domain, mock_libvirt_open):
+        self.mock_event_loop.assert_called_once_with()
+        self.assertIsInstance(self.vbmc._console, sol.ConsoleStream)
+
+    def test_sol_disabled(self, mock_libvirt_domain, mock_libvirt_open):
+        with mock.patch.dict(vbmc.CONF['sol'], {'enabled': False}):
+            bmc = vbmc.VirtualBMC(**self.domain)
+        session = mock.Mock()
+
+        bmc.activate_payload(None, session)
+
+        self.assertIsNone(bmc.iohandler)
+        session.send_ipmi_response.assert_called_once_with(code=0x81)
+
+    @mock.patch.object(vbmc.VirtualBMC, 'is_active', autospec=True)
+    def test_activate_payload(self, mock_is_active, mock_libvirt_domain,
+                              mock_libvirt_open):
+        console = self._sol_vbmc()
+        mock_is_active.return_value = True
+        session = mock.Mock()
+
+        self.vbmc.activate_payload(None, session)
+
+        console.open.assert_called_once_with()
+        session.send_ipmi_response.assert_called_once_with(
+            data=[0, 0, 0, 0, 1, 0, 1, 0, 2, 0x6f, 0xff, 0xff])
+        console.attach.assert_called_once_with(session)
+        self.assertIs(console.attach.return_value, self.vbmc.sol)
+        self.assertTrue(self.vbmc.activated)
+
+        # Already active
+        session.reset_mock()
+        self.vbmc.activate_payload(None, session)
+        session.send_ipmi_response.assert_called_once_with(code=0x80)
+
+    @mock.patch.object(vbmc.VirtualBMC, 'is_active', autospec=True)
+    def test_activate_payload_powered_off(self, mock_is_active,
+                                          mock_libvirt_domain,
+                                          mock_libvirt_open):
+        console = self._sol_vbmc()
+        mock_is_active.return_value = False
+        session = mock.Mock()
+
+        self.vbmc.activate_payload(None, session)
+
+        session.send_ipmi_response.assert_called_once_with(code=0x81)
+        console.open.assert_not_called()
+        self.assertFalse(self.vbmc.activated)
+
+    @mock.patch.object(vbmc.VirtualBMC, 'is_active', autospec=True)
+    def test_activate_payload_error(self, mock_is_active, mock_libvirt_domain,
+                                    mock_libvirt_open):
+        console = self._sol_vbmc()
+        mock_is_active.return_value = True
+        console.open.side_effect = libvirt.libvirtError('boom')
+        session = mock.Mock()
+
+        self.vbmc.activate_payload(None, session)
+
+        session.send_ipmi_response.assert_called_once_with(code=0xC0)
+        console.attach.assert_not_called()
+        self.assertFalse(self.vbmc.activated)
+
+    def test_deactivate_payload(self, mock_libvirt_domain, mock_libvirt_open):
+        console = self._sol_vbmc()
+        sol_console = self.vbmc.sol = mock.Mock()
+        self.vbmc.activated = True
+        session = mock.Mock()
+
+        self.vbmc.deactivate_payload(None, session)
+
+        session.send_ipmi_response.assert_called_once_with()
+        sol_console.close.assert_called_once_with()
+        console.close.assert_called_once_with()
+        self.assertIsNone(self.vbmc.sol)
+        self.assertFalse(self.vbmc.activated)
+
+    def test_console_closed(self, mock_libvirt_domain, mock_libvirt_open):
+        sol_console = self.vbmc.sol = mock.Mock()
+        self.vbmc.activated = True
+
+        self.vbmc._console_closed()
+
+        sol_console.close.assert_called_once_with()
+        self.assertIsNone(self.vbmc.sol)
+        self.assertFalse(self.vbmc.activated)
+
+    def test_iohandler(self, mock_libvirt_domain, mock_libvirt_open):
+        console = self._sol_vbmc()
+
+        self.vbmc.iohandler(b'ls\r')
+
+        console.send.assert_called_once_with(b'ls\r')
+
+
+@mock.patch.object(pool, 'pooled_connection')
+@mock.patch.object(utils, 'get_libvirt_domain')
+class AsyncPowerTestCase(base.TestCase):
+
+    def setUp(self):
+        super(AsyncPowerTestCase, self).setUp()
+        mock.patch('pyghmi.ipmi.bmc.Bmc.__init__', _bmc_init).start()
+        mock.patch.object(events, 'get_domain_cache', autospec=True,
+                          return_value=None).start()
+        mock.patch.object(coalesce, 'get_coalescer', autospec=True,
+                          return_value=None).start()
+        mock.patch.object(events, 'start_event_loop', autospec=True).start()
+        mock.patch.dict(vbmc.CONF['ipmi'],
+                        {'boot_device_flush_delay': 0,
+                         'async_power': True}).start()
+        # Power operations run when the test says so
+        self.calls = []
+        self.mock_executor = mock.patch.object(
+            deadline, 'get_executor', autospec=True).start()
+        self.mock_executor.return_value.submit.side_effect = self._submit
+        self.mock_executor.return_value.run.side_effect = (
+            lambda call, func, timeout: func())
+        self.mock_scheduler = mock.patch.object(
+            scheduler, 'get_scheduler', autospec=True).start()
+        self.mock_scheduler.return_value.submit.side_effect = self._submit
+        self.vbmc = vbmc.VirtualBMC(**test_utils.get_domain())
+        self.vbmc._slot = 7
+
+    def _submit(self, call, func, *args, **kwargs):
+        future = concurrent.futures.Future()
+        self.calls.append((call, func, future))
+        return future
+
+    def _complete(self):
+        call, func, future = self.calls.pop(0)
+        try:
+            future.set_result(func())
+        except Exception as e:
+            future.set_exception(e)
+
+    def test_power_on(self, mock_libvirt_domain, mock_libvirt_open):
+        domain = mock_libvirt_domain.return_value
+        domain.isActive.return_value = False
+
+        self.assertIsNone(self.vbmc.power_on())
+        domain.create.assert_not_called()
+        self.assertEqual(vbmc.POWERON, self.vbmc.get_power_state())
+
+        self._complete()
+        domain.create.assert_called_once_with()
+        self.assertIsNone(self.vbmc._pending_power)
+        # Back to asking libvirt
+        mock_libvirt_open.reset_mock()
+        self.vbmc.get_power_state()
+        mock_libvirt_open.assert_called_once_with(
+            readonly=True, **self.vbmc._conn_args)
+
+    def test_power_on_repeated(self, mock_libvirt_domain, mock_libvirt_open):
+        domain = mock_libvirt_domain.return_value
+        domain.isActive.return_value = False
+
+        self.assertIsNone(self.vbmc.power_on())
+        self.assertIsNone(self.vbmc.power_on())
+
+        self.assertEqual(1, len(self.calls))
+        self._complete()
+        domain.create.assert_called_once_with()
+
+    def test_power_off_while_powering_on(self, mock_libvirt_domain,
+                                         mock_libvirt_open):
+        self.vbmc.power_on()
+
+        self.assertEqual(0xC0, self.vbmc.power_off())
+        self.assertEqual(vbmc.POWERON, self.vbmc.get_power_state())
+        self.assertEqual(1, len(self.calls))
+
+    def test_power_off_pending_state(self, mock_libvirt_domain,
+                                     mock_libvirt_open):
+        mock_libvirt_domain.return_value.isActive.return_value = True
+
+        self.assertIsNone(self.vbmc.power_shutdown())
+
+        self.assertEqual(vbmc.POWEROFF, self.vbmc.get_power_state())
+        mock_libvirt_open.assert_not_called()
+
+    def test_power_on_error(self, mock_libvirt_domain, mock_libvirt_open):
+        domain = mock_libvirt_domain.return_value
+        domain.isActive.return_value = False
+        domain.create.side_effect = libvirt.libvirtError('boom')
+
+        self.assertIsNone(self.vbmc.power_on())
+        self._complete()
+
+        # Done with, the next request is carried out
+        self.assertIsNone(self.vbmc.power_on())
+        self.assertEqual(1, len(self.calls))
+
+    def test_power_off_busy(self, mock_libvirt_domain, mock_libvirt_open):
+        self.mock_executor.return_value.submit.side_effect = (
+            exception.LibvirtBusy(call='power_off'))
+
+        self.assertEqual(0xC0, self.vbmc.power_off())
+        self.assertIsNone(self.vbmc._pending_power)
+
+    def test_power_on_scheduled(self, mock_libvirt_domain, mock_libvirt_open):
+        self.vbmc.power_on()
+
+        self.mock_scheduler.return_value.submit.assert_called_once_with(
+            'power_on', mock.ANY, self.vbmc._conn_args['uri'], slot=7)
+        self.mock_executor.return_value.submit.assert_not_called()
+
+    def test_power_on_flushes_boot_device(self, mock_libvirt_domain,
+                                          mock_libvirt_open):
+        domain = mock_libvirt_domain.return_value
+        domain.isActive.return_value = False
+        self.vbmc._pending_boot_device = 'network'
+
+        with mock.patch.object(self.vbmc, '_apply_boot_device',
+                               autospec=True, return_value=None) as mock_apply:
+            self.assertIsNone(self.vbmc.power_on())
+            mock_apply.assert_not_called()
+
+            self._complete()
+
+        mock_apply.assert_called_once_with('network')
+        domain.create.assert_called_once_with()
+
+    def test_power_on_boot_device_error(self, mock_libvirt_domain,
+                                        mock_libvirt_open):
+        self.vbmc._pending_boot_device = 'network'
+
+        with mock.patch.object(self.vbmc, '_apply_boot_device',
+                               autospec=True, return_value=0xC0):
+            self.vbmc.power_on()
+            future = self.calls[0][2]
+            with mock.patch.object(vbmc.LOG, 'error',
+                                   autospec=True) as mock_error:
+                self._complete()
+
+        mock_libvirt_domain.return_value.create.assert_not_called()
+        self.assertIsInstance(future.exception(), exception.VirtualBMCError)
+        mock_error.assert_called_once_with(mock.ANY, {
+            'call': 'power_on', 'domain': self.vbmc.domain_name,
+            'error': future.exception()})
+
+
+class CompletionCodeTestCase(base.TestCase):
+
+    def _libvirt_error(self, code):
+        error = libvirt.libvirtError('boom')
+        error.get_error_code = mock.Mock(return_value=code)
+        return error
+
+    def test_transient(self):
+        self.assertEqual(0xC0, vbmc.completion_code(
+            self._libvirt_error(libvirt.VIR_ERR_SYSTEM_ERROR)))
+        self.assertEqual(0xC0, vbmc.completion_code(
+            exception.LibvirtUnavailable(uri='fake:///krusty-krab')))
+        self.assertEqual(0xC0, vbmc.completion_code(
+            exception.LibvirtCallTimeout(call='power_on', timeout=3)))
+
+    def test_permanent(self):
+        self.assertEqual(0xD5, vbmc.completion_code(
+            self._libvirt_error(libvirt.VIR_ERR_OPERATION_INVALID)))
+        self.assertEqual(0xC1, vbmc.completion_code(
+            self._libvirt_error(libvirt.VIR_ERR_NO_SUPPORT)))
+        self.assertEqual(0xD4, vbmc.completion_code(
+            self._libvirt_error(libvirt.VIR_ERR_OPERATION_DENIED)))
+        self.assertEqual(0xD5, vbmc.completion_code(
+            exception.DomainNotFound(domain='SpongeBob')))
+
+    def test_domain_lookup_failed(self):
+        try:
+            try:
+                raise self._libvirt_error(libvirt.VIR_ERR_RPC)
+            except libvirt.libvirtError:
+                raise exception.DomainNotFound(domain='SpongeBob')
+        except exception.DomainNotFound as e:
+            error = e
+
+        self.assertEqual(0xC0, vbmc.completion_code(error))
+
+    def test_wrapped(self):
+        try:
+            try:
+                raise exception.DomainNotFound(domain='SpongeBob')
+            except exception.DomainNotFound as e:
+                raise exception.VirtualBMCError(message='boom') from e
+        except exception.VirtualBMCError as e:
+            error = e
+
+        self.assertEqual(0xD5, vbmc.completion_code(error))
+
+    def test_unknown(self):
+        self.assertEqual(0xC0, vbmc.completion_code(ValueError('boom')))
@@ -0,0 +1,415 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import multiprocessing
+from unittest import mock
+
+from virtualbmc import exception
+from virtualbmc.tests.unit import base
+from virtualbmc.tests.unit import utils as test_utils
+from virtualbmc import worker
+
+
+class BMCHostTestCase(base.TestCase):
+
+    def setUp(self):
+        super(BMCHostTestCase, self).setUp()
+        self.conf = {'ipmi': {'shared_port': 0, 'shared_address': '::'}}
+        mock.patch('virtualbmc.router.CONF', self.conf).start()
+        mock.patch('virtualbmc.worker.CONF', self.conf).start()
+        self.mock_session = mock.patch.object(
+            worker.ipmisession, 'Session').start()
+        self.mock_session.bmc_handlers = {}
+        self.iosockets = []
+        mock.patch.object(worker.ipmisession, 'iosockets',
+                          self.iosockets).start()
+        self.mock_io_wait = mock.patch.object(
+            worker.ipmisession, '_io_wait', create=True).start()
+        self.mock_vbmc = mock.patch.object(worker, 'VirtualBMC').start()
+        self.domain = test_utils.get_domain()
+        self.host = worker.BMCHost()
+
+    def _start(self):
+        vbmc = self.mock_vbmc.return_value
+        vbmc.port = self.domain['port']
+        self.host.start(self.domain['domain_name'], self.domain)
+        self.mock_session.bmc_handlers[vbmc.serversocket] = {0: vbmc}
+        self.iosockets.append(vbmc.serversocket)
+        return vbmc
+
+    def test_start(self):
+        vbmc = self._start()
+
+        self.mock_session._assignsocket.assert_called_once_with()
+        self.mock_vbmc.assert_called_once_with(**self.domain)
+        self.assertEqual({'SpongeBob': vbmc}, self.host.bmcs)
+
+    def test_stop(self):
+        vbmc = self._start()
+        session = mock.Mock(bmc=vbmc)
+        other_session = mock.Mock(bmc=mock.Mock())
+        self.mock_session.bmc_handlers[('::1', 4242)] = {
+            vbmc.port: session, 624: other_session}
+
+        self.host.stop(self.domain['domain_name'])
+
+        vbmc.flush_boot_device.assert_called_once_with()
+        vbmc.close_console.assert_called_once_with()
+        self.assertEqual({('::1', 4242): {624: other_session}},
+                         self.mock_session.bmc_handlers)
+        self.assertEqual([], self.iosockets)
+        # the socket is only closed once the I/O thread let go of it
+        vbmc.serversocket.close.assert_not_called()
+
+        self.host.serve(1)
+
+        self.mock_io_wait.assert_called_once_with(0)
+        vbmc.serversocket.close.assert_called_once_with()
+
+    def test_stop_unknown(self):
+        self.host.stop('Patrick')
+        self.host.serve(1)
+
+        self.mock_io_wait.assert_not_called()
+
+    @mock.patch.object(worker.router, 'SharedEndpoint', autospec=True)
+    def test_start_shared(self, mock_endpoint):
+        self.conf['ipmi']['shared_port'] = 623
+        endpoint = mock_endpoint.return_value
+        endpoint.bmcs = {'admin': mock.Mock()}
+        shared_domain = test_utils.get_domain(port=623)
+
+        self.host.start('SpongeBob', shared_domain)
+        self.host.start('Patrick', test_utils.get_domain(port=321))
+
+        mock_endpoint.assert_called_once_with(port=623, address='::')
+        self.mock_vbmc.assert_has_calls(
+            [mock.call(endpoint=endpoint, **shared_domain),
+             mock.call(**test_utils.get_domain(port=321))])
+        self.assertIs(endpoint, self.host.endpoint)
+
+    @mock.patch.object(worker.router, 'SharedEndpoint', autospec=True)
+    def test_stop_shared(self, mock_endpoint):
+        self.conf['ipmi']['shared_port'] = 623
+        endpoint = mock_endpoint.return_value
+        endpoint.port = 623
+        endpoint.serversocket = mock.Mock()
+        endpoint.bmcs = {'admin': mock.Mock()}
+        vbmc = self.mock_vbmc.return_value
+        vbmc.serversocket = endpoint.serversocket
+        vbmc.port = 623
+        self.mock_session.bmc_handlers[endpoint.serversocket] = {
+            0: endpoint}
+        session = mock.Mock(bmc=vbmc)
+        self.mock_session.bmc_handlers[('::1', 4242)] = {623: session}
+
+        self.host.start('SpongeBob', test_utils.get_domain(port=623))
+        self.host.stop('SpongeBob')
+
+        endpoint.release.assert_called_once_with(vbmc)
+        self.assertEqual({('::1', 4242): {}},
+                         {k: v for k, v in
+                          self.mock_session.bmc_handlers.items()
+                          if k != endpoint.serversocket})
+        # other instances are still served by the endpoint
+        self.assertIs(endpoint, self.host.endpoint)
+        self.host.serve(1)
+        endpoint.serversocket.close.assert_not_called()
+
+        # the last instance served by the endpoint goes away
+        endpoint.release.side_effect = lambda vbmc: endpoint.bmcs.clear()
+        self.host.start('SpongeBob', test_utils.get_domain(port=623))
+        self.host.stop('SpongeBob')
+
+        self.assertIsNone(self.host.endpoint)
+        self.host.serve(1)
+        endpoint.serversocket.close.assert_called_once_with()
+
+    def test_serve(self):
+        self.host.serve(1)
+        self.mock_session.wait_for_rsp.assert_not_called()
+
+        self._start()
+        self.host.serve(1)
+        self.mock_session.wait_for_rsp.assert_called_once_with(timeout=1)
+
+
+class WorkerRunnerTestCase(base.TestCase):
+
+    def setUp(self):
+        super(WorkerRunnerTestCase, self).setUp()
+        conf = {'ipmi': {'session_timeout': 10},
+                'default': {'show_passwords': False}}
+        mock.patch('virtualbmc.worker.CONF', conf).start()
+        mock.patch('signal.signal').start()
+        self.mock_host = mock.patch.object(
+            worker, 'BMCHost', autospec=True).start().return_value
+        self.mock_host.bmcs = {}
+        self.domain = test_utils.get_domain()
+        self.conn = mock.Mock()
+
+    def _run(self, *messages):
+        # the manager going away ends the loop
+        self.conn.poll.side_effect = [True] * len(messages) + [False, True]
+        self.conn.recv.side_effect = list(messages) + [EOFError]
+        worker.worker_runner(self.conn)
+
+    def test_worker_runner(self):
+        self._run((worker.START, 'SpongeBob', self.domain),
+                  (worker.STOP, 'SpongeBob', None))
+
+        self.mock_host.start.assert_called_once_with('SpongeBob',
+                                                     self.domain)
+        self.mock_host.stop.assert_called_once_with('SpongeBob')
+        self.conn.send.assert_called_once_with(
+            (worker.STARTED, 'SpongeBob', None))
+        self.mock_host.shutdown.assert_called_once_with()
+
+    def test_worker_runner_start_error(self):
+        self.mock_host.start.side_effect = OSError('Address in use')
+
+        self._run((worker.START, 'SpongeBob', self.domain))
+
+        self.conn.send.assert_called_once_with(
+            (worker.FAILED, 'SpongeBob', 'Address in use'))
+
+
+@mock.patch.object(multiprocessing, 'Pipe')
+@mock.patch.object(multiprocessing, 'Process')
+class BMCWorkerTestCase(base.TestCase):
+
+    def _worker(self, mock_process, mock_pipe):
+        self.conn = mock.Mock()
+        self.child_conn = mock.Mock()
+        mock_pipe.return_value = self.conn, self.child_conn
+        return worker.BMCWorker('vbmcd-worker')
+
+    def test_start_bmc(self, mock_process, mock_pipe):
+        bmc_worker = self._worker(mock_process, mock_pipe)
+        domain = test_utils.get_domain()
+
+        mock_process.assert_called_once_with(
+            name='vbmcd-worker', target=worker.worker_runner,
+            args=(self.child_conn,))
+        mock_process.return_value.start.assert_called_once_with()
+        self.child_conn.close.assert_called_once_with()
+
+        handle = bmc_worker.start_bmc('SpongeBob', domain)
+
+        self.conn.send.assert_called_once_with(
+            (worker.START, 'SpongeBob', domain))
+        self.conn.poll.return_value = False
+        self.assertTrue(handle.is_alive())
+        self.assertIsNone(handle.exitcode)
+
+    def test_start_bmc_failed(self, mock_process, mock_pipe):
+        bmc_worker = self._worker(mock_process, mock_pipe)
+        handle = bmc_worker.start_bmc('SpongeBob', test_utils.get_domain())
+
+        self.conn.poll.side_effect = [True, False, False]
+        self.conn.recv.return_value = (worker.FAILED, 'SpongeBob', 'boom')
+
+        self.assertFalse(handle.is_alive())
+        self.assertEqual(1, handle.exitcode)
+
+    def test_worker_died(self, mock_process, mock_pipe):
+        bmc_worker = self._worker(mock_process, mock_pipe)
+        handle = bmc_worker.start_bmc('SpongeBob', test_utils.get_domain())
+
+        mock_process.return_value.is_alive.return_value = False
+        mock_process.return_value.exitcode = -9
+
+        self.assertFalse(handle.is_alive())
+        self.assertEqual(-9, handle.exitcode)
+
+    def test_terminate_handle(self, mock_process, mock_pipe):
+        bmc_worker = self._worker(mock_process, mock_pipe)
+        handle = bmc_worker.start_bmc('SpongeBob', test_utils.get_domain())
+
+        handle.terminate()
+
+        self.conn.send.assert_called_with((worker.STOP, 'SpongeBob', None))
+        self.assertEqual({}, bmc_worker.domains)
+
+    def test_sentinels(self, mock_process, mock_pipe):
+        bmc_worker = self._worker(mock_process, mock_pipe)
+        mock_process.return_value.sentinel = 7
+        self.conn.fileno.return_value = 8
+
+        self.assertEqual((7, 8), bmc_worker.sentinels())
+
+    def test_terminate(self, mock_process, mock_pipe):
+        bmc_worker = self._worker(mock_process, mock_pipe)
+        mock_process.return_value.is_alive.return_value = True
+
+        bmc_worker.terminate()
+
+        self.conn.close.assert_called_once_with()
+        mock_process.return_value.terminate.assert_called_once_with()
+        mock_process.return_value.join.assert_called_once_with()
+
+
+class HashRingTestCase(base.TestCase):
+
+    def setUp(self):
+        super(HashRingTestCase, self).setUp()
+        self.ring = worker.HashRing()
+        self.keys = ['domain-%d' % i for i in range(200)]
+
+    def test_get_empty(self):
+        self.assertIsNone(self.ring.get('SpongeBob'))
+
+    def test_add(self):
+        for node in ('w0', 'w1', 'w2'):
+            self.ring.add(node)
+        self.ring.add('w0')
+
+        self.assertEqual(3, len(self.ring))
+        self.assertIn('w1', self.ring)
+        placement = [self.ring.get(key) for key in self.keys]
+        self.assertEqual({'w0', 'w1', 'w2'}, set(placement))
+        self.assertEqual(placement, [self.ring.get(key) for key in self.keys])
+
+    def test_remove_only_moves_removed_node_keys(self):
+        for node in ('w0', 'w1', 'w2'):
+            self.ring.add(node)
+        before = {key: self.ring.get(key) for key in self.keys}
+
+        self.ring.remove('w1')
+        self.ring.remove('w1')
+
+        self.assertNotIn('w1', self.ring)
+        for key in self.keys:
+            if before[key] == 'w1':
+                self.assertIn(self.ring.get(key), ('w0', 'w2'))
+            else:
+                self.assertEqual(before[key], self.ring.get(key))
+
+
+@mock.patch.object(worker, 'BMCWorker', autospec=True)
+class WorkerPoolTestCase(base.TestCase):
+
+    def setUp(self):
+        super(WorkerPoolTestCase, self).setUp()
+        self.conf = {'ipmi': {'shared_port': 0}}
+        mock.patch('virtualbmc.router.CONF', self.conf).start()
+
+    def _worker(self, name):
+        bmc_worker = mock.Mock(domains={})
+        bmc_worker.name = name
+        bmc_worker.is_alive.return_value = True
+
+        def start_bmc(domain_name, bmc_config):
+            bmc_worker.domains[domain_name] = worker.START
+            return mock.Mock(worker=bmc_worker)
+
+        bmc_worker.start_bmc.side_effect = start_bmc
+        return bmc_worker
+
+    def test_init(self, mock_worker):
+        mock_worker.side_effect = self._worker
+        worker_pool = worker.WorkerPool(3)
+
+        mock_worker.assert_has_calls([mock.call('vbmcd-worker-0'),
+                                      mock.call('vbmcd-worker-1'),
+                                      mock.call('vbmcd-worker-2')])
+        self.assertEqual(3, len(worker_pool.ring))
+
+    def test_start_bmc(self, mock_worker):
+        mock_worker.side_effect = self._worker
+        worker_pool = worker.WorkerPool(2)
+
+        handle = worker_pool.start_bmc('SpongeBob', test_utils.get_domain())
+
+        owner = worker_pool.ring.get('SpongeBob')
+        self.assertIs(worker_pool.workers[owner], handle.worker)
+
+    def test_maintain_replaces_dead_worker(self, mock_worker):
+        mock_worker.side_effect = self._worker
+        worker_pool = worker.WorkerPool(2)
+        dead = worker_pool.workers['vbmcd-worker-1']
+        dead.is_alive.return_value = False
+
+        worker_pool.maintain()
+
+        dead.terminate.assert_called_once_with()
+        self.assertIsNot(dead, worker_pool.workers['vbmcd-worker-1'])
+        self.assertIn('vbmcd-worker-1', worker_pool.ring)
+
+    def test_maintain_rebalances(self, mock_worker):
+        mock_worker.side_effect = self._worker
+        worker_pool = worker.WorkerPool(2)
+        domains = ['domain-%d' % i for i in range(20)]
+        for domain_name in domains:
+            worker_pool.start_bmc(domain_name, {})
+
+        # the replacement of worker 1 fails to start
+        worker_pool.workers['vbmcd-worker-1'].is_alive.return_value = False
+        mock_worker.side_effect = OSError('Resource temporarily unavailable')
+        worker_pool.maintain()
+
+        self.assertNotIn('vbmcd-worker-1', worker_pool.ring)
+        self.assertNotIn('vbmcd-worker-1', worker_pool.workers)
+        survivor = worker_pool.workers['vbmcd-worker-0']
+        for domain_name in domains:
+            self.assertEqual('vbmcd-worker-0',
+                             worker_pool.ring.get(domain_name))
+            # the manager restarts the instances of the dead worker
+            if domain_name not in survivor.domains:
+                worker_pool.start_bmc(domain_name, {})
+
+        # worker 1 is back, the instances it owns move away from worker 0
+        mock_worker.side_effect = self._worker
+        worker_pool.maintain()
+
+        moved = [domain_name for domain_name in domains
+                 if worker_pool.ring.get(domain_name) == 'vbmcd-worker-1']
+        self.assertTrue(moved)
+        survivor.stop_bmc.assert_has_calls(
+            [mock.call(domain_name) for domain_name in moved],
+            any_order=True)
+        self.assertEqual(len(moved), survivor.stop_bmc.call_count)
+
+    def test_sentinels(self, mock_worker):
+        mock_worker.side_effect = self._worker
+        worker_pool = worker.WorkerPool(2)
+        worker_pool.workers['vbmcd-worker-0'].sentinels.return_value = (1, 2)
+        worker_pool.workers['vbmcd-worker-1'].sentinels.return_value = (3, 4)
+
+        self.assertEqual({1, 2, 3, 4}, worker_pool.sentinels())
+
+    def test_maintain_polls_workers(self, mock_worker):
+        mock_worker.side_effect = self._worker
+        worker_pool = worker.WorkerPool(2)
+
+        worker_pool.maintain()
+
+        for bmc_worker in worker_pool.workers.values():
+            bmc_worker.poll.assert_called_once_with()
+
+    def test_start_bmc_no_worker(self, mock_worker):
+        mock_worker.side_effect = OSError('Resource temporarily unavailable')
+        worker_pool = worker.WorkerPool(1)
+
+        self.assertRaises(exception.VirtualBMCError,
+                          worker_pool.start_bmc, 'SpongeBob', {})
+
+    def test_terminate(self, mock_worker):
+        mock_worker.side_effect = self._worker
+        worker_pool = worker.WorkerPool(2)
+        workers = list(worker_pool.workers.values())
+
+        worker_pool.terminate()
+
+        for bmc_worker in workers:
+            bmc_worker.terminate.assert_called_once_with()
+        self.assertEqual({}, worker_pool.workers)
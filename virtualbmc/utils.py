@@ -12,12 +12,48 @@
 
 import os
 import sys
+import xml.etree.ElementTree as ET
 
 import libvirt
 
 from virtualbmc import exception
 
 
+def open_libvirt_connection(uri, sasl_username=None, sasl_password=None,
+                            readonly=False):
+    """Open a new libvirt connection.
+
+    :param uri: The libvirt URI
+    :param sasl_username: The libvirt SASL username
+    :param sasl_password: The libvirt SASL password
+    :param readonly: Whether to open a read-only connection
+    :returns: A libvirt connection object
+    :raises: LibvirtConnectionOpenError if the connection failed
+    """
+    try:
+        if sasl_username and sasl_password:
+
+            def request_cred(credentials, user_data):
+                for credential in credentials:
+                    if credential[0] == libvirt.VIR_CRED_AUTHNAME:
+                        credential[4] = sasl_username
+                    elif credential[0] == libvirt.VIR_CRED_PASSPHRASE:
+                        credential[4] = sasl_password
+                return 0
+
+            auth = [[libvirt.VIR_CRED_AUTHNAME,
+                     libvirt.VIR_CRED_PASSPHRASE], request_cred, None]
+            flags = libvirt.VIR_CONNECT_RO if readonly else 0
+            return libvirt.openAuth(uri, auth, flags)
+        elif readonly:
+            return libvirt.openReadOnly(uri)
+        else:
+            return libvirt.open(uri)
+
+    except libvirt.libvirtError as e:
+        raise exception.LibvirtConnectionOpenError(uri=uri, error=e)
+
+
 class libvirt_open(object):
 
     def __init__(self, uri, sasl_username=None, sasl_password=None,
@@ -28,30 +64,10 @@ class libvirt_open(object):
         self.readonly = readonly
 
     def __enter__(self):
-        try:
-            if self.sasl_username and self.sasl_password:
-
-                def request_cred(credentials, user_data):
-                    for credential in credentials:
-                        if credential[0] == libvirt.VIR_CRED_AUTHNAME:
-                            credential[4] = self.sasl_username
-                        elif credential[0] == libvirt.VIR_CRED_PASSPHRASE:
-                            credential[4] = self.sasl_password
-                    return 0
-
-                auth = [[libvirt.VIR_CRED_AUTHNAME,
-                         libvirt.VIR_CRED_PASSPHRASE], request_cred, None]
-                flags = libvirt.VIR_CONNECT_RO if self.readonly else 0
-                self.conn = libvirt.openAuth(self.uri, auth, flags)
-            elif self.readonly:
-                self.conn = libvirt.openReadOnly(self.uri)
-            else:
-                self.conn = libvirt.open(self.uri)
-
-            return self.conn
-
-        except libvirt.libvirtError as e:
-            raise exception.LibvirtConnectionOpenError(uri=self.uri, error=e)
+        self.conn = open_libvirt_connection(
+            self.uri, sasl_username=self.sasl_username,
+            sasl_password=self.sasl_password, readonly=self.readonly)
+        return self.conn
 
     def __exit__(self, type, value, traceback):
         self.conn.close()
@@ -64,6 +80,39 @@ def get_libvirt_domain(conn, domain):
         raise exception.DomainNotFound(domain=domain)
 
 
+def get_os_boot_device(domain_xml, chunk_size=4096):
+    """Extract the first ``os/boot`` device from a domain XML.
+
+    The ``os`` element comes early in the domain XML, so rather than
+    building a tree of the whole (possibly tens of kilobytes long)
+    document, it is parsed incrementally and parsing stops as soon as
+    the ``os`` element is over.
+
+    :param domain_xml: The domain XML description
+    :param chunk_size: Number of characters fed to the parser at once
+    :returns: The ``dev`` attribute of the first boot element or None
+    """
+    parser = ET.XMLPullParser(events=('start', 'end'))
+    path = []
+
+    for offset in range(0, len(domain_xml), chunk_size):
+        parser.feed(domain_xml[offset:offset + chunk_size])
+
+        for event, element in parser.read_events():
+            if event == 'end':
+                path.pop()
+                if element.tag == 'os':
+                    return None
+                continue
+
+            if element.tag == 'boot' and path and path[-1] == 'os':
+                return element.attrib.get('dev')
+
+            path.append(element.tag)
+
+    return None
+
+
 def check_libvirt_connection_and_domain(uri, domain, sasl_username=None,
                                         sasl_password=None):
     with libvirt_open(uri, readonly=True, sasl_username=sasl_username,
@@ -10,17 +10,34 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import contextlib
+import functools
+import struct
+import threading
+import time
 import xml.etree.ElementTree as ET
 
 import libvirt
 import pyghmi.ipmi.bmc as bmc
 
+from virtualbmc import breaker
+from virtualbmc import coalesce
+from virtualbmc import config as vbmc_config
+from virtualbmc import deadline
+from virtualbmc import events
 from virtualbmc import exception
 from virtualbmc import log
+from virtualbmc import metrics
+from virtualbmc import pool
+from virtualbmc import scheduler
+from virtualbmc import sensors
+from virtualbmc import sol
 from virtualbmc import utils
 
 LOG = log.get_logger()
 
+CONF = vbmc_config.get_config()
+
 # Power states
 POWEROFF = 0
 POWERON = 1
@@ -31,8 +48,47 @@ POWERON = 1
 #
 # Command failed and can be retried
 IPMI_COMMAND_NODE_BUSY = 0xC0
+# Invalid command
+IPMI_INVALID_COMMAND = 0xC1
 # Invalid data field in request
 IPMI_INVALID_DATA = 0xcc
+# Insufficient privilege level
+IPMI_INSUFFICIENT_PRIVILEGE = 0xD4
+# Command not supported in present state
+IPMI_NOT_SUPPORTED_IN_STATE = 0xD5
+# Payload already active on another session
+IPMI_PAYLOAD_ACTIVE = 0x80
+# Payload type disabled
+IPMI_PAYLOAD_DISABLED = 0x81
+
+# Completion codes of the libvirt errors retrying would not help with
+PERMANENT_ERRORS = {
+    libvirt.VIR_ERR_NO_DOMAIN: IPMI_NOT_SUPPORTED_IN_STATE,
+    libvirt.VIR_ERR_OPERATION_INVALID: IPMI_NOT_SUPPORTED_IN_STATE,
+    libvirt.VIR_ERR_NO_SUPPORT: IPMI_INVALID_COMMAND,
+    libvirt.VIR_ERR_OPERATION_UNSUPPORTED: IPMI_INVALID_COMMAND,
+    libvirt.VIR_ERR_CONFIG_UNSUPPORTED: IPMI_INVALID_COMMAND,
+    libvirt.VIR_ERR_OPERATION_DENIED: IPMI_INSUFFICIENT_PRIVILEGE,
+}
+
+# Power state domains are headed for while power operations are pending
+POWER_TARGETS = {
+    'power_on': POWERON,
+    'power_reset': POWERON,
+    'power_off': POWEROFF,
+    'power_shutdown': POWEROFF,
+}
+
+# Get Chassis Status answers by power state: no power fault, no power
+# restore policy, no last power event, no front panel lockout or button
+# support
+CHASSIS_STATUS = {
+    POWEROFF: bytes((POWEROFF, 0, 0)),
+    POWERON: bytes((POWERON, 0, 0)),
+}
+
+# Get Device ID request (netfn, command)
+GET_DEVICE_ID = (0x06, 0x01)
 
 # Boot device maps
 GET_BOOT_DEVICES_MAP = {
@@ -48,17 +104,107 @@ SET_BOOT_DEVICES_MAP = {
 }
 
 
+def completion_code(error):
+    """Pick the IPMI completion code to answer a failed command with.
+
+    Failures a retry may get past are answered with "node busy", so that
+    the client tries again.
+
+    :param error: The exception the command failed with
+    """
+    if breaker.is_transient(error):
+        return IPMI_COMMAND_NODE_BUSY
+
+    code = PERMANENT_ERRORS.get(breaker.libvirt_error_code(error))
+    if code is not None:
+        return code
+
+    if any(isinstance(cause, exception.DomainNotFound)
+           for cause in breaker.causes(error)):
+        return IPMI_NOT_SUPPORTED_IN_STATE
+
+    return IPMI_COMMAND_NODE_BUSY
+
+
 class VirtualBMC(bmc.Bmc):
 
     def __init__(self, username, password, port, address,
                  domain_name, libvirt_uri, libvirt_sasl_username=None,
-                 libvirt_sasl_password=None, **kwargs):
-        super(VirtualBMC, self).__init__({username: password},
-                                         port=port, address=address)
+                 libvirt_sasl_password=None, endpoint=None, slot=None,
+                 **kwargs):
+        if endpoint is None:
+            super(VirtualBMC, self).__init__({username: password},
+                                             port=port, address=address)
+        else:
+            # Served through a shared IPMI endpoint routing sessions by
+            # user name rather than through a socket of its own
+            endpoint.adopt(self, username, password)
+
         self.domain_name = domain_name
+        self._slot = slot
         self._conn_args = {'uri': libvirt_uri,
                            'sasl_username': libvirt_sasl_username,
                            'sasl_password': libvirt_sasl_password}
+        # NOTE: the event loop has to be running before the first libvirt
+        # connection of this process is opened
+        self._cache = events.get_domain_cache()
+        self._coalescer = coalesce.get_coalescer()
+        # Handles of the domain by pooled connection (read-only or not)
+        self._domain_lock = threading.Lock()
+        self._domain_handles = {}
+        self._domain_uuid = None
+        self._domain_definition = None
+        self._boot_lock = threading.Lock()
+        self._boot_flush_timer = None
+        self._pending_boot_device = None
+        # Power operation in progress in the background, if any
+        self._power_lock = threading.Lock()
+        self._pending_power = None
+        # Forces the domain off unless it shuts down in time
+        self._soft_off_timer = None
+
+        self._sensors = None
+        if slot is not None and CONF['sensors']['enabled']:
+            # Readings older than a few collection intervals are stale
+            self._sensors = sensors.SensorDevice(
+                sensors.get_sensor_table(), slot,
+                max_age=3 * CONF['sensors']['interval'])
+            self.additionaldevices |= sensors.SDR_REPOSITORY_DEVICE
+
+        self._metrics = metrics.BMCMetrics()
+        if slot is not None and CONF['metrics']['enabled']:
+            self._metrics = metrics.BMCMetrics(metrics.get_metrics_table(),
+                                               slot)
+
+        self._console = None
+        if CONF['sol']['enabled']:
+            # Console streams are driven by the libvirt event loop
+            events.start_event_loop()
+            self._console = sol.ConsoleStream(
+                self.domain_name, self._conn_args,
+                buffer_size=CONF['sol']['buffer_size'],
+                retransmit_timeout=CONF['sol']['retransmit_timeout'],
+                on_close=self._console_closed)
+        else:
+            # pyghmi refuses to activate SOL without an I/O handler
+            self.iohandler = None
+
+        self._static_responses = self._encode_static_responses()
+
+    def _encode_static_responses(self):
+        """Encode the answers to requests not depending on the domain.
+
+        Discovery tools keep sending these to every instance, they are
+        answered without going through the pyghmi handlers.
+
+        :returns: The response data by (netfn, command)
+        """
+        device_id = struct.pack(
+            '<6BII', self.deviceid, self.revision, self.firmwaremajor,
+            self.firmwareminor, self.ipmiversion, self.additionaldevices,
+            self.mfgid, self.prodid)
+
+        return {GET_DEVICE_ID: device_id}
 
     # Copied from nova/virt/libvirt/guest.py
     def get_xml_desc(self, domain, dump_sensitive=False):
@@ -71,36 +217,344 @@ class VirtualBMC(bmc.Bmc):
         flags = dump_sensitive and libvirt.VIR_DOMAIN_XML_SECURE or 0
         return domain.XMLDesc(flags=flags)
 
+    @contextlib.contextmanager
+    def _libvirt(self, call, readonly=False):
+        """Borrow a pooled connection, measuring the calls made with it."""
+        with self._metrics.libvirt_call(call):
+            with pool.pooled_connection(readonly=readonly,
+                                        **self._conn_args) as conn:
+                try:
+                    yield conn
+
+                except Exception as e:
+                    if (breaker.libvirt_error_code(e)
+                            == libvirt.VIR_ERR_NO_DOMAIN):
+                        # The domain handle may be stale
+                        self._forget_domain()
+                    raise
+
+    @contextlib.contextmanager
+    def _libvirt_domain(self, call, readonly=False):
+        """Like :meth:`_libvirt`, providing the domain handle."""
+        with self._libvirt(call, readonly=readonly) as conn:
+            yield self._get_domain(conn, readonly=readonly)
+
+    def _bounded(self, call, func):
+        """Have func make libvirt calls within the deadline of call.
+
+        :raises: LibvirtCallTimeout past the deadline, LibvirtCallQueued
+            if the scheduler did not let the call through before it
+        """
+        if scheduler.admitted():
+            # Part of an operation the scheduler let through already
+            return func()
+
+        deadlines = CONF['deadlines']
+        timeout = deadlines.get(call, deadlines['default']) or None
+        uri = self._conn_args['uri']
+
+        if call in scheduler.HEAVY_CALLS and scheduler.limits(uri)[0]:
+            run = functools.partial(scheduler.get_scheduler().run,
+                                    uri=uri, slot=self._slot)
+        elif timeout is None:
+            return func()
+        else:
+            run = deadline.get_executor().run
+
+        try:
+            return run(call, func, timeout=timeout)
+
+        except exception.LibvirtCallTimeout as e:
+            # The call may be hanging on libvirtd
+            breaker.get_breaker(uri).record(e)
+            raise
+
+    def _domain_call(self, call, action, readonly=False):
+        """Call action with the domain handle, within the call deadline."""
+        def run():
+            with self._libvirt_domain(call, readonly=readonly) as domain:
+                return action(domain)
+
+        return self._bounded(call, run)
+
+    def _power_call(self, call, action, flush=False):
+        """Make a power operation on the domain.
+
+        With asynchronous power operations, the operation is only queued
+        and repeating it while in progress does nothing.
+
+        :param flush: Apply the pending boot device change first
+        :returns: None or an IPMI completion code if the pending boot
+            device change failed
+        :raises: PowerOperationPending if another power operation is in
+            progress
+        """
+        if call != 'power_shutdown' and self._stop_soft_off():
+            LOG.info('Soft power off of domain %(domain)s overridden by '
+                     'power operation %(call)s',
+                     {'domain': self.domain_name, 'call': call})
+
+        if not CONF['ipmi']['async_power']:
+            if flush:
+                rc = self.flush_boot_device()
+                if rc is not None:
+                    return rc
+
+            try:
+                self._domain_call(call, action)
+
+            finally:
+                self._invalidate('active')
+            return
+
+        with self._power_lock:
+            if self._pending_power is not None:
+                pending_call = self._pending_power[0]
+                if pending_call != call:
+                    raise exception.PowerOperationPending(
+                        call=pending_call, domain=self.domain_name)
+
+                LOG.debug('Power operation %(call)s is already in progress '
+                          'on domain %(domain)s',
+                          {'call': call, 'domain': self.domain_name})
+                return
+
+            def run():
+                if flush and self.flush_boot_device() is not None:
+                    # Not powering on with the wrong boot device
+                    msg = ('Not carrying out power operation %(call)s on '
+                           'domain %(domain)s, its boot device could not be '
+                           'set' % {'call': call, 'domain': self.domain_name})
+                    raise exception.VirtualBMCError(message=msg)
+
+                with self._libvirt_domain(call) as domain:
+                    action(domain)
+
+            if call in scheduler.HEAVY_CALLS:
+                # Queued behind the heavy operations of the other vBMC
+                # instances, without holding a libvirt call worker
+                future = scheduler.get_scheduler().submit(
+                    call, run, self._conn_args['uri'], slot=self._slot)
+            else:
+                future = deadline.get_executor().submit(call, run)
+            self._pending_power = call, future
+
+        future.add_done_callback(functools.partial(self._power_done, call))
+
+    def _power_done(self, call, future):
+        # Invalidated first, the pending operation makes up for the power
+        # state meanwhile
+        self._invalidate('active')
+        with self._power_lock:
+            self._pending_power = None
+
+        error = future.exception()
+        if error is not None:
+            LOG.error('Error carrying out power operation %(call)s on '
+                      'domain %(domain)s. Error: %(error)s',
+                      {'call': call, 'domain': self.domain_name,
+                       'error': error})
+
+    def _start_soft_off(self):
+        """Force the domain off unless it shuts down in time.
+
+        The domain powering off is noticed through its lifecycle events
+        when available, it is otherwise only checked once the timeout
+        expired.
+        """
+        timeout = CONF['ipmi']['soft_off_timeout']
+        if not timeout:
+            return
+
+        with self._power_lock:
+            if self._soft_off_timer is not None:
+                # The first soft power off command sets the deadline
+                return
+
+            timer = threading.Timer(timeout, self._escalate_soft_off)
+            timer.daemon = True
+            self._soft_off_timer = timer
+
+        if self._cache is not None and self._cache.watch(**self._conn_args):
+            self._cache.listen(self._conn_args['uri'], self.domain_name,
+                               self._lifecycle_event)
+
+        scheduler.get_scheduler_table().track_soft_off(
+            self._slot, time.monotonic() + timeout)
+        timer.start()
+
+        LOG.info('Domain %(domain)s is shutting down, forcing it off in '
+                 '%(timeout)s seconds otherwise',
+                 {'domain': self.domain_name, 'timeout': timeout})
+
+    def _stop_soft_off(self):
+        """Stop waiting for the domain to shut down.
+
+        :returns: True if the domain was being waited for
+        """
+        with self._power_lock:
+            timer, self._soft_off_timer = self._soft_off_timer, None
+
+        if timer is None:
+            return False
+
+        timer.cancel()
+        if self._cache is not None:
+            self._cache.unlisten(self._conn_args['uri'], self.domain_name,
+                                 self._lifecycle_event)
+        scheduler.get_scheduler_table().track_soft_off(self._slot)
+
+        return True
+
+    def _lifecycle_event(self, event, detail):
+        if (event == libvirt.VIR_DOMAIN_EVENT_STOPPED
+                and self._stop_soft_off()):
+            LOG.info('Domain %(domain)s has shut down',
+                     {'domain': self.domain_name})
+
+    def _escalate_soft_off(self):
+        if not self._stop_soft_off():
+            return
+
+        LOG.warning('Domain %(domain)s did not shut down within %(timeout)s '
+                    'seconds, forcing it off',
+                    {'domain': self.domain_name,
+                     'timeout': CONF['ipmi']['soft_off_timeout']})
+        self.power_off()
+
+    def _get_domain(self, conn, readonly=False):
+        """Return the handle of the domain on a pooled connection.
+
+        Looking the domain up takes a round trip to libvirtd, the handle
+        is kept for as long as the connection and the domain last. It is
+        looked up by UUID on new connections, by name the first time and
+        once the domain was undefined or renamed.
+        """
+        definition = None
+        if self._cache is not None:
+            definition = self._cache.definition(self._conn_args['uri'],
+                                                self.domain_name)
+
+        with self._domain_lock:
+            if definition != self._domain_definition:
+                self._domain_handles.clear()
+                self._domain_uuid = None
+                self._domain_definition = definition
+
+            handle = self._domain_handles.get(readonly)
+            if handle is not None and handle[0] is conn:
+                return handle[1]
+
+            uuid = self._domain_uuid
+
+        domain = None
+        if uuid is not None:
+            try:
+                domain = conn.lookupByUUIDString(uuid)
+
+            except libvirt.libvirtError as e:
+                if e.get_error_code() != libvirt.VIR_ERR_NO_DOMAIN:
+                    raise
+
+        if domain is None:
+            domain = utils.get_libvirt_domain(conn, self.domain_name)
+
+        with self._domain_lock:
+            if definition == self._domain_definition:
+                self._domain_uuid = domain.UUIDString()
+                self._domain_handles[readonly] = conn, domain
+
+        return domain
+
+    def _forget_domain(self):
+        with self._domain_lock:
+            self._domain_handles.clear()
+            self._domain_uuid = None
+
+    def _cached(self, field, fetcher):
+        """Answer a domain query from the event-fed cache if possible.
+
+        Otherwise, share the libvirt call with identical queries.
+        """
+        if self._coalescer is not None:
+            fetcher = functools.partial(
+                self._coalescer.fetch,
+                (self._conn_args['uri'], self.domain_name, field), fetcher)
+
+        if self._cache is None:
+            return fetcher()
+
+        if not self._cache.watch(**self._conn_args):
+            self._metrics.count(metrics.DOMAIN_CACHE_MISSES)
+            return fetcher()
+
+        fetched = []
+
+        def fetch():
+            fetched.append(True)
+            return fetcher()
+
+        value = self._cache.fetch(self._conn_args['uri'], self.domain_name,
+                                  field, fetch)
+        self._metrics.count(metrics.DOMAIN_CACHE_MISSES if fetched
+                            else metrics.DOMAIN_CACHE_HITS)
+        return value
+
+    def _invalidate(self, field):
+        """Forget a domain property a command may have changed."""
+        if self._coalescer is not None:
+            self._coalescer.invalidate(
+                (self._conn_args['uri'], self.domain_name, field))
+
+        if self._cache is not None:
+            self._cache.invalidate(self._conn_args['uri'],
+                                   self.domain_name, field)
+
+    def _get_os_boot_device(self):
+        return self._domain_call(
+            'get_boot_device',
+            lambda domain: utils.get_os_boot_device(domain.XMLDesc()),
+            readonly=True)
+
     def get_boot_device(self):
         LOG.debug('Get boot device called for %(domain)s',
                   {'domain': self.domain_name})
-        with utils.libvirt_open(readonly=True, **self._conn_args) as conn:
-            domain = utils.get_libvirt_domain(conn, self.domain_name)
-            boot_element = ET.fromstring(domain.XMLDesc()).find('.//os/boot')
-            boot_dev = None
-            if boot_element is not None:
-                boot_dev = boot_element.attrib.get('dev')
-            return GET_BOOT_DEVICES_MAP.get(boot_dev, 0)
+        boot_dev = self._pending_boot_device
+        if boot_dev is None:
+            boot_dev = self._cached('boot', self._get_os_boot_device)
+        return GET_BOOT_DEVICES_MAP.get(boot_dev, 0)
 
     def _remove_boot_elements(self, parent_element):
         for boot_element in parent_element.findall('boot'):
             parent_element.remove(boot_element)
 
-    def set_boot_device(self, bootdevice):
-        LOG.debug('Set boot device called for %(domain)s with boot '
-                  'device "%(bootdev)s"', {'domain': self.domain_name,
-                                           'bootdev': bootdevice})
-        device = SET_BOOT_DEVICES_MAP.get(bootdevice)
-        if device is None:
-            # Invalid data field in request
-            return IPMI_INVALID_DATA
+    @staticmethod
+    def _has_boot_device(tree, device):
+        """Tell whether a domain XML tree already boots from device only."""
+        if tree.findall('devices/*/boot'):
+            return False
 
-        try:
-            with utils.libvirt_open(**self._conn_args) as conn:
-                domain = utils.get_libvirt_domain(conn, self.domain_name)
+        os_elements = tree.findall('os')
+        return bool(os_elements) and all(
+            [boot.attrib for boot in os_element.findall('boot')]
+            == [{'dev': device}] for os_element in os_elements)
+
+    def _apply_boot_device(self, device):
+        def redefine():
+            with self._libvirt('set_boot_device') as conn:
+                domain = self._get_domain(conn)
                 tree = ET.fromstring(
                     self.get_xml_desc(domain, dump_sensitive=True))
 
+                if self._has_boot_device(tree, device):
+                    # Redefining the domain is slow and wakes up every
+                    # consumer of domain events on the host, skip it
+                    LOG.debug('Boot device of domain %(domain)s is already '
+                              '"%(bootdev)s", not redefining it',
+                              {'domain': self.domain_name,
+                               'bootdev': device})
+                    return
+
                 # Remove all "boot" element under "devices"
                 # They are mutually exclusive with "os/boot"
                 for device_element in tree.findall('devices/*'):
@@ -115,101 +569,268 @@ class VirtualBMC(bmc.Bmc):
                     boot_element.set('dev', device)
 
                 conn.defineXML(ET.tostring(tree, encoding="unicode"))
-        except Exception:
+
+        try:
+            self._bounded('set_boot_device', redefine)
+            self._invalidate('boot')
+
+        except Exception as e:
             LOG.error('Failed setting the boot device %(bootdev)s for '
-                      'domain %(domain)s', {'bootdev': device,
-                                            'domain': self.domain_name})
-            # Command failed, but let client to retry
-            return IPMI_COMMAND_NODE_BUSY
+                      'domain %(domain)s. Error: %(error)s',
+                      {'bootdev': device, 'domain': self.domain_name,
+                       'error': e})
+            return completion_code(e)
+
+    def flush_boot_device(self):
+        """Apply the pending boot device change, if any.
+
+        :returns: None on success or if nothing was pending, an IPMI
+            completion code otherwise
+        """
+        with self._boot_lock:
+            if self._boot_flush_timer is not None:
+                self._boot_flush_timer.cancel()
+                self._boot_flush_timer = None
+
+            device = self._pending_boot_device
+            if device is None:
+                return
+
+            rc = self._apply_boot_device(device)
+            if rc is None:
+                self._pending_boot_device = None
+
+            return rc
+
+    def set_boot_device(self, bootdevice):
+        LOG.debug('Set boot device called for %(domain)s with boot '
+                  'device "%(bootdev)s"', {'domain': self.domain_name,
+                                           'bootdev': bootdevice})
+        device = SET_BOOT_DEVICES_MAP.get(bootdevice)
+        if device is None:
+            # Invalid data field in request
+            return IPMI_INVALID_DATA
+
+        delay = CONF['ipmi']['boot_device_flush_delay']
+        if not delay:
+            return self._apply_boot_device(device)
+
+        # Clients typically set the boot device and power the domain on
+        # right after. Defer the change so that it gets applied with a
+        # single domain redefinition right before the power action (or
+        # once the delay expires), whatever number of times it was set.
+        with self._boot_lock:
+            self._pending_boot_device = device
+
+            if self._boot_flush_timer is None:
+                self._boot_flush_timer = threading.Timer(
+                    delay, self.flush_boot_device)
+                self._boot_flush_timer.daemon = True
+                self._boot_flush_timer.start()
+
+    def _is_active(self):
+        return self._domain_call(
+            'get_power_state', lambda domain: bool(domain.isActive()),
+            readonly=True)
 
     def get_power_state(self):
         LOG.debug('Get power state called for domain %(domain)s',
                   {'domain': self.domain_name})
+        with self._power_lock:
+            pending = self._pending_power
+        if pending is not None:
+            return POWER_TARGETS[pending[0]]
+
         try:
-            with utils.libvirt_open(readonly=True, **self._conn_args) as conn:
-                domain = utils.get_libvirt_domain(conn, self.domain_name)
-                if domain.isActive():
-                    return POWERON
+            active = self._cached('active', self._is_active)
+
         except Exception as e:
             msg = ('Error getting the power state of domain %(domain)s. '
                    'Error: %(error)s' % {'domain': self.domain_name,
                                          'error': e})
             LOG.error(msg)
-            raise exception.VirtualBMCError(message=msg)
+            raise exception.VirtualBMCError(message=msg) from e
 
-        return POWEROFF
+        return POWERON if active else POWEROFF
 
     def pulse_diag(self):
         LOG.debug('Power diag called for domain %(domain)s',
                   {'domain': self.domain_name})
+
+        def inject_nmi(domain):
+            if domain.isActive():
+                domain.injectNMI()
+
         try:
-            with utils.libvirt_open(**self._conn_args) as conn:
-                domain = utils.get_libvirt_domain(conn, self.domain_name)
-                if domain.isActive():
-                    domain.injectNMI()
+            self._domain_call('pulse_diag', inject_nmi)
         except Exception as e:
             LOG.error('Error powering diag the domain %(domain)s. '
                       'Error: %(error)s', {'domain': self.domain_name,
                                            'error': e})
-            # Command failed, but let client to retry
-            return IPMI_COMMAND_NODE_BUSY
+            return completion_code(e)
 
     def power_off(self):
         LOG.debug('Power off called for domain %(domain)s',
                   {'domain': self.domain_name})
+
+        def destroy(domain):
+            if domain.isActive():
+                domain.destroy()
+
         try:
-            with utils.libvirt_open(**self._conn_args) as conn:
-                domain = utils.get_libvirt_domain(conn, self.domain_name)
-                if domain.isActive():
-                    domain.destroy()
+            self._power_call('power_off', destroy)
         except Exception as e:
             LOG.error('Error powering off the domain %(domain)s. '
                       'Error: %(error)s', {'domain': self.domain_name,
                                            'error': e})
-            # Command failed, but let client to retry
-            return IPMI_COMMAND_NODE_BUSY
+            return completion_code(e)
 
     def power_on(self):
         LOG.debug('Power on called for domain %(domain)s',
                   {'domain': self.domain_name})
+
+        def create(domain):
+            if not domain.isActive():
+                domain.create()
+
         try:
-            with utils.libvirt_open(**self._conn_args) as conn:
-                domain = utils.get_libvirt_domain(conn, self.domain_name)
-                if not domain.isActive():
-                    domain.create()
+            return self._power_call('power_on', create, flush=True)
         except Exception as e:
             LOG.error('Error powering on the domain %(domain)s. '
                       'Error: %(error)s', {'domain': self.domain_name,
                                            'error': e})
-            # Command failed, but let client to retry
-            return IPMI_COMMAND_NODE_BUSY
+            return completion_code(e)
 
     def power_shutdown(self):
         LOG.debug('Soft power off called for domain %(domain)s',
                   {'domain': self.domain_name})
+
+        def shutdown(domain):
+            if domain.isActive():
+                domain.shutdown()
+                self._start_soft_off()
+
         try:
-            with utils.libvirt_open(**self._conn_args) as conn:
-                domain = utils.get_libvirt_domain(conn, self.domain_name)
-                if domain.isActive():
-                    domain.shutdown()
+            self._power_call('power_shutdown', shutdown)
         except Exception as e:
             LOG.error('Error soft powering off the domain %(domain)s. '
                       'Error: %(error)s', {'domain': self.domain_name,
                                            'error': e})
-            # Command failed, but let client to retry
-            return IPMI_COMMAND_NODE_BUSY
+            return completion_code(e)
 
     def power_reset(self):
         LOG.debug('Power reset called for domain %(domain)s',
                   {'domain': self.domain_name})
+
+        def reset(domain):
+            if domain.isActive():
+                domain.reset()
+
         try:
-            with utils.libvirt_open(**self._conn_args) as conn:
-                domain = utils.get_libvirt_domain(conn, self.domain_name)
-                if domain.isActive():
-                    domain.reset()
+            return self._power_call('power_reset', reset, flush=True)
         except Exception as e:
             LOG.error('Error resetting the domain %(domain)s. '
                       'Error: %(error)s', {'domain': self.domain_name,
                                            'error': e})
-            # Command not supported in present state
-            return IPMI_COMMAND_NODE_BUSY
+            return completion_code(e)
+
+    def get_chassis_status(self, session):
+        try:
+            power_state = self.get_power_state()
+
+        except exception.VirtualBMCError as e:
+            session.send_ipmi_response(code=completion_code(e))
+            return
+
+        session.send_ipmi_response(data=CHASSIS_STATUS[power_state])
+
+    def get_system_boot_options(self, request, session):
+        try:
+            super(VirtualBMC, self).get_system_boot_options(request, session)
+
+        except Exception as e:
+            LOG.error('Error getting the boot device of domain %(domain)s. '
+                      'Error: %(error)s', {'domain': self.domain_name,
+                                           'error': e})
+            session.send_ipmi_response(code=completion_code(e))
+
+    def is_active(self):
+        return self.get_power_state() == POWERON
+
+    def iohandler(self, data):
+        self._console.send(data)
+
+    def activate_payload(self, request, session):
+        if self._console is None:
+            session.send_ipmi_response(code=IPMI_PAYLOAD_DISABLED)
+            return
+
+        if self.activated:
+            session.send_ipmi_response(code=IPMI_PAYLOAD_ACTIVE)
+            return
+
+        try:
+            if not self.is_active():
+                session.send_ipmi_response(code=IPMI_PAYLOAD_DISABLED)
+                return
+
+            with self._metrics.libvirt_call('open_console'):
+                self._bounded('open_console', self._console.open)
+
+        except Exception as e:
+            LOG.error('Error opening the console of domain %(domain)s. '
+                      'Error: %(error)s', {'domain': self.domain_name,
+                                           'error': e})
+            session.send_ipmi_response(code=completion_code(e))
+            return
+
+        self.activated = True
+        solport = list(struct.unpack('BB', struct.pack('!H', self.port)))
+        session.send_ipmi_response(
+            data=[0, 0, 0, 0, 1, 0, 1, 0] + solport + [0xff, 0xff])
+        self.sol = self._console.attach(session)
+
+    def deactivate_payload(self, request, session):
+        super(VirtualBMC, self).deactivate_payload(request, session)
+        self.close_console()
+
+    def _console_closed(self):
+        # The domain went down or the console was taken over
+        console, self.sol = self.sol, None
+        self.activated = False
+        if console is not None:
+            console.close()
+
+    def close_console(self):
+        """Tear the SOL session down, if any."""
+        if self._console is not None:
+            self._console.close()
+            self._console_closed()
+
+    def handle_raw_request(self, request, session):
+        if not self._metrics.enabled:
+            self._handle_raw_request(request, session)
+            return
+
+        session = metrics.ResponseRecorder(session)
+        start = time.monotonic()
+
+        try:
+            self._handle_raw_request(request, session)
+
+        finally:
+            self._metrics.record_ipmi(request, time.monotonic() - start,
+                                      session.code)
+
+    def _handle_raw_request(self, request, session):
+        data = self._static_responses.get((request['netfn'],
+                                           request['command']))
+        if data is not None:
+            session.send_ipmi_response(data=data)
+            return
+
+        if self._sensors is not None and self._sensors.handle(request,
+                                                              session):
+            return
+
+        super(VirtualBMC, self).handle_raw_request(request, session)
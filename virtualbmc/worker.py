@@ -0,0 +1,453 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Worker processes hosting many vBMC instances each.
+
+pyghmi serves all the BMC sockets of a process from a single I/O loop,
+so a single worker process can host any number of vBMC instances. The
+manager talks to a worker through a pipe, asking it to start or stop
+instances, and the worker reports back whether they came up.
+
+A :class:`WorkerPool` spreads vBMC instances over several workers, so
+that the IPMI session crypto can make use of all the CPU cores.
+"""
+
+import bisect
+import hashlib
+import multiprocessing
+import signal
+import sys
+
+import pyghmi.ipmi.private.session as ipmisession
+
+from virtualbmc import config as vbmc_config
+from virtualbmc import exception
+from virtualbmc import log
+from virtualbmc import router
+from virtualbmc import utils
+from virtualbmc.vbmc import VirtualBMC
+
+LOG = log.get_logger()
+
+CONF = vbmc_config.get_config()
+
+# Control messages
+START = 'start'
+STOP = 'stop'
+
+# Status messages
+STARTED = 'started'
+FAILED = 'failed'
+
+# Hash ring key of the instances served through the shared IPMI endpoint
+SHARED_ENDPOINT_KEY = 'shared-endpoint'
+
+
+def _exit_on_sigterm(signum, frame):
+    sys.exit(0)
+
+
+class BMCHost(object):
+    """The vBMC instances served by the current process."""
+
+    def __init__(self):
+        self.bmcs = {}
+        self.endpoint = None
+        self._closing = []
+        # pyghmi wakes up its I/O thread by sending a datagram to the
+        # first socket it knows about. Allocate a socket that lives as long
+        # as the process, so that wakeups keep working whichever instances
+        # come and go.
+        ipmisession.Session._assignsocket()
+
+    def start(self, domain_name, bmc_config):
+        if domain_name in self.bmcs:
+            self.stop(domain_name)
+
+        if not router.is_shared(bmc_config):
+            self.bmcs[domain_name] = VirtualBMC(**bmc_config)
+            return
+
+        if self.endpoint is None:
+            self.endpoint = router.SharedEndpoint(
+                port=CONF['ipmi']['shared_port'],
+                address=CONF['ipmi']['shared_address'])
+
+        try:
+            self.bmcs[domain_name] = VirtualBMC(endpoint=self.endpoint,
+                                                **bmc_config)
+        finally:
+            if not self.endpoint.bmcs:
+                self._close(self.endpoint)
+                self.endpoint = None
+
+    def stop(self, domain_name):
+        vbmc = self.bmcs.pop(domain_name, None)
+        if vbmc is None:
+            return
+
+        vbmc.flush_boot_device()
+        vbmc.close_console()
+
+        if self.endpoint is not None and vbmc.serversocket is (
+                self.endpoint.serversocket):
+            self.endpoint.release(vbmc)
+            self._drop_sessions(vbmc)
+
+            if not self.endpoint.bmcs:
+                self._close(self.endpoint)
+                self.endpoint = None
+
+        else:
+            self._close(vbmc)
+
+    @staticmethod
+    def _drop_sessions(server):
+        for handlers in list(ipmisession.Session.bmc_handlers.values()):
+            session = handlers.get(server.port)
+            if getattr(session, 'bmc', None) is server:
+                handlers.pop(server.port)
+
+    def _close(self, server):
+        sock = server.serversocket
+        ipmisession.Session.bmc_handlers.pop(sock, None)
+
+        self._drop_sessions(server)
+
+        if sock in ipmisession.iosockets:
+            ipmisession.iosockets.remove(sock)
+
+        # The pyghmi I/O thread may still be selecting on the socket, it
+        # is closed by the next serve() call
+        self._closing.append(sock)
+
+    def serve(self, timeout):
+        """Run one iteration of the IPMI I/O loop."""
+        if self.bmcs:
+            ipmisession.Session.wait_for_rsp(timeout=timeout)
+
+        if self._closing:
+            # Wait for the I/O thread to go through select() once more, so
+            # that it no longer watches the sockets being closed
+            ipmisession._io_wait(0)
+
+            while self._closing:
+                self._closing.pop().close()
+
+    def shutdown(self):
+        for domain_name in list(self.bmcs):
+            self.stop(domain_name)
+
+
+def worker_runner(conn):
+    # The manager process installs a signal handler for SIGTERM to
+    # propagate it to children. Exit cleanly instead, so that pending
+    # work such as a deferred boot device change is not lost.
+    signal.signal(signal.SIGTERM, _exit_on_sigterm)
+
+    show_passwords = CONF['default']['show_passwords']
+    timeout = CONF['ipmi']['session_timeout']
+
+    host = BMCHost()
+
+    try:
+        while True:
+            if host.bmcs:
+                host.serve(timeout)
+                ready = conn.poll()
+            else:
+                host.serve(0)
+                ready = conn.poll(timeout)
+
+            while ready:
+                command, domain_name, bmc_config = conn.recv()
+
+                if command == START:
+                    try:
+                        host.start(domain_name, bmc_config)
+
+                    except Exception as ex:
+                        show_options = bmc_config
+                        if not show_passwords:
+                            show_options = utils.mask_dict_password(
+                                bmc_config)
+                        LOG.exception(
+                            'Error running vBMC with configuration '
+                            '%(opts)s: %(error)s', {'opts': show_options,
+                                                    'error': ex}
+                        )
+                        conn.send((FAILED, domain_name, str(ex)))
+
+                    else:
+                        conn.send((STARTED, domain_name, None))
+
+                elif command == STOP:
+                    host.stop(domain_name)
+
+                ready = conn.poll()
+
+    except EOFError:
+        LOG.info('Manager connection closed, shutting down worker')
+
+    finally:
+        host.shutdown()
+
+
+class BMCWorker(object):
+    """Manager-side handle of a worker process."""
+
+    def __init__(self, name):
+        self.name = name
+        self.domains = {}
+        self._conn, child_conn = multiprocessing.Pipe()
+
+        self.process = multiprocessing.Process(
+            name=name, target=worker_runner, args=(child_conn,)
+        )
+        self.process.daemon = True
+        self.process.start()
+
+        child_conn.close()
+
+    def is_alive(self):
+        return self.process.is_alive()
+
+    def sentinels(self):
+        """Return file descriptors ready as the worker reports or dies."""
+        return self.process.sentinel, self._conn.fileno()
+
+    def poll(self):
+        """Process status reports sent by the worker."""
+        try:
+            while self._conn.poll():
+                status, domain_name, error = self._conn.recv()
+
+                if domain_name not in self.domains:
+                    continue
+
+                if status == FAILED:
+                    LOG.error('vBMC instance for domain %(domain)s failed '
+                              'to start in worker %(worker)s: %(error)s',
+                              {'domain': domain_name, 'worker': self.name,
+                               'error': error})
+
+                self.domains[domain_name] = status
+
+        except (EOFError, OSError):
+            pass
+
+    def start_bmc(self, domain_name, bmc_config):
+        self.domains[domain_name] = START
+        self._conn.send((START, domain_name, bmc_config))
+        return WorkerBMCHandle(self, domain_name)
+
+    def stop_bmc(self, domain_name):
+        if self.domains.pop(domain_name, None) is None:
+            return
+
+        try:
+            self._conn.send((STOP, domain_name, None))
+        except (BrokenPipeError, OSError):
+            pass
+
+    def terminate(self):
+        self.domains.clear()
+        self._conn.close()
+        if self.process.is_alive():
+            self.process.terminate()
+        self.process.join()
+
+
+class WorkerBMCHandle(object):
+    """A vBMC instance hosted by a worker.
+
+    Mimics the bits of :class:`multiprocessing.Process` the manager relies
+    on for per-instance processes.
+    """
+
+    def __init__(self, worker, domain_name):
+        self.worker = worker
+        self.domain_name = domain_name
+
+    def is_alive(self):
+        if not self.worker.is_alive():
+            return False
+
+        self.worker.poll()
+        return self.worker.domains.get(self.domain_name) in (START, STARTED)
+
+    @property
+    def exitcode(self):
+        if not self.worker.is_alive():
+            return self.worker.process.exitcode
+
+        return None if self.is_alive() else 1
+
+    def terminate(self):
+        self.worker.stop_bmc(self.domain_name)
+
+
+class HashRing(object):
+    """Consistent hash ring mapping domain names to workers.
+
+    Every node is placed at several points of the ring, a key belongs to
+    the first node following its hash. Adding or removing a node only
+    moves the keys of that node.
+    """
+
+    def __init__(self, replicas=64):
+        self.replicas = replicas
+        self._members = set()
+        self._hashes = []
+        self._nodes = {}
+
+    @staticmethod
+    def _hash(key):
+        return int.from_bytes(
+            hashlib.sha256(key.encode('utf-8')).digest()[:8], 'big')
+
+    def __contains__(self, node):
+        return node in self._members
+
+    def __len__(self):
+        return len(self._members)
+
+    def add(self, node):
+        if node in self:
+            return
+
+        self._members.add(node)
+
+        for replica in range(self.replicas):
+            point = self._hash('%s-%d' % (node, replica))
+            self._nodes[point] = node
+            bisect.insort(self._hashes, point)
+
+    def remove(self, node):
+        if node not in self:
+            return
+
+        self._members.remove(node)
+
+        for replica in range(self.replicas):
+            point = self._hash('%s-%d' % (node, replica))
+            del self._nodes[point]
+            self._hashes.remove(point)
+
+    def get(self, key):
+        """Return the node owning the key, None if the ring is empty."""
+        if not self._hashes:
+            return None
+
+        index = bisect.bisect(self._hashes, self._hash(key))
+        return self._nodes[self._hashes[index % len(self._hashes)]]
+
+
+class WorkerPool(object):
+    """A fixed number of workers sharing the vBMC instances.
+
+    Instances are assigned to workers by consistent hashing of their
+    domain name. A dead worker is replaced, its instances are started
+    again by the manager on the replacement. Should the replacement fail
+    to start, the worker leaves the hash ring and its instances are
+    rebalanced over the surviving workers until it comes back.
+    """
+
+    def __init__(self, size, name='vbmcd-worker'):
+        self.size = size
+        self.name = name
+        self.workers = {}
+        self.ring = HashRing()
+        self._placement = {}
+
+        self.maintain()
+
+    def maintain(self):
+        """Replace dead workers and move misplaced instances."""
+        for index in range(self.size):
+            worker_name = '%s-%d' % (self.name, index)
+
+            worker = self.workers.get(worker_name)
+            if worker and worker.is_alive():
+                # Status reports of instances no longer looked after
+                # would otherwise keep the worker ready for reading
+                worker.poll()
+                continue
+
+            if worker:
+                LOG.warning('vBMC worker %(worker)s died (rc %(rc)s), '
+                            'restarting it', {'worker': worker_name,
+                                              'rc': worker.process.exitcode})
+                worker.terminate()
+                del self.workers[worker_name]
+
+            try:
+                self.workers[worker_name] = BMCWorker(worker_name)
+
+            except OSError as ex:
+                LOG.error('Failed to start vBMC worker %(worker)s, its vBMC '
+                          'instances are moved to the other workers: '
+                          '%(error)s', {'worker': worker_name, 'error': ex})
+                self.ring.remove(worker_name)
+                continue
+
+            self.ring.add(worker_name)
+
+        for domain_name, (ring_key, worker_name) in list(
+                self._placement.items()):
+            worker = self.workers.get(worker_name)
+            if worker is None or domain_name not in worker.domains:
+                del self._placement[domain_name]
+
+            elif self.ring.get(ring_key) != worker_name:
+                # The instance is started again on its new worker by the
+                # manager, once it notices it is gone
+                LOG.info('Moving vBMC instance for domain %(domain)s away '
+                         'from worker %(worker)s', {'domain': domain_name,
+                                                    'worker': worker_name})
+                worker.stop_bmc(domain_name)
+                del self._placement[domain_name]
+
+    @staticmethod
+    def _ring_key(domain_name, bmc_config):
+        # The instances served through the shared IPMI endpoint have to
+        # live in the same process as its socket
+        if router.is_shared(bmc_config):
+            return SHARED_ENDPOINT_KEY
+
+        return domain_name
+
+    def start_bmc(self, domain_name, bmc_config):
+        ring_key = self._ring_key(domain_name, bmc_config)
+        worker_name = self.ring.get(ring_key)
+        if worker_name is None:
+            raise exception.VirtualBMCError(
+                'No vBMC worker available to run domain %s' % domain_name)
+
+        self._placement[domain_name] = ring_key, worker_name
+        return self.workers[worker_name].start_bmc(domain_name, bmc_config)
+
+    def sentinels(self):
+        """Return file descriptors ready as workers report or die."""
+        fds = set()
+
+        for worker in self.workers.values():
+            fds.update(worker.sentinels())
+
+        return fds
+
+    def terminate(self):
+        for worker in self.workers.values():
+            worker.terminate()
+
+        self.workers.clear()
+        self._placement.clear()